@@ -65,10 +65,11 @@ def create_app(config_class=Config):
     babel = Babel(app, locale_selector=get_locale) # Pass selector here
     csrf.init_app(app)
     login_manager.init_app(app)
-    socketio.init_app(app)
+    from app.services.socket_broker import message_queue_options
+    socketio.init_app(app, **message_queue_options(app.config))
     mail.init_app(app)
     migrate.init_app(app, db)
-    cache.init_app(app, config={'CACHE_TYPE': 'SimpleCache'})
+    cache.init_app(app) # CACHE_TYPE from the config: per process unless a shared backend is configured
     limiter.init_app(app)
     # bootstrap.init_app(app)
 
@@ -95,12 +96,32 @@ def create_app(config_class=Config):
     from app.core import models # noqa
 
     if not app.config.get('TESTING', False):
-        from app.core.scheduler import init_scheduler
-        with app.app_context():
-            init_scheduler(app)
+        if app.config.get('SCHEDULER_ENABLED', True):
+            from app.core.scheduler import init_scheduler
+            with app.app_context():
+                init_scheduler(app)
 
     app.jinja_env.filters['linkify_mentions'] = linkify_mentions
+    from flask_login import current_user
+    from app.services.post_view_service import load_post_view
+    # Fallback for post cards rendered without a preloaded post_views batch
+    app.jinja_env.globals['load_post_view'] = lambda post: load_post_view(post, current_user)
     from app.core import events # noqa
+    from app.services import timeline_service # noqa - registers the timeline fan-out session hooks
+    from app.services import counter_service # noqa - registers the engagement counter session hooks
+    from app.services import search_service # noqa - registers the search index session hooks
+    from app.services import mention_index # noqa - registers the mention autocomplete index session hooks
+    from app.services import trending_stream # noqa - registers the trending hashtag stream session hooks
+    from app.services import mention_links # noqa - registers the @mention link cache session hooks
+    from app.services import related_posts_service # noqa - registers the related posts index session hooks
+    from app.services import recommendation_service # noqa - registers the recommendation staleness session hooks
+    from app.services import social_graph # noqa - registers the follow graph session hooks
+    from app.services import notification_service # noqa - registers the unread count cache session hooks
+    from app.services import outbox # noqa - registers the outbox dispatch session hooks
+    from app.services import side_effects # noqa - registers the outbox event handlers
+    from app.services.visibility_service import forget_viewers
+    # g outlives the request when an app context was already pushed (tests, CLI)
+    app.teardown_request(forget_viewers)
 
     @app.after_request
     def add_security_headers(response):
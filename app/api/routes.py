@@ -129,6 +129,8 @@ def oauth_token():
 from app.core.models import Post, PRIVACY_PUBLIC, PRIVACY_PRIVATE, PRIVACY_FOLLOWERS, PRIVACY_CUSTOM_LIST
 from app.oauth2 import token_required
 from flask import g, abort # For g.current_user
+from app.utils.pagination import keyset_paginate, encode_cursor
+from app.services.visibility_service import post_visibility_filter, can_view_post
 
 # Helper to serialize user data (can be expanded)
 def serialize_user_public_data(user):
@@ -208,7 +210,7 @@ def serialize_post_data(post):
         "body": post.body,
         "timestamp": post.timestamp.isoformat() + 'Z', # ISO 8601 format
         "author_id": post.user_id,
-        "like_count": post.like_count(), # Assuming Post model has like_count()
+        "like_count": post.reaction_count(reaction_type='like'),
         "comment_count": post.comments.count(), # Assuming Post model has comments relationship
         "privacy_level": post.privacy_level
         # Add other fields as needed, e.g., media_items
@@ -235,7 +237,12 @@ def get_user_posts(user_id):
         type: integer
         required: false
         default: 1
-        description: Page number for pagination.
+        description: Page number for pagination. Ignored when `cursor` is given.
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: Opaque cursor from a previous response's `next_cursor` (keyset pagination; preferred for deep paging).
       - name: per_page
         in: query
         type: integer
@@ -267,6 +274,7 @@ def get_user_posts(user_id):
             per_page: { type: integer }
             total_pages: { type: integer }
             total_items: { type: integer }
+            next_cursor: { type: string, nullable: true }
       401:
         description: Unauthorized (token missing or invalid).
       403:
@@ -313,55 +321,48 @@ def get_user_posts(user_id):
         # per_page = 100
         return jsonify(error="InvalidRequest", message="Items per page cannot exceed 100."), 400
 
-    # Base query for published posts by the target user
-    posts_query = Post.query.filter_by(user_id=target_user.id, is_published=True)
-
-    # Apply privacy filtering for each post
-    # This can be inefficient if done purely in Python for many posts.
-    # For a more optimized approach, complex SQL queries or pre-filtering might be needed.
-    # Here, we fetch then filter in Python for clarity of logic.
-
-    # A more performant way would be to build up the query with OR conditions based on privacy.
-    # For example:
-    # conditions = [Post.privacy_level == PRIVACY_PUBLIC]
-    # if requesting_user.id == target_user.id:
-    #     conditions.append(Post.privacy_level.in_([PRIVACY_PRIVATE, PRIVACY_FOLLOWERS, PRIVACY_CUSTOM_LIST]))
-    # elif requesting_user.is_following(target_user):
-    #     conditions.append(Post.privacy_level == PRIVACY_FOLLOWERS)
-    # # Custom list check would be more complex: check if requesting_user is in Post.custom_friend_list.members
-    # posts_query = posts_query.filter(db.or_(*conditions))
-    # This is still simplified, especially for PRIVACY_CUSTOM_LIST.
-
-    # For now, let's paginate first, then filter the paginated items in Python (less ideal for large datasets).
-    pagination = posts_query.order_by(Post.timestamp.desc()).paginate(page=page, per_page=per_page, error_out=False)
-    all_posts_on_page = pagination.items
-
-    visible_posts = []
-    if target_user.id == requesting_user.id: # Owner sees all their own posts
-        visible_posts = all_posts_on_page
+    # Published posts by the target user that the requester may see. Privacy is part of the
+    # query, so pages are full and total_items counts only visible posts.
+    posts_query = Post.query.filter(
+        Post.user_id == target_user.id,
+        Post.is_published == True,
+        post_visibility_filter(requesting_user)
+    )
+
+    cursor = request.args.get('cursor')
+    pagination = None
+    if cursor:
+        cursor_page = keyset_paginate(posts_query, Post.timestamp, Post.id, cursor=cursor, per_page=per_page)
+        visible_posts = cursor_page.items
+        next_cursor = cursor_page.next_cursor
     else:
-        for post in all_posts_on_page:
-            if post.privacy_level == PRIVACY_PUBLIC:
-                visible_posts.append(post)
-            elif post.privacy_level == PRIVACY_FOLLOWERS:
-                if requesting_user.is_following(target_user):
-                    visible_posts.append(post)
-            elif post.privacy_level == PRIVACY_CUSTOM_LIST:
-                # This requires checking if requesting_user is in post.custom_friend_list.members
-                # Assuming Post model has 'custom_friend_list' relationship and FriendList has 'members'
-                if post.custom_friend_list and requesting_user in post.custom_friend_list.members.all():
-                     visible_posts.append(post)
-            # PRIVACY_PRIVATE posts are only visible to the owner, already handled by the first `if`
+        pagination = posts_query.order_by(Post.timestamp.desc(), Post.id.desc()).paginate(page=page, per_page=per_page, error_out=False)
+        visible_posts = pagination.items
+        # Let page-number clients switch to cursors from here on
+        next_cursor = encode_cursor(visible_posts[-1].timestamp, visible_posts[-1].id) if pagination.has_next else None
+
+    if pagination is None: # Cursor mode does not count or number pages
+        return jsonify({
+            "posts": [serialize_post_data(post) for post in visible_posts],
+            "per_page": per_page,
+            "next_cursor": next_cursor
+        }), 200
 
     return jsonify({
         "posts": [serialize_post_data(post) for post in visible_posts],
+        "next_cursor": next_cursor,
         "page": pagination.page,
         "per_page": pagination.per_page,
         "total_pages": pagination.pages,
-        "total_items": pagination.total # This total is for pre-filtered posts by user_id and is_published
-                                        # A more accurate total for visible posts would require counting after filtering.
+        "total_items": pagination.total
     }), 200
 
+POST_FORBIDDEN_MESSAGES = {
+    PRIVACY_FOLLOWERS: "This post is only visible to followers of the author.",
+    PRIVACY_CUSTOM_LIST: "Access to this post is restricted to a custom list.",
+    PRIVACY_PRIVATE: "This post is private."
+}
+
 @api_bp.route('/posts/<int:post_id>', methods=['GET'])
 @token_required
 def get_post(post_id):
@@ -403,29 +404,123 @@ def get_post(post_id):
     post = Post.query.get_or_404(post_id)
     requesting_user = g.current_user
 
-    # Check if post is published, unless requester is the author
-    if not post.is_published and post.user_id != requesting_user.id:
-        # This specific 404 is fine as is, or can use the generic handler via abort(404, description="...")
-        return jsonify(error="NotFound", message="Post not found or not published."), 404
-
-    # Privacy checks
-    if post.user_id == requesting_user.id: # Author can always view their own post
-        pass
-    elif post.privacy_level == PRIVACY_PUBLIC:
-        pass
-    elif post.privacy_level == PRIVACY_FOLLOWERS:
-        if not post.author or not requesting_user.is_following(post.author):
-            return jsonify(error="Forbidden", message="This post is only visible to followers of the author."), 403
-    elif post.privacy_level == PRIVACY_CUSTOM_LIST:
-        if not post.custom_friend_list or requesting_user not in post.custom_friend_list.members.all():
-            return jsonify(error="Forbidden", message="Access to this post is restricted to a custom list."), 403
-    elif post.privacy_level == PRIVACY_PRIVATE:
-        return jsonify(error="Forbidden", message="This post is private."), 403 # Should be caught by first check if not author
-    else:
-        return jsonify(error="Forbidden", message="Post visibility settings prevent access."), 403
+    if not can_view_post(requesting_user, post):
+        # Unpublished and moderated posts do not exist as far as other users are concerned
+        if not post.is_published or post.is_hidden_by_moderation:
+            return jsonify(error="NotFound", message="Post not found or not published."), 404
+        message = POST_FORBIDDEN_MESSAGES.get(post.privacy_level, "Post visibility settings prevent access.")
+        return jsonify(error="Forbidden", message=message), 403
 
     return jsonify(serialize_post_data(post)), 200
 
+from app.services.fuzzy_search import fuzzy_matches, FUZZY_FIELDS
+from app.services.visibility_service import get_viewer, profile_visibility_filter
+
+@api_bp.route('/search/fuzzy', methods=['GET'])
+@token_required
+def fuzzy_search():
+    """
+    Typo-tolerant search over user, group or hashtag names.
+    Requires Bearer token authentication. Users hidden by profile privacy are left out.
+    ---
+    tags:
+      - Search
+    parameters:
+      - name: q
+        in: query
+        type: string
+        required: true
+        description: The (possibly misspelled) name to look for.
+      - name: type
+        in: query
+        type: string
+        enum: [users, groups, hashtags]
+        default: users
+      - name: limit
+        in: query
+        type: integer
+        default: 20
+        description: Maximum number of results (1-100).
+    security:
+      - BearerAuth: []
+    responses:
+      200:
+        description: Matches, best first.
+        schema:
+          type: object
+          properties:
+            results:
+              type: array
+              items:
+                type: object
+                properties:
+                  id: { type: integer }
+                  name: { type: string }
+                  score: { type: number }
+      400:
+        description: Missing query or unknown type.
+      401:
+        description: Unauthorized (token missing or invalid).
+    """
+    term = request.args.get('q', '', type=str).strip()
+    kind = request.args.get('type', 'users', type=str)
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    if not term:
+        return jsonify(error="InvalidRequest", message="Missing search query 'q'."), 400
+    if kind not in FUZZY_FIELDS:
+        return jsonify(error="InvalidRequest", message=f"Unknown search type '{kind}'."), 400
+
+    model, field = FUZZY_FIELDS[kind]
+    # Ask for extra matches since privacy filtering may drop some of them
+    scores = dict(fuzzy_matches(kind, term, limit=limit * 2 if kind == 'users' else limit))
+    query = model.query.filter(model.id.in_(list(scores)))
+    if kind == 'users':
+        query = query.filter(profile_visibility_filter(get_viewer(g.current_user)))
+    found = sorted(query.all(), key=lambda obj: (-scores[obj.id], obj.id))[:limit]
+    return jsonify(results=[
+        {"id": obj.id, "name": getattr(obj, field), "score": round(scores[obj.id], 1)} for obj in found
+    ]), 200
+
+from app.services.trending_service import get_trending_hashtags
+
+@api_bp.route('/hashtags/trending', methods=['GET'])
+@token_required
+def trending_hashtags():
+    """
+    The hashtags trending right now, hottest first.
+    Requires Bearer token authentication.
+    ---
+    tags:
+      - Hashtags
+    parameters:
+      - name: limit
+        in: query
+        type: integer
+        default: 10
+        description: Number of hashtags to return (1-100).
+    security:
+      - BearerAuth: []
+    responses:
+      200:
+        description: Trending hashtags with their decayed usage scores.
+        schema:
+          type: object
+          properties:
+            hashtags:
+              type: array
+              items:
+                type: object
+                properties:
+                  tag: { type: string }
+                  score: { type: number }
+      401:
+        description: Unauthorized (token missing or invalid).
+    """
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    return jsonify(hashtags=[
+        {"tag": tag.tag_text, "score": round(tag.score, 3)} for tag in get_trending_hashtags(limit)
+    ]), 200
+
 from app.utils.helpers import process_hashtags, process_mentions # For creating/updating posts
 from app.core.models import FriendList # For custom list validation
 
@@ -526,15 +621,7 @@ def create_post():
 
     # Process hashtags and mentions
     process_hashtags(new_post.body, new_post)
-    # process_mentions(new_post.body, new_post, requesting_user) # actor is requesting_user
-    # For process_mentions, the original function signature might be (text, post_id, actor_id, comment_id=None)
-    # Assuming process_mentions can handle a Post object and actor object, or adjust call accordingly.
-    # Let's assume a simplified call for now, focusing on data integrity of hashtags.
-    # Full mention notification logic might be complex for API response.
-    # The original process_mentions in app/utils.py is:
-    # def process_mentions(text_body, post_id, actor_id, comment_id=None, db_session=None):
-    # So, we need post_id and actor_id.
-    process_mentions(text_body=new_post.body, post_id=new_post.id, actor_id=requesting_user.id, db_session=db.session)
+    process_mentions(text_content=new_post.body, owner_object=new_post, actor_user=requesting_user)
 
 
     db.session.commit() # Commit again if hashtags/mentions modify the session (e.g. new tags)
@@ -669,7 +756,7 @@ def update_post(post_id):
         db.session.flush() # Ensure deletions and clears are processed before adding new ones
 
         process_hashtags(post.body, post)
-        process_mentions(text_body=post.body, post_id=post.id, actor_id=requesting_user.id, db_session=db.session)
+        process_mentions(text_content=post.body, owner_object=post, actor_user=requesting_user)
 
     db.session.commit()
     return jsonify(serialize_post_data(post)), 200
@@ -969,19 +1056,8 @@ def toggle_like_post(post_id):
     if not post.is_published and post.user_id != requesting_user.id:
         return jsonify(error="NotFound", message="Post not found or not published."), 404
 
-    # Privacy checks for interaction (similar to GET /posts/<id>)
-    can_interact = False
-    if post.user_id == requesting_user.id:
-        can_interact = True
-    elif post.privacy_level == PRIVACY_PUBLIC:
-        can_interact = True
-    elif post.privacy_level == PRIVACY_FOLLOWERS:
-        if post.author and requesting_user.is_following(post.author):
-            can_interact = True
-    elif post.privacy_level == PRIVACY_CUSTOM_LIST:
-        if post.custom_friend_list and requesting_user in post.custom_friend_list.members.all():
-            can_interact = True
-    # PRIVACY_PRIVATE posts are only interactable by the author, covered by the first check.
+    # Privacy checks for interaction (same rules as GET /posts/<id>)
+    can_interact = can_view_post(requesting_user, post)
 
     if not can_interact:
         return jsonify(error="Forbidden", message="You do not have permission to interact with this post."), 403
@@ -1085,17 +1161,7 @@ def create_comment_on_post(post_id):
         return jsonify(error="NotFound", message="Post not found or not published."), 404
 
     # Privacy checks for interaction
-    can_interact = False
-    if post.user_id == requesting_user.id:
-        can_interact = True
-    elif post.privacy_level == PRIVACY_PUBLIC:
-        can_interact = True
-    elif post.privacy_level == PRIVACY_FOLLOWERS:
-        if post.author and requesting_user.is_following(post.author):
-            can_interact = True
-    elif post.privacy_level == PRIVACY_CUSTOM_LIST:
-        if post.custom_friend_list and requesting_user in post.custom_friend_list.members.all():
-            can_interact = True
+    can_interact = can_view_post(requesting_user, post)
 
     if not can_interact:
         return jsonify(error="Forbidden", message="You do not have permission to comment on this post."), 403
@@ -1121,8 +1187,7 @@ def create_comment_on_post(post_id):
     db.session.commit() # Commit to get new_comment.id for mention processing
 
     # Process mentions in the comment
-    # def process_mentions(text_body, post_id, actor_id, comment_id=None, db_session=None):
-    process_mentions(text_body=new_comment.body, post_id=post.id, actor_id=requesting_user.id, comment_id=new_comment.id, db_session=db.session)
+    process_mentions(text_content=new_comment.body, owner_object=new_comment, actor_user=requesting_user)
     db.session.commit() # Commit again if mentions created new DB objects or modified session
 
     return jsonify(serialize_comment_data(new_comment)), 201
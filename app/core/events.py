@@ -2,8 +2,12 @@ from flask_socketio import join_room, leave_room, emit
 from flask_login import current_user
 from flask import request, current_app # Import current_app
 from app import socketio, db # Assuming socketio and db are initialized in app/__init__.py
-from app.core.models import Conversation, ChatMessage, User, Notification, MessageReadStatus, LiveStream, StreamChatMessage, WhiteboardSession
+from app.core.models import Conversation, ChatMessage, User, LiveStream, StreamChatMessage, WhiteboardSession
 from datetime import datetime, timezone
+from app.services.chat_history import load_message_window, message_window_json
+from app.services.outbox import enqueue
+from app.services.read_state import mark_read
+from app.services.side_effects import CHAT_MESSAGE_SENT
 
 poll_room_viewers = {}
 
@@ -121,29 +125,11 @@ def handle_send_chat_message(data):
     db.session.add(message)
 
     conversation.last_updated = message.timestamp
+    db.session.flush() # Assigns message.id for the outbox event
+    # The other participants' notifications are sent by the outbox, after this commit
+    enqueue(CHAT_MESSAGE_SENT, {'message_id': message.id}, f'{CHAT_MESSAGE_SENT}:{message.id}')
     db.session.commit()
 
-    # Create notifications for other participants
-    for participant in conversation.participants:
-        if participant.id != current_user.id:
-            notification = Notification(
-                recipient_id=participant.id,
-                actor_id=current_user.id,
-                type='new_chat_message',
-                related_post_id=None,  # Explicitly None for chat messages
-                related_conversation_id=conversation.id # Link to the conversation
-            )
-            db.session.add(notification)
-            # Emit real-time notification to the specific participant
-            socketio.emit('new_notification', {
-                'message': f'{current_user.username} sent you a new chat message.',
-                'type': 'new_chat_message',
-                'actor_username': current_user.username,
-                'sender_id': current_user.id,
-                'conversation_id': conversation.id
-            }, room=str(participant.id))
-    db.session.commit() # Commit notifications
-
     emit_data = {
         'message_id': message.id, # Added message_id
         'conversation_id': conversation.id,
@@ -156,6 +142,22 @@ def handle_send_chat_message(data):
     socketio.emit('new_chat_message', emit_data, room=f'conv_{conversation.id}') # Use socketio.emit for broadcast to room
     print(f"Message from {current_user.username} sent to room conv_{conversation.id}") # Original print
 
+@socketio.on('load_older_messages')
+def handle_load_older_messages(data):
+    """Sends the requester the window of messages before data['cursor'] (see app/services/chat_history.py)."""
+    conversation_id = data.get('conversation_id') if isinstance(data, dict) else None
+    if not str(conversation_id).isdigit() or not current_user.is_authenticated:
+        emit('chat_error', {'message': 'Invalid data or authentication issue.'}, room=request.sid)
+        return
+
+    conversation = Conversation.query.get(int(conversation_id))
+    if not conversation or current_user not in conversation.participants:
+        emit('chat_error', {'message': 'Conversation not found or you are not a participant.'}, room=request.sid)
+        return
+
+    page, messages = load_message_window(conversation.id, current_user.id, cursor=data.get('cursor'))
+    emit('older_messages', message_window_json(conversation.id, page, messages), room=request.sid)
+
 @socketio.on('typing_started')
 def handle_typing_started(data):
     conversation_id = data.get('conversation_id')
@@ -192,110 +194,38 @@ def handle_mark_messages_as_read(data):
         print("User not authenticated for mark_messages_as_read")
         return
 
-    if not conversation_id or not message_ids or not isinstance(message_ids, list):
+    if not str(conversation_id).isdigit() or not message_ids or not isinstance(message_ids, list):
         emit('mark_read_error', {'message': 'Invalid data: conversation_id and message_ids (list) are required.'}, room=request.sid)
         print(f"Invalid data for mark_messages_as_read: conv_id={conversation_id}, message_ids={message_ids}")
         return
 
-    processed_message_ids_for_notification = []
-
-    for message_id in message_ids:
-        if not isinstance(message_id, int):
-            print(f"Skipping invalid message_id type: {message_id}")
-            continue
-
-        # Check if MessageReadStatus already exists
-        existing_status = MessageReadStatus.query.filter_by(
-            user_id=current_user.id,
-            message_id=message_id
-        ).first()
-
-        if existing_status:
-            print(f"Message {message_id} already marked as read by user {current_user.id}")
-            continue
-
-        message = ChatMessage.query.get(message_id)
-        if not message:
-            print(f"ChatMessage with id {message_id} not found.")
-            continue
-
-        # Ensure message is part of the given conversation
-        if str(message.conversation_id) != str(conversation_id):
-            print(f"Message {message_id} does not belong to conversation {conversation_id}.")
-            continue
-
-        # Create and save new MessageReadStatus
-        new_status = MessageReadStatus(
-            message_id=message_id,
-            user_id=current_user.id
-            # read_at is set by default
-        )
-        db.session.add(new_status)
-        print(f"Created MessageReadStatus for message {message_id}, user {current_user.id}")
-
-        # If it's an incoming message being marked as read by the current user
-        if message.sender_id != current_user.id:
-            processed_message_ids_for_notification.append(message_id)
-            # Update ChatMessage.read_at if it's the first read for this message by anyone (or recipient in 1-1)
-            if message.read_at is None:
-                message.read_at = new_status.read_at # Use the same timestamp as MessageReadStatus
-                print(f"Updated ChatMessage {message_id} read_at to {message.read_at}")
-
-    if not processed_message_ids_for_notification and not db.session.new: # Check if any new MessageReadStatus were added
-        # No new read statuses were created, and no messages qualified for notification.
-        # This can happen if all messages were already read or were sent by the current user.
-        print(f"No messages processed or needed notification for user {current_user.id} in conversation {conversation_id}.")
-        # We still need to commit if message.read_at was updated for messages not in processed_message_ids_for_notification
-        # (e.g. if a message was already marked read by this user via MessageReadStatus, but ChatMessage.read_at was still null)
-        # However, the current logic updates message.read_at only for *newly* created MessageReadStatus for incoming messages.
-        # So, if processed_message_ids_for_notification is empty, it means no *incoming* messages were newly marked read.
-        # If db.session.new is also empty, it means no MessageReadStatus objects were created at all (e.g. all messages already read by this user).
-        # If db.session.dirty might contain message.read_at changes, we should commit.
-        # For simplicity here, we commit if anything changed (new MRS or dirty CM).
-        if db.session.new or db.session.dirty:
-            db.session.commit()
+    conversation = Conversation.query.get(int(conversation_id))
+    if not conversation or current_user not in conversation.participants:
+        emit('mark_read_error', {'message': 'Conversation not found or you are not a participant.'}, room=request.sid)
         return
 
-
+    message_ids = [message_id for message_id in message_ids if isinstance(message_id, int)]
+    # Moves the user's read watermark past the newest of these (see app/services/read_state.py)
+    result = mark_read(current_user.id, int(conversation_id), message_ids) if message_ids else None
+    if result is None:
+        # Nothing past the watermark (already read, or not in this conversation)
+        return
     db.session.commit()
-    print(f"Committed read statuses for user {current_user.id}, conversation {conversation_id}")
 
-    # Emit messages_read_update if there were any incoming messages marked as read
-    if processed_message_ids_for_notification:
+    if result['message_ids']:
         update_payload = {
             'conversation_id': conversation_id,
-            'message_ids': processed_message_ids_for_notification,
+            'message_ids': result['message_ids'],
             'reader_user_id': current_user.id,
-            # 'read_at': # We could send the specific read_at time, but client might not need it for this event.
-                         # The ChatMessage.read_at will be updated and can be fetched if needed.
-                         # MessageReadStatus.read_at is also available.
+            # Everything up to here is read by the reader, not only message_ids
+            'last_read_message_id': result['last_read_message_id'],
+            'last_read_timestamp': result['last_read_timestamp'].isoformat() + 'Z',
+            'read_at': result['read_at'].isoformat()
         }
-
-        # Emit to the conversation room (for all participants, including other devices of the current user)
-        conversation_room = f'conv_{conversation_id}'
-        socketio.emit('messages_read_update', update_payload, room=conversation_room)
-        print(f"Emitted messages_read_update to {conversation_room} for messages {processed_message_ids_for_notification}")
-
-        # Emit to the original sender's room if they are online
-        # This requires finding the sender for each message, but since we only notify for messages
-        # where sender_id != current_user.id, we need to get those senders.
-        # For simplicity, if multiple messages from different senders are marked read in one go,
-        # this will emit one event per sender. A more optimized way might be to group them.
-        # However, the current payload is a list of message_ids, so it's okay to send it to each sender.
-
-        # Find unique sender IDs for the messages that were processed
-        sender_ids_to_notify = set()
-        for msg_id in processed_message_ids_for_notification:
-            msg = ChatMessage.query.get(msg_id) # Fetch again, or pass message objects around
-            if msg and msg.sender_id != current_user.id:
-                sender_ids_to_notify.add(msg.sender_id)
-
-        for sender_id in sender_ids_to_notify:
-            sender_room = str(sender_id)
-            # Avoid sending to self if somehow sender_id is current_user.id (should not happen with current logic)
-            if sender_room != str(current_user.id):
-                 socketio.emit('messages_read_update', update_payload, room=sender_room)
-                 print(f"Emitted messages_read_update to sender {sender_room} for messages {processed_message_ids_for_notification}")
+        # The conversation room (all participants, including the reader's other devices) and
+        # the senders' own rooms, in one emit
+        rooms = [f'conv_{conversation_id}'] + [str(sender_id) for sender_id in result['sender_ids']]
+        socketio.emit('messages_read_update', update_payload, to=rooms)
 
 # -------------------- WebRTC Signaling Events for Live Streaming --------------------
 
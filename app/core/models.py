@@ -15,6 +15,7 @@ except ImportError:
     from itsdangerous import URLSafeTimedSerializer as Serializer
 from flask import current_app
 from sqlalchemy.ext.associationproxy import association_proxy
+from app.utils.pagination import CursorPage, encode_cursor, decode_cursor
 
 
 # Add this class definition at an appropriate place, e.g., in app/models.py or a utils file.
@@ -65,7 +66,9 @@ class ManualPagination:
 # Define the association table for followers
 followers = db.Table('followers',
     db.Column('follower_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
-    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    # The composite PK only serves follower_id lookups; fan-out reads by followed_id
+    db.Index('ix_followers_followed_id', 'followed_id')
 )
 
 # Define the association table for conversation participants
@@ -84,7 +87,9 @@ post_hashtags = db.Table('post_hashtags',
 # Association table for FriendList members
 friend_list_members = db.Table('friend_list_members',
     db.Column('friend_list_id', db.Integer, db.ForeignKey('friend_list.id'), primary_key=True),
-    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    # Visibility checks ask "which lists is this viewer on?"; the PK only serves the reverse
+    db.Index('ix_friend_list_members_user_id', 'user_id')
 )
 
 class FriendList(db.Model):
@@ -137,6 +142,8 @@ class Badge(db.Model):
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), index=True, unique=True, nullable=False)
+    # Case-insensitive username lookups (@mentions) filter on lower(username)
+    __table_args__ = (db.Index('ix_user_username_lower', db.func.lower(username)),)
     email = db.Column(db.String(120), index=True, unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
     bio = db.Column(db.String(250), nullable=True)
@@ -237,62 +244,99 @@ class User(db.Model, UserMixin):
             self.followed.remove(user)
 
     def is_following(self, user):
-        # Ensure user.id is not None for new, uncommitted users if that's a possibility
-        if user.id is None:
-            return False
-        return self.followed.filter(
-            followers.c.followed_id == user.id).count() > 0
+        # Read from the database through the request's Viewer (plus follows pending in the session)
+        from app.services.social_graph import is_following
+        return is_following(self, user)
 
     # Method to get posts from followed users (for the feed)
-    @cache.cached(timeout=300)
-    def followed_posts(self, page=1, per_page=10):
-        user_and_followed_ids = [f.id for f in self.followed] + [self.id]
-
-        # Get current user's posts and posts by followed users
-        direct_posts = Post.query.filter(Post.user_id.in_(user_and_followed_ids)).all()
-
-        # Get shares by current user and shares by followed users
-        shares = Share.query.options(
-            db.joinedload(Share.original_post).joinedload(Post.author),
-            db.joinedload(Share.user) # Eager load the sharer (User object)
-        ).filter(Share.user_id.in_(user_and_followed_ids)).all()
-
-        feed_items = []
-        processed_post_ids_in_feed = set() # To help avoid some forms of duplication
-
-        # Add direct posts
-        for post in direct_posts:
-            feed_items.append({'type': 'post', 'item': post, 'timestamp': post.timestamp, 'sharer': None})
-            processed_post_ids_in_feed.add((post.id, 'post', None))
-
+    def _followed_feed_rows(self):
+        """
+        SQL UNION of the direct posts and shares by this user and everyone they follow,
+        as (type, post_id, share_id, timestamp, sharer_id) rows. Ordering and slicing
+        happen in the database, so a page costs O(per_page) rows rather than O(history).
+        """
+        from sqlalchemy import select, literal, union_all, or_, and_, not_, func
 
-        # Add shared posts
-        for share in shares:
+        followed_ids = select(followers.c.followed_id).where(followers.c.follower_id == self.id)
+        direct_posts = select(
+            literal('post').label('type'),
+            Post.id.label('post_id'),
+            literal(0).label('share_id'),
+            Post.timestamp.label('timestamp'),
+            literal(None, db.Integer).label('sharer_id')
+        ).where(or_(Post.user_id == self.id, Post.user_id.in_(followed_ids)))
+        # One item per (post, sharer) even if it was shared to several destinations
+        shares = select(
+            literal('share').label('type'),
+            Share.post_id.label('post_id'),
+            func.min(Share.id).label('share_id'),
+            func.min(Share.timestamp).label('timestamp'),
+            Share.user_id.label('sharer_id')
+        ).join(Post, Share.post_id == Post.id).where(
+            or_(Share.user_id == self.id, Share.user_id.in_(followed_ids)),
             # Avoid showing a share if the viewer is the one who shared their own post on their main feed
-            if share.user_id == self.id and share.original_post.user_id == self.id and share.group_id is None:
-                continue
-
-            # Avoid adding a share if the original post by the same author is already in feed_items
-            # This simple check might not cover all nuanced duplication scenarios but is a start.
-            # A more sophisticated check might be needed if User A follows User B, User A posts P1, User B shares P1.
-            # Current logic will show both P1 by A, and P1 shared by B. This is generally acceptable.
-
-            # Key for this share instance
-            share_key = (share.original_post.id, 'share', share.user_id)
-            if share_key not in processed_post_ids_in_feed:
-                 feed_items.append({'type': 'share', 'item': share.original_post, 'timestamp': share.timestamp, 'sharer': share.user})
-                 processed_post_ids_in_feed.add(share_key)
-
-
-        # Sort items: newest first
-        feed_items.sort(key=lambda x: x['timestamp'], reverse=True)
-
-        # Manual pagination
-        start = (page - 1) * per_page
-        end = start + per_page
-        paginated_items = feed_items[start:end]
+            not_(and_(Share.user_id == self.id, Post.user_id == self.id, Share.group_id.is_(None)))
+        ).group_by(Share.post_id, Share.user_id)
+        return union_all(direct_posts, shares).subquery('feed')
+
+    def _load_feed_items(self, rows):
+        """Turns feed rows into the {'type', 'item', 'timestamp', 'sharer'} dicts the templates expect."""
+        post_ids = {row[1] for row in rows}
+        sharer_ids = {row[4] for row in rows if row[4] is not None}
+        posts = {p.id: p for p in Post.query.options(db.joinedload(Post.author)).filter(Post.id.in_(post_ids))} if post_ids else {}
+        sharers = {u.id: u for u in User.query.filter(User.id.in_(sharer_ids))} if sharer_ids else {}
+        return [
+            {'type': row[0], 'item': posts[row[1]], 'timestamp': row[3], 'sharer': sharers.get(row[4])}
+            for row in rows if row[1] in posts
+        ]
+
+    def _followed_author_ids(self):
+        from app.utils.feed_cache import get_cached_followed_ids
+        return [self.id] + get_cached_followed_ids(
+            self.id, lambda: db.session.execute(
+                db.select(followers.c.followed_id).where(followers.c.follower_id == self.id)
+            ).scalars().all()
+        )
+
+    def followed_posts(self, page=1, per_page=10, cursor=None):
+        """
+        Merged feed of posts and shares from this user and the users they follow, newest first.
 
-        pagination_obj = ManualPagination(paginated_items, page, per_page, len(feed_items))
+        Page-number calls return a ManualPagination; pass `cursor` (from a previous page's
+        `next_cursor`) for keyset pagination, which does not need to count or skip rows.
+        Results are memoized per user and invalidated when this user's follow graph or any
+        followed author's posts or shares change (see app/utils/feed_cache.py).
+        """
+        from sqlalchemy import tuple_
+        from app.utils.feed_cache import feed_cache_key, FEED_CACHE_TIMEOUT
+
+        after = decode_cursor(cursor, id_count=2) if cursor else None
+        memo_key = feed_cache_key('followed_posts', self.id, self._followed_author_ids(),
+                                  page, per_page, cursor if after else '')
+        cached = cache.get(memo_key)
+        if cached is None:
+            feed = self._followed_feed_rows()
+            query = db.select(feed.c.type, feed.c.post_id, feed.c.share_id, feed.c.timestamp, feed.c.sharer_id)
+            query = query.order_by(feed.c.timestamp.desc(), feed.c.post_id.desc(), feed.c.share_id.desc())
+            total = None
+            if after:
+                query = query.where(tuple_(feed.c.timestamp, feed.c.post_id, feed.c.share_id) < tuple_(*after))
+            else:
+                total = db.session.execute(db.select(db.func.count()).select_from(feed)).scalar()
+                query = query.offset((page - 1) * per_page)
+            rows = [tuple(row) for row in db.session.execute(query.limit(per_page + 1))]
+            cached = (rows, total)
+            cache.set(memo_key, cached, timeout=FEED_CACHE_TIMEOUT)
+
+        rows, total = cached
+        page_rows = rows[:per_page]
+        next_cursor = encode_cursor(page_rows[-1][3], page_rows[-1][1], page_rows[-1][2]) if len(rows) > per_page else None
+        items = self._load_feed_items(page_rows)
+        if after:
+            return CursorPage(items, per_page, next_cursor=next_cursor, cursor=cursor)
+
+        pagination_obj = ManualPagination(items, page, per_page, total)
+        pagination_obj.next_cursor = next_cursor
         return pagination_obj
 
     def get_reset_password_token(self, expires_sec=1800):
@@ -399,47 +443,25 @@ class Post(db.Model):
         """
         Returns the count of a specific reaction type on this post.
         If reaction_type is None, returns total count of all reactions.
+        Read from the denormalized engagement counters rather than counting Reaction rows.
         """
+        from app.services.counter_service import get_reaction_counts
+        counts = get_reaction_counts([self.id]).get(self.id, {})
         if reaction_type:
-            return self.reactions.filter_by(reaction_type=reaction_type).count()
-        return self.reactions.count()
+            return counts.get(reaction_type, 0)
+        return sum(counts.values())
 
     def related_posts(self, max_posts=5):
         """
         Finds posts related to the current post based on shared hashtags.
+        Read from the precomputed related_post lists (see related_posts_service).
         """
-        if not self.hashtags.all():
+        from app.services.related_posts_service import get_related_post_ids
+        related_ids = get_related_post_ids([self.id], limit=max_posts).get(self.id, [])
+        if not related_ids:
             return []
-
-        current_post_tags_ids = {tag.id for tag in self.hashtags}
-
-        # Find posts that share at least one tag, excluding the current post
-        # and order by the number of shared tags.
-        # This requires a subquery to count common tags.
-
-        # Alias for the post_hashtags table to use in the subquery
-        from sqlalchemy.orm import aliased
-        from sqlalchemy import func
-
-        ph_alias = aliased(post_hashtags)
-
-        # Subquery to count common tags for each post
-        subquery = db.session.query(
-            Post.id.label('post_id'),
-            func.count(ph_alias.c.hashtag_id).label('common_tags_count')
-        ).join(ph_alias, Post.id == ph_alias.c.post_id)\
-         .filter(ph_alias.c.hashtag_id.in_(current_post_tags_ids))\
-         .filter(Post.id != self.id)\
-         .group_by(Post.id)\
-         .subquery()
-
-        # Main query to get the posts, ordered by the count of common tags
-        related_posts_query = db.session.query(Post)\
-            .join(subquery, Post.id == subquery.c.post_id)\
-            .order_by(subquery.c.common_tags_count.desc())\
-            .limit(max_posts)
-
-        return related_posts_query.all()
+        posts = {post.id: post for post in Post.query.filter(Post.id.in_(related_ids))}
+        return [posts[post_id] for post_id in related_ids if post_id in posts]
 
 # class Like(db.Model): # Removed, functionality merged into Reaction
 #     __tablename__ = 'likes'
@@ -474,7 +496,7 @@ class Comment(db.Model):
     body = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, index=True, default=lambda: datetime.now(timezone.utc) if hasattr(timezone, 'utc') else datetime.utcnow())
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False, index=True)
 
     is_pending_moderation = db.Column(db.Boolean, default=False, nullable=False, index=True)
     is_hidden_by_moderation = db.Column(db.Boolean, default=False, nullable=False, index=True)
@@ -526,8 +548,33 @@ class HashtagUsage(db.Model):
     def __repr__(self):
         return f'<HashtagUsage {self.hashtag.tag_text} at {self.timestamp}>'
 
+class HashtagUsageHourly(db.Model):
+    """
+    HashtagUsage rows rolled up per hashtag and UTC hour (bucket_start is the start of
+    the hour). Filled by the rollup job for complete hours only, after which raw rows
+    can be compacted away (see app/services/hashtag_usage_service.py).
+    """
+    __tablename__ = 'hashtag_usage_hourly'
+    hashtag_id = db.Column(db.Integer, db.ForeignKey('hashtag.id'), primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True, index=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<HashtagUsageHourly {self.hashtag_id} {self.bucket_start}={self.count}>'
+
+class HashtagUsageDaily(db.Model):
+    """Hourly buckets rolled up per hashtag and UTC day; kept after the hourly rows expire."""
+    __tablename__ = 'hashtag_usage_daily'
+    hashtag_id = db.Column(db.Integer, db.ForeignKey('hashtag.id'), primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True, index=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<HashtagUsageDaily {self.hashtag_id} {self.bucket_start}={self.count}>'
+
 class Notification(db.Model):
     __tablename__ = 'notifications'
+    __table_args__ = (db.Index('ix_notifications_recipient_is_read', 'recipient_id', 'is_read'),) # Mark-all-read and counter reconcile
     id = db.Column(db.Integer, primary_key=True)
     recipient_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True) # User receiving the notification
     actor_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True) # User who triggered the notification
@@ -538,6 +585,11 @@ class Notification(db.Model):
     # related_comment_id could be added if direct linking to comments is desired
     timestamp = db.Column(db.DateTime, index=True, default=lambda: datetime.now(timezone.utc) if hasattr(timezone, 'utc') else datetime.utcnow())
     is_read = db.Column(db.Boolean, default=False, nullable=False)
+    # Unread notifications for the same (recipient, kind, target) are coalesced into one row:
+    # actor_id is the latest actor and actor_count how many distinct actors it stands for
+    actor_count = db.Column(db.Integer, default=1, server_default='1', nullable=False)
+    # Those actors, recorded once a second one is coalesced in (until then only actor_id)
+    actor_links = db.relationship('NotificationActor', backref='notification', cascade='all, delete-orphan')
 
     # Relationships to easily access user objects
     recipient = db.relationship('User', foreign_keys=[recipient_id], backref=db.backref('notifications_received', lazy='dynamic'))
@@ -553,6 +605,15 @@ class Notification(db.Model):
     def __repr__(self):
         return f'<Notification {self.type} for User ID {self.recipient_id} by User ID {self.actor_id}>'
 
+class NotificationActor(db.Model):
+    """One of the distinct actors a coalesced notification stands for (see notification_service.notify)."""
+    __tablename__ = 'notification_actor'
+    notification_id = db.Column(db.Integer, db.ForeignKey('notifications.id', ondelete='CASCADE'), primary_key=True)
+    actor_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+
+    def __repr__(self):
+        return f'<NotificationActor notification_id={self.notification_id} actor_id={self.actor_id}>'
+
 class Conversation(db.Model):
     __tablename__ = 'conversations'
     id = db.Column(db.Integer, primary_key=True)
@@ -579,6 +640,8 @@ class ChatMessage(db.Model):
     # Relationship to the sender (User)
     sender = db.relationship('User', backref='sent_chat_messages', foreign_keys=[sender_id])
 
+    __table_args__ = (db.Index('ix_chat_messages_conversation_cursor', 'conversation_id', 'timestamp', 'id'),) # History windows and unread counts
+
     def __repr__(self):
         return f'<ChatMessage {self.id} from User {self.sender_id} in Conv {self.conversation_id}>'
 
@@ -599,6 +662,22 @@ class MessageReadStatus(db.Model):
     def __repr__(self):
         return f'<MessageReadStatus message_id={self.message_id} user_id={self.user_id} read_at={self.read_at}>'
 
+class ConversationReadState(db.Model):
+    """
+    How far a participant has read a conversation: the (timestamp, id) of the newest
+    message they have read. Every message at or before it counts as read by them (see
+    app/services/read_state.py).
+    """
+    __tablename__ = 'conversation_read_state'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id', ondelete='CASCADE'), primary_key=True)
+    last_read_message_id = db.Column(db.Integer, nullable=False)
+    last_read_timestamp = db.Column(db.DateTime, nullable=False) # The message's timestamp, for keyset comparisons
+    read_at = db.Column(db.DateTime, nullable=False) # When the watermark last moved
+
+    def __repr__(self):
+        return f'<ConversationReadState user_id={self.user_id} conversation_id={self.conversation_id} last_read_message_id={self.last_read_message_id}>'
+
 # Group Model
 class Group(db.Model):
     __tablename__ = 'group'
@@ -621,6 +700,10 @@ class Group(db.Model):
     # Polls associated with this group
     polls = db.relationship('Poll', backref='group', lazy='dynamic')
 
+    def member_count(self):
+        from app.services.counter_service import get_counter, GROUP, MEMBERS
+        return get_counter(GROUP, self.id, MEMBERS)
+
     def __repr__(self):
         return f'<Group {self.name}>'
 
@@ -723,7 +806,7 @@ class Poll(db.Model):
     timestamp = db.Column(db.DateTime, index=True, default=lambda: datetime.now(timezone.utc) if hasattr(timezone, 'utc') else datetime.utcnow())
 
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False) # Creator of the poll
-    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=True) # Optional: Poll associated with a post
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=True, index=True) # Optional: Poll associated with a post
     group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=True) # Optional: Poll associated with a group
 
     options = db.relationship('PollOption', backref='poll', lazy='dynamic', cascade='all, delete-orphan')
@@ -746,7 +829,7 @@ class PollOption(db.Model):
     __tablename__ = 'poll_option'
     id = db.Column(db.Integer, primary_key=True)
     option_text = db.Column(db.String(255), nullable=False)
-    poll_id = db.Column(db.Integer, db.ForeignKey('poll.id'), nullable=False)
+    poll_id = db.Column(db.Integer, db.ForeignKey('poll.id'), nullable=False, index=True)
 
     votes = db.relationship('PollVote', backref='option', lazy='dynamic', cascade='all, delete-orphan')
 
@@ -763,7 +846,7 @@ class PollVote(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     option_id = db.Column(db.Integer, db.ForeignKey('poll_option.id'), nullable=False)
     # Adding poll_id here directly to make the UniqueConstraint straightforward
-    poll_id = db.Column(db.Integer, db.ForeignKey('poll.id'), nullable=False)
+    poll_id = db.Column(db.Integer, db.ForeignKey('poll.id'), nullable=False, index=True)
     timestamp = db.Column(db.DateTime, index=True, default=lambda: datetime.now(timezone.utc) if hasattr(timezone, 'utc') else datetime.utcnow())
 
     __table_args__ = (db.UniqueConstraint('user_id', 'poll_id', name='_user_poll_uc'),)
@@ -859,6 +942,117 @@ class Share(db.Model):
         return f'<Share user_id={self.user_id} post_id={self.post_id} group_id={self.group_id}>'
 
 
+class TimelineEntry(db.Model):
+    """
+    One row per (timeline owner, feed item): the materialized home timeline.
+    Rows are written on post/share creation and follow changes (see
+    app/services/timeline_service.py) and read by cursor on (timestamp, post_id, share_id).
+    """
+    __tablename__ = 'timeline_entry'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False) # Timeline owner
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False, index=True)
+    # 0 for a direct post, otherwise Share.id. Kept non-null so it can take part in the cursor.
+    share_id = db.Column(db.Integer, nullable=False, default=0)
+    author_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    sharer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
+    timestamp = db.Column(db.DateTime, nullable=False)
+
+    post = db.relationship('Post', backref=db.backref('timeline_entries', lazy='dynamic', cascade='all, delete-orphan'))
+    sharer = db.relationship('User', foreign_keys=[sharer_id])
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'post_id', 'share_id', name='_timeline_entry_item_uc'),
+        db.Index('ix_timeline_entry_user_cursor', 'user_id', 'timestamp', 'post_id', 'share_id'),
+    )
+
+    def __repr__(self):
+        return f'<TimelineEntry user_id={self.user_id} post_id={self.post_id} share_id={self.share_id}>'
+
+
+class RelatedPost(db.Model):
+    """
+    Precomputed related posts: for each post, the RELATED_POSTS_INDEX_SIZE published posts
+    sharing the most hashtags with it (score = shared hashtag count). Kept current as posts
+    are tagged and rebuilt periodically (see app/services/related_posts_service.py).
+    """
+    __tablename__ = 'related_post'
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id', ondelete='CASCADE'), primary_key=True)
+    related_post_id = db.Column(db.Integer, db.ForeignKey('post.id', ondelete='CASCADE'), primary_key=True, index=True)
+    score = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<RelatedPost {self.post_id} -> {self.related_post_id} ({self.score})>'
+
+
+class RecommendationCandidate(db.Model):
+    """
+    Precomputed recommendations: the posts, users and groups the recommendation job scored
+    for each user. Reads filter them against the user's current follows, memberships and
+    interactions (see app/services/recommendation_service.py).
+    """
+    __tablename__ = 'recommendation_candidate'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    kind = db.Column(db.String(10), primary_key=True) # 'post', 'user' or 'group'
+    item_id = db.Column(db.Integer, primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return f'<RecommendationCandidate user_id={self.user_id} {self.kind} {self.item_id} ({self.score})>'
+
+
+class RecommendationState(db.Model):
+    """When each user's recommendation candidates were computed, and whether their inputs changed since."""
+    __tablename__ = 'recommendation_state'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    computed_at = db.Column(db.DateTime, nullable=False, index=True)
+    is_stale = db.Column(db.Boolean, nullable=False, default=False, index=True)
+
+    def __repr__(self):
+        return f'<RecommendationState user_id={self.user_id} computed_at={self.computed_at} stale={self.is_stale}>'
+
+
+class EngagementCounter(db.Model):
+    """
+    Denormalized engagement totals, one row per (entity, counter name): reactions by type,
+    comments, shares and bookmarks per post, follower/following/post totals, received
+    engagement and unread notifications per user, and member totals per group. Maintained
+    in the same transaction as the change they count (see app/services/counter_service.py).
+    """
+    __tablename__ = 'engagement_counter'
+    entity_type = db.Column(db.String(20), primary_key=True) # 'post', 'user' or 'group'
+    entity_id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), primary_key=True) # e.g. 'reactions:like', 'comments', 'followers'
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<EngagementCounter {self.entity_type}:{self.entity_id} {self.name}={self.value}>'
+
+
+class OutboxEvent(db.Model):
+    """
+    A side effect of a write (points, quest progress, notifications) recorded in the same
+    transaction as the write and applied later by the outbox workers (see app/services/outbox.py).
+    """
+    __tablename__ = 'outbox_event'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False) # Handler name, e.g. 'reaction_added'
+    idempotency_key = db.Column(db.String(200), nullable=False, unique=True) # Enqueuing the same key twice is a no-op
+    payload = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    available_at = db.Column(db.DateTime, nullable=False) # Not claimed before this: retry backoff or a worker's lease
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    claim_token = db.Column(db.String(32), nullable=True) # The worker currently applying it
+    processed_at = db.Column(db.DateTime, nullable=True)
+    failed_at = db.Column(db.DateTime, nullable=True) # Gave up after OUTBOX_MAX_ATTEMPTS
+    last_error = db.Column(db.Text, nullable=True)
+
+    __table_args__ = (db.Index('ix_outbox_event_pending', 'processed_at', 'failed_at', 'available_at'),)
+
+    def __repr__(self):
+        return f'<OutboxEvent {self.id} {self.kind} attempts={self.attempts}>'
+
+
 class Tip(db.Model):
     __tablename__ = 'tip'
     id = db.Column(db.Integer, primary_key=True)
@@ -15,10 +15,27 @@ from sqlalchemy.orm import joinedload # Import joinedload
 from werkzeug.utils import secure_filename
 from app import db, socketio, cache # Import cache
 from app.core.forms import RegistrationForm, LoginForm, EditProfileForm, PostForm, CommentForm, ForgotPasswordForm, ResetPasswordForm, GroupCreationForm, StoryForm, PollForm, EventForm, FriendListForm, AddUserToFriendListForm, PRIVACY_CHOICES, ArticleForm, AudioPostForm, SubscriptionPlanForm, TOTPSetupForm, Verify2FAForm, Disable2FAForm, ConfirmPasswordAndTOTPForm, DiscussionThreadForm, ThreadReplyForm # Added Disable2FAForm, ConfirmPasswordAndTOTPForm
-from app.core.models import User, Post, MediaItem, Reaction, Comment, Notification, Conversation, ChatMessage, Hashtag, Group, GroupMembership, Story, Poll, PollOption, PollVote, followers, Event, UserAnalytics, Share, MessageReadStatus, Mention, PRIVACY_PUBLIC, PRIVACY_FOLLOWERS, PRIVACY_CUSTOM_LIST, PRIVACY_PRIVATE, FriendList, Article, AudioPost, SubscriptionPlan, UserSubscription, Bookmark, UserPoints, ActivityLog, DiscussionThread, ThreadReply, Tip # Added Tip
+from app.core.models import User, Post, MediaItem, Reaction, Comment, Notification, Conversation, ChatMessage, Hashtag, Group, GroupMembership, Story, Poll, PollOption, PollVote, followers, Event, UserAnalytics, Share, Mention, PRIVACY_PUBLIC, PRIVACY_FOLLOWERS, PRIVACY_CUSTOM_LIST, PRIVACY_PRIVATE, FriendList, Article, AudioPost, SubscriptionPlan, UserSubscription, Bookmark, UserPoints, ActivityLog, DiscussionThread, ThreadReply, Tip # Added Tip
 from app.utils.helpers import save_picture, save_group_image, save_story_media, process_mentions, get_historical_engagement, get_top_performing_hashtags, get_top_performing_groups, save_media_file, slugify, save_audio_file, get_audio_duration, process_hashtags, award_points, get_current_utc # Added get_current_utc
 from app.services.purchase_service import process_virtual_good_purchase, process_post_purchase # Import the new service function
 from app.services.moderation_service import get_moderation_service # Import moderation service
+from app.services.timeline_service import get_home_timeline, get_public_timeline
+from app.utils.pagination import keyset_paginate
+from app.services.visibility_service import get_viewer, post_visibility_filter, story_visibility_filter, profile_visibility_filter
+from app.services.post_view_service import load_post_views
+from app.services.search_service import search_query, page_of
+from app.services.fuzzy_search import fuzzy_search_query
+from app.services.mention_index import search_mentions
+from app.services.notification_service import mark_all_read, notify
+from app.services.notification_fanout import notify_group_members
+from app.services.outbox import enqueue
+from app.services.chat_history import load_message_window, message_window_json
+from app.services.read_state import unread_counts
+from app.services.side_effects import POST_PUBLISHED, COMMENT_ADDED, REACTION_ADDED, like_milestone_event
+from app.services.counter_service import (
+    get_counters, counter_sum, top_posts_by_engagement, reactions_counter,
+    POST, USER, GROUP, COMMENTS, FOLLOWERS, FOLLOWING, POSTS, MEMBERS
+)
 from app.core.models import ModerationLog # Import ModerationLog
 from app.utils.email import send_password_reset_email # Import email utility
 import pyotp
@@ -61,8 +78,6 @@ LOGIN_LOCKOUT_PERIOD_SECONDS = 300 # 5 minutes
 # Structure: {'ip_address': {'attempts': count, 'lockout_until': timestamp}}
 failed_login_attempts = {}
 
-LIKE_MILESTONES = [10, 50, 100, 250, 500, 1000]
-
 # Cache key generation function for user-specific caching
 def make_user_specific_cache_key(*args, **kwargs):
     path = request.path
@@ -75,60 +90,18 @@ def make_user_specific_cache_key(*args, **kwargs):
 @main.route('/index')
 @cache.cached(timeout=300, make_cache_key=make_user_specific_cache_key, unless=lambda: current_user.is_authenticated) # Cache for anonymous users
 def index():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = current_app.config.get('POSTS_PER_PAGE', 10)
-    posts_pagination = None # Initialize to None
 
     if current_user.is_authenticated:
-        purchased_post_ids = {p.post_id for p in current_user.post_purchases}
-        followed_user_ids = [user.id for user in current_user.followed]
-
-        # Condition for posts from others (followed, public, or custom list they are part of)
-        # These must be published AND NOT hidden by moderation.
-        others_posts_condition = and_(
-            Post.is_published == True,
-            Post.is_hidden_by_moderation == False, # New condition
-            or_(
-                and_( # Posts from followed users
-                    Post.user_id.in_(followed_user_ids),
-                    or_(
-                        Post.privacy_level == PRIVACY_PUBLIC,
-                        Post.privacy_level == PRIVACY_FOLLOWERS
-                    )
-                ),
-                and_( # Posts from ANY user shared with a custom list current_user is on
-                    Post.privacy_level == PRIVACY_CUSTOM_LIST,
-                    Post.custom_friend_list_id.isnot(None),
-                    Post.custom_friend_list.has(
-                        FriendList.members.any(User.id == current_user.id)
-                    )
-                ),
-                Post.privacy_level == PRIVACY_PUBLIC # Public posts from anyone not followed
-            )
-        )
-
-        # Condition for user's own posts (published or scheduled)
-        own_posts_condition = and_(Post.user_id == current_user.id)
-
-        posts_query = Post.query.filter(
-            or_(
-                others_posts_condition,
-                own_posts_condition
-            )
-        ).distinct().order_by(Post.timestamp.desc())
-
-        posts_pagination = db.paginate(posts_query, page=page, per_page=per_page, error_out=False)
-        posts = posts_pagination.items
+        # Materialized home timeline (fan-out-on-write) merged with followed high-follower
+        # authors and public discovery posts; see app/services/timeline_service.py
+        posts_pagination = get_home_timeline(current_user, cursor=cursor, per_page=per_page)
     else:
-        # Public feed for guests (e.g., most recent posts from all users)
-        # Only show published posts AND NOT hidden by moderation
-        posts_query = Post.query.filter(
-            Post.privacy_level == PRIVACY_PUBLIC,
-            Post.is_published == True,
-            Post.is_hidden_by_moderation == False # New condition
-        ).order_by(Post.timestamp.desc())
-        posts_pagination = db.paginate(posts_query, page=page, per_page=per_page, error_out=False)
-        posts = posts_pagination.items
+        # Public feed for guests: published, non-hidden public posts from all users
+        posts_pagination = get_public_timeline(cursor=cursor, per_page=per_page)
+    posts = [item['item'] for item in posts_pagination.items]
+    post_views = load_post_views(posts, current_user)
 
     comment_form = CommentForm()
     recommended_users = []
@@ -138,10 +111,8 @@ def index():
         recommendations = get_recommendations(current_user.id)
         recommended_users = recommendations.get('users', [])[:3]
         recommended_groups = recommendations.get('groups', [])[:3]
-    else:
-        purchased_post_ids = set()
 
-    return render_template('index.html', title=_l('Home'), posts=posts, comment_form=comment_form, pagination=posts_pagination, recommended_users=recommended_users, recommended_groups=recommended_groups, purchased_post_ids=purchased_post_ids)
+    return render_template('index.html', title=_l('Home'), posts=posts, comment_form=comment_form, pagination=posts_pagination, recommended_users=recommended_users, recommended_groups=recommended_groups, post_views=post_views)
 
 
 from app.core.models import post_hashtags # For hashtag popularity sort
@@ -154,99 +125,78 @@ def search():
     query_term = request.args.get('q', '').strip()
     category = request.args.get('category', 'all').lower()
     sort_by = request.args.get('sort_by', 'relevance').lower()
+    fuzzy = request.args.get('fuzzy', 0, type=int) == 1
+    # Typo-tolerant matching covers names; posts always go through the full-text index
+    find_names = fuzzy_search_query if fuzzy else search_query
 
     recommendations = None
     if not query_term and current_user.is_authenticated:
         recommendations = get_recommendations(current_user.id)
 
     users_found, posts_found, groups_found, hashtags_found = [], [], [], []
-    purchased_post_ids = set()
-    if current_user.is_authenticated:
-        purchased_post_ids = {p.post_id for p in current_user.post_purchases}
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = current_app.config.get('SEARCH_RESULTS_PER_PAGE', 20)
+    has_next = False
 
     if query_term:
+        viewer = get_viewer(current_user) # Follow and friend-list memberships, loaded once for all categories
+        # Each category is matched through the search index and ranked by relevance unless another sort is asked for
         # Users Search
         if category == 'all' or category == 'users':
-            user_q = User.query.filter(or_(User.username.ilike(f'%{query_term}%'), User.email.ilike(f'%{query_term}%')))
-            if current_user.is_authenticated:
-                user_q = user_q.filter(
-                    or_(
-                        User.id == current_user.id, # Own profile
-                        User.profile_visibility == PRIVACY_PUBLIC,
-                        # Check if current_user is a follower of the User being searched
-                        and_(User.profile_visibility == PRIVACY_FOLLOWERS, User.followers.any(User.id == current_user.id))
-                    )
-                )
-            else: # Unauthenticated user
-                user_q = user_q.filter(User.profile_visibility == PRIVACY_PUBLIC)
-            if sort_by == 'popularity':
-                user_q = user_q.outerjoin(followers, User.id == followers.c.followed_id)\
-                               .group_by(User.id)\
-                               .order_by(func.count(followers.c.follower_id).desc(), User.username.asc())
-            elif sort_by == 'date':
-                user_q = user_q.order_by(User.id.desc())
-            else:
-                user_q = user_q.order_by(User.username.asc())
-            users_found = user_q.all()
+            user_q, rank = find_names('users', query_term)
+            if user_q is not None:
+                user_q = user_q.filter(profile_visibility_filter(viewer))
+                if sort_by == 'popularity':
+                    user_q = user_q.order_by(counter_sum(USER, User.id, FOLLOWERS).desc(), User.username.asc())
+                elif sort_by == 'date':
+                    user_q = user_q.order_by(User.id.desc())
+                else:
+                    user_q = user_q.order_by(rank, User.username.asc())
+                users_found, more = page_of(user_q, page, per_page)
+                has_next = has_next or more
 
         # Posts Search
         if category == 'all' or category == 'posts':
-            post_q = Post.query.filter(Post.body.ilike(f'%{query_term}%'))
-            if current_user.is_authenticated:
-                # Define followed_ids_for_search if not already in scope
-                followed_ids_for_search = [u.id for u in current_user.followed]
-                post_q = post_q.filter(
-                    or_(
-                        Post.user_id == current_user.id, # Own posts
-                        Post.privacy_level == PRIVACY_PUBLIC,
-                        and_(Post.privacy_level == PRIVACY_FOLLOWERS, Post.user_id.in_(followed_ids_for_search)),
-                        and_( # Posts matching search term shared via a custom list current_user is on
-                            Post.privacy_level == PRIVACY_CUSTOM_LIST,
-                            Post.custom_friend_list_id.isnot(None),
-                            Post.custom_friend_list.has(
-                                FriendList.members.any(User.id == current_user.id)
-                            )
-                        )
-                    )
-                ).distinct() # Added distinct()
-            else: # Unauthenticated user
-                post_q = post_q.filter(Post.privacy_level == PRIVACY_PUBLIC)
-            if sort_by == 'date':
-                post_q = post_q.order_by(Post.timestamp.desc())
-            elif sort_by == 'popularity':
-                # Updated to join with Reaction model, specifically counting 'like' reactions for popularity
-                post_q = post_q.outerjoin(Post.reactions.and_(Reaction.reaction_type == 'like')).outerjoin(Post.comments)\
-                               .group_by(Post.id)\
-                               .order_by((func.coalesce(func.count(Reaction.id), 0) + func.coalesce(func.count(Comment.id), 0)).desc(), Post.timestamp.desc())
-            else:
-                post_q = post_q.order_by(Post.timestamp.desc())
-            posts_found = post_q.all()
+            post_q, rank = search_query('posts', query_term)
+            if post_q is not None:
+                post_q = post_q.filter(post_visibility_filter(viewer))
+                if sort_by == 'date':
+                    post_q = post_q.order_by(Post.timestamp.desc(), Post.id.desc())
+                elif sort_by == 'popularity':
+                    # 'like' reactions plus comments, read from the engagement counters
+                    post_q = post_q.order_by(counter_sum(POST, Post.id, reactions_counter('like'), COMMENTS).desc(), Post.timestamp.desc())
+                else:
+                    post_q = post_q.order_by(rank, Post.timestamp.desc())
+                posts_found, more = page_of(post_q, page, per_page)
+                has_next = has_next or more
 
         # Groups Search
         if category == 'all' or category == 'groups':
-            group_q = Group.query.filter(or_(Group.name.ilike(f'%{query_term}%'), Group.description.ilike(f'%{query_term}%')))
-            if sort_by == 'date':
-                group_q = group_q.order_by(Group.created_at.desc())
-            elif sort_by == 'popularity':
-                group_q = group_q.outerjoin(GroupMembership)\
-                                 .group_by(Group.id)\
-                                 .order_by(func.count(GroupMembership.id).desc(), Group.name.asc())
-            else:
-                group_q = group_q.order_by(Group.name.asc())
-            groups_found = group_q.all()
+            group_q, rank = find_names('groups', query_term)
+            if group_q is not None:
+                if sort_by == 'date':
+                    group_q = group_q.order_by(Group.created_at.desc())
+                elif sort_by == 'popularity':
+                    group_q = group_q.order_by(counter_sum(GROUP, Group.id, MEMBERS).desc(), Group.name.asc())
+                else:
+                    group_q = group_q.order_by(rank, Group.name.asc())
+                groups_found, more = page_of(group_q, page, per_page)
+                has_next = has_next or more
 
         # Hashtags Search
         if category == 'all' or category == 'hashtags':
-            hashtag_q = Hashtag.query.filter(Hashtag.tag_text.ilike(f'%{query_term}%'))
-            if sort_by == 'popularity':
-                hashtag_q = hashtag_q.outerjoin(post_hashtags, Hashtag.id == post_hashtags.c.hashtag_id)\
-                                     .group_by(Hashtag.id)\
-                                     .order_by(func.count(post_hashtags.c.post_id).desc(), Hashtag.tag_text.asc())
-            elif sort_by == 'date':
-                hashtag_q = hashtag_q.order_by(Hashtag.tag_text.asc())
-            else:
-                hashtag_q = hashtag_q.order_by(Hashtag.tag_text.asc())
-            hashtags_found = hashtag_q.all()
+            hashtag_q, rank = find_names('hashtags', query_term)
+            if hashtag_q is not None:
+                if sort_by == 'popularity':
+                    hashtag_q = hashtag_q.outerjoin(post_hashtags, Hashtag.id == post_hashtags.c.hashtag_id)\
+                                         .group_by(Hashtag.id, rank)\
+                                         .order_by(func.count(post_hashtags.c.post_id).desc(), Hashtag.tag_text.asc())
+                elif sort_by == 'date':
+                    hashtag_q = hashtag_q.order_by(Hashtag.tag_text.asc())
+                else:
+                    hashtag_q = hashtag_q.order_by(rank, Hashtag.tag_text.asc())
+                hashtags_found, more = page_of(hashtag_q, page, per_page)
+                has_next = has_next or more
 
     # Title Logic
     final_title = ""
@@ -263,24 +213,28 @@ def search():
                 temp_title_parts.append(_l('sorted by %(sort_by)s', sort_by=sort_by.capitalize()))
 
         if temp_title_parts:
-            final_title = " ".join(temp_title_parts)
+            final_title = " ".join(str(part) for part in temp_title_parts)
         elif recommendations:
              final_title = _l('Recommended for You')
         else:
             final_title = _l('Search')
 
     comment_form = CommentForm()
+    post_views = load_post_views(list(posts_found) + list((recommendations or {}).get('posts', [])), current_user)
 
     return render_template('search_results.html',
                            title=final_title,
                            query=query_term,
-                           purchased_post_ids=purchased_post_ids,
+                           post_views=post_views,
                            users=users_found,
                            posts=posts_found,
                            groups=groups_found,
                            hashtags=hashtags_found,
                            selected_category=category,
                            selected_sort_by=sort_by,
+                           fuzzy=fuzzy,
+                           page=page,
+                           has_next=has_next,
                            recommendations=recommendations,
                            comment_form=comment_form)
 
@@ -298,7 +252,11 @@ def search_recommendations():
 
     recommendations = get_recommendations(current_user.id)
 
-    # Serialize recommendations
+    # Serialize recommendations (counts read in bulk from the engagement counters)
+    like_counter = reactions_counter('like')
+    post_counters = get_counters(POST, [p.id for p in recommendations.get('posts', [])], names=(like_counter, COMMENTS))
+    user_counters = get_counters(USER, [u.id for u in recommendations.get('users', [])], names=(FOLLOWERS,))
+    group_counters = get_counters(GROUP, [g.id for g in recommendations.get('groups', [])], names=(MEMBERS,))
     rec_posts = []
     for post in recommendations.get('posts', []):
         rec_posts.append({
@@ -313,8 +271,8 @@ def search_recommendations():
             'group_id': post.group_id,
             'group_name': post.group.name if post.group else None, # Add group name
             'user_id': post.user_id,
-            'like_count': post.reaction_count('like'), # Updated to use reaction_count for 'like'
-            'comment_count': post.comments.count(), # Assuming Comment model has direct count or a method like post.comments.count()
+            'like_count': post_counters[post.id].get(like_counter, 0),
+            'comment_count': post_counters[post.id].get(COMMENTS, 0),
             'url': url_for('main.view_post_page', post_id=post.id) if hasattr(main, 'view_post_page') else '#' # Placeholder for post view URL
         })
 
@@ -325,7 +283,7 @@ def search_recommendations():
             'username': user_obj.username,
             'bio': user_obj.bio,
             'profile_picture_url': user_obj.profile_picture_url or url_for('static', filename='images/default_profile_pic.png'),
-            'follower_count': user_obj.followers.count(), # Add follower count
+            'follower_count': user_counters[user_obj.id].get(FOLLOWERS, 0), # Add follower count
             'is_following': current_user.is_following(user_obj) if current_user.is_authenticated else False, # Check if current user is following
             'profile_url': url_for('main.profile', username=user_obj.username)
         })
@@ -337,7 +295,7 @@ def search_recommendations():
             'name': group_obj.name,
             'description': group_obj.description,
             'image_file': group_obj.image_file or url_for('static', filename='images/default_group_pic.png'),
-            'member_count': group_obj.memberships.count(), # Add member count
+            'member_count': group_counters[group_obj.id].get(MEMBERS, 0), # Add member count
             'is_member': current_user.is_member_of(group_obj.id) if current_user.is_authenticated else False, # Check if current user is a member
             'group_url': url_for('main.view_group', group_id=group_obj.id)
         })
@@ -355,13 +313,12 @@ def search_mentions_for_autocomplete():
     query = request.args.get('q', '', type=str)
     results = []
     if query and len(query) >= 1: # Require at least 1 char for query
-        # Search for users where username starts with the query (case-insensitive)
-        users = User.query.filter(User.username.ilike(f"{query}%")).limit(10).all()
-        for user in users:
+        # Usernames starting with the query (case-insensitive), served from the in-process prefix index
+        for entry in search_mentions(query, current_user, limit=10):
             results.append({
-                'username': user.username,
+                'username': entry.username,
                 # Construct profile picture URL safely
-                'profile_picture_url': url_for('static', filename=f'images/{user.profile_picture_url if user.profile_picture_url else "default_profile_pic.png"}')
+                'profile_picture_url': url_for('static', filename=f'images/{entry.profile_picture_url if entry.profile_picture_url else "default_profile_pic.png"}')
             })
     return jsonify({'users': results})
 
@@ -371,35 +328,35 @@ def hashtag_feed(tag_text):
     normalized_tag_text = tag_text.lower()
     hashtag = Hashtag.query.filter_by(tag_text=normalized_tag_text).first()
     posts = []
+    pagination = None
     title = _l('No posts found for #%(tag)s', tag=normalized_tag_text)
 
     if hashtag:
-        # Only show published and not hidden posts in hashtag feeds
-        posts = hashtag.posts.filter(
+        # Only show published and not hidden posts in hashtag feeds (not even the viewer's own drafts),
+        # and only those the viewer's follow/list memberships entitle them to
+        posts_query = hashtag.posts.filter(
             Post.is_published == True,
-            Post.is_hidden_by_moderation == False # New condition
-        ).order_by(Post.timestamp.desc()).all()
+            Post.is_hidden_by_moderation == False,
+            post_visibility_filter(current_user)
+        )
+        pagination = keyset_paginate(posts_query, Post.timestamp, Post.id, cursor=request.args.get('cursor'),
+                                     per_page=current_app.config.get('POSTS_PER_PAGE', 10))
+        posts = pagination.items
         title = _l('Posts tagged #%(tag)s', tag=hashtag.tag_text)
         if not posts: # Hashtag exists but no posts are associated or published/visible
              title = _l('No published posts found for #%(tag)s', tag=hashtag.tag_text) # Message can be improved
     # else: title remains "No posts found..."
-    purchased_post_ids = set()
-    if current_user.is_authenticated:
-        purchased_post_ids = {p.post_id for p in current_user.post_purchases}
+    post_views = load_post_views(posts, current_user)
 
-    return render_template('hashtag_feed.html', title=title, hashtag=hashtag, posts=posts, query=normalized_tag_text, purchased_post_ids=purchased_post_ids) # pass normalized
+    return render_template('hashtag_feed.html', title=title, hashtag=hashtag, posts=posts, pagination=pagination, query=normalized_tag_text, post_views=post_views) # pass normalized
 
 
-from app.services.trending_service import calculate_trending_scores
+from app.services.trending_service import get_trending_hashtags
 
 @main.route('/trending_hashtags')
 def trending_hashtags():
-    trending_hashtags_with_scores = calculate_trending_scores()
-    trending_hashtags = []
-    for tag_text, score in trending_hashtags_with_scores:
-        hashtag = Hashtag.query.filter_by(tag_text=tag_text).first()
-        if hashtag:
-            trending_hashtags.append(hashtag)
+    # Top-K (tag_text, score) from the streaming trending summary
+    trending_hashtags = get_trending_hashtags()
     return render_template('trending_hashtags.html', title=_l("Trending Hashtags"), hashtags=trending_hashtags)
 
 
@@ -622,10 +579,6 @@ def profile(username):
     profile_is_private = False
     profile_is_limited = False
 
-    purchased_post_ids = set()
-    if current_user.is_authenticated:
-        purchased_post_ids = {p.post_id for p in current_user.post_purchases}
-
     if user.id != getattr(current_user, 'id', None): # Not viewing own profile
         if user.profile_visibility == PRIVACY_PRIVATE:
             flash(_l("%(username)s's profile is private.", username=user.username), "info")
@@ -648,33 +601,10 @@ def profile(username):
     elif getattr(current_user, 'id', None) == user.id: # Viewing own profile
         # Show all own posts, regardless of is_published (for drafts/scheduled) or moderation status
         posts = posts_query.all()
+    elif profile_is_limited: # Followers-only profile and current_user is not a follower
+        posts = []
     else: # Viewing another user's profile (and it's not fully private)
-        # Base filter for published and not hidden posts
-        q_filters = [Post.is_published == True, Post.is_hidden_by_moderation == False] # New condition
-
-        # Add privacy level filters for published posts
-        privacy_options = [Post.privacy_level == PRIVACY_PUBLIC]
-        if current_user.is_authenticated and current_user.is_following(user):
-            privacy_options.append(Post.privacy_level == PRIVACY_FOLLOWERS)
-
-        if current_user.is_authenticated:
-            privacy_options.append(
-                and_(
-                    Post.privacy_level == PRIVACY_CUSTOM_LIST,
-                    Post.custom_friend_list_id.isnot(None),
-                    Post.user_id == user.id, # Ensure it's the profile owner's post
-                    Post.custom_friend_list.has(
-                        FriendList.members.any(User.id == current_user.id)
-                    )
-                )
-            )
-
-        q_filters.append(or_(*privacy_options))
-        posts_query = posts_query.filter(and_(*q_filters))
-        posts = posts_query.distinct().all()
-
-        if profile_is_limited: # If profile is followers-only and current_user is not a follower
-             posts = []
+        posts = posts_query.filter(post_visibility_filter(current_user)).all()
 
     # Fetch equipped virtual goods
     equipped_badge = None
@@ -709,7 +639,7 @@ def profile(username):
                            profile_is_limited=profile_is_limited,
                            equipped_badge=equipped_badge, equipped_frame=equipped_frame,
                            equipped_items_error=equipped_items_error,
-                           purchased_post_ids=purchased_post_ids)
+                           post_views=load_post_views(posts, current_user))
 
 @main.route('/edit_profile', methods=['GET', 'POST'])
 @login_required
@@ -1091,7 +1021,7 @@ def create_post():
             db.session.add(item)
 
         process_hashtags(post.body, post)
-        mentioned_users_in_post = process_mentions(text_content=post.body, owner_object=post, actor_user=current_user)
+        process_mentions(text_content=post.body, owner_object=post, actor_user=current_user)
 
         # db.session.add(post) is done above. Media items are added after this block.
         # Process hashtags and mentions (can happen before or after commit, but before notifications)
@@ -1189,52 +1119,15 @@ def create_post():
                 db.session.rollback()
                 current_app.logger.error(f"Error creating/committing notification for auto-hidden post {post.id}: {e_hidden_notif}")
 
-        elif post.is_published and not post.is_hidden_by_moderation: # Check flags AFTER commit
-            # Gamification: Award points for creating a post (more for media posts)
-            points_for_post = 15 if media_items_to_add else 10 # media_items_to_add is from original code
-            award_points(current_user, 'create_post', points_for_post, related_item=post)
-
-            # Quest progress updates for post creation
-            update_quest_progress(current_user, 'create_post', related_item=post)
-            if media_items_to_add: # Check if there was media
-                update_quest_progress(current_user, 'create_post_with_media', related_item=post)
-            update_quest_progress(current_user, 'general_engagement_weekly', related_item=post)
-            # Note: award_points & update_quest_progress add to session. Commit is handled below or with notifications.
-
-            if mentioned_users_in_post: # mentioned_users_in_post is from original code
-                for tagged_user in mentioned_users_in_post:
-                    if tagged_user.id != current_user.id:
-                        mention_obj = Mention.query.filter_by(
-                            user_id=tagged_user.id,
-                            post_id=post.id,
-                            actor_id=current_user.id
-                        ).order_by(Mention.timestamp.desc()).first()
-                        if mention_obj:
-                            notification = Notification(
-                                recipient_id=tagged_user.id,
-                                actor_id=current_user.id,
-                                type='mention',
-                                related_post_id=post.id,
-                                related_mention_id=mention_obj.id)
-                            db.session.add(notification)
-                            socketio.emit('new_notification', {
-                                'type': 'mention', 'message': f"{current_user.username} mentioned you in a post.",
-                                'actor_username': current_user.username, 'tagged_username': tagged_user.username,
-                                'post_id': post.id, 'post_body_preview': post.body[:50] + "..." if len(post.body) > 50 else post.body,
-                                'owner_username': post.author.username,
-                                'url': url_for('main.profile', username=post.author.username, _external=True) + f'#post-{post.id}'
-                            }, room=str(tagged_user.id))
-                db.session.commit() # Commit mention notifications
-
-            if target_group: # This implies post.group_id is set
-                for membership_assoc in target_group.memberships:
-                    member_user = membership_assoc.user
-                    if member_user.id != current_user.id:
-                        notification = Notification(
-                            recipient_id=member_user.id, actor_id=current_user.id,
-                            type='new_group_post', related_post_id=post.id, related_group_id=target_group.id)
-                        db.session.add(notification)
-                db.session.commit() # Commit group post notifications
+        else:
+            if post.is_published:
+                # Points, quests, @mention and group notifications are applied by the outbox workers,
+                # committed together with the post so they can be neither lost nor applied twice
+                enqueue(POST_PUBLISHED, {
+                    'post_id': post.id, 'with_media': bool(media_items_to_add),
+                    'url': url_for('main.profile', username=current_user.username, _external=True) + f'#post-{post.id}'
+                }, f'{POST_PUBLISHED}:{post.id}')
+            db.session.commit() # Commit post, media, hashtags, mentions, moderation log and outbox event
 
         # Flash messages based on moderation decision (needs to be after the main commit)
         if post.is_hidden_by_moderation:
@@ -1350,17 +1243,14 @@ def edit_post(post_id):
                             type='mention', related_mention_id=mention_obj.id
                         ).first()
                         if not existing_notification:
-                            notification = Notification(
-                                recipient_id=tagged_user.id, actor_id=current_user.id, type='mention',
-                                related_post_id=post.id, related_mention_id=mention_obj.id)
-                            db.session.add(notification)
-                            socketio.emit('new_notification', {
+                            notify(tagged_user.id, current_user.id, 'mention', related_post_id=post.id,
+                                   related_mention_id=mention_obj.id, payload={
                                 'type': 'mention', 'message': f"{current_user.username} mentioned you in an updated post.",
                                 'actor_username': current_user.username, 'tagged_username': tagged_user.username,
                                 'post_id': post.id, 'post_body_preview': post.body[:50] + "..." if len(post.body) > 50 else post.body,
                                 'owner_username': post.author.username,
                                 'url': url_for('main.profile', username=post.author.username, _external=True) + f'#post-{post.id}'
-                            }, room=str(tagged_user.id))
+                            })
             db.session.commit()
 
         flash('Your post has been updated!', 'success')
@@ -1511,8 +1401,8 @@ def add_comment(post_id):
         )
         db.session.add(comment)
 
-        # Process mentions before committing the comment
-        mentioned_users_in_comment = process_mentions(text_content=comment.body, owner_object=comment, actor_user=current_user)
+        # Process mentions before committing the comment (their notifications are sent by the outbox workers)
+        process_mentions(text_content=comment.body, owner_object=comment, actor_user=current_user)
 
         db.session.flush() # Flush to get comment.id for ModerationLog
 
@@ -1527,58 +1417,21 @@ def add_comment(post_id):
             )
             db.session.add(moderation_log_entry)
 
-        # Gamification and notifications only if comment is not hidden
+        # Gamification and notifications only if comment is not hidden, applied by the outbox workers
         if not comment.is_hidden_by_moderation:
-            award_points(current_user, 'create_comment', 5, related_item=comment)
-            if post.author.id != current_user.id:
-                award_points(post.author, 'receive_comment', 3, related_item=comment)
-
-            # Quest progress updates for comment creation
-            update_quest_progress(current_user, 'create_comment', related_item=comment)
-            update_quest_progress(current_user, 'general_engagement_weekly', related_item=comment)
+            enqueue(COMMENT_ADDED, {
+                'comment_id': comment.id,
+                'url': url_for('main.profile', username=post.author.username, _external=True) + f'#comment-{comment.id}'
+            }, f'{COMMENT_ADDED}:{comment.id}')
 
         try:
-            db.session.commit() # Commit comment, points, activity logs, quest progress, and moderation log
+            db.session.commit() # Commit comment, mentions, moderation log and outbox event
         except Exception as e_comment_commit:
             db.session.rollback()
             current_app.logger.error(f"Error committing comment: {e_comment_commit}")
             flash('An error occurred while adding your comment. Please try again.', 'danger')
             return redirect(request.referrer or url_for('main.index'))
 
-        # Notifications for mentions in the comment (if not hidden)
-        if not comment.is_hidden_by_moderation and mentioned_users_in_comment:
-            for tagged_user in mentioned_users_in_comment:
-                if tagged_user.id != current_user.id: # Avoid self-notification
-                    mention_obj = Mention.query.filter_by(
-                        user_id=tagged_user.id,
-                        comment_id=comment.id,
-                        actor_id=current_user.id
-                    ).order_by(Mention.timestamp.desc()).first()
-
-                    if mention_obj: # Should exist as process_mentions created it
-                        notification = Notification(
-                            recipient_id=tagged_user.id,
-                            actor_id=current_user.id,
-                            type='mention',
-                            related_post_id=comment.post_id,
-                            related_mention_id=mention_obj.id
-                        )
-                        db.session.add(notification)
-                        # Emit SocketIO for mention in comment
-                        socketio.emit('new_notification', {
-                            'type': 'mention',
-                            'message': f"{current_user.username} mentioned you in a comment.",
-                            'actor_username': current_user.username,
-                            'tagged_username': tagged_user.username,
-                            'post_id': comment.post_id,
-                            'comment_id': comment.id,
-                            'comment_body_preview': comment.body[:50] + "..." if len(comment.body) > 50 else comment.body,
-                            'owner_username': comment.author.username,
-                            'post_author_username': post.author.username,
-                            'url': url_for('main.profile', username=post.author.username, _external=True) + f'#comment-{comment.id}'
-                        }, room=str(tagged_user.id))
-            db.session.commit() # Commit mention notifications for comment
-
         # Flash message based on moderation decision
         if comment.is_hidden_by_moderation:
             flash('Your comment is under review and not currently visible.', 'warning')
@@ -1606,28 +1459,6 @@ def add_comment(post_id):
             flash('Your comment has been submitted and flagged for review.', 'info')
         else: # Not hidden, not pending
             flash('Your comment has been added!', 'success')
-
-        # Notification to post author (if not hidden and not self-comment)
-        if not comment.is_hidden_by_moderation and post.author.id != current_user.id:
-            notification = Notification( # Ensure Notification is imported
-                recipient_id=post.author.id,
-                actor_id=current_user.id,
-                type='comment',
-                related_post_id=post.id
-                # Consider adding related_comment_id=comment.id if useful
-            )
-            db.session.add(notification)
-            db.session.commit() # Commit notification
-            socketio.emit('new_notification',
-                          {
-                            'message': f'{current_user.username} commented on your post.',
-                            'type': 'comment',
-                            'actor_username': current_user.username,
-                            'post_id': post.id,
-                            'post_author_username': post.author.username,
-                            'comment_body': comment.body[:50] + "..." if len(comment.body) > 50 else comment.body
-                           },
-                          room=str(post.author.id))
     else:
         if form.errors:
             error_messages = []
@@ -1647,13 +1478,19 @@ def add_comment(post_id):
 @main.route('/notifications')
 @login_required
 def notifications():
-    # Fetch notifications for the current user, newest first
-    user_notifications = Notification.query.filter_by(recipient_id=current_user.id).order_by(Notification.timestamp.desc()).all()
-    for notification in user_notifications:
-        notification.is_read = True
+    # Fetch one page of notifications for the current user, newest first
+    pagination = keyset_paginate(
+        Notification.query.filter_by(recipient_id=current_user.id),
+        Notification.timestamp, Notification.id,
+        cursor=request.args.get('cursor'),
+        per_page=current_app.config.get('NOTIFICATIONS_PER_PAGE', 20)
+    )
+    user_notifications = pagination.items
+    # Visiting the page clears the badge: one UPDATE instead of loading every row, and the cached count drops to 0
+    mark_all_read(current_user.id)
     db.session.commit()
     socketio.emit('notifications_cleared', {'message': 'All notifications marked as read.'}, room=str(current_user.id))
-    return render_template('notifications.html', title='Your Notifications', notifications=user_notifications)
+    return render_template('notifications.html', title='Your Notifications', notifications=user_notifications, pagination=pagination)
 
 # Define allowed reaction types
 ALLOWED_REACTIONS = {'like', 'love', 'haha', 'wow', 'sad', 'angry'}
@@ -1686,73 +1523,18 @@ def react_to_post(post_id, reaction_type):
         # New reaction
         new_reaction = Reaction(user_id=current_user.id, post_id=post.id, reaction_type=reaction_type)
         db.session.add(new_reaction)
-        # db.session.commit() # Commit will be done after potential points awarding and notifications
+        db.session.flush() # Assigns new_reaction.id for the outbox event
 
-        # Award points to the post author for receiving a new reaction
-        if post.author.id != current_user.id: # Don't award points if user reacts to their own post
-            points_for_reaction = 0
+        # Points, the author's notification and like milestones are applied by the outbox
+        if post.author.id != current_user.id: # Not for reacting to your own post
+            enqueue(REACTION_ADDED, {'reaction_id': new_reaction.id, 'reaction_type': reaction_type},
+                    f'{REACTION_ADDED}:{new_reaction.id}')
             if reaction_type == 'like':
-                points_for_reaction = 2
-            else:
-                points_for_reaction = 3 # For other reactions like 'love', 'haha', etc.
-
-            action_name_for_reaction = f'receive_{reaction_type}_reaction'
-            # Gamification: Award points to post author for receiving a reaction (more for non-likes)
-            award_points(post.author, action_name_for_reaction, points_for_reaction, related_item=post)
-
-        db.session.commit() # Commit reaction and any points/activity logs
+                # The counter hooks ran on flush, so this is the count this like made
+                like_milestone_event(post, current_user.id, post.reaction_count('like'))
+        db.session.commit()
         flash(f'You reacted with "{reaction_type}" to the post!', 'success')
 
-        # Notification for the post author (if not reacting to own post)
-        if post.author.id != current_user.id:
-            notification = Notification(
-                recipient_id=post.author.id,
-                actor_id=current_user.id,
-                type=f'reaction_{reaction_type}', # More specific notification type
-                related_post_id=post.id
-            )
-            db.session.add(notification)
-            db.session.commit() # Commit notification separately or ensure it's part of a larger transaction
-            socketio.emit('new_notification', {
-                'message': f'{current_user.username} reacted with "{reaction_type}" to your post.',
-                'type': f'reaction_{reaction_type}',
-                'reaction_type': reaction_type,
-                'actor_username': current_user.username,
-                'post_id': post.id,
-                'post_author_username': post.author.username
-            }, room=str(post.author.id))
-
-            # Milestone notifications specifically for 'like' reactions
-            if reaction_type == 'like':
-                current_like_count = post.reaction_count('like') # Use new method
-                for milestone_val in LIKE_MILESTONES:
-                    if current_like_count == milestone_val:
-                        # Check if a milestone notification of this type already exists for this post for this author
-                        # To prevent duplicate notifications if something causes a recount or re-trigger
-                        existing_milestone_notif = Notification.query.filter_by(
-                            recipient_id=post.author.id, # Should be post.author.id
-                            related_post_id=post.id,
-                            type=f'like_milestone_{milestone_val}'
-                        ).first()
-                        if not existing_milestone_notif:
-                            milestone_notif = Notification(
-                                recipient_id=post.author.id,
-                                actor_id=current_user.id, # The user whose 'like' caused the milestone
-                                type=f'like_milestone_{milestone_val}',
-                                related_post_id=post.id
-                            )
-                            db.session.add(milestone_notif)
-                            db.session.commit() # Commit milestone notification
-                            socketio.emit('new_notification', {
-                                'message': f"Your post '{post.body[:30]}{'...' if len(post.body) > 30 else ''}' reached {milestone_val} likes!",
-                                'type': f'like_milestone_{milestone_val}',
-                                'actor_username': current_user.username, # Or system/generic for milestones
-                                'post_id': post.id,
-                                'post_author_username': post.author.username,
-                                'milestone_count': milestone_val
-                            }, room=str(post.author.id))
-
-
     return redirect(request.referrer or url_for('main.index'))
 
 
@@ -1779,13 +1561,15 @@ def bookmark_post(post_id):
 def list_bookmarks():
     # Fetch Post objects bookmarked by the current_user, ordered by Bookmark.timestamp desc
     bookmarked_posts_query = Post.query.join(Bookmark, Post.id == Bookmark.post_id)\
-        .filter(Bookmark.user_id == current_user.id)\
-        .order_by(Bookmark.timestamp.desc())
+        .filter(Bookmark.user_id == current_user.id)
 
-    bookmarked_posts = bookmarked_posts_query.all()
+    pagination = keyset_paginate(bookmarked_posts_query, Bookmark.timestamp, Bookmark.id,
+                                 cursor=request.args.get('cursor'),
+                                 per_page=current_app.config.get('POSTS_PER_PAGE', 10))
 
     comment_form = CommentForm()  # For the _post.html partial
-    return render_template('bookmarks.html', title=_l('My Bookmarks'), posts=bookmarked_posts, comment_form=comment_form)
+    return render_template('bookmarks.html', title=_l('My Bookmarks'), posts=pagination.items, pagination=pagination,
+                           comment_form=comment_form, post_views=load_post_views(pagination.items, current_user))
 
 
 @main.route('/chat')
@@ -1794,7 +1578,10 @@ def list_bookmarks():
 def list_conversations():
     # Fetch conversations where the current user is a participant, ordered by last_updated
     user_conversations = current_user.conversations.order_by(Conversation.last_updated.desc()).all()
-    return render_template('chat/conversations_list.html', title='My Chats', conversations=user_conversations, ChatMessage=ChatMessage)
+    # One grouped query against the read watermarks, not a count per conversation
+    unread = unread_counts(current_user.id, [conv.id for conv in user_conversations])
+    return render_template('chat/conversations_list.html', title='My Chats', conversations=user_conversations,
+                           unread_counts=unread, ChatMessage=ChatMessage)
 
 @main.route('/chat/<int:conversation_id>')
 @login_required
@@ -1805,32 +1592,10 @@ def view_conversation(conversation_id):
         flash('You are not part of this conversation.', 'danger')
         return redirect(url_for('main.list_conversations'))
 
-    messages_query = conversation.messages.order_by(ChatMessage.timestamp.asc()).all() # Ensure order
-
-    # Get read statuses for the current user for messages in this conversation
-    message_ids_in_conversation = [msg.id for msg in messages_query]
-
-    current_user_read_statuses = {}
-    if message_ids_in_conversation: # Only query if there are messages
-        statuses = MessageReadStatus.query.filter(
-            MessageReadStatus.user_id == current_user.id,
-            MessageReadStatus.message_id.in_(message_ids_in_conversation)
-        ).all()
-        current_user_read_statuses = {status.message_id: status.read_at for status in statuses}
-
-    # Augment messages with read status for the current user and the general read_at
-    augmented_messages = []
-    for msg in messages_query:
-        augmented_messages.append({
-            'id': msg.id,
-            'sender_id': msg.sender_id,
-            'sender_username': msg.sender.username, # Assuming sender relationship is loaded or accessible
-            'body': msg.body,
-            'timestamp': msg.timestamp,
-            'read_at': msg.read_at, # This is the general read_at (first read by anyone/recipient in 1-1)
-            'is_read_by_current_user': msg.id in current_user_read_statuses,
-            'read_at_by_current_user': current_user_read_statuses.get(msg.id) # Specific time current user read it
-        })
+    # Newest window of messages (keyset on timestamp, id); the page backfills older ones from
+    # conversation_messages, and ?cursor= reaches them without JavaScript
+    pagination, augmented_messages = load_message_window(conversation.id, current_user.id,
+                                                         cursor=request.args.get('cursor'))
 
     other_participants = [p for p in conversation.participants if p.id != current_user.id]
 
@@ -1838,9 +1603,20 @@ def view_conversation(conversation_id):
                            title=f'Chat with {", ".join(p.username for p in other_participants) if other_participants else "Saved Messages"}',
                            conversation=conversation,
                            messages=augmented_messages, # Pass augmented messages
+                           pagination=pagination,
                            other_participants=other_participants,
                            current_user_id=current_user.id) # Pass current_user_id for template logic
 
+@main.route('/chat/<int:conversation_id>/messages')
+@login_required
+def conversation_messages(conversation_id):
+    """The window of messages before ?cursor= as JSON, for the chat page's backfill."""
+    conversation = Conversation.query.get_or_404(conversation_id)
+    if current_user not in conversation.participants:
+        return jsonify({'error': 'You are not part of this conversation.'}), 403
+    pagination, messages = load_message_window(conversation.id, current_user.id, cursor=request.args.get('cursor'))
+    return jsonify(message_window_json(conversation.id, pagination, messages))
+
 @main.route('/chat/start/<int:user_id>', methods=['POST', 'GET'])
 @login_required
 def start_or_get_conversation(user_id):
@@ -1912,22 +1688,22 @@ def analytics():
 
     # Follower/Following counts (can also come from HistoricalAnalytics if desired for the latest day)
     # For consistency, let's use the direct counts for current snapshot
-    follower_count = current_user.followers.count()
-    following_count = current_user.followed.count()
-    total_posts_count = current_user.posts.count() # More direct way to get total posts
+    user_counters = get_counters(USER, [current_user.id], names=(FOLLOWERS, FOLLOWING, POSTS))[current_user.id]
+    follower_count = user_counters.get(FOLLOWERS, 0)
+    following_count = user_counters.get(FOLLOWING, 0)
+    total_posts_count = user_counters.get(POSTS, 0)
 
-    # Top posts logic (can remain as is or be enhanced)
-    user_posts = current_user.posts.all() # Get all posts for sorting if needed by existing logic
-    # Updated to use reaction_count('like') for sorting by engagement
-    sorted_posts = sorted(user_posts, key=lambda p: p.reaction_count(reaction_type='like') + p.comments.count(), reverse=True)
-    top_5_posts_list = sorted_posts[:5]
+    # Top posts by 'like' reactions plus comments, ranked from the engagement counters
+    top_5_posts_list = top_posts_by_engagement(current_user.id, limit=5)
+    like_counter = reactions_counter('like')
+    post_counters = get_counters(POST, [post.id for post in top_5_posts_list], names=(like_counter, COMMENTS))
 
     top_posts_chart_data_json = []
     if top_5_posts_list:
         top_posts_chart_data_json = json.dumps([
             {'label': f"Post ID {post.id}: {post.body[:20]}..." if len(post.body) > 20 else f"Post ID {post.id}: {post.body}",
-             'likes': post.reaction_count(reaction_type='like'), # Use reaction_count for 'like'
-             'comments': post.comments.count()} # Assuming post.comments.count() is correct
+             'likes': post_counters[post.id].get(like_counter, 0),
+             'comments': post_counters[post.id].get(COMMENTS, 0)}
             for post in top_5_posts_list
         ])
 
@@ -1968,9 +1744,10 @@ def analytics_export():
 
     # 1. Fetch Summary Statistics
     user_analytics_summary = UserAnalytics.query.filter_by(user_id=current_user.id).first()
-    total_posts_count = Post.query.filter_by(user_id=current_user.id).count()
-    current_follower_count = current_user.followers.count()
-    current_following_count = current_user.followed.count()
+    user_counters = get_counters(USER, [current_user.id], names=(FOLLOWERS, FOLLOWING, POSTS))[current_user.id]
+    total_posts_count = user_counters.get(POSTS, 0)
+    current_follower_count = user_counters.get(FOLLOWERS, 0)
+    current_following_count = user_counters.get(FOLLOWING, 0)
 
     summary_data = [
         ("Total Posts", total_posts_count),
@@ -2118,22 +1895,14 @@ def join_event(event_id):
 
         # Notification for the event organizer
         if event.organizer_id != current_user.id:
-            notification = Notification(
-                recipient_id=event.organizer_id,
-                actor_id=current_user.id,
-                type='event_join',
-                related_event_id=event.id
-            )
-            db.session.add(notification)
-            # Emit socketio event if desired for real-time notification
-            socketio.emit('new_notification',
-                          {'message': f'{current_user.username} is attending your event: {event.name}.',
-                           'type': 'event_join',
-                           'actor_username': current_user.username,
-                           # 'event_id': event.id, # Optional: for client-side routing
-                           'event_name': event.name
-                           },
-                          room=str(event.organizer_id))
+            # Pushed once the commit below succeeds
+            notify(event.organizer_id, current_user.id, 'event_join', related_event_id=event.id, payload={
+                'message': f'{current_user.username} is attending your event: {event.name}.',
+                'type': 'event_join',
+                'actor_username': current_user.username,
+                # 'event_id': event.id, # Optional: for client-side routing
+                'event_name': event.name
+            })
 
         # Gamification: Award points for joining an event
         award_points(current_user, 'join_event', 5, related_item=event)
@@ -2399,8 +2168,9 @@ def leave_group(group_id):
 @login_required # Or remove @login_required for public browsing
 def groups_list():
     all_groups = Group.query.order_by(Group.name).all()
+    member_counts = get_counters(GROUP, [group.id for group in all_groups], names=(MEMBERS,))
     # The template groups.html will be created in a subsequent step
-    return render_template('groups.html', title='Browse Groups', groups=all_groups)
+    return render_template('groups.html', title='Browse Groups', groups=all_groups, member_counts=member_counts)
 
 
 # -------------------- Story Routes --------------------
@@ -2410,47 +2180,8 @@ def groups_list():
 def display_stories():
     now = get_current_utc()
 
-    stories_query = Story.query.filter(Story.expires_at > now)
-
-    if current_user.is_authenticated:
-        followed_user_ids = [user.id for user in current_user.followed]
-
-        # Base filter for active stories (published and not expired, or own scheduled)
-        active_filter = or_(
-            and_(Story.is_published == True, Story.expires_at > now), # Published and not expired
-            and_(Story.user_id == current_user.id, Story.is_published == False) # Own scheduled (expires_at is None or will be set on publish)
-        )
-        stories_query = stories_query.filter(active_filter)
-
-        # Privacy filters on top of the active_filter
-        privacy_filter = or_(
-            Story.user_id == current_user.id, # Own stories (already covered by active_filter for scheduled, this ensures published are also included)
-            and_( # Stories from followed users (must be published and not expired)
-                Story.user_id.in_(followed_user_ids),
-                Story.is_published == True, # Redundant if active_filter is perfect, but good for clarity
-                or_(
-                    Story.privacy_level == PRIVACY_PUBLIC,
-                    Story.privacy_level == PRIVACY_FOLLOWERS
-                )
-            ),
-            and_( # Stories from ANY user shared with a custom list current_user is on (must be published and not expired)
-                Story.privacy_level == PRIVACY_CUSTOM_LIST,
-                Story.custom_friend_list_id.isnot(None),
-                Story.is_published == True, # Redundant if active_filter is perfect
-                Story.custom_friend_list.has(
-                    FriendList.members.any(User.id == current_user.id)
-                )
-            ),
-            and_( # Public stories from anyone (must be published and not expired)
-                 Story.privacy_level == PRIVACY_PUBLIC,
-                 Story.is_published == True
-            )
-        )
-        stories_query = stories_query.filter(privacy_filter).distinct()
-
-    else: # Unauthenticated users
-        stories_query = stories_query.filter(Story.privacy_level == PRIVACY_PUBLIC, Story.is_published == True, Story.expires_at > now)
-
+    # Unexpired stories: own (including scheduled) plus published ones the privacy rules admit
+    stories_query = Story.query.filter(story_visibility_filter(current_user, now))
     active_stories = stories_query.order_by(Story.timestamp.desc()).all()
 
     return render_template('stories.html', title='Stories', stories=active_stories)
@@ -2622,25 +2353,14 @@ def create_poll():
         if new_poll.group_id:
             group = Group.query.get(new_poll.group_id)
             if group:
-                for membership in group.memberships:
-                    member_user = membership.user
-                    if member_user.id != current_user.id:
-                        notification = Notification(
-                            recipient_id=member_user.id,
-                            actor_id=current_user.id,
-                            type='new_group_poll',
-                            related_group_id=group.id
-                            # related_poll_id=new_poll.id # Would add this if model supported it
-                        )
-                        db.session.add(notification)
-                        socketio.emit('new_notification', {
-                            'message': f'New poll in group {group.name}: "{new_poll.question[:30]}{"..." if len(new_poll.question) > 30 else ""}"',
-                            'type': 'new_group_poll',
-                            'actor_username': current_user.username,
-                            'group_id': group.id,
-                            'group_name': group.name,
-                            'poll_question': new_poll.question[:70] # Slightly longer for direct display
-                        }, room=str(member_user.id))
+                notify_group_members(group.id, current_user.id, 'new_group_poll', payload={
+                    'message': f'New poll in group {group.name}: "{new_poll.question[:30]}{"..." if len(new_poll.question) > 30 else ""}"',
+                    'type': 'new_group_poll',
+                    'actor_username': current_user.username,
+                    'group_id': group.id,
+                    'group_name': group.name,
+                    'poll_question': new_poll.question[:70] # Slightly longer for direct display
+                })
         else: # Not a group poll, so notify followers (user poll)
             for follower in current_user.followers:
                 # No need to check if follower.id != current_user.id, as one cannot follow oneself.
@@ -3002,34 +2722,15 @@ def share_post(post_id):
     if share.group_id:
         group = Group.query.get(share.group_id)
         if group:
-            notifications_for_socketio = [] # Store details for emitting socket events
-            for membership_assoc in group.memberships:
-                member_user = membership_assoc.user
-                if member_user.id != current_user.id: # Don't notify the sharer
-                    group_share_notification = Notification(
-                        recipient_id=member_user.id,
-                        actor_id=current_user.id,
-                        type='group_share', # Distinct type for group shares
-                        related_post_id=share.post_id,
-                        related_group_id=share.group_id
-                        # related_share_id=share.id # If you add this to Notification model
-                    )
-                    db.session.add(group_share_notification)
-                    notifications_for_socketio.append({
-                        'recipient_id': member_user.id,
-                        'group_name': group.name
-                    })
-            db.session.commit() # Commit all group share notifications
-
-            for notif_detail in notifications_for_socketio:
-                socketio.emit('new_notification', {
-                    'message': f"{current_user.username} shared a post to the group {notif_detail['group_name']}.",
-                    'type': 'group_share',
-                    'actor_username': current_user.username,
-                    'post_id': share.post_id,
-                    'group_id': share.group_id,
-                    'group_name': notif_detail['group_name']
-                }, room=str(notif_detail['recipient_id']))
+            # Distinct 'group_share' type; the sharer is not notified
+            notify_group_members(group.id, current_user.id, 'group_share', related_post_id=share.post_id, payload={
+                'message': f"{current_user.username} shared a post to the group {group.name}.",
+                'type': 'group_share',
+                'actor_username': current_user.username,
+                'post_id': share.post_id,
+                'group_id': share.group_id,
+                'group_name': group.name
+            })
 
     flash('Post shared successfully!', 'success')
     if group_id:
@@ -7,6 +7,7 @@ from sqlalchemy import func
 # Imported Post and Story models
 from app.core.models import User, Post, Story, Reaction, Comment, HistoricalAnalytics, UserAnalytics, followers, Notification, Mention, Group, GroupMembership # Added Notification, Mention, Group, GroupMembership, Replaced Like with Reaction
 from app.utils.helpers import process_mentions # Added process_mentions
+from app.services.notification_fanout import fan_out_group_notification
 
 def collect_daily_analytics():
     from app import db # Added here
@@ -17,29 +18,22 @@ def collect_daily_analytics():
         print("No users found to process.")
         return
 
+    # Totals come from the denormalized engagement counters: one query for every user
+    # instead of three COUNTs per user.
+    from app.services.counter_service import (
+        get_counters, USER, FOLLOWERS, COMMENTS_RECEIVED, reactions_received_counter
+    )
+    likes_received = reactions_received_counter('like')
+    counters = get_counters(USER, [user.id for user in users], names=(likes_received, COMMENTS_RECEIVED, FOLLOWERS))
+    analytics_by_user = {ua.user_id: ua for ua in UserAnalytics.query.all()}
+
     for user in users:
         print(f"Processing analytics for user ID: {user.id} ({user.username})")
-        # Calculate total likes received on user's posts (specifically 'like' reactions)
-        total_likes_received = db.session.query(func.count(Reaction.id))\
-            .join(Post, Post.id == Reaction.post_id)\
-            .filter(Post.user_id == user.id, Reaction.reaction_type == 'like')\
-            .scalar() or 0
-
-        # Calculate total comments received on user's posts
-        total_comments_received = db.session.query(func.count(Comment.id))\
-            .join(Post, Post.id == Comment.post_id)\
-            .filter(Post.user_id == user.id)\
-            .scalar() or 0
-
-        # Calculate followers count
-        # Using the relationship user.followers.count() is generally fine.
-        # For very large numbers of followers, a direct query might be marginally more performant,
-        # but user.followers.count() is idiomatic SQLAlchemy.
-        followers_count = user.followers.count()
-        # Alternative direct query:
-        # followers_count = db.session.query(func.count(followers.c.follower_id))\
-        #     .filter(followers.c.followed_id == user.id)\
-        #     .scalar() or 0
+        user_counters = counters[user.id]
+        # Total 'like' reactions and comments received on the user's posts
+        total_likes_received = user_counters.get(likes_received, 0)
+        total_comments_received = user_counters.get(COMMENTS_RECEIVED, 0)
+        followers_count = user_counters.get(FOLLOWERS, 0)
 
         print(f"User {user.id}: Likes={total_likes_received}, Comments={total_comments_received}, Followers={followers_count}")
 
@@ -55,7 +49,7 @@ def collect_daily_analytics():
         print(f"Created HistoricalAnalytics record for user {user.id}")
 
         # Update or create UserAnalytics record
-        user_analytics = UserAnalytics.query.filter_by(user_id=user.id).first()
+        user_analytics = analytics_by_user.get(user.id)
         if not user_analytics:
             user_analytics = UserAnalytics(user_id=user.id)
             db.session.add(user_analytics)
@@ -76,6 +70,65 @@ def collect_daily_analytics():
         db.session.rollback()
         print(f"Error during daily analytics collection commit: {e}")
 
+def collect_daily_analytics_job(app):
+    """Runs collect_daily_analytics() in an app context (scheduler threads have none)."""
+    with app.app_context():
+        collect_daily_analytics()
+
+def publish_scheduled_content_job(app):
+    """Runs publish_scheduled_content() in an app context, so its notifications and emits go out through the app's socketio."""
+    with app.app_context():
+        publish_scheduled_content()
+
+def reconcile_engagement_counters(app):
+    """Recounts the denormalized engagement counters and repairs any that drifted."""
+    from app.services.counter_service import reconcile_counters
+    with app.app_context():
+        drift = reconcile_counters()
+        print(f"Engagement counters reconciled: {len(drift)} value(s) repaired.")
+
+def refresh_mention_index_job(app):
+    """Rebuilds the @mention autocomplete index and writes the snapshot the other workers load."""
+    from app.services.mention_index import refresh_mention_index
+    with app.app_context():
+        index = refresh_mention_index()
+        print(f"Mention index refreshed: {len(index)} usernames.")
+
+def refresh_social_graph_job(app):
+    """Rebuilds the follow graph and writes the snapshot the other workers map."""
+    from app.services.social_graph import refresh_social_graph
+    with app.app_context():
+        graph = refresh_social_graph()
+        print(f"Social graph refreshed: {len(graph)} users, {graph.edge_count} follows.")
+
+def sync_trending_stream_job(app):
+    """Publishes this worker's hashtag uses to the shared trending snapshot and reads back the merged counts."""
+    from app.services.trending_stream import sync_trending_stream
+    with app.app_context():
+        stream = sync_trending_stream(force=True)
+        print(f"Trending stream synced: {len(stream.top(stream.capacity))} hashtags tracked.")
+
+def rollup_hashtag_usage_job(app):
+    """Rolls raw hashtag usage up into hourly and daily buckets and deletes expired raw rows."""
+    from app.services.hashtag_usage_service import rollup_hashtag_usage
+    with app.app_context():
+        result = rollup_hashtag_usage()
+        print(f"Hashtag usage rolled up: {result}")
+
+def rebuild_related_posts_job(app):
+    """Recomputes every post's precomputed related posts list."""
+    from app.services.related_posts_service import rebuild_related_posts
+    with app.app_context():
+        written = rebuild_related_posts()
+        print(f"Related posts rebuilt: {written} row(s).")
+
+def refresh_recommendations_job(app):
+    """Rescores the recommendation candidates of stale, new and least recently scored users."""
+    from app.services.recommendation_service import refresh_recommendations
+    with app.app_context():
+        refreshed = refresh_recommendations()
+        print(f"Recommendations refreshed for {refreshed} user(s).")
+
 scheduler = None
 
 def init_scheduler(app):
@@ -86,10 +139,31 @@ def init_scheduler(app):
 
     scheduler = BackgroundScheduler(daemon=True)
     # Schedule to run daily at midnight UTC
-    scheduler.add_job(collect_daily_analytics, trigger='cron', hour=0, minute=5) # Run at 00:05 UTC
+    scheduler.add_job(collect_daily_analytics_job, trigger='cron', hour=0, minute=5, args=[app]) # Run at 00:05 UTC
 
     # Add job for publishing scheduled content (runs every minute)
-    scheduler.add_job(publish_scheduled_content, trigger='interval', minutes=1)
+    scheduler.add_job(publish_scheduled_content_job, trigger='interval', minutes=1, args=[app])
+
+    # Repair engagement counter drift nightly, before the analytics snapshot reads them
+    scheduler.add_job(reconcile_engagement_counters, trigger='cron', hour=0, minute=0, args=[app])
+
+    # Rebuild the @mention autocomplete index (fresh follower counts) and republish its snapshot
+    scheduler.add_job(refresh_mention_index_job, trigger='interval', minutes=10, args=[app])
+
+    # Rebuild the follow graph snapshot; follows in between are read through the feed cache
+    scheduler.add_job(refresh_social_graph_job, trigger='interval', minutes=10, args=[app])
+
+    # Keep the shared trending snapshot current even when this worker serves no trending reads
+    scheduler.add_job(sync_trending_stream_job, trigger='interval', minutes=1, args=[app])
+
+    # Roll the previous hour of hashtag usage up and compact the raw table
+    scheduler.add_job(rollup_hashtag_usage_job, trigger='cron', minute=2, args=[app])
+
+    # Recompute related posts lists; tagging keeps them current in between
+    scheduler.add_job(rebuild_related_posts_job, trigger='cron', hour=3, minute=0, args=[app])
+
+    # Rescore recommendation candidates, a batch of the most out-of-date users per run
+    scheduler.add_job(refresh_recommendations_job, trigger='interval', minutes=5, args=[app])
 
     # For testing, you might want a shorter interval:
     # scheduler.add_job(collect_daily_analytics, trigger='interval', seconds=60)
@@ -194,19 +268,13 @@ def publish_scheduled_content():
                     try:
                         group = Group.query.get(post.group_id)
                         if group:
-                            for membership_assoc in group.memberships:
-                                member_user = membership_assoc.user
-                                if member_user.id != post.author.id:
-                                    notification = Notification(
-                                        recipient_id=member_user.id,
-                                        actor_id=post.author.id,
-                                        type='new_group_post',
-                                        related_post_id=post.id,
-                                        related_group_id=group.id
-                                    )
-                                    db.session.add(notification)
-                            db.session.commit() # Commit group post notifications
-                            print(f"Scheduler: Processed group notifications for published post ID {post.id}")
+                            # Already off the request thread: fan out inline, one INSERT ... SELECT for all members
+                            notified = fan_out_group_notification(group.id, post.user_id, 'new_group_post', related_post_id=post.id, payload={
+                                'type': 'new_group_post', 'message': f"{post.author.username} posted in {group.name}.",
+                                'actor_username': post.author.username, 'post_id': post.id,
+                                'group_id': group.id, 'group_name': group.name
+                            })
+                            print(f"Scheduler: Notified {notified} group member(s) of published post ID {post.id}")
                     except Exception as e_group_notif:
                         db.session.rollback()
                         print(f"Scheduler: Error processing group notifications for post ID {post.id}. Error: {e_group_notif}")
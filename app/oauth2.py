@@ -43,8 +43,11 @@ def validate_access_token(token_string):
     if not access_token:
         return None
 
-    # Check if token is expired
-    if access_token.expires_at < datetime.now(timezone.utc):
+    # Check if token is expired (SQLite hands back naive datetimes; they are stored as UTC)
+    expires_at = access_token.expires_at
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    if expires_at < datetime.now(timezone.utc):
         # Optionally, clean up expired tokens
         db.session.delete(access_token)
         db.session.commit()
@@ -0,0 +1,62 @@
+"""
+Windows of a conversation's messages, for the chat page and its backfill.
+
+The page renders only the newest CHAT_MESSAGES_PER_PAGE messages. Older ones are fetched
+a window at a time, with the keyset cursor of the window before, through the
+/chat/<id>/messages JSON endpoint or the load_older_messages socket event. Loading a
+window takes one query for the messages with their senders joined in, and one for the
+viewer's read watermark in the conversation, however long the conversation is.
+"""
+from flask import current_app
+from sqlalchemy.orm import joinedload
+
+from app.core.models import ChatMessage, User
+from app.services.read_state import get_watermarks
+from app.utils.pagination import keyset_paginate
+
+
+def _iso(timestamp):
+    return timestamp.isoformat() + 'Z' if timestamp else None # Stored as naive UTC
+
+
+def load_message_window(conversation_id, viewer_id, cursor=None, per_page=None):
+    """
+    The window of messages before `cursor` (the newest for none), oldest first, as dicts
+    with the sender's username and whether `viewer_id` has read them. Returns (page, messages);
+    page.next_cursor reaches the window before this one.
+    """
+    per_page = per_page or current_app.config.get('CHAT_MESSAGES_PER_PAGE', 50)
+    query = ChatMessage.query.filter(ChatMessage.conversation_id == conversation_id) \
+        .options(joinedload(ChatMessage.sender).load_only(User.id, User.username))
+    page = keyset_paginate(query, ChatMessage.timestamp, ChatMessage.id, cursor=cursor, per_page=per_page)
+    window = list(reversed(page.items)) # Display oldest first within the window
+
+    # The viewer has read everything up to their watermark (see app/services/read_state.py)
+    watermark = get_watermarks(conversation_id, [viewer_id]).get(viewer_id) if window else None
+
+    def read_by_viewer(message):
+        return watermark is not None and message.timestamp is not None and (message.timestamp, message.id) <= watermark[:2]
+
+    messages = [{
+        'id': message.id,
+        'sender_id': message.sender_id,
+        'sender_username': message.sender.username,
+        'body': message.body,
+        'timestamp': message.timestamp,
+        'read_at': message.read_at, # First read by anyone (the recipient in a 1-1 chat)
+        'is_read_by_current_user': read_by_viewer(message),
+        'read_at_by_current_user': watermark[2] if read_by_viewer(message) else None # By then at the latest
+    } for message in window]
+    return page, messages
+
+
+def message_window_json(conversation_id, page, messages):
+    """The JSON form of a window, as the backfill endpoint and socket event send it."""
+    return {
+        'conversation_id': conversation_id,
+        'messages': [dict(message, message_id=message['id'], timestamp=_iso(message['timestamp']),
+                          read_at=_iso(message['read_at']),
+                          read_at_by_current_user=_iso(message['read_at_by_current_user']))
+                     for message in messages],
+        'next_cursor': page.next_cursor
+    }
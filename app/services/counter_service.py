@@ -0,0 +1,365 @@
+"""
+Denormalized engagement counters (EngagementCounter rows).
+
+Post cards, group pages, analytics and the daily analytics job used to COUNT reactions,
+comments, followers and members on every read. The totals are kept in one narrow table
+instead, keyed on (entity_type, entity_id, name):
+
+    post   reactions:<type>, comments, shares, bookmarks
+    user   followers, following, posts, reactions_received:<type>, comments_received,
+           unread_notifications
+    group  members
+
+Counters are maintained by session hooks (like the home timeline in timeline_service),
+so react_to_post, add_comment, share_post, follow/unfollow, join/leave group, new or
+read notifications and the API all update them in the same transaction as the change
+itself. Deltas for a flush are
+summed per counter and written with one UPSERT (INSERT .. ON CONFLICT DO UPDATE) where
+the dialect supports it.
+
+Writes that bypass the ORM (bulk deletes, raw SQL, manual repairs) are not seen by the
+hooks; reconcile_counters() recomputes every counter with grouped queries and repairs
+the rows that drifted. It runs nightly from the scheduler.
+"""
+from collections import defaultdict
+
+from flask import current_app
+from sqlalchemy import event, select, update, delete, insert, func, tuple_, and_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, attributes, aliased
+
+from app import db
+from app.core.models import (
+    EngagementCounter, Post, User, Group, Reaction, Comment, Share, Bookmark, GroupMembership, Notification,
+    followers
+)
+from app.services.timeline_service import pending_follow_changes
+
+POST = 'post'
+USER = 'user'
+GROUP = 'group'
+
+COMMENTS = 'comments'
+SHARES = 'shares'
+BOOKMARKS = 'bookmarks'
+FOLLOWERS = 'followers'
+FOLLOWING = 'following'
+POSTS = 'posts'
+COMMENTS_RECEIVED = 'comments_received'
+MEMBERS = 'members'
+UNREAD_NOTIFICATIONS = 'unread_notifications'
+REACTIONS_PREFIX = 'reactions:'
+REACTIONS_RECEIVED_PREFIX = 'reactions_received:'
+
+# Deleting one of these removes all of its counter rows
+ENTITY_MODELS = ((Post, POST), (User, USER), (Group, GROUP))
+
+
+def reactions_counter(reaction_type):
+    return REACTIONS_PREFIX + reaction_type
+
+
+def reactions_received_counter(reaction_type):
+    return REACTIONS_RECEIVED_PREFIX + reaction_type
+
+
+# -------------------- Read path --------------------
+
+def get_counters(entity_type, entity_ids, names=None):
+    """Returns {entity_id: {name: value}} for `entity_ids`, optionally restricted to `names`."""
+    entity_ids = list(set(entity_ids))
+    counters = {entity_id: {} for entity_id in entity_ids}
+    if not entity_ids:
+        return counters
+    query = select(EngagementCounter.entity_id, EngagementCounter.name, EngagementCounter.value).where(
+        EngagementCounter.entity_type == entity_type, EngagementCounter.entity_id.in_(entity_ids)
+    )
+    if names is not None:
+        query = query.where(EngagementCounter.name.in_(list(names)))
+    for entity_id, name, value in db.session.execute(query):
+        counters[entity_id][name] = value
+    return counters
+
+
+def get_counter(entity_type, entity_id, name):
+    value = db.session.execute(select(EngagementCounter.value).where(
+        EngagementCounter.entity_type == entity_type,
+        EngagementCounter.entity_id == entity_id,
+        EngagementCounter.name == name
+    )).scalar()
+    return value or 0
+
+
+def get_reaction_counts(post_ids):
+    """Returns {post_id: {reaction_type: count}} (types with no reactions omitted)."""
+    post_ids = list(set(post_ids))
+    counts = {post_id: {} for post_id in post_ids}
+    if not post_ids:
+        return counts
+    for post_id, name, value in db.session.execute(
+        select(EngagementCounter.entity_id, EngagementCounter.name, EngagementCounter.value).where(
+            EngagementCounter.entity_type == POST,
+            EngagementCounter.entity_id.in_(post_ids),
+            EngagementCounter.name.startswith(REACTIONS_PREFIX, autoescape=True),
+            EngagementCounter.value > 0
+        )
+    ):
+        counts[post_id][name[len(REACTIONS_PREFIX):]] = value
+    return counts
+
+
+def counter_sum(entity_type, id_column, *names):
+    """Correlated scalar expression summing the named counters of the entity in `id_column`, for ORDER BY."""
+    return select(func.coalesce(func.sum(EngagementCounter.value), 0)).where(
+        EngagementCounter.entity_type == entity_type,
+        EngagementCounter.entity_id == id_column,
+        EngagementCounter.name.in_(names)
+    ).scalar_subquery()
+
+
+def top_posts_by_engagement(user_id, limit=5):
+    """`user_id`'s posts ordered by 'like' reactions plus comments, ranked from the counters in one query."""
+    likes = aliased(EngagementCounter)
+    comments = aliased(EngagementCounter)
+    score = func.coalesce(likes.value, 0) + func.coalesce(comments.value, 0)
+    return Post.query.outerjoin(likes, and_(
+        likes.entity_type == POST, likes.entity_id == Post.id, likes.name == reactions_counter('like')
+    )).outerjoin(comments, and_(
+        comments.entity_type == POST, comments.entity_id == Post.id, comments.name == COMMENTS
+    )).filter(Post.user_id == user_id).order_by(score.desc(), Post.id.asc()).limit(limit).all()
+
+
+# -------------------- Write path (session hooks) --------------------
+
+def upsert_counters(connection, values, increment):
+    """
+    Writes {(entity_type, entity_id, name): value} into engagement_counter, adding to
+    (increment=True) or replacing the stored values. Rows are written in key order so
+    concurrent transactions lock them in the same order.
+    """
+    rows = [
+        {'entity_type': entity_type, 'entity_id': entity_id, 'name': name, 'value': value}
+        for (entity_type, entity_id, name), value in sorted(values.items())
+    ]
+    if not rows:
+        return
+    table = EngagementCounter.__table__
+    dialect_insert = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}.get(connection.dialect.name)
+    if dialect_insert is not None:
+        stmt = dialect_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.entity_type, table.c.entity_id, table.c.name],
+            set_={'value': table.c.value + stmt.excluded.value if increment else stmt.excluded.value}
+        )
+        connection.execute(stmt, rows)
+        return
+    for row in rows:
+        result = connection.execute(update(table).where(
+            table.c.entity_type == row['entity_type'],
+            table.c.entity_id == row['entity_id'],
+            table.c.name == row['name']
+        ).values(value=table.c.value + row['value'] if increment else row['value']))
+        if result.rowcount == 0:
+            connection.execute(insert(table).values(**row))
+
+
+def _post_authors(connection, post_ids, deleted_posts):
+    """{post_id: author id}, taking posts deleted in this flush from the session (their rows are gone)."""
+    authors = {post_id: post.user_id for post_id, post in deleted_posts.items() if post_id in post_ids}
+    missing = set(post_ids) - set(authors)
+    if missing:
+        authors.update(connection.execute(select(Post.id, Post.user_id).where(Post.id.in_(missing))).all())
+    return authors
+
+
+def _notification_read_changes(session):
+    """(notification, delta) for notifications marked read (-1) or unread (+1) in place."""
+    changes = []
+    for obj in session.dirty:
+        if isinstance(obj, Notification) and obj not in session.deleted:
+            history = attributes.instance_state(obj).attrs.is_read.history
+            if history.added and history.deleted and bool(history.added[0]) != bool(history.deleted[0]):
+                changes.append((obj, -1 if history.added[0] else 1))
+    return changes
+
+
+def _reaction_type_changes(session):
+    """(reaction, old_type, new_type) for reactions whose type was switched in place."""
+    changes = []
+    for obj in session.dirty:
+        if isinstance(obj, Reaction) and obj not in session.deleted:
+            history = attributes.instance_state(obj).attrs.reaction_type.history
+            if history.added and history.deleted and history.added[0] != history.deleted[0]:
+                changes.append((obj, history.deleted[0], history.added[0]))
+    return changes
+
+
+@event.listens_for(Reaction.reaction_type, 'set', active_history=True)
+def _load_previous_reaction_type(target, value, oldvalue, initiator):
+    # active_history loads the stored type before it is overwritten, even when the attribute
+    # was expired by a commit, so _reaction_type_changes() can move the count between types
+    return value
+
+
+@event.listens_for(Notification.is_read, 'set', active_history=True)
+def _load_previous_is_read(target, value, oldvalue, initiator):
+    # Same for is_read, so _notification_read_changes() sees an expired notification being marked read
+    return value
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_follow_counter_changes(session, flush_context, instances):
+    session.info.setdefault('counter_follow_changes', []).extend(pending_follow_changes(session))
+
+
+@event.listens_for(Session, 'after_flush')
+def _count_after_flush(session, flush_context):
+    follow_changes = session.info.pop('counter_follow_changes', None) or []
+    added = list(session.new)
+    removed = list(session.deleted)
+    retyped = _reaction_type_changes(session)
+    read_changes = _notification_read_changes(session)
+    if not (follow_changes or added or removed or retyped or read_changes):
+        return
+
+    deltas = defaultdict(int)
+    deleted_entities = {(entity_type, obj.id) for obj in removed
+                        for model, entity_type in ENTITY_MODELS if isinstance(obj, model)}
+    deleted_posts = {obj.id: obj for obj in removed if isinstance(obj, Post)}
+
+    # (post_id, counter name, delta) for engagement that is also credited to the post author
+    received = []
+    for objects, sign in ((added, 1), (removed, -1)):
+        for obj in objects:
+            if isinstance(obj, Reaction):
+                reaction_type = attributes.instance_state(obj).attrs.reaction_type.history.deleted or [obj.reaction_type]
+                deltas[(POST, obj.post_id, reactions_counter(reaction_type[0]))] += sign
+                received.append((obj.post_id, reactions_received_counter(reaction_type[0]), sign))
+            elif isinstance(obj, Comment):
+                deltas[(POST, obj.post_id, COMMENTS)] += sign
+                received.append((obj.post_id, COMMENTS_RECEIVED, sign))
+            elif isinstance(obj, Share):
+                deltas[(POST, obj.post_id, SHARES)] += sign
+            elif isinstance(obj, Bookmark):
+                deltas[(POST, obj.post_id, BOOKMARKS)] += sign
+            elif isinstance(obj, Post):
+                deltas[(USER, obj.user_id, POSTS)] += sign
+            elif isinstance(obj, GroupMembership):
+                deltas[(GROUP, obj.group_id, MEMBERS)] += sign
+            elif isinstance(obj, Notification):
+                # Only what is loaded: an expired, deleted row can no longer be refreshed
+                # (the nightly reconcile corrects the count)
+                loaded = attributes.instance_state(obj).dict
+                if not loaded.get('is_read', True) and 'recipient_id' in loaded:
+                    deltas[(USER, loaded['recipient_id'], UNREAD_NOTIFICATIONS)] += sign
+    for notification, sign in read_changes:
+        deltas[(USER, notification.recipient_id, UNREAD_NOTIFICATIONS)] += sign
+    for reaction, old_type, new_type in retyped:
+        deltas[(POST, reaction.post_id, reactions_counter(old_type))] -= 1
+        deltas[(POST, reaction.post_id, reactions_counter(new_type))] += 1
+        received.append((reaction.post_id, reactions_received_counter(old_type), -1))
+        received.append((reaction.post_id, reactions_received_counter(new_type), 1))
+
+    seen = set()
+    for follower, followed, is_follow in follow_changes:
+        key = (follower.id, followed.id, is_follow)
+        if key in seen or follower.id is None or followed.id is None:
+            continue
+        seen.add(key)
+        sign = 1 if is_follow else -1
+        deltas[(USER, follower.id, FOLLOWING)] += sign
+        deltas[(USER, followed.id, FOLLOWERS)] += sign
+
+    connection = session.connection()
+    if received:
+        authors = _post_authors(connection, {post_id for post_id, _, _ in received}, deleted_posts)
+        for post_id, name, sign in received:
+            if post_id in authors:
+                deltas[(USER, authors[post_id], name)] += sign
+
+    upsert_counters(connection, {key: delta for key, delta in deltas.items()
+                         if delta and key[:2] not in deleted_entities}, increment=True)
+    if deleted_entities:
+        table = EngagementCounter.__table__
+        connection.execute(delete(table).where(
+            tuple_(table.c.entity_type, table.c.entity_id).in_(sorted(deleted_entities))
+        ))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_counter_changes(session):
+    session.info.pop('counter_follow_changes', None)
+
+
+# -------------------- Reconciliation --------------------
+
+def _expected_counters():
+    """Recomputes every counter from the source tables, one grouped query per counter family."""
+    expected = {}
+    session = db.session
+    for post_id, reaction_type, count in session.query(
+        Reaction.post_id, Reaction.reaction_type, func.count(Reaction.id)
+    ).group_by(Reaction.post_id, Reaction.reaction_type):
+        expected[(POST, post_id, reactions_counter(reaction_type))] = count
+    for user_id, reaction_type, count in session.query(
+        Post.user_id, Reaction.reaction_type, func.count(Reaction.id)
+    ).join(Post, Post.id == Reaction.post_id).group_by(Post.user_id, Reaction.reaction_type):
+        expected[(USER, user_id, reactions_received_counter(reaction_type))] = count
+
+    per_post = ((Comment, COMMENTS), (Share, SHARES), (Bookmark, BOOKMARKS))
+    for model, name in per_post:
+        for post_id, count in session.query(model.post_id, func.count(model.id)).group_by(model.post_id):
+            expected[(POST, post_id, name)] = count
+    for user_id, count in session.query(Post.user_id, func.count(Comment.id)).join(
+        Post, Post.id == Comment.post_id
+    ).group_by(Post.user_id):
+        expected[(USER, user_id, COMMENTS_RECEIVED)] = count
+    for user_id, count in session.query(Post.user_id, func.count(Post.id)).group_by(Post.user_id):
+        expected[(USER, user_id, POSTS)] = count
+
+    for column, name in ((followers.c.followed_id, FOLLOWERS), (followers.c.follower_id, FOLLOWING)):
+        for user_id, count in session.query(column, func.count()).select_from(followers).group_by(column):
+            expected[(USER, user_id, name)] = count
+    for group_id, count in session.query(GroupMembership.group_id, func.count(GroupMembership.id)).group_by(GroupMembership.group_id):
+        expected[(GROUP, group_id, MEMBERS)] = count
+    for user_id, count in session.query(Notification.recipient_id, func.count(Notification.id)).filter(
+        Notification.is_read == False
+    ).group_by(Notification.recipient_id):
+        expected[(USER, user_id, UNREAD_NOTIFICATIONS)] = count
+    return expected
+
+
+def reconcile_counters(repair=True):
+    """
+    Compares every stored counter with a fresh grouped recount and, if `repair`, rewrites
+    the ones that drifted (missing rows are inserted, rows for counts that no longer exist
+    are deleted) and commits. Returns the drift as a list of
+    (entity_type, entity_id, name, stored, actual) tuples.
+    """
+    expected = _expected_counters()
+    stored = {
+        (entity_type, entity_id, name): value
+        for entity_type, entity_id, name, value in db.session.execute(select(
+            EngagementCounter.entity_type, EngagementCounter.entity_id, EngagementCounter.name, EngagementCounter.value
+        ))
+    }
+    drift = sorted(
+        key + (stored.get(key, 0), expected.get(key, 0))
+        for key in set(stored) | set(expected)
+        if stored.get(key, 0) != expected.get(key, 0)
+    )
+    if drift:
+        current_app.logger.warning('Engagement counters: %d drifted value(s) found', len(drift))
+    if not repair:
+        return drift
+
+    stale = sorted(key for key in stored if key not in expected)
+    connection = db.session.connection()
+    upsert_counters(connection, {key: expected[key] for key in expected if stored.get(key) != expected[key]}, increment=False)
+    table = EngagementCounter.__table__
+    for key in stale:
+        connection.execute(delete(table).where(
+            table.c.entity_type == key[0], table.c.entity_id == key[1], table.c.name == key[2]
+        ))
+    db.session.commit()
+    return drift
@@ -0,0 +1,132 @@
+"""
+Typo-tolerant search over user, group and hashtag names.
+
+Scoring every name with RapidFuzz on each query is linear in the number of names, so
+each worker keeps, per kind, a FuzzyNameIndex: the lower-cased names in one array plus
+an inverted index from character trigrams to positions in that array. A query only
+scores the names sharing the most trigrams with it (at most
+FUZZY_SEARCH_MAX_CANDIDATES), passing that slice to rapidfuzz.process.extract in one
+call.
+
+The arrays are rebuilt from the database after FUZZY_SEARCH_INDEX_TTL seconds, so a
+new name can take that long to become fuzzy-searchable. Matches are re-read from the
+database by id, which keeps deleted entities and privacy filters out of the results.
+fuzzy_search_query() has the same contract as search_service.search_query(), so the
+search page can sort and paginate either the same way.
+"""
+import threading
+import time
+from array import array
+from collections import Counter
+
+from flask import current_app
+from rapidfuzz import fuzz, process
+from sqlalchemy import select, case
+
+from app import db
+from app.core.models import User, Group, Hashtag
+
+NGRAM_SIZE = 3
+
+FUZZY_FIELDS = {
+    'users': (User, 'username'),
+    'groups': (Group, 'name'),
+    'hashtags': (Hashtag, 'tag_text'),
+}
+
+
+def ngrams(text):
+    """Character trigrams of `text`, padded so the start and end of short names count too."""
+    padded = f'  {text.lower()} '
+    return {padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)}
+
+
+class FuzzyNameIndex:
+    """Parallel id/name arrays for one kind, with a trigram -> positions inverted index."""
+    def __init__(self, rows, built_at=None):
+        self.ids = array('q')
+        self.names = []
+        self._postings = {}
+        for entity_id, name in rows:
+            if not name:
+                continue
+            position = len(self.names)
+            self.ids.append(entity_id)
+            self.names.append(name.lower())
+            for gram in ngrams(name):
+                postings = self._postings.get(gram)
+                if postings is None:
+                    postings = self._postings[gram] = array('I')
+                postings.append(position)
+        self.built_at = built_at or time.monotonic()
+
+    def __len__(self):
+        return len(self.names)
+
+    def candidates(self, term, max_candidates):
+        """Positions of the names sharing the most trigrams with `term`, best first."""
+        shared = Counter()
+        for gram in ngrams(term):
+            postings = self._postings.get(gram)
+            if postings is not None:
+                shared.update(postings)
+        return [position for position, _ in shared.most_common(max_candidates)]
+
+    def search(self, term, limit=20, min_score=70, max_candidates=5000):
+        """[(entity_id, score)] for the best fuzzy matches of `term`, highest score first."""
+        term = (term or '').strip().lower()
+        if not term:
+            return []
+        positions = self.candidates(term, max_candidates)
+        if not positions:
+            return []
+        choices = [self.names[position] for position in positions]
+        matches = process.extract(term, choices, scorer=fuzz.WRatio, limit=limit, score_cutoff=min_score)
+        return [(self.ids[positions[index]], score) for _, score, index in matches]
+
+
+def build_fuzzy_index(kind):
+    model, field = FUZZY_FIELDS[kind]
+    rows = db.session.execute(select(model.id, getattr(model, field))).all()
+    return FuzzyNameIndex(rows)
+
+
+_build_lock = threading.Lock()
+
+
+def get_fuzzy_index(kind):
+    """This worker's index for `kind`, rebuilt once it is older than FUZZY_SEARCH_INDEX_TTL."""
+    indexes = current_app.extensions.setdefault('fuzzy_search', {})
+    ttl = current_app.config.get('FUZZY_SEARCH_INDEX_TTL', 300)
+    index = indexes.get(kind)
+    if index is None or time.monotonic() - index.built_at >= ttl:
+        with _build_lock:
+            index = indexes.get(kind)
+            if index is None or time.monotonic() - index.built_at >= ttl:
+                index = indexes[kind] = build_fuzzy_index(kind)
+    return index
+
+
+def fuzzy_matches(kind, term, limit=None):
+    config = current_app.config
+    return get_fuzzy_index(kind).search(
+        term,
+        limit=limit or config.get('FUZZY_SEARCH_MAX_RESULTS', 200),
+        min_score=config.get('FUZZY_SEARCH_MIN_SCORE', 70),
+        max_candidates=config.get('FUZZY_SEARCH_MAX_CANDIDATES', 5000)
+    )
+
+
+def fuzzy_search_query(kind, term):
+    """
+    Returns (query, rank) like search_query(): a Model query limited to the fuzzy matches
+    of `term` for `kind` and a rank column (ascending = better match), or (None, None)
+    if nothing matches.
+    """
+    matches = fuzzy_matches(kind, term)
+    if not matches:
+        return None, None
+    model = FUZZY_FIELDS[kind][0]
+    ids = [entity_id for entity_id, _ in matches]
+    rank = case({entity_id: position for position, entity_id in enumerate(ids)}, value=model.id)
+    return model.query.filter(model.id.in_(ids)), rank
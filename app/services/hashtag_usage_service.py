@@ -0,0 +1,136 @@
+"""
+Hourly and daily rollups of HashtagUsage.
+
+process_hashtags writes one HashtagUsage row per tag per post. rollup_hashtag_usage()
+(run hourly by the scheduler) aggregates complete UTC hours into hashtag_usage_hourly
+and complete days into hashtag_usage_daily. It then compacts the sources: raw rows older
+than HASHTAG_USAGE_RAW_RETENTION_HOURS and hourly buckets older than
+HASHTAG_USAGE_HOURLY_RETENTION_DAYS are deleted once they are rolled up.
+
+Each level rolls forward from its own watermark (the end of its newest bucket), so
+runs are idempotent and a missed run is caught up by the next one. Rows timestamped
+before the hourly watermark when they are inserted are not counted; HashtagUsage
+timestamps default to the insert time, so that only happens with clock skew.
+
+Readers combine the two levels with usage_rows(): hourly buckets up to the watermark
+plus the raw rows after it, which is never more than the last hour or so of raw data.
+A raw row counts as its usage_count uses, as in the trending stream.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, func, delete, union_all
+
+from app import db
+from app.core.models import HashtagUsage, HashtagUsageHourly, HashtagUsageDaily
+from app.utils.app_config import config_value
+
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+
+
+def floor_hour(moment):
+    return moment.replace(minute=0, second=0, microsecond=0, tzinfo=None)
+
+
+def floor_day(moment):
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+
+
+def _watermark(bucket_model, step):
+    """End of the newest bucket of `bucket_model`, or None if it has none."""
+    newest = db.session.execute(select(func.max(bucket_model.bucket_start))).scalar()
+    return newest + step if newest is not None else None
+
+
+def hourly_watermark():
+    """Raw HashtagUsage rows before this time are counted in hashtag_usage_hourly."""
+    return _watermark(HashtagUsageHourly, HOUR)
+
+
+def _roll_up(source_ts, source_count, source_hashtag, bucket_model, step, floor, start, end):
+    """
+    Writes one bucket_model row per hashtag for every `step`-long bucket in [start, end)
+    that has source rows, skipping empty stretches. Returns the number of buckets written.
+    """
+    written = 0
+    bucket = start
+    while bucket < end:
+        next_ts = db.session.execute(
+            select(func.min(source_ts)).where(source_ts >= bucket, source_ts < end)
+        ).scalar()
+        if next_ts is None:
+            break
+        bucket = floor(next_ts)
+        bucket_end = bucket + step
+        counts = db.session.execute(
+            select(source_hashtag, func.sum(source_count))
+            .where(source_ts >= bucket, source_ts < bucket_end)
+            .group_by(source_hashtag)
+        ).all()
+        # Replace rather than add, so re-running a bucket never double counts
+        db.session.execute(delete(bucket_model).where(bucket_model.bucket_start == bucket))
+        db.session.execute(bucket_model.__table__.insert(), [
+            {'hashtag_id': hashtag_id, 'bucket_start': bucket, 'count': int(count)} for hashtag_id, count in counts
+        ])
+        written += len(counts)
+        bucket = bucket_end
+    return written
+
+
+def rollup_hashtag_usage(now=None):
+    """
+    Rolls complete hours and days up and compacts what has been rolled up and expired.
+    Returns a dict of the rows written and deleted at each level.
+    """
+    now = now or datetime.utcnow()
+    current_hour, current_day = floor_hour(now), floor_day(now)
+
+    hourly_start = hourly_watermark()
+    if hourly_start is None:
+        oldest = db.session.execute(select(func.min(HashtagUsage.timestamp))).scalar()
+        hourly_start = floor_hour(oldest) if oldest is not None else current_hour
+    hourly_written = _roll_up(
+        HashtagUsage.timestamp, HashtagUsage.usage_count, HashtagUsage.hashtag_id,
+        HashtagUsageHourly, HOUR, floor_hour, hourly_start, current_hour
+    )
+
+    daily_start = _watermark(HashtagUsageDaily, DAY)
+    if daily_start is None:
+        oldest = db.session.execute(select(func.min(HashtagUsageHourly.bucket_start))).scalar()
+        daily_start = floor_day(oldest) if oldest is not None else current_day
+    daily_written = _roll_up(
+        HashtagUsageHourly.bucket_start, HashtagUsageHourly.count, HashtagUsageHourly.hashtag_id,
+        HashtagUsageDaily, DAY, floor_day, daily_start, current_day
+    )
+
+    # Everything before the current hour (day) is rolled up now, so only expiry limits compaction
+    raw_cutoff = min(now - timedelta(hours=config_value('HASHTAG_USAGE_RAW_RETENTION_HOURS', 48)), current_hour)
+    raw_deleted = db.session.execute(delete(HashtagUsage).where(HashtagUsage.timestamp < raw_cutoff)).rowcount
+    hourly_cutoff = min(now - timedelta(days=config_value('HASHTAG_USAGE_HOURLY_RETENTION_DAYS', 35)), current_day)
+    hourly_deleted = db.session.execute(
+        delete(HashtagUsageHourly).where(HashtagUsageHourly.bucket_start < hourly_cutoff)
+    ).rowcount
+    db.session.commit()
+    return {'hourly_written': hourly_written, 'daily_written': daily_written,
+            'raw_deleted': raw_deleted, 'hourly_deleted': hourly_deleted}
+
+
+def usage_rows(since):
+    """
+    Selectable of (hashtag_id, ts, uses) covering HashtagUsage since `since`: hourly
+    buckets before the rollup watermark (ts = bucket start, so windows are hour-aligned
+    there) and raw rows after it.
+    """
+    watermark = hourly_watermark()
+    raw_since = since if watermark is None else max(since, watermark)
+    raw = select(
+        HashtagUsage.hashtag_id.label('hashtag_id'), HashtagUsage.timestamp.label('ts'),
+        HashtagUsage.usage_count.label('uses')
+    ).where(HashtagUsage.timestamp >= raw_since)
+    if watermark is None or watermark <= since:
+        return raw.subquery('hashtag_usage_rows')
+    buckets = select(
+        HashtagUsageHourly.hashtag_id.label('hashtag_id'), HashtagUsageHourly.bucket_start.label('ts'),
+        HashtagUsageHourly.count.label('uses')
+    ).where(HashtagUsageHourly.bucket_start >= since, HashtagUsageHourly.bucket_start < watermark)
+    return union_all(buckets, raw).subquery('hashtag_usage_rows')
@@ -0,0 +1,285 @@
+"""
+In-process prefix index over usernames for @mention autocomplete.
+
+The composer calls /users/search_mentions on every keystroke. Instead of an
+ilike('q%') query per request, each worker keeps every username in a sorted array
+and answers with bisect: the matches for a prefix are one contiguous slice. Results
+are ranked people-you-follow first, then by follower count.
+
+Keeping it current:
+  * user creation, renames and profile picture changes are applied to the local index
+    when their transaction commits (session hooks below);
+  * refresh_mention_index() rebuilds from the database (follower counts come from the
+    engagement counters) and writes a JSON snapshot to MENTION_INDEX_SNAPSHOT_PATH.
+    The scheduler runs it periodically; other workers load the snapshot at startup and
+    reload it when it changes, at most every MENTION_INDEX_RELOAD_SECONDS, so they pick
+    up each other's new users without querying the database themselves.
+"""
+import heapq
+import json
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, select, and_, func
+from sqlalchemy.orm import Session, attributes
+
+from app import db
+from app.core.models import User, EngagementCounter, followers
+from app.utils.feed_cache import get_cached_followed_ids
+from app.services.counter_service import USER, FOLLOWERS
+
+SNAPSHOT_VERSION = 1
+# Prefixes up to this length match a large share of all users, so their ranked top
+# results are memoized until a user under that prefix changes
+SHORT_PREFIX_LENGTH = 2
+_KEY_UPPER_BOUND = '\U0010ffff'
+
+
+class MentionEntry:
+    __slots__ = ('user_id', 'username', 'profile_picture_url', 'follower_count')
+
+    def __init__(self, user_id, username, profile_picture_url=None, follower_count=0):
+        self.user_id = user_id
+        self.username = username
+        self.profile_picture_url = profile_picture_url
+        self.follower_count = follower_count or 0
+
+    @property
+    def key(self):
+        return self.username.lower()
+
+    def to_row(self):
+        return [self.user_id, self.username, self.profile_picture_url, self.follower_count]
+
+    def __repr__(self):
+        return f'<MentionEntry {self.username}>'
+
+
+def _popularity_order(entry):
+    return (-entry.follower_count, len(entry.username), entry.key, entry.user_id)
+
+
+class MentionIndex:
+    """Sorted (lower-cased username, user id) keys plus the entries they point to."""
+    def __init__(self, entries=(), built_at=None):
+        self._lock = threading.Lock()
+        self._entries = {entry.user_id: entry for entry in entries}
+        self._keys = sorted((entry.key, entry.user_id) for entry in self._entries.values())
+        self._top_by_prefix = {}
+        self.built_at = built_at or time.time()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _range(self, prefix):
+        start = bisect_left(self._keys, (prefix,))
+        end = bisect_left(self._keys, (prefix + _KEY_UPPER_BOUND,))
+        return start, end
+
+    def _invalidate(self, key):
+        for length in range(SHORT_PREFIX_LENGTH + 1):
+            self._top_by_prefix.pop(key[:length], None)
+
+    def upsert(self, user_id, username, profile_picture_url=None, follower_count=None):
+        with self._lock:
+            existing = self._entries.get(user_id)
+            if existing is not None:
+                self._keys.pop(bisect_left(self._keys, (existing.key, user_id)))
+                self._invalidate(existing.key)
+                if follower_count is None:
+                    follower_count = existing.follower_count
+            entry = MentionEntry(user_id, username, profile_picture_url, follower_count)
+            self._entries[user_id] = entry
+            insort(self._keys, (entry.key, user_id))
+            self._invalidate(entry.key)
+
+    def remove(self, user_id):
+        with self._lock:
+            existing = self._entries.pop(user_id, None)
+            if existing is not None:
+                self._keys.pop(bisect_left(self._keys, (existing.key, user_id)))
+                self._invalidate(existing.key)
+
+    def _top_popular(self, prefix, limit):
+        if len(prefix) <= SHORT_PREFIX_LENGTH:
+            cached = self._top_by_prefix.get(prefix)
+            if cached is not None and len(cached) >= limit:
+                return cached[:limit]
+        start, end = self._range(prefix)
+        top = heapq.nsmallest(limit, (self._entries[user_id] for _, user_id in self._keys[start:end]), key=_popularity_order)
+        if len(prefix) <= SHORT_PREFIX_LENGTH:
+            self._top_by_prefix[prefix] = top
+        return top
+
+    def search(self, prefix, limit=10, followed_ids=()):
+        """
+        Up to `limit` entries whose username starts with `prefix` (case-insensitive):
+        users in `followed_ids` first, then the rest by follower count.
+        """
+        prefix = prefix.lower()
+        with self._lock:
+            followed = [self._entries[user_id] for user_id in followed_ids
+                        if user_id in self._entries and self._entries[user_id].key.startswith(prefix)]
+            followed = heapq.nsmallest(limit, followed, key=_popularity_order)
+            followed_set = {entry.user_id for entry in followed}
+            popular = self._top_popular(prefix, limit + len(followed_set))
+            return (followed + [entry for entry in popular if entry.user_id not in followed_set])[:limit]
+
+    # -------------------- Snapshots --------------------
+
+    def to_snapshot(self):
+        with self._lock:
+            rows = [entry.to_row() for entry in self._entries.values()]
+        return {'version': SNAPSHOT_VERSION, 'built_at': self.built_at, 'entries': rows}
+
+    @classmethod
+    def from_snapshot(cls, data):
+        if data.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported mention index snapshot version: {data.get('version')}")
+        return cls([MentionEntry(*row) for row in data['entries']], built_at=data.get('built_at'))
+
+    def write_snapshot(self, path):
+        """Writes the snapshot atomically (temp file + rename) so readers never see a partial file."""
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_snapshot(), f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def read_snapshot(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls.from_snapshot(json.load(f))
+
+
+def build_mention_index():
+    """Builds a MentionIndex for every user in one query, with follower counts from the engagement counters."""
+    built_at = time.time() # Taken before reading, so changes committed during the read are replayed on reload
+    rows = db.session.execute(
+        select(User.id, User.username, User.profile_picture_url, func.coalesce(EngagementCounter.value, 0))
+        .outerjoin(EngagementCounter, and_(
+            EngagementCounter.entity_type == USER,
+            EngagementCounter.entity_id == User.id,
+            EngagementCounter.name == FOLLOWERS
+        ))
+    ).all()
+    return MentionIndex([MentionEntry(*row) for row in rows], built_at=built_at)
+
+
+def _snapshot_path():
+    return current_app.config.get('MENTION_INDEX_SNAPSHOT_PATH')
+
+
+def _load_snapshot_if_newer(state, path):
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return False
+    if state.get('snapshot_mtime') == mtime:
+        return False
+    try:
+        index = MentionIndex.read_snapshot(path)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        current_app.logger.warning('Could not load mention index snapshot %s: %s', path, e)
+        return False
+    _install(state, index)
+    state['snapshot_mtime'] = mtime
+    return True
+
+
+def _install(state, index):
+    """Makes `index` this worker's index, replaying the changes it committed since `index` was built."""
+    state['journal'] = [item for item in state.get('journal', []) if item[0] >= index.built_at]
+    for _, user_id, change in state['journal']:
+        _apply_change(index, user_id, change)
+    state['index'] = index
+
+
+def get_mention_index():
+    """
+    This worker's index: loaded from the snapshot file if there is one (and reloaded
+    when it changes), otherwise built from the database on first use.
+    """
+    state = current_app.extensions.setdefault('mention_index', {})
+    path = _snapshot_path()
+    now = time.monotonic()
+    if path and now - state.get('checked_at', 0) >= current_app.config.get('MENTION_INDEX_RELOAD_SECONDS', 60):
+        state['checked_at'] = now
+        _load_snapshot_if_newer(state, path)
+    if state.get('index') is None:
+        state['index'] = build_mention_index()
+    return state['index']
+
+
+def refresh_mention_index():
+    """Rebuilds this worker's index from the database and publishes it as the shared snapshot."""
+    state = current_app.extensions.setdefault('mention_index', {})
+    index = build_mention_index()
+    _install(state, index)
+    path = _snapshot_path()
+    if path:
+        index.write_snapshot(path)
+        state['snapshot_mtime'] = os.path.getmtime(path)
+    return index
+
+
+def search_mentions(prefix, user=None, limit=10):
+    """Ranked MentionEntry matches for `prefix`, people `user` follows first."""
+    if not prefix:
+        return []
+    followed_ids = ()
+    if user is not None and getattr(user, 'is_authenticated', False):
+        user_id = user.id
+        followed_ids = get_cached_followed_ids(user_id, lambda: db.session.execute(
+            select(followers.c.followed_id).where(followers.c.follower_id == user_id)
+        ).scalars().all())
+    return get_mention_index().search(prefix, limit=limit, followed_ids=followed_ids)
+
+
+# -------------------- Incremental updates --------------------
+
+def _apply_change(index, user_id, change):
+    if change is None:
+        index.remove(user_id)
+    else:
+        index.upsert(user_id, *change)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_username_changes(session, flush_context):
+    changes = session.info.setdefault('mention_index_changes', {})
+    for obj in session.new:
+        if isinstance(obj, User):
+            changes[obj.id] = (obj.username, obj.profile_picture_url)
+    for obj in session.dirty:
+        if isinstance(obj, User) and obj not in session.deleted:
+            state = attributes.instance_state(obj)
+            if state.attrs.username.history.has_changes() or state.attrs.profile_picture_url.history.has_changes():
+                changes[obj.id] = (obj.username, obj.profile_picture_url)
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            changes[obj.id] = None
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_username_changes(session):
+    changes = session.info.pop('mention_index_changes', None)
+    if not changes or not has_app_context():
+        return
+    # Only a worker that has already built its index needs patching; others build it fresh
+    state = current_app.extensions.get('mention_index', {})
+    index = state.get('index')
+    if index is None:
+        return
+    committed_at = time.time()
+    journal = state.setdefault('journal', [])
+    for user_id, change in changes.items():
+        _apply_change(index, user_id, change)
+        journal.append((committed_at, user_id, change))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_username_changes(session):
+    session.info.pop('mention_index_changes', None)
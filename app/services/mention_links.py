@@ -0,0 +1,229 @@
+"""
+@mention links in rendered post and comment bodies (the linkify_mentions filter).
+
+Resolving every @name with its own query made a busy thread cost dozens of queries.
+Names now go through three layers:
+  * rendered HTML is cached (Flask-Caching) under a hash of the body, so a body that
+    was rendered before is linkified without looking at its mentions at all;
+  * each worker keeps an LRU of lower-cased username -> (user id, username), names
+    that match nobody included, whose entries expire after MENTION_LINK_CACHE_TTL;
+  * whatever is left is resolved by the request's MentionResolver in one IN query.
+    Pages prime it with every body they are about to render (load_post_views does so
+    for post cards and their comments), so the first body that needs the database
+    resolves the names of the whole page.
+
+Both caches are keyed on a username generation token that every signup, rename and
+user deletion replaces. With a cache backend that is not shared between workers the
+other workers pick a change up once their LRU entries and rendered bodies expire.
+"""
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, has_app_context, url_for
+from markupsafe import Markup, escape
+from sqlalchemy import event, select, func
+from sqlalchemy.orm import Session, attributes
+
+from app import db, cache
+from app.core.models import User
+
+MENTION_RE = re.compile(r"@(\w+)")
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_CACHE_TTL = 300
+DEFAULT_HTML_TTL = 3600
+_GENERATION_KEY = 'mention_links_gen'
+_HTML_KEY = 'mention_html:{}:{}'
+
+
+def mention_names(text):
+    """The lower-cased names @mentioned in `text`."""
+    return {name.lower() for name in MENTION_RE.findall(text)}
+
+
+class UsernameCache:
+    """Thread-safe LRU of lower-cased username -> (user id, username) or None, with a TTL."""
+    def __init__(self, size=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # name -> (expires_at, generation, value)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_many(self, names, generation):
+        """{name: value} for the `names` cached under `generation` and not expired yet."""
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for name in names:
+                entry = self._entries.get(name)
+                if entry is None:
+                    continue
+                expires_at, entry_generation, value = entry
+                if expires_at <= now or entry_generation != generation:
+                    del self._entries[name]
+                    continue
+                self._entries.move_to_end(name)
+                found[name] = value
+        return found
+
+    def put_many(self, values, generation):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for name, value in values.items():
+                self._entries[name] = (expires_at, generation, value)
+                self._entries.move_to_end(name)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+def get_username_cache():
+    username_cache = current_app.extensions.get('mention_links')
+    if username_cache is None:
+        username_cache = current_app.extensions.setdefault('mention_links', UsernameCache(
+            current_app.config.get('MENTION_LINK_CACHE_SIZE', DEFAULT_CACHE_SIZE),
+            current_app.config.get('MENTION_LINK_CACHE_TTL', DEFAULT_CACHE_TTL)
+        ))
+    return username_cache
+
+
+def get_username_generation():
+    return cache.get(_GENERATION_KEY) or 0
+
+
+def bump_username_generation():
+    """Invalidates every cached username resolution and rendered body."""
+    # A fresh token rather than an increment, so an evicted counter can never reuse an old value
+    cache.set(_GENERATION_KEY, time.time_ns(), timeout=0)
+
+
+class MentionResolver:
+    """One request's view of @mentions: the names resolved so far, those still pending and the bodies rendered."""
+    def __init__(self, username_cache, generation, html_ttl=DEFAULT_HTML_TTL):
+        self.username_cache = username_cache
+        self.generation = generation
+        self.html_ttl = html_ttl
+        self._users = {} # name -> (user id, username) or None
+        self._pending = set()
+        self._html = {} # body -> Markup
+
+    def _html_key(self, text):
+        return _HTML_KEY.format(self.generation, hashlib.sha1(text.encode('utf-8')).hexdigest())
+
+    def prime(self, texts):
+        """Queues the names in `texts` (bodies about to be rendered) for the next resolve()."""
+        texts = {text for text in texts if text and '@' in text and text not in self._html}
+        if not texts:
+            return
+        keys = {text: self._html_key(text) for text in texts}
+        for (text, key), html in zip(keys.items(), cache.get_many(*keys.values())):
+            if html is not None:
+                self._html[text] = Markup(html)
+            else:
+                self._pending.update(mention_names(text))
+        self._pending.difference_update(self._users)
+
+    def resolve(self, names):
+        """{name: (user id, username) or None} for the lower-cased `names`; pending names are resolved along with them."""
+        wanted = (set(names) | self._pending) - self._users.keys()
+        self._pending = set()
+        if wanted:
+            found = self.username_cache.get_many(wanted, self.generation)
+            missing = wanted - found.keys()
+            if missing:
+                rows = db.session.execute(
+                    select(User.id, User.username).where(func.lower(User.username).in_(missing))
+                ).all()
+                loaded = dict.fromkeys(missing)
+                loaded.update({username.lower(): (user_id, username) for user_id, username in rows})
+                self.username_cache.put_many(loaded, self.generation)
+                found.update(loaded)
+            self._users.update(found)
+        return {name: self._users.get(name) for name in names}
+
+    def render(self, text):
+        html = self._html.get(text)
+        if html is None:
+            key = self._html_key(text)
+            cached = cache.get(key)
+            if cached is None:
+                html = self._linkify(text)
+                cache.set(key, str(html), timeout=self.html_ttl)
+            else:
+                html = Markup(cached)
+            self._html[text] = html
+        return html
+
+    def _linkify(self, text):
+        users = self.resolve(mention_names(text))
+        segments = []
+        last_end = 0
+        for match in MENTION_RE.finditer(text):
+            segments.append(escape(text[last_end:match.start()]))
+            user = users.get(match.group(1).lower())
+            if user:
+                username = user[1]
+                profile_url = url_for('main.profile', username=username)
+                segments.append(f'<a href="{escape(profile_url)}">@{escape(username)}</a>')
+            else:
+                segments.append(escape(match.group(0)))
+            last_end = match.end()
+        segments.append(escape(text[last_end:]))
+        return Markup("".join(segments))
+
+
+def get_mention_resolver():
+    resolver = g.get('mention_resolver')
+    if resolver is None:
+        resolver = g.mention_resolver = MentionResolver(
+            get_username_cache(), get_username_generation(),
+            current_app.config.get('MENTION_LINK_HTML_TTL', DEFAULT_HTML_TTL)
+        )
+    return resolver
+
+
+def prime_mentions(texts):
+    """Lets the request resolve the @mentions of all `texts` in one query before they are rendered."""
+    get_mention_resolver().prime(texts)
+
+
+def render_mentions(text):
+    """`text` escaped, with each @mention of an existing user linked to their profile."""
+    if not text:
+        return Markup('')
+    if '@' not in text:
+        return escape(text)
+    return get_mention_resolver().render(text)
+
+
+# -------------------- Invalidation --------------------
+
+@event.listens_for(Session, 'after_flush')
+def _collect_username_changes(session, flush_context):
+    if session.info.get('mention_links_changed'):
+        return
+    for obj in session.new | session.deleted:
+        if isinstance(obj, User):
+            session.info['mention_links_changed'] = True
+            return
+    for obj in session.dirty:
+        if isinstance(obj, User) and attributes.instance_state(obj).attrs.username.history.has_changes():
+            session.info['mention_links_changed'] = True
+            return
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_username_generation(session):
+    if not session.info.pop('mention_links_changed', None) or not has_app_context():
+        return
+    bump_username_generation()
+    g.pop('mention_resolver', None)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_username_changes(session):
+    session.info.pop('mention_links_changed', None)
@@ -0,0 +1,145 @@
+"""
+Bulk notification fan-out to group members.
+
+Posting, sharing or creating a poll in a group used to walk group.memberships, load each
+member's User row and add one Notification at a time inside the request, so posting into
+a 10k-member group took seconds. notify_group_members() instead:
+
+  * coalesces into members' open unread notification for the same group with one UPDATE
+    (see notification_service.notify), writes everyone else's with one INSERT ... SELECT
+    from group_membership, and bumps their unread counters with one upsert;
+  * pushes the socket event to the members' rooms NOTIFICATION_FANOUT_EMIT_BATCH rooms
+    per emit, with the same payload for everyone, debounced per group and type;
+  * runs on a Socket.IO background task (threads, eventlet or gevent, whichever the
+    server uses), so the request returns once its own write has committed.
+
+With NOTIFICATION_FANOUT_ASYNC off (tests, or callers already off the request thread
+such as the scheduler) the fan-out runs inline.
+"""
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import select, insert, update, literal, case, union_all
+
+from app import db, socketio
+from app.core.models import GroupMembership, Notification
+from app.services.notification_service import (
+    count_bulk_notifications, coalesce_kind, coalesce_since, push_after_commit, record_actors, distinct_actor_count
+)
+
+DEFAULT_EMIT_BATCH = 500
+
+
+def _open_group_aggregates(group_id, notification_type, since):
+    """Filter for members' unread `notification_type` notifications about `group_id` active since `since`."""
+    return (
+        Notification.related_group_id == group_id, Notification.type == notification_type,
+        Notification.is_read == False, Notification.timestamp >= since
+    )
+
+
+def coalesce_group_notifications(connection, group_id, actor_id, notification_type, related_post_id=None, now=None):
+    """
+    Updates the members' open unread `notification_type` notifications about `group_id` in
+    place for `actor_id`'s new activity. Returns the ids of the members coalesced into.
+    """
+    now = now or datetime.now(timezone.utc)
+    since = coalesce_since(now)
+    if since is None or coalesce_kind(notification_type) is None:
+        return []
+    table = Notification.__table__
+    open_aggregates = _open_group_aggregates(group_id, notification_type, since) + (
+        Notification.recipient_id.in_(select(GroupMembership.user_id).where(GroupMembership.group_id == group_id)),
+        Notification.recipient_id != actor_id
+    )
+    recipient_ids = connection.execute(select(Notification.recipient_id).where(*open_aggregates)).scalars().all()
+    if recipient_ids:
+        # Rows another actor stood for until now gain the new one, counted once (see notification_service.notify)
+        changing = open_aggregates + (Notification.actor_id != actor_id,)
+        record_actors(connection, union_all(
+            select(Notification.id, Notification.actor_id).where(*changing),
+            select(Notification.id, literal(actor_id)).where(*changing)
+        ))
+        connection.execute(update(table).where(*open_aggregates).values(
+            actor_count=case((table.c.actor_id != actor_id, distinct_actor_count(table.c.id).scalar_subquery()),
+                             else_=table.c.actor_count),
+            actor_id=actor_id, related_post_id=related_post_id, timestamp=now
+        ))
+    return recipient_ids
+
+
+def insert_group_notifications(connection, group_id, actor_id, notification_type, related_post_id=None, now=None,
+                               skip_open_since=None):
+    """
+    Inserts a notification for every member of `group_id` but `actor_id` in one statement,
+    skipping members with an open aggregate active since `skip_open_since` (if given). Returns the row count.
+    """
+    now = now or datetime.now(timezone.utc)
+    members = select(
+        GroupMembership.user_id, literal(actor_id), literal(notification_type), literal(related_post_id),
+        literal(group_id), literal(now), literal(False)
+    ).where(GroupMembership.group_id == group_id, GroupMembership.user_id != actor_id)
+    if skip_open_since is not None:
+        members = members.where(~select(Notification.id).where(
+            Notification.recipient_id == GroupMembership.user_id,
+            *_open_group_aggregates(group_id, notification_type, skip_open_since)
+        ).exists())
+    result = connection.execute(insert(Notification.__table__).from_select(
+        ['recipient_id', 'actor_id', 'type', 'related_post_id', 'related_group_id', 'timestamp', 'is_read'], members
+    ))
+    return result.rowcount
+
+
+def emit_to_users(event_name, payload, user_ids, batch_size=None):
+    """Emits `payload` to the personal rooms of `user_ids`, a batch of rooms per emit. Returns the number of emits."""
+    batch_size = batch_size or current_app.config.get('NOTIFICATION_FANOUT_EMIT_BATCH', DEFAULT_EMIT_BATCH)
+    rooms = [str(user_id) for user_id in user_ids]
+    for start in range(0, len(rooms), batch_size):
+        socketio.emit(event_name, payload, to=rooms[start:start + batch_size])
+    return -(-len(rooms) // batch_size)
+
+
+def fan_out_group_notification(group_id, actor_id, notification_type, related_post_id=None, payload=None):
+    """Notifies the members of `group_id` (but `actor_id`) now, in this thread. Returns the number notified."""
+    recipient_ids = db.session.execute(
+        select(GroupMembership.user_id)
+        .where(GroupMembership.group_id == group_id, GroupMembership.user_id != actor_id)
+    ).scalars().all()
+    if not recipient_ids:
+        return 0
+    connection = db.session.connection()
+    now = datetime.now(timezone.utc)
+    coalesced = set(coalesce_group_notifications(connection, group_id, actor_id, notification_type, related_post_id, now))
+    insert_group_notifications(connection, group_id, actor_id, notification_type, related_post_id, now,
+                               skip_open_since=coalesce_since(now) if coalesced else None)
+    count_bulk_notifications(db.session, [user_id for user_id in recipient_ids if user_id not in coalesced])
+    if payload is not None:
+        push_after_commit(db.session(), ('group', group_id, notification_type), payload, recipient_ids)
+    db.session.commit()
+    return len(recipient_ids)
+
+
+def _fan_out_task(app, kwargs):
+    with app.app_context():
+        try:
+            count = fan_out_group_notification(**kwargs)
+            app.logger.debug('Group %s: %s %s notification(s) sent', kwargs['group_id'], count, kwargs['notification_type'])
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('Group notification fan-out failed for group %s', kwargs['group_id'])
+        finally:
+            db.session.remove()
+
+
+def notify_group_members(group_id, actor_id, notification_type, related_post_id=None, payload=None):
+    """
+    Notifies the members of `group_id` (but `actor_id`) of a committed post, share or poll,
+    on a background task unless NOTIFICATION_FANOUT_ASYNC is off. `payload` is the
+    'new_notification' socket event sent to each of them (None: no socket event).
+    """
+    kwargs = dict(group_id=group_id, actor_id=actor_id, notification_type=notification_type,
+                  related_post_id=related_post_id, payload=payload)
+    if not current_app.config.get('NOTIFICATION_FANOUT_ASYNC', True):
+        return fan_out_group_notification(**kwargs)
+    socketio.start_background_task(_fan_out_task, current_app._get_current_object(), kwargs)
+    return None
@@ -0,0 +1,289 @@
+"""
+Unread notification counts, coalescing and socket pushes.
+
+base.html shows the unread badge on every page, so the context processor used to COUNT
+the viewer's unread notifications on every render. The count is now the user's
+'unread_notifications' engagement counter: counter_service keeps it in step with ORM
+inserts, deletes and is_read changes, and writes that bypass the ORM go through
+count_bulk_notifications() and mark_all_read() below. Reads are cached in the app cache
+under unread_notifications:<user id> for NOTIFICATION_UNREAD_CACHE_TTL seconds, and a
+committed change deletes the key. With the default per-process SimpleCache the delete
+only reaches the committing process, so the TTL defaults to a few seconds; with a shared
+backend (CACHE_TYPE, e.g. RedisCache) it reaches every process and the TTL is an hour.
+The context processor only reads the count when a template renders it.
+
+Reactions, comments, mentions, chat messages and group posts used to write one row and
+send one socket event each, so a viral post left its author thousands of rows. notify()
+coalesces them instead: while a recipient's notification for the same kind and target
+(COALESCE_TARGETS, e.g. reactions to one post) is unread and its latest activity is less
+than NOTIFICATION_COALESCE_WINDOW_SECONDS old, the new actor updates that row in place
+("alice and 41 others reacted to your post") and the unread count stays the same. The
+distinct actors are recorded in notification_actor once a second one arrives, so
+repeat actions by the same people do not inflate the count. Its
+'new_notification' event goes out after the commit through a per-worker PushDebouncer:
+the first push for a key is sent at once, later ones within NOTIFICATION_PUSH_DEBOUNCE_SECONDS
+only replace one trailing push.
+"""
+import threading
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, update, insert, select, exists, func, literal, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app import db, cache, socketio
+from app.core.models import Notification, NotificationActor
+from app.services.counter_service import USER, UNREAD_NOTIFICATIONS, get_counter, upsert_counters
+
+DEFAULT_UNREAD_CACHE_TTL = 5
+DEFAULT_COALESCE_WINDOW = 6 * 3600
+DEFAULT_PUSH_DEBOUNCE = 2.0
+_UNREAD_KEY = 'unread_notifications:{}'
+
+# Coalesced notification kinds -> the column that identifies their target. All 'reaction_<type>'
+# notifications are one kind, so likes and loves on a post share a row.
+COALESCE_TARGETS = {
+    'reaction': 'related_post_id',
+    'comment': 'related_post_id',
+    'mention': 'related_post_id',
+    'new_chat_message': 'related_conversation_id',
+    'new_group_post': 'related_group_id',
+    'new_group_poll': 'related_group_id',
+    'group_share': 'related_group_id',
+    'event_join': 'related_event_id',
+}
+AGGREGATE_PHRASES = {
+    'reaction': 'reacted to your post',
+    'comment': 'commented on your post',
+    'mention': 'mentioned you in a post',
+    'new_chat_message': 'sent you messages',
+    'new_group_post': 'posted in a group you are in',
+    'new_group_poll': 'created polls in a group you are in',
+    'group_share': 'shared posts to a group you are in',
+    'event_join': 'are attending your event',
+}
+
+
+def get_unread_count(user_id):
+    """`user_id`'s unread notification count, from the cache or their counter row."""
+    key = _UNREAD_KEY.format(user_id)
+    count = cache.get(key)
+    if count is None:
+        count = max(get_counter(USER, user_id, UNREAD_NOTIFICATIONS), 0)
+        cache.set(key, count, timeout=current_app.config.get('NOTIFICATION_UNREAD_CACHE_TTL', DEFAULT_UNREAD_CACHE_TTL))
+    return count
+
+
+def _invalidate_on_commit(session, user_ids):
+    session.info.setdefault('unread_notification_users', set()).update(user_ids)
+
+
+def count_bulk_notifications(session, recipient_ids):
+    """Counts one new unread notification for each of `recipient_ids`, for rows inserted outside the ORM."""
+    recipient_ids = list(recipient_ids)
+    upsert_counters(session.connection(), {(USER, user_id, UNREAD_NOTIFICATIONS): 1 for user_id in recipient_ids},
+                    increment=True)
+    _invalidate_on_commit(session, recipient_ids)
+
+
+def mark_all_read(user_id):
+    """Marks all of `user_id`'s notifications read with one UPDATE and zeroes their count (the caller commits)."""
+    connection = db.session.connection()
+    connection.execute(
+        update(Notification.__table__)
+        .where(Notification.recipient_id == user_id, Notification.is_read == False)
+        .values(is_read=True)
+    )
+    upsert_counters(connection, {(USER, user_id, UNREAD_NOTIFICATIONS): 0}, increment=False)
+    _invalidate_on_commit(db.session(), [user_id])
+
+
+# -------------------- Coalescing --------------------
+
+def coalesce_kind(notification_type):
+    """The COALESCE_TARGETS kind of `notification_type`, or None if it is never coalesced."""
+    kind = 'reaction' if notification_type.startswith('reaction_') else notification_type
+    return kind if kind in COALESCE_TARGETS else None
+
+
+def coalesce_since(now):
+    """Oldest latest-activity time an unread notification can still absorb new actors at, or None if coalescing is off."""
+    window = current_app.config.get('NOTIFICATION_COALESCE_WINDOW_SECONDS', DEFAULT_COALESCE_WINDOW)
+    return now - timedelta(seconds=window) if window > 0 else None
+
+
+def aggregate_message(actor_username, actor_count, notification_type):
+    """"alice and 41 others reacted to your post." for a coalesced notification."""
+    others = actor_count - 1
+    return f"{actor_username} and {others} other{'s' if others > 1 else ''} {AGGREGATE_PHRASES[coalesce_kind(notification_type)]}."
+
+
+def record_actors(connection, rows):
+    """
+    Records the (notification id, actor id) pairs selected by `rows` in notification_actor,
+    skipping pairs already there, with one INSERT ... SELECT.
+    """
+    table = NotificationActor.__table__
+    columns = [table.c.notification_id, table.c.actor_id]
+    dialect_insert = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}.get(connection.dialect.name)
+    if dialect_insert is not None:
+        connection.execute(dialect_insert(table).from_select(columns, rows).on_conflict_do_nothing())
+        return
+    pairs = rows.subquery()
+    notification_id, actor_id = pairs.c
+    connection.execute(insert(table).from_select(columns, select(notification_id, actor_id).where(~exists().where(
+        table.c.notification_id == notification_id, table.c.actor_id == actor_id
+    ))))
+
+
+def distinct_actor_count(notification_id):
+    """SELECT of how many distinct actors `notification_id` (a value or correlated column) stands for."""
+    return select(func.count()).select_from(NotificationActor).where(NotificationActor.notification_id == notification_id)
+
+
+def _open_aggregate(recipient_id, notification_type, related, now):
+    kind = coalesce_kind(notification_type)
+    since = coalesce_since(now)
+    target_column = COALESCE_TARGETS.get(kind)
+    if since is None or related.get(target_column) is None:
+        return None
+    query = Notification.query.filter(
+        Notification.recipient_id == recipient_id, Notification.is_read == False,
+        getattr(Notification, target_column) == related[target_column], Notification.timestamp >= since
+    )
+    if kind == 'reaction':
+        query = query.filter(Notification.type.startswith('reaction_', autoescape=True))
+    else:
+        query = query.filter(Notification.type == notification_type)
+    return query.order_by(Notification.timestamp.desc()).first()
+
+
+def notify(recipient_id, actor_id, notification_type, payload=None, now=None, **related):
+    """
+    Notifies `recipient_id` of `actor_id`'s action (the caller commits): a new Notification,
+    or their open unread one for the same kind and target updated in place. `related` are
+    Notification's related_*_id columns. `payload` is the 'new_notification' socket event,
+    pushed (debounced) once the session commits, with the aggregate message and
+    'actor_count' filled in for a coalesced row (None: no socket event). Returns the row.
+    """
+    now = now or datetime.now(timezone.utc)
+    notification = _open_aggregate(recipient_id, notification_type, related, now)
+    if notification is None:
+        notification = Notification(recipient_id=recipient_id, actor_id=actor_id, type=notification_type,
+                                    timestamp=now, **related)
+        db.session.add(notification)
+        actor_count = 1
+    else:
+        actor_count = notification.actor_count
+        if notification.actor_id != actor_id:
+            # The previous and the new actor, each recorded once however often they act
+            rows = Notification.id == notification.id
+            record_actors(db.session.connection(), union_all(
+                select(Notification.id, Notification.actor_id).where(rows),
+                select(Notification.id, literal(actor_id)).where(rows)
+            ))
+            actor_count = db.session.execute(distinct_actor_count(notification.id)).scalar()
+            # Recounted in SQL so concurrent coalescing into the same row loses no actors
+            notification.actor_count = distinct_actor_count(Notification.id).scalar_subquery()
+        notification.actor_id = actor_id
+        notification.type = notification_type
+        notification.timestamp = now
+        for column, value in related.items():
+            setattr(notification, column, value)
+
+    if payload is not None:
+        payload = dict(payload, actor_count=actor_count)
+        if actor_count > 1 and payload.get('actor_username'):
+            payload['message'] = aggregate_message(payload['actor_username'], actor_count, notification_type)
+        target = related.get(COALESCE_TARGETS.get(coalesce_kind(notification_type)))
+        push_after_commit(db.session(), (recipient_id, coalesce_kind(notification_type) or notification_type, target),
+                          payload, [recipient_id])
+    return notification
+
+
+# -------------------- Socket pushes --------------------
+
+class PushDebouncer:
+    """
+    Leading and trailing debounce of 'new_notification' pushes, per key: the first push for
+    a key goes out at once, later ones within `interval` seconds replace a single pending
+    payload that is sent when the interval ends. Thread-safe; one per worker.
+    """
+    def __init__(self, interval=DEFAULT_PUSH_DEBOUNCE):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pending = {} # key -> None, or the (payload, user ids) to send when the interval ends
+
+    def push(self, key, payload, user_ids):
+        """Pushes `payload` to `user_ids` now or at the end of `key`'s interval. Returns True if sent now."""
+        from app.services.notification_fanout import emit_to_users
+        if self.interval <= 0:
+            emit_to_users('new_notification', payload, user_ids)
+            return True
+        with self._lock:
+            if key in self._pending:
+                self._pending[key] = (payload, user_ids)
+                return False
+            self._pending[key] = None
+        emit_to_users('new_notification', payload, user_ids)
+        socketio.start_background_task(self._flush, current_app._get_current_object(), key)
+        return True
+
+    def _flush(self, app, key):
+        from app.services.notification_fanout import emit_to_users
+        socketio.sleep(self.interval)
+        with self._lock:
+            pending = self._pending.pop(key, None)
+        if pending is not None:
+            with app.app_context():
+                emit_to_users('new_notification', *pending)
+
+
+def push_after_commit(session, key, payload, user_ids):
+    """Pushes `payload` to `user_ids` through the debouncer (under `key`) once `session` commits."""
+    session.info.setdefault('notification_pushes', []).append((key, payload, user_ids))
+
+
+def get_push_debouncer():
+    debouncer = current_app.extensions.get('notification_pushes')
+    if debouncer is None:
+        debouncer = current_app.extensions.setdefault('notification_pushes', PushDebouncer(
+            current_app.config.get('NOTIFICATION_PUSH_DEBOUNCE_SECONDS', DEFAULT_PUSH_DEBOUNCE)
+        ))
+    return debouncer
+
+
+# -------------------- Session hooks --------------------
+
+@event.listens_for(Session, 'after_flush')
+def _collect_unread_changes(session, flush_context):
+    user_ids = {obj.recipient_id for obj in session.new if isinstance(obj, Notification)}
+    user_ids.update(obj.recipient_id for obj in session.dirty
+                    if isinstance(obj, Notification) and obj not in session.deleted)
+    user_ids.update(
+        obj.__dict__['recipient_id'] for obj in session.deleted
+        if isinstance(obj, Notification) and 'recipient_id' in obj.__dict__
+    )
+    if user_ids:
+        _invalidate_on_commit(session, user_ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_unread_counts(session):
+    user_ids = session.info.pop('unread_notification_users', None)
+    pushes = session.info.pop('notification_pushes', None)
+    if not has_app_context():
+        return
+    if user_ids:
+        cache.delete_many(*[_UNREAD_KEY.format(user_id) for user_id in user_ids])
+    if pushes:
+        debouncer = get_push_debouncer()
+        for key, payload, user_ids in pushes:
+            debouncer.push(key, payload, user_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_unread_changes(session):
+    session.info.pop('unread_notification_users', None)
+    session.info.pop('notification_pushes', None)
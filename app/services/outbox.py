@@ -0,0 +1,288 @@
+"""
+Transactional outbox for the side effects of a write.
+
+Posting, commenting, reacting and chatting used to award points, advance quests, check
+badges and send notifications inside the HTTP or socket handler, committing several times
+along the way: the request waited for all of it, and a crash between two commits left the
+side effects half applied. Instead the handler now records an OutboxEvent with enqueue()
+in the same transaction as its write, and commits once.
+
+Outbox workers (OUTBOX_WORKERS background tasks per server process, started by the entry
+point with start_outbox_workers(), woken when a commit enqueues and polling every
+OUTBOX_POLL_SECONDS) drain the table in batches:
+
+  * a batch of up to OUTBOX_BATCH_SIZE due events is claimed with one UPDATE that stamps a
+    claim token and leases them for OUTBOX_LEASE_SECONDS, so workers in any process never
+    apply the same event concurrently, and a crashed worker's events are claimed again
+    once the lease runs out;
+  * each event is applied in its own transaction, together with marking it processed
+    (only if the claim is still ours). Legacy helpers that commit part-way through (badge
+    checks, group fan-out) only flush there, so the event's effects commit all together
+    or not at all, and notification pushes go out after that commit;
+  * a failed event is retried with exponential backoff and given up on (failed_at) after
+    OUTBOX_MAX_ATTEMPTS;
+  * the idempotency key is unique: enqueuing the same key again is a no-op.
+
+With OUTBOX_WORKERS = 0 (tests, single-process development), and in processes that did
+not start workers (flask run, a WSGI server, CLI commands, scripts), the events a commit
+enqueued are applied right after it, each in its own transaction. Only those events
+(and the ones their handlers enqueue) are applied there, never the rest of the table:
+other users' events and retries wait for a process that runs workers.
+"""
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app, has_app_context
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import event, select, update, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app import db, socketio
+from app.core.models import OutboxEvent
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 8
+DEFAULT_RETRY_BASE_SECONDS = 5
+DEFAULT_RETRY_MAX_SECONDS = 3600
+DEFAULT_POLL_SECONDS = 5
+
+_handlers = {}
+_inline = threading.local()
+
+
+def outbox_handler(kind):
+    """Registers the decorated function(payload) as the handler of `kind` events."""
+    def register(func):
+        _handlers[kind] = func
+        return func
+    return register
+
+
+def _utcnow():
+    return datetime.now(timezone.utc)
+
+
+def enqueue(kind, payload, idempotency_key, session=None):
+    """
+    Records a `kind` event with the JSON `payload` in `session`'s transaction (db.session by
+    default). Nothing happens if an event with `idempotency_key` was already recorded.
+    """
+    session = session or db.session()
+    connection = session.connection()
+    row = {'kind': kind, 'idempotency_key': idempotency_key, 'payload': payload,
+           'created_at': _utcnow(), 'available_at': _utcnow(), 'attempts': 0}
+    table = OutboxEvent.__table__
+    dialect_insert = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}.get(connection.dialect.name)
+    if dialect_insert is not None:
+        connection.execute(dialect_insert(table).values(**row).on_conflict_do_nothing(
+            index_elements=[table.c.idempotency_key]
+        ))
+    elif connection.execute(select(table.c.id).where(table.c.idempotency_key == idempotency_key)).first() is None:
+        connection.execute(insert(table).values(**row))
+    session.info.setdefault('outbox_enqueued', []).append(idempotency_key)
+
+
+# -------------------- Applying events --------------------
+
+class _EventSession(FlaskSession):
+    """
+    The session an event is applied in. While the handler runs, commit() only flushes, so
+    the event's effects commit together with marking it processed, and a rollback() fails
+    the event (the handler's earlier work is gone) instead of letting it carry on.
+    """
+    applying = False
+    rolled_back = False
+
+    def commit(self):
+        if self.applying:
+            self.flush()
+            return
+        super().commit()
+
+    def rollback(self):
+        if self.applying:
+            self.rolled_back = True
+        super().rollback()
+
+
+@contextmanager
+def _event_session(app):
+    """A fresh app context whose db.session is an _EventSession."""
+    with app.app_context():
+        session = _EventSession(**db.session.session_factory.kw)
+        db.session.registry.set(session)
+        try:
+            yield session
+        finally:
+            db.session.remove()
+
+
+def claim_batch(batch_size=None, lease_seconds=None, keys=None):
+    """
+    Claims up to `batch_size` due events for this worker, only those with an idempotency
+    key in `keys` if given. Returns (token, [(id, kind, payload, attempts)]).
+    """
+    config = current_app.config
+    batch_size = batch_size or config.get('OUTBOX_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    lease = timedelta(seconds=lease_seconds or config.get('OUTBOX_LEASE_SECONDS', DEFAULT_LEASE_SECONDS))
+    now = _utcnow()
+    token = uuid.uuid4().hex
+    claimable = (OutboxEvent.processed_at.is_(None), OutboxEvent.failed_at.is_(None), OutboxEvent.available_at <= now)
+    if keys is not None:
+        claimable += (OutboxEvent.idempotency_key.in_(keys),)
+    due = select(OutboxEvent.id).where(*claimable).order_by(OutboxEvent.id).limit(batch_size)
+    # The outer conditions are checked again on each row, so an event another worker claimed meanwhile is skipped
+    db.session.execute(
+        update(OutboxEvent).where(OutboxEvent.id.in_(due), *claimable)
+        .values(claim_token=token, available_at=now + lease)
+        .execution_options(synchronize_session=False)
+    )
+    events = db.session.execute(
+        select(OutboxEvent.id, OutboxEvent.kind, OutboxEvent.payload, OutboxEvent.attempts)
+        .where(OutboxEvent.claim_token == token).order_by(OutboxEvent.id)
+    ).all()
+    db.session.commit()
+    return token, events
+
+
+def _record_failure(event_id, token, attempts, error):
+    config = current_app.config
+    now = _utcnow()
+    attempts += 1
+    values = {'attempts': attempts, 'claim_token': None, 'last_error': repr(error)[:2000]}
+    if attempts >= config.get('OUTBOX_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS):
+        values['failed_at'] = now
+    else:
+        delay = min(config.get('OUTBOX_RETRY_BASE_SECONDS', DEFAULT_RETRY_BASE_SECONDS) * 2 ** (attempts - 1),
+                    config.get('OUTBOX_RETRY_MAX_SECONDS', DEFAULT_RETRY_MAX_SECONDS))
+        values['available_at'] = now + timedelta(seconds=delay)
+    db.session.execute(
+        update(OutboxEvent).where(OutboxEvent.id == event_id, OutboxEvent.claim_token == token).values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return values.get('failed_at') is not None
+
+
+def apply_event(app, token, event_id, kind, payload, attempts):
+    """Applies one claimed event in its own transaction. Returns True if it was processed."""
+    with _event_session(app) as session:
+        try:
+            handler = _handlers.get(kind)
+            if handler is None:
+                raise LookupError(f'No outbox handler for {kind!r}')
+            session.applying = True
+            try:
+                handler(payload)
+            finally:
+                session.applying = False
+            if session.rolled_back:
+                raise RuntimeError(f'The {kind!r} handler rolled back its transaction')
+            done = session.execute(
+                update(OutboxEvent).where(OutboxEvent.id == event_id, OutboxEvent.claim_token == token)
+                .values(processed_at=_utcnow(), claim_token=None)
+                .execution_options(synchronize_session=False)
+            )
+            if done.rowcount != 1:
+                raise RuntimeError(f'Lost the claim on outbox event {event_id}')
+            session.commit()
+            return True
+        except Exception as error:
+            session.rollback()
+            gave_up = _record_failure(event_id, token, attempts, error)
+            log = app.logger.error if gave_up else app.logger.warning
+            log('Outbox event %s (%s) failed on attempt %s%s: %r', event_id, kind, attempts + 1,
+                ', giving up' if gave_up else '', error, exc_info=gave_up)
+            return False
+
+
+def drain_outbox(app=None, batch_size=None, keys=None):
+    """Claims and applies one batch of due events (see claim_batch). Returns the number of events claimed."""
+    app = app or current_app._get_current_object()
+    with app.app_context():
+        token, events = claim_batch(batch_size, keys=keys)
+    for event_id, kind, payload, attempts in events:
+        apply_event(app, token, event_id, kind, payload, attempts)
+    return len(events)
+
+
+# -------------------- Workers --------------------
+
+class OutboxWorkerPool:
+    """`size` background tasks draining the outbox, woken by wake() or every `poll_seconds`."""
+    def __init__(self, app, size, poll_seconds=DEFAULT_POLL_SECONDS):
+        self.app = app
+        self.size = size
+        self.poll_seconds = poll_seconds
+        self._wake = threading.Event()
+
+    def start(self):
+        for _ in range(self.size):
+            socketio.start_background_task(self._run)
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            try:
+                claimed = drain_outbox(self.app)
+            except Exception:
+                self.app.logger.exception('Outbox worker failed to drain a batch')
+                claimed = 0
+            if not claimed:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+
+
+def start_outbox_workers(app):
+    """
+    Starts this process's outbox workers (none with OUTBOX_WORKERS = 0: events are applied
+    inline). Called by the server entry point, not create_app(), so CLI commands and
+    migrations do not start workers.
+    """
+    # Register every handler before a worker can claim an event, or it would fail the
+    # event with a LookupError and spend one of its attempts
+    from app.services import side_effects # noqa
+    size = app.config.get('OUTBOX_WORKERS', 0)
+    if size <= 0:
+        return None
+    pool = OutboxWorkerPool(app, size, app.config.get('OUTBOX_POLL_SECONDS', DEFAULT_POLL_SECONDS))
+    app.extensions['outbox_workers'] = pool
+    pool.start()
+    return pool
+
+
+@event.listens_for(Session, 'after_commit')
+def _dispatch_enqueued(session):
+    keys = session.info.pop('outbox_enqueued', None)
+    if not keys or not has_app_context():
+        return
+    pool = current_app.extensions.get('outbox_workers')
+    if pool is not None:
+        pool.wake()
+        return
+    pending = getattr(_inline, 'pending', None)
+    if pending is not None:
+        # Enqueued by a handler being applied inline: applied by the loop below
+        pending.extend(keys)
+        return
+    # No workers: apply this commit's events now, in their own app contexts and transactions
+    _inline.pending = list(keys)
+    try:
+        while _inline.pending:
+            batch = _inline.pending[:]
+            del _inline.pending[:]
+            while drain_outbox(keys=batch):
+                pass
+    finally:
+        _inline.pending = None
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_enqueued(session):
+    session.info.pop('outbox_enqueued', None)
@@ -0,0 +1,172 @@
+"""
+Batch loading for post cards (_post.html).
+
+Rendering a post card used to issue its own queries for every reaction type, the
+viewer's reaction, media, hashtags, each poll option's votes, comments, the bookmark
+state and related posts, so a 10-post page ran well over a hundred queries.
+load_post_views() fetches all of that for a whole page in a fixed number of grouped
+queries (independent of the number of posts) and returns one PostView per post for
+the template to read from.
+"""
+from collections import defaultdict, namedtuple
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import joinedload
+
+from app import db
+from app.core.models import (
+    Post, User, Reaction, Comment, MediaItem, Hashtag, Poll, PollOption, PollVote,
+    Bookmark, PostPurchase, UserVirtualGood, Group, FriendList, post_hashtags
+)
+from app.services.visibility_service import get_viewer
+from app.services.counter_service import get_reaction_counts
+from app.services.mention_links import prime_mentions
+from app.services.related_posts_service import get_related_post_ids
+
+RELATED_POSTS_LIMIT = 5
+
+PollView = namedtuple('PollView', ['poll', 'options', 'total_votes', 'viewer_has_voted'])
+PollOptionView = namedtuple('PollOptionView', ['option', 'vote_count'])
+RelatedPostView = namedtuple('RelatedPostView', ['post', 'hashtags'])
+
+
+class PostView:
+    """Everything _post.html needs about one post, as seen by one viewer."""
+    def __init__(self, post):
+        self.post = post
+        self.reaction_counts = {}
+        self.viewer_reaction = None # reaction_type string
+        self.media_items = []
+        self.hashtags = []
+        self.polls = []
+        self.comments = []
+        self.related_posts = []
+        self.is_bookmarked = False
+        self.is_purchased = False
+
+    def reaction_count(self, reaction_type=None):
+        if reaction_type:
+            return self.reaction_counts.get(reaction_type, 0)
+        return sum(self.reaction_counts.values())
+
+    def __repr__(self):
+        return f'<PostView {self.post.id}>'
+
+
+def _load_hashtags(post_ids):
+    tags = defaultdict(list)
+    if post_ids:
+        rows = db.session.query(post_hashtags.c.post_id, Hashtag).join(
+            Hashtag, Hashtag.id == post_hashtags.c.hashtag_id
+        ).filter(post_hashtags.c.post_id.in_(post_ids)).order_by(Hashtag.id).all()
+        for post_id, hashtag in rows:
+            tags[post_id].append(hashtag)
+    return tags
+
+
+def _load_polls(post_ids, viewer):
+    polls_by_post = defaultdict(list)
+    polls = Poll.query.filter(Poll.post_id.in_(post_ids)).order_by(Poll.id).all()
+    if not polls:
+        return polls_by_post
+    poll_ids = [poll.id for poll in polls]
+
+    options = defaultdict(list)
+    for option in PollOption.query.filter(PollOption.poll_id.in_(poll_ids)).order_by(PollOption.id):
+        options[option.poll_id].append(option)
+    vote_counts = dict(db.session.query(PollVote.option_id, func.count(PollVote.id)).filter(
+        PollVote.poll_id.in_(poll_ids)
+    ).group_by(PollVote.option_id).all())
+    voted_poll_ids = set()
+    if not viewer.is_anonymous:
+        voted_poll_ids = set(db.session.execute(
+            select(PollVote.poll_id).where(PollVote.user_id == viewer.user_id, PollVote.poll_id.in_(poll_ids))
+        ).scalars())
+
+    for poll in polls:
+        option_views = [PollOptionView(option, vote_counts.get(option.id, 0)) for option in options[poll.id]]
+        polls_by_post[poll.post_id].append(PollView(
+            poll, option_views, sum(o.vote_count for o in option_views), poll.id in voted_poll_ids
+        ))
+    return polls_by_post
+
+
+def _prime_identity_map(posts):
+    """Loads the authors (with active titles), groups and friend lists the cards reference in bulk,
+    so the template's many-to-one attribute access is served from the session's identity map."""
+    author_ids = {post.user_id for post in posts}
+    if author_ids:
+        User.query.options(
+            joinedload(User.active_title).joinedload(UserVirtualGood.virtual_good)
+        ).filter(User.id.in_(author_ids)).all()
+    group_ids = {post.group_id for post in posts if post.group_id}
+    if group_ids:
+        Group.query.filter(Group.id.in_(group_ids)).all()
+    list_ids = {post.custom_friend_list_id for post in posts if post.custom_friend_list_id}
+    if list_ids:
+        FriendList.query.filter(FriendList.id.in_(list_ids)).all()
+
+
+def load_post_views(posts, viewer_user, related_limit=RELATED_POSTS_LIMIT):
+    """
+    Returns {post_id: PostView} for `posts` (Post objects, duplicates allowed) as seen by
+    `viewer_user` (a User, current_user or None).
+    """
+    posts = list({post.id: post for post in posts}.values())
+    if not posts:
+        return {}
+    viewer = get_viewer(viewer_user)
+    post_ids = [post.id for post in posts]
+    views = {post.id: PostView(post) for post in posts}
+
+    for post_id, counts in get_reaction_counts(post_ids).items():
+        views[post_id].reaction_counts = counts
+
+    for media_item in MediaItem.query.filter(MediaItem.post_id.in_(post_ids)).order_by(MediaItem.id):
+        views[media_item.post_id].media_items.append(media_item)
+
+    for comment in Comment.query.options(joinedload(Comment.author)).filter(
+        Comment.post_id.in_(post_ids)
+    ).order_by(Comment.timestamp.asc(), Comment.id.asc()):
+        views[comment.post_id].comments.append(comment)
+    # The cards linkify these bodies; let the first one resolve every @mention on the page
+    prime_mentions([post.body for post in posts] + [c.body for view in views.values() for c in view.comments])
+
+    for post_id, poll_views in _load_polls(post_ids, viewer).items():
+        views[post_id].polls = poll_views
+
+    related_ids = get_related_post_ids(post_ids, viewer, related_limit) if related_limit else {}
+    all_related_ids = {rid for ids in related_ids.values() for rid in ids}
+    related_posts = {}
+    if all_related_ids:
+        related_posts = {p.id: p for p in Post.query.options(joinedload(Post.author)).filter(Post.id.in_(all_related_ids))}
+
+    hashtags = _load_hashtags(post_ids + list(all_related_ids))
+    for post_id, view in views.items():
+        view.hashtags = hashtags.get(post_id, [])
+        view.related_posts = [
+            RelatedPostView(related_posts[rid], hashtags.get(rid, []))
+            for rid in related_ids.get(post_id, []) if rid in related_posts
+        ]
+
+    if not viewer.is_anonymous:
+        for post_id, reaction_type in db.session.query(Reaction.post_id, Reaction.reaction_type).filter(
+            Reaction.user_id == viewer.user_id, Reaction.post_id.in_(post_ids)
+        ):
+            views[post_id].viewer_reaction = reaction_type
+        for post_id in db.session.execute(
+            select(Bookmark.post_id).where(Bookmark.user_id == viewer.user_id, Bookmark.post_id.in_(post_ids))
+        ).scalars():
+            views[post_id].is_bookmarked = True
+        for post_id in db.session.execute(
+            select(PostPurchase.post_id).where(PostPurchase.user_id == viewer.user_id, PostPurchase.post_id.in_(post_ids))
+        ).scalars():
+            views[post_id].is_purchased = True
+
+    _prime_identity_map(posts + list(related_posts.values()))
+    return views
+
+
+def load_post_view(post, viewer_user):
+    """Single-post fallback for templates rendered without a preloaded batch."""
+    return load_post_views([post], viewer_user)[post.id]
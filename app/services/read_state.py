@@ -0,0 +1,133 @@
+"""
+Per-conversation read watermarks (ConversationReadState rows).
+
+A participant's place in a conversation is the (timestamp, id) of the newest message
+they have read; every message at or before it, in the keyset order the chat page pages
+by, is read. Marking messages read moves the watermark forward with one UPSERT that
+never moves it back, instead of a MessageReadStatus row per message, and
+"read by this user" and unread counts become comparisons against it.
+
+ChatMessage.read_at (when a recipient first read a message, shown to its sender) is
+still materialized, with one UPDATE over the messages the watermark passed that nobody
+had read yet.
+"""
+from datetime import datetime, timezone
+
+from sqlalchemy import select, update, insert, func, tuple_, and_, or_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+from app.core.models import ChatMessage, ConversationReadState
+
+
+def _utcnow():
+    return datetime.now(timezone.utc)
+
+
+def _message_key():
+    return tuple_(ChatMessage.timestamp, ChatMessage.id)
+
+
+def get_watermarks(conversation_id, user_ids=None):
+    """{user_id: (last_read_timestamp, last_read_message_id, read_at)} for the conversation's readers."""
+    query = select(ConversationReadState.user_id, ConversationReadState.last_read_timestamp,
+                   ConversationReadState.last_read_message_id, ConversationReadState.read_at) \
+        .where(ConversationReadState.conversation_id == conversation_id)
+    if user_ids is not None:
+        query = query.where(ConversationReadState.user_id.in_(user_ids))
+    return {user_id: (timestamp, message_id, read_at)
+            for user_id, timestamp, message_id, read_at in db.session.execute(query)}
+
+
+def _upsert_watermark(connection, row):
+    table = ConversationReadState.__table__
+    dialect_insert = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}.get(connection.dialect.name)
+    if dialect_insert is not None:
+        stmt = dialect_insert(table).values(**row)
+        newer = tuple_(stmt.excluded.last_read_timestamp, stmt.excluded.last_read_message_id) > \
+            tuple_(table.c.last_read_timestamp, table.c.last_read_message_id)
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.conversation_id],
+            set_={'last_read_message_id': stmt.excluded.last_read_message_id,
+                  'last_read_timestamp': stmt.excluded.last_read_timestamp,
+                  'read_at': stmt.excluded.read_at},
+            where=newer
+        ))
+        return
+    result = connection.execute(update(table).where(
+        table.c.user_id == row['user_id'],
+        table.c.conversation_id == row['conversation_id'],
+        tuple_(table.c.last_read_timestamp, table.c.last_read_message_id) <
+        tuple_(row['last_read_timestamp'], row['last_read_message_id'])
+    ).values(last_read_message_id=row['last_read_message_id'], last_read_timestamp=row['last_read_timestamp'],
+             read_at=row['read_at']))
+    if result.rowcount == 0 and connection.execute(select(table.c.user_id).where(
+            table.c.user_id == row['user_id'], table.c.conversation_id == row['conversation_id'])).first() is None:
+        connection.execute(insert(table).values(**row))
+
+
+def mark_read(user_id, conversation_id, message_ids):
+    """
+    Moves `user_id`'s watermark in the conversation up to the newest of `message_ids` (ids
+    from other conversations are ignored) and stamps ChatMessage.read_at on the other
+    participants' messages it passed. Returns None when the watermark did not move, else
+    a dict with the new watermark, the given ids it newly covers that others sent, and
+    the senders of those messages. The caller commits.
+    """
+    rows = db.session.execute(select(ChatMessage.id, ChatMessage.timestamp, ChatMessage.sender_id).where(
+        ChatMessage.id.in_(message_ids), ChatMessage.conversation_id == conversation_id,
+        ChatMessage.timestamp.isnot(None)
+    )).all()
+    if not rows:
+        return None
+    newest = max(rows, key=lambda row: (row.timestamp, row.id))
+    previous = get_watermarks(conversation_id, [user_id]).get(user_id)
+    if previous and (newest.timestamp, newest.id) <= previous[:2]:
+        return None
+
+    now = _utcnow()
+    connection = db.session.connection()
+    _upsert_watermark(connection, {'user_id': user_id, 'conversation_id': conversation_id,
+                                   'last_read_message_id': newest.id, 'last_read_timestamp': newest.timestamp,
+                                   'read_at': now})
+
+    passed = [_message_key() <= tuple_(newest.timestamp, newest.id)]
+    if previous:
+        passed.append(_message_key() > tuple_(*previous[:2]))
+    connection.execute(update(ChatMessage.__table__).where(
+        ChatMessage.conversation_id == conversation_id,
+        ChatMessage.sender_id != user_id,
+        ChatMessage.read_at.is_(None),
+        *passed
+    ).values(read_at=now))
+
+    newly_read = [row for row in rows if row.sender_id != user_id and
+                  (previous is None or (row.timestamp, row.id) > previous[:2])]
+    return {
+        'last_read_message_id': newest.id,
+        'last_read_timestamp': newest.timestamp,
+        'read_at': now,
+        'message_ids': sorted(row.id for row in newly_read),
+        'sender_ids': sorted({row.sender_id for row in newly_read})
+    }
+
+
+def unread_counts(user_id, conversation_ids):
+    """
+    {conversation_id: messages from others after `user_id`'s watermark}, for every
+    conversation in `conversation_ids` (0 when all read), in one grouped query.
+    """
+    if not conversation_ids:
+        return {}
+    state = ConversationReadState
+    rows = db.session.execute(
+        select(ChatMessage.conversation_id, func.count(ChatMessage.id))
+        .outerjoin(state, and_(state.conversation_id == ChatMessage.conversation_id, state.user_id == user_id))
+        .where(ChatMessage.conversation_id.in_(conversation_ids), ChatMessage.sender_id != user_id,
+               or_(state.user_id.is_(None),
+                   _message_key() > tuple_(state.last_read_timestamp, state.last_read_message_id)))
+        .group_by(ChatMessage.conversation_id)
+    ).all()
+    counts = dict.fromkeys(conversation_ids, 0)
+    counts.update(rows)
+    return counts
@@ -0,0 +1,201 @@
+"""
+Collaborative filtering for the recommendation candidates.
+
+The per-user SQL scorers in recommendation_service count overlapping hashtag ids, one
+user at a time. The engine loads the interactions of a whole refresh batch once into
+sparse matrices (app.utils.sparse) and scores every user in the batch together:
+
+  UH  batch users x hashtags  reactions and comments on posts carrying the hashtag
+  PH  candidate posts x hashtags  published posts from the last RECOMMENDATION_POST_WINDOW_DAYS
+  UG  users x groups  memberships
+  GH  groups x hashtags  hashtags of the groups' posts in the same window
+  F   batch users x users  follows
+
+Hashtag columns are weighted by inverse document frequency over the candidate posts (a
+shared #photo says less than a shared #bouldering) and rows are L2-normalised, so:
+
+  post score  = UH . PHᵀ  cosine between the user's interests and the post's hashtags
+  user score  = friend-of-friend count from the follow graph (social_graph)
+              + UG . GU   number of groups shared
+  group score = UG . GG   item-item similarity to the groups the user is in
+                          (GG is the cosine co-membership of two groups)
+              + F . UG    share of the people the user follows who are members
+              + UH . GHᵀ  cosine between the user's interests and the group's hashtags
+
+Posts the user wrote or interacted with, users they follow and groups they are in are
+never returned.
+"""
+import math
+from array import array
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, func, union_all, literal
+
+from app import db
+from app.core.models import Post, Reaction, Comment, GroupMembership, followers, post_hashtags
+from app.services.social_graph import get_social_graph, following_rows, friends_of_friends
+from app.utils.app_config import config_value
+from app.utils.sparse import CSRMatrix, IdIndex, top_n
+
+DEFAULT_POST_WINDOW_DAYS = 90
+# How much one interaction with a tagged post adds to the user's interest in the hashtag
+REACTION_WEIGHT = 1.0
+COMMENT_WEIGHT = 2.0
+# How the three group signals add up
+CO_MEMBERSHIP_WEIGHT = 1.0
+FOLLOWED_MEMBERS_WEIGHT = 1.0
+GROUP_HASHTAGS_WEIGHT = 1.0
+
+
+def _idf(matrix):
+    """Smoothed inverse document frequency of each column of `matrix`."""
+    n_rows = matrix.n_rows
+    return array('d', (math.log((1 + n_rows) / (1 + count)) + 1.0 for count in matrix.column_counts()))
+
+
+def _add(total, vector, weight):
+    for position, value in vector.items():
+        total[position] = total.get(position, 0.0) + weight * value
+    return total
+
+
+class RecommendationEngine:
+    """Interaction matrices for one batch of users; the score_*() methods rank for all of them."""
+
+    def __init__(self, user_ids, now=None):
+        now = now or datetime.utcnow()
+        since = now - timedelta(days=config_value('RECOMMENDATION_POST_WINDOW_DAYS', DEFAULT_POST_WINDOW_DAYS))
+        # Batch users take the first positions, so their rows are 0..len(user_ids) - 1
+        self.users = IdIndex(user_ids)
+        self.batch = range(len(self.users))
+        self.hashtags = IdIndex()
+        self.posts = IdIndex()
+        self.groups = IdIndex()
+        self._load_posts(since)
+        self._load_interests()
+        self._load_groups(since)
+
+    # -------------------- Loading --------------------
+
+    def _load_posts(self, since):
+        rows = db.session.execute(
+            select(Post.id, Post.user_id, post_hashtags.c.hashtag_id)
+            .join(post_hashtags, post_hashtags.c.post_id == Post.id)
+            .where(Post.is_published == True, Post.timestamp >= since)
+            .order_by(Post.timestamp, Post.id)
+        ).all()
+        # Oldest first, so the higher position wins a tie and newer posts rank first
+        triples, self.post_authors = [], {}
+        for post_id, author_id, hashtag_id in rows:
+            position = self.posts.add(post_id)
+            self.post_authors[position] = author_id
+            triples.append((position, self.hashtags.add(hashtag_id), 1.0))
+        post_hashtag = CSRMatrix.from_triples(len(self.posts), len(self.hashtags), triples)
+        self.idf = _idf(post_hashtag)
+        self.post_hashtag = post_hashtag.scale_columns(self.idf).normalize_rows()
+
+    def _load_interests(self):
+        batch_ids = list(self.users.ids)
+        interactions = union_all(
+            select(Reaction.user_id, Reaction.post_id, literal(REACTION_WEIGHT).label('weight'))
+            .where(Reaction.user_id.in_(batch_ids)),
+            select(Comment.user_id, Comment.post_id, literal(COMMENT_WEIGHT).label('weight'))
+            .where(Comment.user_id.in_(batch_ids))
+        ).subquery()
+        self.seen_posts = {row: set() for row in self.batch}
+        for user_id, post_id in db.session.execute(select(interactions.c.user_id, interactions.c.post_id)):
+            position = self.posts.position(post_id)
+            if position is not None:
+                self.seen_posts[self.users.position(user_id)].add(position)
+
+        weight = func.sum(interactions.c.weight)
+        triples = []
+        for user_id, hashtag_id, total in db.session.execute(
+            select(interactions.c.user_id, post_hashtags.c.hashtag_id, weight)
+            .join(post_hashtags, post_hashtags.c.post_id == interactions.c.post_id)
+            .group_by(interactions.c.user_id, post_hashtags.c.hashtag_id)
+        ):
+            # Interests in hashtags no candidate uses cannot score anything
+            column = self.hashtags.position(hashtag_id)
+            if column is not None:
+                triples.append((self.users.position(user_id), column, float(total)))
+        user_hashtag = CSRMatrix.from_triples(len(self.batch), len(self.hashtags), triples)
+        self.user_hashtag = user_hashtag.scale_columns(self.idf).normalize_rows()
+
+    def _load_groups(self, since):
+        memberships = db.session.execute(select(GroupMembership.user_id, GroupMembership.group_id)).all()
+        follows = db.session.execute(
+            select(followers.c.follower_id, followers.c.followed_id)
+            .where(followers.c.follower_id.in_(list(self.users.ids)))
+        ).all()
+        group_tags = db.session.execute(
+            select(Post.group_id, post_hashtags.c.hashtag_id, func.count())
+            .join(post_hashtags, post_hashtags.c.post_id == Post.id)
+            .where(Post.group_id.is_not(None), Post.is_published == True, Post.timestamp >= since)
+            .group_by(Post.group_id, post_hashtags.c.hashtag_id)
+        ).all()
+
+        membership_triples = [(self.users.add(user_id), self.groups.add(group_id), 1.0)
+                              for user_id, group_id in memberships]
+        follow_triples = [(self.users.position(follower_id), self.users.add(followed_id), 1.0)
+                          for follower_id, followed_id in follows]
+        tag_triples = []
+        for group_id, hashtag_id, count in group_tags:
+            column = self.hashtags.position(hashtag_id)
+            if column is not None:
+                tag_triples.append((self.groups.add(group_id), column, float(count)))
+        n_users, n_groups = len(self.users), len(self.groups)
+
+        self.user_group = CSRMatrix.from_triples(n_users, n_groups, membership_triples)
+        self.group_user = group_user = self.user_group.transpose()
+        # Cosine co-membership: |members(a) & members(b)| / sqrt(|members(a)| |members(b)|)
+        inverse_sqrt_sizes = array('d', (1.0 / math.sqrt(size) if size else 0.0 for size in group_user.row_counts()))
+        self.group_similarity = group_user.scale_rows(inverse_sqrt_sizes).dot(
+            self.user_group.scale_columns(inverse_sqrt_sizes))
+        # Each followed member counts 1 / (number of people followed)
+        follows = CSRMatrix.from_triples(len(self.batch), n_users, follow_triples)
+        self.follows = follows.scale_rows(array('d', (1.0 / count if count else 0.0 for count in follows.row_counts())))
+        self.group_hashtag = CSRMatrix.from_triples(
+            n_groups, len(self.hashtags), tag_triples
+        ).scale_columns(self.idf).normalize_rows()
+
+    # -------------------- Scoring --------------------
+
+    def score_posts(self, limit):
+        """{user id: [(post id, score)]} for every user in the batch, best first."""
+        results = {}
+        for row, scores in self.user_hashtag.dot_rows(self.batch, self.post_hashtag.transpose()):
+            user_id = self.users.ids[row]
+            exclude = self.seen_posts[row] | {p for p in scores if self.post_authors[p] == user_id}
+            results[user_id] = [(self.posts.ids[p], score) for p, score in top_n(scores, limit, exclude)]
+        return results
+
+    def score_users(self, limit):
+        """{user id: [(user id, score)]}: mutual follows (from the social graph) plus shared groups."""
+        shared_groups = dict(self.user_group.dot_rows(self.batch, self.group_user))
+        graph = get_social_graph()
+        followed = following_rows([self.users.ids[row] for row in self.batch], graph)
+        results = {}
+        for row in self.batch:
+            user_id = self.users.ids[row]
+            scores = {self.users.ids[u]: count for u, count in shared_groups[row].items()}
+            for candidate, mutual in friends_of_friends(user_id):
+                scores[candidate] = scores.get(candidate, 0.0) + mutual
+            results[user_id] = top_n(scores, limit, set(followed[user_id]) | {user_id})
+        return results
+
+    def score_groups(self, limit):
+        """{user id: [(group id, score)]} for every user in the batch, best first."""
+        co_membership = dict(self.user_group.dot_rows(self.batch, self.group_similarity))
+        followed_members = dict(self.follows.dot_rows(self.batch, self.user_group))
+        hashtags = dict(self.user_hashtag.dot_rows(self.batch, self.group_hashtag.transpose()))
+        results = {}
+        for row in self.batch:
+            scores = _add({}, co_membership[row], CO_MEMBERSHIP_WEIGHT)
+            _add(scores, followed_members[row], FOLLOWED_MEMBERS_WEIGHT)
+            _add(scores, hashtags[row], GROUP_HASHTAGS_WEIGHT)
+            joined = set(self.user_group.row(row)[0])
+            results[self.users.ids[row]] = [
+                (self.groups.ids[g], score) for g, score in top_n(scores, limit, joined)
+            ]
+        return results
@@ -0,0 +1,251 @@
+"""
+Precomputed recommendations.
+
+get_recommendations() used to score posts, users and groups for the viewer on every page
+load: about ten queries, several of them walking the user's reactions, comments and
+posts in Python to build exclusion sets. refresh_recommendations() (run by the
+scheduler) now scores them offline into recommendation_candidate, up to
+RECOMMENDATION_CANDIDATES per kind and user, and stamps recommendation_state. Reads
+take the best candidates that still qualify: published posts the user may see and has
+not written, liked or commented on, users they do not follow and groups they have not
+joined.
+
+The job scores its whole batch at once with the collaborative filtering engine
+(recommendation_engine). The per-user SQL scorers below serve users who have never been
+scored, on their first read; their state is left stale so the next run rescores them
+with the engine.
+
+The job is incremental. Each run refreshes at most RECOMMENDATION_REFRESH_BATCH users:
+first those marked stale (their reactions, comments, follows or group memberships
+changed, see the session hooks below), then those never scored, then those whose
+candidates are older than RECOMMENDATION_MAX_AGE_MINUTES.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, select, insert, delete, update, func, distinct, union, union_all, case, or_
+from sqlalchemy.orm import Session, aliased
+
+from app import db
+from app.core.models import (
+    User, Post, Group, GroupMembership, Reaction, Comment, RecommendationCandidate, RecommendationState,
+    followers, post_hashtags
+)
+from app.services.recommendation_engine import RecommendationEngine
+from app.services.timeline_service import pending_follow_changes
+from app.services.visibility_service import get_viewer, post_visibility_filter
+from app.utils.app_config import config_value
+
+POST, USER, GROUP = 'post', 'user', 'group'
+DEFAULT_CANDIDATES = 50
+DEFAULT_REFRESH_BATCH = 500
+DEFAULT_MAX_AGE_MINUTES = 6 * 60
+
+
+# -------------------- Scoring --------------------
+
+def _followed_ids(user_id):
+    return select(followers.c.followed_id).where(followers.c.follower_id == user_id)
+
+
+def _group_ids(user_id):
+    return select(GroupMembership.group_id).where(GroupMembership.user_id == user_id)
+
+
+def _liked_post_ids(user_id):
+    return select(Reaction.post_id).where(Reaction.user_id == user_id, Reaction.reaction_type == 'like')
+
+
+def _commented_post_ids(user_id):
+    return select(Comment.post_id).where(Comment.user_id == user_id)
+
+
+def score_posts(user_id, limit):
+    """[(post id, score)]: posts sharing the most hashtags with those the user liked or commented on."""
+    interests = union(
+        select(post_hashtags.c.hashtag_id).where(post_hashtags.c.post_id.in_(_liked_post_ids(user_id))),
+        select(post_hashtags.c.hashtag_id).where(post_hashtags.c.post_id.in_(_commented_post_ids(user_id)))
+    ).subquery()
+    score = func.count(distinct(post_hashtags.c.hashtag_id))
+    return db.session.execute(
+        select(Post.id, score)
+        .join(post_hashtags, post_hashtags.c.post_id == Post.id)
+        .where(
+            post_hashtags.c.hashtag_id.in_(select(interests.c.hashtag_id)),
+            Post.user_id != user_id,
+            Post.is_published == True,
+            Post.id.not_in(_liked_post_ids(user_id)),
+            Post.id.not_in(_commented_post_ids(user_id))
+        )
+        .group_by(Post.id, Post.timestamp)
+        .order_by(score.desc(), Post.timestamp.desc())
+        .limit(limit)
+    ).all()
+
+
+def score_users(user_id, limit):
+    """[(user id, score)]: users followed by people the user follows, plus users sharing their groups."""
+    their_follows = aliased(followers)
+    membership = aliased(GroupMembership)
+    mutual = select(
+        their_follows.c.followed_id.label('item_id'), func.count().label('score')
+    ).where(their_follows.c.follower_id.in_(_followed_ids(user_id))).group_by(their_follows.c.followed_id)
+    shared_groups = select(
+        membership.user_id.label('item_id'), func.count(distinct(membership.group_id)).label('score')
+    ).where(membership.group_id.in_(_group_ids(user_id))).group_by(membership.user_id)
+    combined = union_all(mutual, shared_groups).subquery()
+    score = func.sum(combined.c.score)
+    return db.session.execute(
+        select(User.id, score)
+        .join(combined, combined.c.item_id == User.id)
+        .where(User.id != user_id, User.id.not_in(_followed_ids(user_id)))
+        .group_by(User.id, User.username)
+        .order_by(score.desc(), User.username)
+        .limit(limit)
+    ).all()
+
+
+def score_groups(user_id, limit):
+    """[(group id, score)]: groups posting under hashtags the user liked, plus groups the people they follow joined."""
+    liked_hashtags = select(post_hashtags.c.hashtag_id).where(post_hashtags.c.post_id.in_(_liked_post_ids(user_id)))
+    interest = select(
+        Post.group_id.label('item_id'), func.count(distinct(post_hashtags.c.hashtag_id)).label('score')
+    ).join(post_hashtags, post_hashtags.c.post_id == Post.id).where(
+        Post.group_id.is_not(None), post_hashtags.c.hashtag_id.in_(liked_hashtags)
+    ).group_by(Post.group_id)
+    social = select(
+        GroupMembership.group_id.label('item_id'), func.count(distinct(GroupMembership.user_id)).label('score')
+    ).where(GroupMembership.user_id.in_(_followed_ids(user_id))).group_by(GroupMembership.group_id)
+    combined = union_all(interest, social).subquery()
+    score = func.sum(combined.c.score)
+    return db.session.execute(
+        select(Group.id, score)
+        .join(combined, combined.c.item_id == Group.id)
+        .where(Group.id.not_in(_group_ids(user_id)))
+        .group_by(Group.id, Group.name)
+        .order_by(score.desc(), Group.name)
+        .limit(limit)
+    ).all()
+
+
+SCORERS = {POST: score_posts, USER: score_users, GROUP: score_groups}
+
+
+# -------------------- Precomputation --------------------
+
+def refresh_user_recommendations(user_id, now=None, scored=None, stale=False):
+    """
+    Rescores `user_id`'s candidates of every kind and stamps their state (in the caller's transaction).
+    `scored` maps kinds to [(item id, score)] already computed by the engine; other kinds are scored in SQL.
+    """
+    now = now or datetime.utcnow()
+    limit = config_value('RECOMMENDATION_CANDIDATES', DEFAULT_CANDIDATES)
+    scored = scored or {}
+    rows = [
+        {'user_id': user_id, 'kind': kind, 'item_id': item_id, 'score': float(score)}
+        for kind, scorer in SCORERS.items()
+        for item_id, score in (scored[kind] if kind in scored else scorer(user_id, limit))
+    ]
+    connection = db.session.connection()
+    connection.execute(delete(RecommendationCandidate.__table__).where(RecommendationCandidate.user_id == user_id))
+    if rows:
+        connection.execute(insert(RecommendationCandidate.__table__), rows)
+    connection.execute(delete(RecommendationState.__table__).where(RecommendationState.user_id == user_id))
+    connection.execute(insert(RecommendationState.__table__).values(user_id=user_id, computed_at=now, is_stale=stale))
+    return len(rows)
+
+
+def users_due_for_refresh(now, limit):
+    """Up to `limit` user ids whose candidates are stale, missing or too old, most urgent first."""
+    max_age = timedelta(minutes=config_value('RECOMMENDATION_MAX_AGE_MINUTES', DEFAULT_MAX_AGE_MINUTES))
+    state = RecommendationState
+    urgency = case((state.is_stale == True, 0), (state.user_id.is_(None), 1), else_=2)
+    return db.session.execute(
+        select(User.id)
+        .outerjoin(state, state.user_id == User.id)
+        .where(or_(state.user_id.is_(None), state.is_stale == True, state.computed_at < now - max_age))
+        .order_by(urgency, state.computed_at, User.id)
+        .limit(limit)
+    ).scalars().all()
+
+
+def refresh_recommendations(now=None, limit=None):
+    """Refreshes the candidates of the users most in need of it. Returns the number of users refreshed."""
+    now = now or datetime.utcnow()
+    user_ids = users_due_for_refresh(now, limit or config_value('RECOMMENDATION_REFRESH_BATCH', DEFAULT_REFRESH_BATCH))
+    if user_ids:
+        engine = RecommendationEngine(user_ids, now)
+        candidates = config_value('RECOMMENDATION_CANDIDATES', DEFAULT_CANDIDATES)
+        scored = {POST: engine.score_posts(candidates), USER: engine.score_users(candidates),
+                  GROUP: engine.score_groups(candidates)}
+        for user_id in user_ids:
+            refresh_user_recommendations(user_id, now, {kind: scores[user_id] for kind, scores in scored.items()})
+    db.session.commit()
+    return len(user_ids)
+
+
+# -------------------- Read path --------------------
+
+def _candidates(user_id, kind, model, tie_break, *filters, limit):
+    candidate = RecommendationCandidate
+    return model.query.join(candidate, candidate.item_id == model.id).filter(
+        candidate.user_id == user_id, candidate.kind == kind, *filters
+    ).order_by(candidate.score.desc(), tie_break).limit(limit).all()
+
+
+def get_recommendations(user_id, limit_posts=5, limit_users=5, limit_groups=5):
+    """{'posts': [Post], 'users': [User], 'groups': [Group]} recommended to `user_id`, best first."""
+    user = db.session.get(User, user_id)
+    if not user:
+        return {'posts': [], 'users': [], 'groups': []}
+    if db.session.get(RecommendationState, user_id) is None:
+        refresh_user_recommendations(user_id, stale=True)
+        db.session.commit()
+
+    viewer = get_viewer(user)
+    return {
+        'posts': _candidates(
+            user_id, POST, Post, Post.timestamp.desc(),
+            Post.is_published == True, Post.user_id != user_id, post_visibility_filter(viewer),
+            Post.id.not_in(_liked_post_ids(user_id)), Post.id.not_in(_commented_post_ids(user_id)),
+            limit=limit_posts
+        ),
+        'users': _candidates(
+            user_id, USER, User, User.username, User.id.not_in(_followed_ids(user_id)), limit=limit_users
+        ),
+        'groups': _candidates(
+            user_id, GROUP, Group, Group.name, Group.id.not_in(_group_ids(user_id)), limit=limit_groups
+        ),
+    }
+
+
+# -------------------- Staleness --------------------
+
+def _mark_stale(session, users):
+    session.info.setdefault('recommendations_stale', []).extend(users)
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_follow_changes(session, flush_context, instances):
+    # Follow history lives on dynamic relationships and is gone after the flush
+    _mark_stale(session, [follower for follower, _, _ in pending_follow_changes(session)])
+
+
+@event.listens_for(Session, 'after_flush')
+def _mark_recommendations_stale(session, flush_context):
+    user_ids = {user.id for user in session.info.pop('recommendations_stale', ())}
+    user_ids.update(
+        obj.user_id for obj in session.new | session.deleted
+        if isinstance(obj, (Reaction, Comment, GroupMembership))
+    )
+    user_ids.discard(None)
+    if user_ids:
+        session.connection().execute(
+            update(RecommendationState.__table__)
+            .where(RecommendationState.user_id.in_(user_ids), RecommendationState.is_stale == False)
+            .values(is_stale=True)
+        )
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_stale_users(session):
+    session.info.pop('recommendations_stale', None)
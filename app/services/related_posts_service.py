@@ -0,0 +1,183 @@
+"""
+Precomputed related posts.
+
+A post's related posts are the published posts sharing the most hashtags with it, the
+newest first among equals. Computing them while rendering meant a grouped self-join of
+post_hashtags for every page of post cards, so they are kept in the related_post table
+instead: up to RELATED_POSTS_INDEX_SIZE rows per post, read with one primary-key range
+lookup per page.
+
+Keeping it current:
+  * when a post's hashtags change or it is published, its own list is recomputed in the
+    same transaction (session hooks below). Its rows in other posts' lists are dropped
+    and it is offered to the lists of the posts in its new list: the relation is
+    symmetric, so those are the posts it is most related to. Deleted posts are dropped.
+  * rebuild_related_posts() recomputes every list in batches. The scheduler runs it
+    nightly, which also restores a post to longer-tail lists it was dropped from.
+
+Lists are longer than the few related posts a card shows because the viewer may not be
+allowed to see all of them.
+"""
+from collections import defaultdict
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, select, insert, delete, func, or_, bindparam
+from sqlalchemy.orm import Session, aliased, attributes
+
+from app import db
+from app.core.models import Post, RelatedPost, post_hashtags
+from app.services.visibility_service import post_visibility_filter
+
+DEFAULT_INDEX_SIZE = 20
+REBUILD_BATCH_SIZE = 500
+
+
+def _index_size():
+    if has_app_context():
+        return current_app.config.get('RELATED_POSTS_INDEX_SIZE', DEFAULT_INDEX_SIZE)
+    return DEFAULT_INDEX_SIZE
+
+
+def ranked_related_posts(post_ids, size):
+    """Select of (post_id, related_post_id, score): the top `size` published posts sharing hashtags with each of `post_ids`."""
+    source = aliased(post_hashtags)
+    candidate = aliased(post_hashtags)
+    shared = func.count(candidate.c.hashtag_id)
+    ranked = select(
+        source.c.post_id.label('post_id'),
+        candidate.c.post_id.label('related_post_id'),
+        shared.label('score'),
+        func.row_number().over(
+            partition_by=source.c.post_id, order_by=(shared.desc(), candidate.c.post_id.desc())
+        ).label('rank')
+    ).join(
+        candidate, candidate.c.hashtag_id == source.c.hashtag_id
+    ).join(
+        Post, Post.id == candidate.c.post_id
+    ).where(
+        source.c.post_id.in_(post_ids),
+        candidate.c.post_id != source.c.post_id,
+        Post.is_published == True
+    ).group_by(source.c.post_id, candidate.c.post_id).subquery()
+    return select(ranked.c.post_id, ranked.c.related_post_id, ranked.c.score).where(ranked.c.rank <= size)
+
+
+def _trim(connection, post_ids, size):
+    """Deletes the rows of `post_ids` ranked below the top `size` of their list."""
+    table = RelatedPost.__table__
+    ranked = select(
+        table.c.post_id, table.c.related_post_id,
+        func.row_number().over(
+            partition_by=table.c.post_id, order_by=(table.c.score.desc(), table.c.related_post_id.desc())
+        ).label('rank')
+    ).where(table.c.post_id.in_(post_ids)).subquery()
+    excess = connection.execute(
+        select(ranked.c.post_id, ranked.c.related_post_id).where(ranked.c.rank > size)
+    ).all()
+    if excess:
+        connection.execute(
+            delete(table).where(
+                table.c.post_id == bindparam('_post_id'), table.c.related_post_id == bindparam('_related_post_id')
+            ),
+            [{'_post_id': post_id, '_related_post_id': related_id} for post_id, related_id in excess]
+        )
+
+
+def refresh_related_posts(connection, post_ids, size=None):
+    """
+    Recomputes the lists of `post_ids` and offers each published one to the lists of the
+    posts it is now related to, on `connection` (inside the caller's transaction).
+    """
+    size = size or _index_size()
+    post_ids = set(post_ids)
+    table = RelatedPost.__table__
+    connection.execute(delete(table).where(or_(table.c.post_id.in_(post_ids), table.c.related_post_id.in_(post_ids))))
+    rows = connection.execute(ranked_related_posts(post_ids, size)).all()
+    if not rows:
+        return
+    connection.execute(insert(table), [
+        {'post_id': post_id, 'related_post_id': related_id, 'score': score} for post_id, related_id, score in rows
+    ])
+
+    published = set(connection.execute(
+        select(Post.id).where(Post.id.in_(post_ids), Post.is_published == True)
+    ).scalars())
+    # Lists of refreshed posts were computed above and already include each other
+    offered = [
+        {'post_id': related_id, 'related_post_id': post_id, 'score': score}
+        for post_id, related_id, score in rows if post_id in published and related_id not in post_ids
+    ]
+    if offered:
+        connection.execute(insert(table), offered)
+        _trim(connection, {row['post_id'] for row in offered}, size)
+
+
+def remove_related_posts(connection, post_ids):
+    table = RelatedPost.__table__
+    connection.execute(delete(table).where(or_(table.c.post_id.in_(post_ids), table.c.related_post_id.in_(post_ids))))
+
+
+def rebuild_related_posts(batch_size=REBUILD_BATCH_SIZE):
+    """Recomputes every post's list, `batch_size` source posts per query. Returns the number of rows written."""
+    size = _index_size()
+    table = RelatedPost.__table__
+    connection = db.session.connection()
+    connection.execute(delete(table))
+    written = 0
+    last_id = 0
+    while True:
+        post_ids = db.session.execute(
+            select(Post.id).where(Post.id > last_id).order_by(Post.id).limit(batch_size)
+        ).scalars().all()
+        if not post_ids:
+            break
+        rows = connection.execute(ranked_related_posts(post_ids, size)).all()
+        if rows:
+            connection.execute(insert(table), [
+                {'post_id': post_id, 'related_post_id': related_id, 'score': score} for post_id, related_id, score in rows
+            ])
+        written += len(rows)
+        last_id = post_ids[-1]
+    db.session.commit()
+    return written
+
+
+def get_related_post_ids(post_ids, viewer=None, limit=5):
+    """
+    {post_id: [related post ids]} for `post_ids`, best first and at most `limit` each, from
+    the precomputed lists. With a `viewer` (see visibility_service.get_viewer) only posts
+    they may see are returned.
+    """
+    stmt = select(RelatedPost.post_id, RelatedPost.related_post_id).join(
+        Post, Post.id == RelatedPost.related_post_id
+    ).where(
+        RelatedPost.post_id.in_(post_ids), Post.is_published == True
+    ).order_by(RelatedPost.post_id, RelatedPost.score.desc(), RelatedPost.related_post_id.desc())
+    if viewer is not None:
+        stmt = stmt.where(post_visibility_filter(viewer))
+    related = defaultdict(list)
+    for post_id, related_id in db.session.execute(stmt):
+        if len(related[post_id]) < limit:
+            related[post_id].append(related_id)
+    return related
+
+
+# -------------------- Session hooks --------------------
+
+@event.listens_for(Session, 'after_flush')
+def _refresh_related_posts_after_flush(session, flush_context):
+    changed = set()
+    for obj in session.new | session.dirty:
+        if isinstance(obj, Post) and obj not in session.deleted:
+            state = attributes.instance_state(obj)
+            if state.attrs.hashtags.history.has_changes() or \
+                    (obj not in session.new and state.attrs.is_published.history.has_changes()):
+                changed.add(obj.id)
+    removed = {obj.id for obj in session.deleted if isinstance(obj, Post)}
+    if not (changed or removed):
+        return
+    connection = session.connection()
+    if removed:
+        remove_related_posts(connection, removed)
+    if changed:
+        refresh_related_posts(connection, changed)
@@ -0,0 +1,263 @@
+"""
+Full-text search over posts, users, groups and hashtags.
+
+search() used to filter every category with ilike('%term%'), which scans the whole
+table on every query. Searches now go through a SearchBackend:
+
+    fts5  SQLite FTS5 inverted indexes (one virtual table per kind, rowid = entity id),
+          ranked by bm25. The default on SQLite.
+    like  the old substring match on the source columns, with no index to maintain.
+          The default on other databases until a native backend is registered.
+
+The SEARCH_BACKEND config key picks one ('auto' by default); other backends can be
+added with register_search_backend(). Indexes are kept current by session hooks on
+insert, edit and delete, so every write path updates them in the same transaction.
+
+Queries are tokenized and each word is matched as a prefix ("pyth" finds "python").
+match() returns a selectable of (id, rank) that callers join to the model, so privacy
+filters, sorting and pagination all stay in SQL.
+"""
+import re
+from abc import ABC, abstractmethod
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, select, literal, literal_column, or_, table, column, text
+from sqlalchemy.orm import Session, attributes
+
+from app import db
+from app.core.models import Post, User, Group, Hashtag
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class SearchIndex:
+    """A searchable kind: its source model, the indexed text columns and the index table name."""
+    def __init__(self, table_name, model, fields):
+        self.table_name = table_name
+        self.model = model
+        self.fields = fields
+
+    def __repr__(self):
+        return f'<SearchIndex {self.table_name}>'
+
+
+SEARCH_INDEXES = {
+    'posts': SearchIndex('post_search', Post, ('body',)),
+    'users': SearchIndex('user_search', User, ('username', 'email')),
+    'groups': SearchIndex('group_search', Group, ('name', 'description')),
+    'hashtags': SearchIndex('hashtag_search', Hashtag, ('tag_text',)),
+}
+
+
+def tokenize(term):
+    """Lower-cased word tokens of a user-entered search term."""
+    return _TOKEN_RE.findall((term or '').lower())
+
+
+class SearchBackend(ABC):
+    """
+    Interface for search backends. `index` and `remove` are called from the flush hooks
+    with the flush's connection; `match` builds the query side. A backend missing any of
+    the abstract methods cannot be instantiated, rather than failing inside a flush.
+    """
+    maintains_index = True
+
+    def create_indexes(self, connection):
+        pass
+
+    def drop_indexes(self, connection):
+        pass
+
+    @abstractmethod
+    def index(self, connection, kind, rows):
+        """(Re)indexes `rows`, a list of (entity_id, {field: text}) for `kind`."""
+
+    @abstractmethod
+    def remove(self, connection, kind, entity_ids):
+        """Drops `entity_ids` of `kind` from the index."""
+
+    @abstractmethod
+    def rebuild(self, connection, kind=None):
+        """Repopulates the index for `kind` (or every kind) from the source tables."""
+
+    @abstractmethod
+    def match(self, kind, term):
+        """
+        Selectable of (id, rank) for the `kind` entities matching `term`, lower rank
+        meaning more relevant. None when `term` has nothing searchable in it.
+        """
+
+
+class LikeSearchBackend(SearchBackend):
+    """Substring matching on the source columns. Needs no index but scans the table."""
+    maintains_index = False
+
+    def index(self, connection, kind, rows):
+        pass
+
+    def remove(self, connection, kind, entity_ids):
+        pass
+
+    def rebuild(self, connection, kind=None):
+        pass
+
+    def match(self, kind, term):
+        term = (term or '').strip()
+        if not term:
+            return None
+        spec = SEARCH_INDEXES[kind]
+        model = spec.model
+        return select(model.id.label('id'), literal(0).label('rank')).where(
+            or_(*[getattr(model, field).ilike(f'%{term}%') for field in spec.fields])
+        ).subquery(f'{spec.table_name}_hits')
+
+
+class FTS5SearchBackend(SearchBackend):
+    """SQLite FTS5 indexes, one per kind, keyed on rowid = entity id and ranked by bm25."""
+
+    def _table(self, kind):
+        spec = SEARCH_INDEXES[kind]
+        return table(spec.table_name, column('rowid'), *[column(field) for field in spec.fields])
+
+    def create_indexes(self, connection):
+        for spec in SEARCH_INDEXES.values():
+            connection.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {spec.table_name} "
+                f"USING fts5({', '.join(spec.fields)}, tokenize='unicode61')"
+            ))
+
+    def drop_indexes(self, connection):
+        for spec in SEARCH_INDEXES.values():
+            connection.execute(text(f'DROP TABLE IF EXISTS {spec.table_name}'))
+
+    def index(self, connection, kind, rows):
+        if not rows:
+            return
+        self.remove(connection, kind, [entity_id for entity_id, _ in rows])
+        fields = SEARCH_INDEXES[kind].fields
+        connection.execute(self._table(kind).insert(), [
+            dict({'rowid': entity_id}, **{field: values.get(field) or '' for field in fields})
+            for entity_id, values in rows
+        ])
+
+    def remove(self, connection, kind, entity_ids):
+        if entity_ids:
+            index_table = self._table(kind)
+            connection.execute(index_table.delete().where(index_table.c.rowid.in_(list(entity_ids))))
+
+    def rebuild(self, connection, kind=None):
+        for name in ([kind] if kind else SEARCH_INDEXES):
+            spec = SEARCH_INDEXES[name]
+            model = spec.model
+            connection.execute(text(f'DELETE FROM {spec.table_name}'))
+            connection.execute(self._table(name).insert().from_select(
+                ['rowid'] + list(spec.fields),
+                select(model.id, *[db.func.coalesce(getattr(model, field), '') for field in spec.fields])
+            ))
+
+    def match(self, kind, term):
+        tokens = tokenize(term)
+        if not tokens:
+            return None
+        # Every token must match, each as a quoted prefix so FTS5 syntax in user input is inert
+        fts_query = ' '.join(f'"{token}"*' for token in tokens)
+        spec = SEARCH_INDEXES[kind]
+        index_table = literal_column(spec.table_name)
+        return select(
+            literal_column('rowid').label('id'),
+            literal_column(f'bm25({spec.table_name})').label('rank')
+        ).select_from(text(spec.table_name)).where(
+            index_table.op('MATCH')(fts_query)
+        ).subquery(f'{spec.table_name}_hits')
+
+
+SEARCH_BACKENDS = {
+    'fts5': FTS5SearchBackend(),
+    'like': LikeSearchBackend(),
+}
+
+
+def register_search_backend(name, backend):
+    """Makes `backend` (a SearchBackend instance) selectable with SEARCH_BACKEND = `name`."""
+    if not isinstance(backend, SearchBackend):
+        raise TypeError(f'{backend!r} is not a SearchBackend')
+    SEARCH_BACKENDS[name] = backend
+
+
+def get_search_backend(dialect_name=None):
+    name = current_app.config.get('SEARCH_BACKEND', 'auto') if has_app_context() else 'auto'
+    if name == 'auto':
+        dialect_name = dialect_name or db.engine.dialect.name
+        name = 'fts5' if dialect_name == 'sqlite' else 'like'
+    return SEARCH_BACKENDS[name]
+
+
+def search_query(kind, term):
+    """
+    Returns (query, rank) where `query` is a Model query limited to the entities of `kind`
+    matching `term` and `rank` the relevance column to order by (ascending), or
+    (None, None) if `term` has nothing searchable in it.
+    """
+    hits = get_search_backend().match(kind, term)
+    if hits is None:
+        return None, None
+    model = SEARCH_INDEXES[kind].model
+    return model.query.join(hits, hits.c.id == model.id), hits.c.rank
+
+
+def page_of(query, page, per_page):
+    """Returns (items, has_next) for 1-based `page`, reading one row past the page instead of counting."""
+    rows = query.limit(per_page + 1).offset((page - 1) * per_page).all()
+    return rows[:per_page], len(rows) > per_page
+
+
+def index_search_rows(connection, kind, rows):
+    """
+    Indexes rows written with Core statements, which the session hooks do not see.
+    `rows` is a list of (entity_id, {field: text}); re-indexing an entity replaces it.
+    """
+    backend = get_search_backend(connection.dialect.name)
+    if backend.maintains_index:
+        backend.index(connection, kind, rows)
+
+
+def rebuild_search_index(kind=None):
+    get_search_backend().rebuild(db.session.connection(), kind)
+    db.session.commit()
+
+
+# -------------------- Index maintenance --------------------
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_search_indexes(target, connection, **kw):
+    get_search_backend(connection.dialect.name).create_indexes(connection)
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def _drop_search_indexes(target, connection, **kw):
+    get_search_backend(connection.dialect.name).drop_indexes(connection)
+
+
+def _text_changed(obj, fields):
+    state = attributes.instance_state(obj)
+    return any(state.attrs[field].history.has_changes() for field in fields)
+
+
+@event.listens_for(Session, 'after_flush')
+def _update_search_indexes(session, flush_context):
+    backend = get_search_backend(session.get_bind().dialect.name)
+    if not backend.maintains_index:
+        return
+    connection = None
+    for kind, spec in SEARCH_INDEXES.items():
+        changed = [obj for obj in session.new if isinstance(obj, spec.model)]
+        changed += [obj for obj in session.dirty
+                    if isinstance(obj, spec.model) and obj not in session.deleted and _text_changed(obj, spec.fields)]
+        removed = [obj.id for obj in session.deleted if isinstance(obj, spec.model)]
+        if not (changed or removed):
+            continue
+        connection = connection or session.connection()
+        backend.remove(connection, kind, removed)
+        backend.index(connection, kind, [
+            (obj.id, {field: getattr(obj, field) for field in spec.fields}) for obj in changed
+        ])
@@ -0,0 +1,175 @@
+"""
+Outbox handlers for the side effects of posting, commenting, reacting and chatting.
+
+The request or socket handler commits the write together with an outbox event (see
+app/services/outbox.py); these functions then award the points, advance the quests and
+send the notifications off the request path. Each runs in one transaction that commits
+only if the whole handler succeeds. Payloads carry ids rather than objects, plus any URL
+the notifications need, since workers have no request to build URLs from. The row may be
+gone or changed by the time a handler runs (a reaction toggled off, a post hidden by a
+moderator), so handlers re-check it and do nothing if there is nothing left to do.
+"""
+from app import db
+from app.core.models import User, Post, Reaction, Comment, ChatMessage, Conversation, Mention, Notification
+from app.services.notification_fanout import fan_out_group_notification
+from app.services.notification_service import notify
+from app.services.outbox import outbox_handler, enqueue
+from app.utils.helpers import award_points
+from app.utils.quest_utils import update_quest_progress
+
+POST_PUBLISHED = 'post_published'
+COMMENT_ADDED = 'comment_added'
+REACTION_ADDED = 'reaction_added'
+CHAT_MESSAGE_SENT = 'chat_message_sent'
+LIKE_MILESTONE_REACHED = 'like_milestone_reached'
+
+LIKE_MILESTONES = [10, 50, 100, 250, 500, 1000]
+
+
+def _preview(text, length=50):
+    return text[:length] + "..." if len(text) > length else text
+
+
+def _notify_mentions(mentions, actor, message, url, **fields):
+    """Notifies each user @mentioned in `mentions` (but the actor) once."""
+    notified = set()
+    for mention in mentions:
+        if mention.user_id == actor.id or mention.user_id in notified:
+            continue
+        notified.add(mention.user_id)
+        notify(mention.user_id, actor.id, 'mention', related_post_id=fields['post_id'], related_mention_id=mention.id,
+               payload=dict(fields, type='mention', message=message, actor_username=actor.username,
+                            tagged_username=mention.user.username, url=url))
+
+
+@outbox_handler(POST_PUBLISHED)
+def post_published(payload):
+    """Points, quest progress, @mention and group notifications for a published post."""
+    post = db.session.get(Post, payload['post_id'])
+    if post is None or not post.is_published or post.is_hidden_by_moderation:
+        return
+    author = post.author
+    with_media = payload.get('with_media', False)
+    award_points(author, 'create_post', 15 if with_media else 10, related_item=post)
+    update_quest_progress(author, 'create_post', related_item=post)
+    if with_media:
+        update_quest_progress(author, 'create_post_with_media', related_item=post)
+    update_quest_progress(author, 'general_engagement_weekly', related_item=post)
+
+    mentions = post.mentions.filter_by(actor_id=author.id).order_by(Mention.timestamp.desc()).all()
+    _notify_mentions(mentions, author, f"{author.username} mentioned you in a post.", payload['url'],
+                     post_id=post.id, post_body_preview=_preview(post.body), owner_username=author.username)
+
+    if post.group is not None:
+        # Already off the request path: fan out here, in this event's transaction
+        fan_out_group_notification(post.group.id, author.id, 'new_group_post', related_post_id=post.id, payload={
+            'type': 'new_group_post', 'message': f"{author.username} posted in {post.group.name}.",
+            'actor_username': author.username, 'post_id': post.id,
+            'group_id': post.group.id, 'group_name': post.group.name
+        })
+
+
+@outbox_handler(COMMENT_ADDED)
+def comment_added(payload):
+    """Points and quest progress for a comment, and notifications for its @mentions and the post's author."""
+    comment = db.session.get(Comment, payload['comment_id'])
+    if comment is None or comment.is_hidden_by_moderation:
+        return
+    author, post = comment.author, comment.commented_post
+    award_points(author, 'create_comment', 5, related_item=comment)
+    if post.author.id != author.id:
+        award_points(post.author, 'receive_comment', 3, related_item=comment)
+    update_quest_progress(author, 'create_comment', related_item=comment)
+    update_quest_progress(author, 'general_engagement_weekly', related_item=comment)
+
+    mentions = comment.mentions.filter_by(actor_id=author.id).order_by(Mention.timestamp.desc()).all()
+    _notify_mentions(mentions, author, f"{author.username} mentioned you in a comment.", payload['url'],
+                     post_id=post.id, comment_id=comment.id, comment_body_preview=_preview(comment.body),
+                     owner_username=author.username, post_author_username=post.author.username)
+
+    if post.author.id != author.id:
+        notify(post.author.id, author.id, 'comment', related_post_id=post.id, payload={
+            'message': f'{author.username} commented on your post.',
+            'type': 'comment',
+            'actor_username': author.username,
+            'post_id': post.id,
+            'post_author_username': post.author.username,
+            'comment_body': _preview(comment.body)
+        })
+
+
+@outbox_handler(REACTION_ADDED)
+def reaction_added(payload):
+    """Points and a notification for the author of a reacted-to post."""
+    reaction = db.session.get(Reaction, payload['reaction_id'])
+    if reaction is None: # Toggled off again before the event was applied
+        return
+    post, actor = reaction.post, reaction.user
+    reaction_type = payload['reaction_type']
+    if post.author.id == actor.id:
+        return
+    # More points for reactions other than likes
+    award_points(post.author, f'receive_{reaction_type}_reaction', 2 if reaction_type == 'like' else 3, related_item=post)
+    # Coalesced into the author's unread reaction notification for this post, if any
+    notify(post.author.id, actor.id, f'reaction_{reaction_type}', related_post_id=post.id, payload={
+        'message': f'{actor.username} reacted with "{reaction_type}" to your post.',
+        'type': f'reaction_{reaction_type}',
+        'reaction_type': reaction_type,
+        'actor_username': actor.username,
+        'post_id': post.id,
+        'post_author_username': post.author.username
+    })
+
+
+def like_milestone_event(post, actor_id, like_count):
+    """
+    Enqueues the milestone notification if the post's like count, as counted in the
+    current transaction, is a milestone. Called by the write that added the like: counts
+    read when events are applied can skip a milestone or see it twice. The idempotency key
+    makes it once per post, even if the count drops below the milestone and reaches it again.
+    """
+    if like_count in LIKE_MILESTONES:
+        enqueue(LIKE_MILESTONE_REACHED, {'post_id': post.id, 'actor_id': actor_id, 'milestone': like_count},
+                f'{LIKE_MILESTONE_REACHED}:{post.id}:{like_count}')
+
+
+@outbox_handler(LIKE_MILESTONE_REACHED)
+def like_milestone_reached(payload):
+    """Notifies a post's author that it reached a like milestone."""
+    post = db.session.get(Post, payload['post_id'])
+    actor = db.session.get(User, payload['actor_id'])
+    if post is None or actor is None:
+        return
+    like_count = payload['milestone']
+    milestone_type = f'like_milestone_{like_count}'
+    # Milestones notified before they were outbox events have no idempotency key
+    if Notification.query.filter_by(recipient_id=post.author.id, related_post_id=post.id, type=milestone_type).first():
+        return
+    notify(post.author.id, actor.id, milestone_type, related_post_id=post.id, payload={
+        'message': f"Your post '{_preview(post.body, 30)}' reached {like_count} likes!",
+        'type': milestone_type,
+        'actor_username': actor.username, # The user whose 'like' caused the milestone
+        'post_id': post.id,
+        'post_author_username': post.author.username,
+        'milestone_count': like_count
+    })
+
+
+@outbox_handler(CHAT_MESSAGE_SENT)
+def chat_message_sent(payload):
+    """Notifies the other participants of a conversation of a new message."""
+    message = db.session.get(ChatMessage, payload['message_id'])
+    if message is None:
+        return
+    conversation = db.session.get(Conversation, message.conversation_id)
+    sender = db.session.get(User, message.sender_id)
+    # One unread notification per conversation: new messages update it in place
+    for participant in conversation.participants:
+        if participant.id != sender.id:
+            notify(participant.id, sender.id, 'new_chat_message', related_conversation_id=conversation.id, payload={
+                'message': f'{sender.username} sent you a new chat message.',
+                'type': 'new_chat_message',
+                'actor_username': sender.username,
+                'sender_id': sender.id,
+                'conversation_id': conversation.id
+            })
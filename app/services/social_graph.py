@@ -0,0 +1,396 @@
+"""
+In-memory follow graph, shared read-only between workers through a memory-mapped snapshot.
+
+Friend-of-friend suggestions grouped the followers table per user, and follower counts
+ran a COUNT per profile card. The graph keeps the followers table as CSR adjacency in
+both directions, over sorted user ids:
+
+  ids          int32[n]      every user with at least one follow edge, ascending
+  out_indptr   int64[n + 1]  ids[i] follows out_indices[out_indptr[i]:out_indptr[i + 1]] (ascending)
+  out_indices  int32[m]
+  in_indptr    int64[n + 1]  ids[i] is followed by in_indices[in_indptr[i]:in_indptr[i + 1]] (ascending)
+  in_indices   int32[m]
+
+so follower counts are an indptr difference and friend-of-friend scoring walks
+O(sum of degrees) ids.
+
+refresh_social_graph() (run by the scheduler) rebuilds the graph and writes it to
+SOCIAL_GRAPH_SNAPSHOT_PATH; workers mmap the file (re-checked at most every
+SOCIAL_GRAPH_RELOAD_SECONDS), so every process reads the same pages from the OS page
+cache instead of holding its own copy. Without a path each worker builds its own and
+rebuilds it every SOCIAL_GRAPH_RELOAD_SECONDS.
+
+The graph may lag other workers' follows by up to a snapshot, which only suggestions and
+counts can tolerate. is_following() decides access to followers-only content and whether
+User.follow() inserts an edge, so it reads the database: the request's Viewer (see
+visibility_service), loaded once per request, or a single-row lookup outside a request.
+
+Keeping it current between snapshots:
+  * a follow or unfollow bumps the follower's feed generation in the app cache (see
+    timeline_service); a user whose generation is newer than the snapshot has their
+    followed ids read through get_cached_followed_ids() instead of the snapshot row;
+  * follower and following counts are patched with the changes this worker committed
+    since the snapshot was built (session hooks below); other workers' changes show up
+    with the next snapshot;
+  * is_following() also sees follow changes still pending in the current session, and a
+    commit drops the request's memoized Viewers of the users whose follows changed.
+"""
+import heapq
+import mmap
+import os
+import struct
+import time
+from array import array
+from bisect import bisect_left
+
+from flask import current_app, has_app_context, has_request_context
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from app import db
+from app.core.models import followers
+from app.services.timeline_service import pending_follow_changes
+from app.services.visibility_service import forget_viewer, get_viewer
+from app.utils.feed_cache import get_cached_followed_ids, get_feed_generations
+
+SNAPSHOT_MAGIC = b'SOCGRAPH'
+SNAPSHOT_VERSION = 1
+# magic, version, (reserved), nodes, edges, built_at
+_HEADER = struct.Struct('=8sIIQQd')
+_ALIGNMENT = 8
+
+
+def _layout(n_nodes, n_edges):
+    """(name, typecode, offset, length) of each section, each aligned to 8 bytes after the header."""
+    sections = []
+    offset = _HEADER.size
+    for name, typecode, length in (('ids', 'i', n_nodes), ('out_indptr', 'q', n_nodes + 1),
+                                   ('out_indices', 'i', n_edges), ('in_indptr', 'q', n_nodes + 1),
+                                   ('in_indices', 'i', n_edges)):
+        offset += -offset % _ALIGNMENT
+        sections.append((name, typecode, offset, length))
+        offset += length * array(typecode).itemsize
+    return sections, offset
+
+
+def _adjacency(ids, edges):
+    """(indptr, indices) for (source, target) `edges` sorted by source then target."""
+    indptr, indices = array('q', [0]), array('i')
+    edge_iter = iter(edges)
+    edge = next(edge_iter, None)
+    for node in ids:
+        while edge is not None and edge[0] == node:
+            indices.append(edge[1])
+            edge = next(edge_iter, None)
+        indptr.append(len(indices))
+    return indptr, indices
+
+
+class SocialGraph:
+    """Read-only follow graph over a snapshot buffer (bytes or a memory map)."""
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        view = memoryview(buffer)
+        magic, version, _, n_nodes, n_edges, self.built_at = _HEADER.unpack_from(view)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f'Unsupported social graph snapshot: {magic!r} version {version}')
+        sections, size = _layout(n_nodes, n_edges)
+        if len(view) < size:
+            raise ValueError(f'Truncated social graph snapshot: {len(view)} of {size} bytes')
+        for name, typecode, offset, length in sections:
+            itemsize = array(typecode).itemsize
+            setattr(self, name, view[offset:offset + length * itemsize].cast(typecode))
+        self.edge_count = n_edges
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def built_at_ns(self):
+        return int(self.built_at * 1_000_000_000)
+
+    @classmethod
+    def build(cls, edges, built_at=None):
+        """Builds a graph from (follower id, followed id) pairs."""
+        out_edges = sorted({(follower, followed) for follower, followed in edges})
+        in_edges = sorted((followed, follower) for follower, followed in out_edges)
+        ids = array('i', sorted({user_id for edge in out_edges for user_id in edge}))
+        out_indptr, out_indices = _adjacency(ids, out_edges)
+        in_indptr, in_indices = _adjacency(ids, in_edges)
+
+        sections, size = _layout(len(ids), len(out_edges))
+        buffer = bytearray(size)
+        _HEADER.pack_into(buffer, 0, SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, len(ids), len(out_edges),
+                          built_at or time.time())
+        arrays = {'ids': ids, 'out_indptr': out_indptr, 'out_indices': out_indices,
+                  'in_indptr': in_indptr, 'in_indices': in_indices}
+        for name, _, offset, _ in sections:
+            data = arrays[name].tobytes()
+            buffer[offset:offset + len(data)] = data
+        return cls(bytes(buffer))
+
+    # -------------------- Snapshots --------------------
+
+    def write_snapshot(self, path):
+        """Writes the snapshot atomically (temp file + rename); workers still mapping the old file keep it."""
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self._buffer)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def open_snapshot(cls, path):
+        with open(path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    # -------------------- Queries --------------------
+
+    def _position(self, user_id):
+        position = bisect_left(self.ids, user_id)
+        if position < len(self.ids) and self.ids[position] == user_id:
+            return position
+        return None
+
+    def following(self, user_id):
+        """Ids `user_id` follows, ascending."""
+        position = self._position(user_id)
+        if position is None:
+            return ()
+        return self.out_indices[self.out_indptr[position]:self.out_indptr[position + 1]]
+
+    def followers(self, user_id):
+        """Ids following `user_id`, ascending."""
+        position = self._position(user_id)
+        if position is None:
+            return ()
+        return self.in_indices[self.in_indptr[position]:self.in_indptr[position + 1]]
+
+    def is_following(self, follower_id, followed_id):
+        row = self.following(follower_id)
+        index = bisect_left(row, followed_id)
+        return index < len(row) and row[index] == followed_id
+
+    def follower_count(self, user_id):
+        position = self._position(user_id)
+        return 0 if position is None else self.in_indptr[position + 1] - self.in_indptr[position]
+
+    def following_count(self, user_id):
+        position = self._position(user_id)
+        return 0 if position is None else self.out_indptr[position + 1] - self.out_indptr[position]
+
+
+def build_social_graph():
+    """Builds the graph from the followers table in one query."""
+    built_at = time.time() # Taken before reading, so changes committed during the read are replayed
+    edges = db.session.execute(select(followers.c.follower_id, followers.c.followed_id)).all()
+    return SocialGraph.build(edges, built_at=built_at)
+
+
+# -------------------- Per-worker state --------------------
+
+def _snapshot_path():
+    return current_app.config.get('SOCIAL_GRAPH_SNAPSHOT_PATH')
+
+
+def _load_snapshot_if_newer(state, path):
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return False
+    if state.get('snapshot_mtime') == mtime:
+        return False
+    try:
+        graph = SocialGraph.open_snapshot(path)
+    except (OSError, ValueError, struct.error) as e:
+        current_app.logger.warning('Could not load social graph snapshot %s: %s', path, e)
+        return False
+    _install(state, graph)
+    state['snapshot_mtime'] = mtime
+    return True
+
+
+def _apply_change(state, follower_id, followed_id, is_follow):
+    """Patches the count deltas for one committed edge change, relative to the installed graph."""
+    edges = state['edges']
+    key = (follower_id, followed_id)
+    was_following = edges.get(key)
+    if was_following is None:
+        was_following = state['graph'].is_following(follower_id, followed_id)
+    edges[key] = is_follow
+    if was_following != is_follow:
+        step = 1 if is_follow else -1
+        for deltas, user_id in ((state['follower_deltas'], followed_id), (state['following_deltas'], follower_id)):
+            deltas[user_id] = deltas.get(user_id, 0) + step
+
+
+def _install(state, graph):
+    """Makes `graph` this worker's graph, replaying the changes it committed since `graph` was built."""
+    state['graph'] = graph
+    state['checked_at'] = time.monotonic()
+    state['edges'], state['follower_deltas'], state['following_deltas'] = {}, {}, {}
+    state['journal'] = [item for item in state.get('journal', []) if item[0] >= graph.built_at]
+    for _, follower_id, followed_id, is_follow in state['journal']:
+        _apply_change(state, follower_id, followed_id, is_follow)
+
+
+def _state():
+    """This worker's state, with the graph loaded from the snapshot (reloaded when it changes) or built."""
+    state = current_app.extensions.setdefault('social_graph', {})
+    path = _snapshot_path()
+    now = time.monotonic()
+    if now - state.get('checked_at', 0) >= current_app.config.get('SOCIAL_GRAPH_RELOAD_SECONDS', 60):
+        state['checked_at'] = now
+        if path:
+            _load_snapshot_if_newer(state, path)
+        elif state.get('graph') is not None:
+            # No shared snapshot to pick up other workers' changes from: rebuild our own
+            _install(state, build_social_graph())
+    if state.get('graph') is None:
+        _install(state, build_social_graph())
+    return state
+
+
+def get_social_graph():
+    return _state()['graph']
+
+
+def refresh_social_graph():
+    """Rebuilds the graph from the database and publishes it as the shared snapshot."""
+    state = current_app.extensions.setdefault('social_graph', {})
+    graph = build_social_graph()
+    path = _snapshot_path()
+    if path:
+        graph.write_snapshot(path)
+        state['snapshot_mtime'] = os.path.getmtime(path)
+        graph = SocialGraph.open_snapshot(path)
+    _install(state, graph)
+    return graph
+
+
+# -------------------- Read API --------------------
+
+def _load_followed_ids(user_id):
+    return db.session.execute(
+        select(followers.c.followed_id).where(followers.c.follower_id == user_id)
+    ).scalars().all()
+
+
+def following_rows(user_ids, graph=None):
+    """
+    {user id: ascending ids they follow}: the snapshot row, unless the user's follows
+    changed after the snapshot was built (one cache round trip for all of `user_ids`).
+    """
+    graph = graph or get_social_graph()
+    user_ids = list(user_ids)
+    rows = {}
+    for user_id, generation in zip(user_ids, get_feed_generations(user_ids)):
+        if generation and generation >= graph.built_at_ns:
+            rows[user_id] = sorted(get_cached_followed_ids(user_id, lambda: _load_followed_ids(user_id)))
+        else:
+            rows[user_id] = graph.following(user_id)
+    return rows
+
+
+def _same_user(a, b):
+    return a is b or (a.id is not None and a.id == b.id)
+
+
+def _uncommitted_change(session, follower, followed):
+    """True/False for a follow/unfollow of `followed` by `follower` not yet committed in `session`, else None."""
+    for change_follower, change_followed, is_follow in reversed(pending_follow_changes(session)):
+        if _same_user(change_follower, follower) and _same_user(change_followed, followed):
+            return is_follow
+    for follower_id, followed_id, is_follow in reversed(session.info.get('social_graph_changes', [])):
+        if follower_id == follower.id and followed_id == followed.id:
+            return is_follow
+    return None
+
+
+def is_following(follower, followed):
+    """
+    Whether User `follower` follows User `followed`, including changes pending in the
+    session. Read from the database, never the graph, so other workers' commits count.
+    """
+    pending = _uncommitted_change(db.session(), follower, followed)
+    if pending is not None:
+        return pending
+    if follower.id is None or followed.id is None:
+        return False
+    if has_request_context():
+        return followed.id in get_viewer(follower).followed_ids
+    return db.session.execute(select(followers.c.follower_id).where(
+        followers.c.follower_id == follower.id, followers.c.followed_id == followed.id
+    ).limit(1)).first() is not None
+
+
+def follower_count(user_id):
+    state = _state()
+    return state['graph'].follower_count(user_id) + state['follower_deltas'].get(user_id, 0)
+
+
+def following_count(user_id):
+    state = _state()
+    return state['graph'].following_count(user_id) + state['following_deltas'].get(user_id, 0)
+
+
+def friends_of_friends(user_id, limit=None):
+    """
+    [(user id, mutual count)] for users followed by people `user_id` follows (but not by
+    `user_id`), most mutual connections first.
+    """
+    graph = get_social_graph()
+    followed = following_rows([user_id], graph)[user_id]
+    counts = {}
+    for row in following_rows(followed, graph).values():
+        for candidate in row:
+            counts[candidate] = counts.get(candidate, 0) + 1
+    counts.pop(user_id, None)
+    for followed_id in followed:
+        counts.pop(followed_id, None)
+    order = lambda item: (-item[1], item[0])
+    if limit is None:
+        return sorted(counts.items(), key=order)
+    return heapq.nsmallest(limit, counts.items(), key=order)
+
+
+# -------------------- Incremental updates --------------------
+
+@event.listens_for(Session, 'before_flush')
+def _collect_follow_changes(session, flush_context, instances):
+    session.info['social_graph_pending'] = pending_follow_changes(session)
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_follow_changes(session, flush_context):
+    # Ids are only known after the flush, and the objects are expired by the time the commit hooks run
+    pending = session.info.pop('social_graph_pending', None)
+    if pending:
+        session.info.setdefault('social_graph_changes', []).extend(
+            (follower.id, followed.id, is_follow) for follower, followed, is_follow in pending
+        )
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_follow_changes(session):
+    changes = session.info.pop('social_graph_changes', None)
+    if not changes or not has_app_context():
+        return
+    if has_request_context():
+        for follower_id in {follower_id for follower_id, _, _ in changes}:
+            forget_viewer(follower_id)
+    # Only a worker that has already loaded its graph needs patching; others build it fresh
+    state = current_app.extensions.get('social_graph', {})
+    if state.get('graph') is None:
+        return
+    committed_at = time.time()
+    journal = state.setdefault('journal', [])
+    for follower_id, followed_id, is_follow in changes:
+        _apply_change(state, follower_id, followed_id, is_follow)
+        journal.append((committed_at, follower_id, followed_id, is_follow))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_follow_changes(session):
+    session.info.pop('social_graph_pending', None)
+    session.info.pop('social_graph_changes', None)
@@ -0,0 +1,229 @@
+"""
+Socket.IO message queue: routes emits between processes.
+
+Without a queue each process only reaches the Socket.IO clients connected to it, so a
+notification emitted by one web worker, an outbox worker or the scheduler never reached
+a user connected to another worker. With SOCKETIO_MESSAGE_QUEUE set, every process
+publishes its emits on SOCKETIO_CHANNEL and each process delivers the ones addressed to
+its own clients. The code emitting does not change: socketio.emit() from a request, a
+socket handler or a background task goes through the queue.
+
+The queue speaks the Redis protocol. In production point it at Redis
+(redis://host:6379/0). For tests and single-host deployments LocalBroker is an in-repo
+stand-in that implements the part of the protocol Socket.IO uses (SUBSCRIBE, PUBLISH and
+the connection handshake, over RESP2 or RESP3). Run it next to the workers with
+
+    python -m app.services.socket_broker --port 6390
+
+and set SOCKETIO_MESSAGE_QUEUE=redis://127.0.0.1:6390/0. It keeps nothing: messages
+published while a worker is disconnected are not delivered to it, as with Redis pub/sub.
+"""
+import argparse
+import socket
+import socketserver
+import threading
+
+DEFAULT_CHANNEL = 'flask-socketio'
+DEFAULT_PORT = 6390
+
+
+def message_queue_options(config):
+    """socketio.init_app() keyword arguments for the message queue in `config` (none: a single process)."""
+    url = config.get('SOCKETIO_MESSAGE_QUEUE')
+    if not url:
+        return {}
+    return {'message_queue': url, 'channel': config.get('SOCKETIO_CHANNEL') or DEFAULT_CHANNEL}
+
+
+# -------------------- Local stand-in broker --------------------
+
+def _bulk(value):
+    if value is None:
+        return b'$-1\r\n'
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+def _array(*items):
+    return b'*%d\r\n' % len(items) + b''.join(items)
+
+
+def _integer(value):
+    return b':%d\r\n' % value
+
+
+def _push(protocol, *items):
+    """Out-of-band pub/sub frames: arrays in RESP2, push types in RESP3."""
+    return (b'>%d\r\n' if protocol == 3 else b'*%d\r\n') % len(items) + b''.join(items)
+
+
+def _hello(protocol, connection_id):
+    fields = [(b'server', _bulk(b'redis')), (b'version', _bulk(b'7.0.0')), (b'proto', _integer(protocol)),
+              (b'id', _integer(connection_id)), (b'mode', _bulk(b'standalone')), (b'role', _bulk(b'master')),
+              (b'modules', _array())]
+    if protocol == 3:
+        return b'%%%d\r\n' % len(fields) + b''.join(_bulk(key) + value for key, value in fields)
+    return _array(*(item for key, value in fields for item in (_bulk(key), value)))
+
+
+class _Connection(socketserver.StreamRequestHandler):
+    """One client connection: reads RESP commands and writes replies (and published messages)."""
+
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.write_lock = threading.Lock()
+        self.channels = set()
+        self.protocol = 2
+
+    def send(self, data):
+        with self.write_lock:
+            self.wfile.write(data)
+            self.wfile.flush()
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'): # Inline command, e.g. from telnet or redis-cli --pipe
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        broker = self.server.broker
+        try:
+            while True:
+                command = self.read_command()
+                if command is None:
+                    break
+                if not command:
+                    continue
+                name, args = command[0].upper(), command[1:]
+                if name == b'PUBLISH' and len(args) == 2:
+                    self.send(_integer(broker.publish(args[0], args[1])))
+                elif name == b'SUBSCRIBE' and args:
+                    for channel in args:
+                        self.channels.add(channel)
+                        broker.subscribe(channel, self)
+                        self.send(_push(self.protocol, _bulk(b'subscribe'), _bulk(channel), _integer(len(self.channels))))
+                elif name == b'UNSUBSCRIBE':
+                    for channel in args or sorted(self.channels) or [None]:
+                        self.channels.discard(channel)
+                        broker.unsubscribe(channel, self)
+                        self.send(_push(self.protocol, _bulk(b'unsubscribe'), _bulk(channel), _integer(len(self.channels))))
+                elif name == b'PING':
+                    if self.channels and self.protocol == 2: # Subscribed RESP2 clients get the pub/sub form of the reply
+                        self.send(_array(_bulk(b'pong'), _bulk(args[0] if args else b'')))
+                    else:
+                        self.send(_bulk(args[0]) if args else b'+PONG\r\n')
+                elif name == b'HELLO':
+                    if args and args[0] not in (b'2', b'3'):
+                        self.send(b'-NOPROTO unsupported protocol version\r\n')
+                        continue
+                    if args:
+                        self.protocol = int(args[0])
+                    self.send(_hello(self.protocol, id(self) & 0xffffffff))
+                elif name in (b'SELECT', b'CLIENT', b'AUTH'): # One keyspace, no clients list, no users
+                    self.send(b'+OK\r\n')
+                elif name == b'QUIT':
+                    self.send(b'+OK\r\n')
+                    break
+                else:
+                    self.send(b"-ERR unknown command '%s'\r\n" % name.lower())
+        except (ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            for channel in self.channels:
+                broker.unsubscribe(channel, self)
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class LocalBroker:
+    """
+    A Redis-protocol pub/sub broker for Socket.IO message queues on a single host. Each
+    connection is served by a thread, and a message is written to every subscriber before
+    PUBLISH returns, so a subscriber that stops reading slows publishers down.
+    """
+
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), _Connection, bind_and_activate=True)
+        self._server.broker = self
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address[:2]
+
+    @property
+    def url(self):
+        host, port = self.address
+        return f'redis://{host}:{port}/0'
+
+    def subscribe(self, channel, connection):
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(connection)
+
+    def unsubscribe(self, channel, connection):
+        with self._lock:
+            subscribers = self._subscribers.get(channel)
+            if subscribers is not None:
+                subscribers.discard(connection)
+                if not subscribers:
+                    del self._subscribers[channel]
+
+    def subscriber_count(self, channel):
+        with self._lock:
+            return len(self._subscribers.get(channel, ()))
+
+    def publish(self, channel, message):
+        """Sends `message` to the subscribers of `channel`. Returns how many received it."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        frames = {protocol: _push(protocol, _bulk(b'message'), _bulk(channel), _bulk(message)) for protocol in (2, 3)}
+        received = 0
+        for connection in subscribers:
+            try:
+                connection.send(frames[connection.protocol])
+                received += 1
+            except OSError: # Disconnected; its handler unsubscribes it
+                pass
+        return received
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self):
+        """Serves on a daemon thread. Returns the broker."""
+        self._thread = threading.Thread(target=self.serve_forever, name='socketio-local-broker', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local stand-in Socket.IO message queue broker (Redis protocol).')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args(argv)
+    broker = LocalBroker(args.host, args.port)
+    print(f'Socket.IO broker listening on {broker.url}')
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        broker.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,388 @@
+"""
+Home timeline storage (fan-out-on-write).
+
+Every post and share is copied into the TimelineEntry rows of the users who should
+see it at write time, so reading a home timeline is a single indexed range scan on
+(user_id, timestamp, post_id, share_id) bounded by the page size.
+
+Writes are hooked into the SQLAlchemy session (before_flush/after_flush) rather than
+individual routes, so create_post, share_post, publish_scheduled_content, the API and
+follow/unfollow all maintain the timeline in the same transaction as the change itself.
+
+Authors with more than TIMELINE_FANOUT_MAX_FOLLOWERS followers are not fanned out to
+their followers; their posts and shares are pulled at read time and merged in instead.
+
+The same hooks invalidate memoized User.followed_posts pages (app/utils/feed_cache.py)
+once the transaction commits.
+"""
+from datetime import timezone
+
+from sqlalchemy import event, select, insert, update, delete, literal, and_, or_, exists, tuple_, func, union
+from sqlalchemy.orm import Session, attributes, contains_eager, joinedload
+
+from app import db, cache
+from app.core.models import (
+    TimelineEntry, Post, Share, User, followers, friend_list_members,
+    PRIVACY_PUBLIC, PRIVACY_FOLLOWERS, PRIVACY_CUSTOM_LIST
+)
+from app.utils.app_config import config_value
+from app.utils.feed_cache import bump_feed_generation
+from app.utils.pagination import CursorPage, encode_cursor, decode_cursor
+from app.services.visibility_service import ANONYMOUS, get_viewer, post_visibility_filter
+
+DEFAULT_FANOUT_MAX_FOLLOWERS = 5000
+DEFAULT_BACKFILL_LIMIT = 200
+PULL_AUTHORS_CACHE_KEY = 'timeline:pull_author_ids'
+PULL_AUTHORS_CACHE_TIMEOUT = 600 # 10 minutes
+
+# Privacy levels a follower is entitled to see
+FOLLOWER_VISIBLE_PRIVACY = (PRIVACY_PUBLIC, PRIVACY_FOLLOWERS)
+
+_ENTRY_COLUMNS = ['user_id', 'post_id', 'share_id', 'author_id', 'sharer_id', 'timestamp']
+
+
+def get_pull_author_ids(connection=None):
+    """
+    Returns the ids of users whose follower count exceeds TIMELINE_FANOUT_MAX_FOLLOWERS.
+    The set is small and changes slowly, so it is cached process-wide.
+    """
+    author_ids = cache.get(PULL_AUTHORS_CACHE_KEY)
+    if author_ids is None:
+        threshold = config_value('TIMELINE_FANOUT_MAX_FOLLOWERS', DEFAULT_FANOUT_MAX_FOLLOWERS)
+        stmt = select(followers.c.followed_id).group_by(followers.c.followed_id).having(func.count() > threshold)
+        executor = connection if connection is not None else db.session
+        author_ids = set(executor.execute(stmt).scalars().all())
+        cache.set(PULL_AUTHORS_CACHE_KEY, author_ids, timeout=PULL_AUTHORS_CACHE_TIMEOUT)
+    return author_ids
+
+
+def _insert_missing(connection, *sources):
+    """INSERT ... SELECT the union of `sources`, skipping items already on the owner's timeline."""
+    src = union(*sources).subquery() if len(sources) > 1 else sources[0].subquery()
+    stmt = select(*[src.c[name] for name in _ENTRY_COLUMNS]).where(
+        ~exists().where(
+            TimelineEntry.user_id == src.c.user_id,
+            TimelineEntry.post_id == src.c.post_id,
+            TimelineEntry.share_id == src.c.share_id
+        )
+    )
+    connection.execute(insert(TimelineEntry.__table__).from_select(_ENTRY_COLUMNS, stmt))
+
+
+def _post_entries(owner_column, *where):
+    return select(
+        owner_column.label('user_id'),
+        Post.id.label('post_id'),
+        literal(0).label('share_id'),
+        Post.user_id.label('author_id'),
+        literal(None, db.Integer).label('sharer_id'),
+        Post.timestamp.label('timestamp')
+    ).where(*where)
+
+
+def _share_entries(owner_column, *where):
+    return select(
+        owner_column.label('user_id'),
+        Share.post_id.label('post_id'),
+        Share.id.label('share_id'),
+        Post.user_id.label('author_id'),
+        Share.user_id.label('sharer_id'),
+        Share.timestamp.label('timestamp')
+    ).join(Post, Share.post_id == Post.id).where(*where)
+
+
+def fan_out_post(connection, post):
+    """Writes `post` to its author's timeline and, once published, to its audience's."""
+    sources = [_post_entries(Post.user_id, Post.id == post.id)]
+    if post.is_published:
+        if post.privacy_level in FOLLOWER_VISIBLE_PRIVACY and post.user_id not in get_pull_author_ids(connection):
+            sources.append(_post_entries(
+                followers.c.follower_id, Post.id == post.id, followers.c.followed_id == Post.user_id
+            ))
+        elif post.privacy_level == PRIVACY_CUSTOM_LIST and post.custom_friend_list_id:
+            sources.append(_post_entries(
+                friend_list_members.c.user_id, Post.id == post.id,
+                friend_list_members.c.friend_list_id == Post.custom_friend_list_id
+            ))
+    _insert_missing(connection, *sources)
+
+
+def retract_post(connection, post):
+    """Removes `post` from every timeline except its author's (e.g. before re-fanning after a privacy change)."""
+    connection.execute(delete(TimelineEntry.__table__).where(
+        TimelineEntry.post_id == post.id,
+        TimelineEntry.share_id == 0,
+        TimelineEntry.user_id != post.user_id
+    ))
+
+
+def fan_out_share(connection, share):
+    """Writes `share` to the sharer's timeline and to their followers' if the original post is public."""
+    sources = []
+    original_author_id = connection.execute(select(Post.user_id).where(Post.id == share.post_id)).scalar()
+    # Mirrors followed_posts: sharing your own post to your own feed does not add a feed item
+    if not (original_author_id == share.user_id and share.group_id is None):
+        sources.append(_share_entries(Share.user_id, Share.id == share.id))
+    if share.user_id not in get_pull_author_ids(connection):
+        sources.append(_share_entries(
+            followers.c.follower_id, Share.id == share.id,
+            followers.c.followed_id == Share.user_id, Post.privacy_level == PRIVACY_PUBLIC
+        ))
+    if sources:
+        _insert_missing(connection, *sources)
+
+
+def backfill_follow(connection, follower_id, followed_id):
+    """Copies the most recent posts and shares of `followed_id` into the new follower's timeline."""
+    if followed_id in get_pull_author_ids(connection):
+        return # Read from the author at request time instead
+    limit = config_value('TIMELINE_BACKFILL_LIMIT', DEFAULT_BACKFILL_LIMIT)
+    _insert_missing(connection, _post_entries(
+        literal(follower_id), Post.user_id == followed_id, Post.is_published == True,
+        Post.privacy_level.in_(FOLLOWER_VISIBLE_PRIVACY)
+    ).order_by(Post.timestamp.desc()).limit(limit))
+    _insert_missing(connection, _share_entries(
+        literal(follower_id), Share.user_id == followed_id, Post.privacy_level == PRIVACY_PUBLIC
+    ).order_by(Share.timestamp.desc()).limit(limit))
+
+
+def remove_follow(connection, follower_id, followed_id):
+    """Drops the unfollowed user's posts and shares from the former follower's timeline."""
+    followed_post_ids = select(Post.id).where(
+        Post.user_id == followed_id,
+        Post.privacy_level != PRIVACY_CUSTOM_LIST # Still visible through list membership
+    )
+    connection.execute(delete(TimelineEntry.__table__).where(
+        TimelineEntry.user_id == follower_id,
+        or_(
+            and_(TimelineEntry.share_id == 0, TimelineEntry.post_id.in_(followed_post_ids)),
+            TimelineEntry.sharer_id == followed_id
+        )
+    ))
+
+
+def rebuild_timeline(user_id):
+    """
+    Recreates a user's timeline from the follow graph. Used to populate timelines for
+    data that predates the timeline_entry table; normal writes keep it current.
+    """
+    connection = db.session.connection()
+    connection.execute(delete(TimelineEntry.__table__).where(TimelineEntry.user_id == user_id))
+    _insert_missing(connection, _post_entries(literal(user_id), Post.user_id == user_id))
+    _insert_missing(connection, _share_entries(
+        literal(user_id), Share.user_id == user_id, or_(Post.user_id != user_id, Share.group_id.isnot(None))
+    ))
+    followed_ids = connection.execute(
+        select(followers.c.followed_id).where(followers.c.follower_id == user_id)
+    ).scalars().all()
+    for followed_id in followed_ids:
+        backfill_follow(connection, user_id, followed_id)
+    _insert_missing(connection, _post_entries(
+        literal(user_id), Post.is_published == True, Post.privacy_level == PRIVACY_CUSTOM_LIST,
+        Post.custom_friend_list_id.in_(
+            select(friend_list_members.c.friend_list_id).where(friend_list_members.c.user_id == user_id)
+        )
+    ))
+    db.session.commit()
+
+
+# -------------------- Write path (session hooks) --------------------
+
+def pending_follow_changes(session):
+    """
+    (follower, followed, is_follow) tuples for the follows and unfollows pending in `session`.
+    Follow changes live on dynamic relationships, whose history is only visible before the
+    flush, so this must be called from a before_flush hook.
+    """
+    changes = []
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, User):
+            continue
+        followed_history = attributes.get_history(obj, 'followed', passive=attributes.PASSIVE_NO_INITIALIZE)
+        followers_history = attributes.get_history(obj, 'followers', passive=attributes.PASSIVE_NO_INITIALIZE)
+        changes.extend((obj, other, True) for other in followed_history.added or ())
+        changes.extend((obj, other, False) for other in followed_history.deleted or ())
+        changes.extend((other, obj, True) for other in followers_history.added or ())
+        changes.extend((other, obj, False) for other in followers_history.deleted or ())
+    return changes
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_follow_changes(session, flush_context, instances):
+    session.info.setdefault('timeline_follow_changes', []).extend(pending_follow_changes(session))
+
+
+@event.listens_for(Session, 'after_flush')
+def _fan_out_after_flush(session, flush_context):
+    follow_changes = session.info.pop('timeline_follow_changes', None) or []
+    new_posts = [obj for obj in session.new if isinstance(obj, Post)]
+    new_shares = [obj for obj in session.new if isinstance(obj, Share)]
+    changed_posts = []
+    retimed_posts = []
+    for obj in session.dirty:
+        if isinstance(obj, Post) and obj not in session.deleted:
+            state = attributes.instance_state(obj)
+            if state.attrs.timestamp.history.has_changes():
+                retimed_posts.append(obj)
+            published = state.attrs.is_published.history
+            audience_changed = (state.attrs.privacy_level.history.has_changes()
+                                or state.attrs.custom_friend_list_id.history.has_changes())
+            if audience_changed or (published.has_changes() and obj.is_published):
+                changed_posts.append((obj, audience_changed))
+    removed = [obj for obj in session.deleted if isinstance(obj, (Post, Share))]
+    if not (follow_changes or new_posts or new_shares or changed_posts or retimed_posts or removed):
+        return
+
+    # Memoized User.followed_posts pages keyed on these users go stale once this commits
+    session.info.setdefault('feed_invalidations', set()).update(
+        [obj.user_id for obj in new_posts + new_shares + retimed_posts + removed]
+        + [post.user_id for post, _ in changed_posts]
+        + [follower.id for follower, _, _ in follow_changes]
+    )
+
+    connection = session.connection()
+    for post in retimed_posts:
+        connection.execute(update(TimelineEntry.__table__).where(
+            TimelineEntry.post_id == post.id, TimelineEntry.share_id == 0
+        ).values(timestamp=select(Post.timestamp).where(Post.id == post.id).scalar_subquery()))
+    for post in new_posts:
+        fan_out_post(connection, post)
+    for post, audience_changed in changed_posts:
+        if audience_changed:
+            retract_post(connection, post)
+        fan_out_post(connection, post)
+    for share in new_shares:
+        fan_out_share(connection, share)
+
+    seen = set()
+    for follower, followed, is_follow in follow_changes:
+        key = (follower.id, followed.id, is_follow)
+        if key in seen or follower.id is None or followed.id is None:
+            continue
+        seen.add(key)
+        if is_follow:
+            backfill_follow(connection, follower.id, followed.id)
+        else:
+            remove_follow(connection, follower.id, followed.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_feeds_after_commit(session):
+    user_ids = session.info.pop('feed_invalidations', None)
+    if user_ids:
+        bump_feed_generation(*user_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_follow_changes(session):
+    session.info.pop('timeline_follow_changes', None)
+    session.info.pop('feed_invalidations', None)
+
+
+# -------------------- Read path --------------------
+
+def _sort_key(item):
+    return (item['timestamp'], item['item'].id, item['share_id'])
+
+
+def _keyset(timestamp_column, post_id_column, share_id_column, after):
+    return tuple_(timestamp_column, post_id_column, share_id_column) < tuple_(*after)
+
+
+def _wrap(post, timestamp, share_id=0, sharer=None):
+    if timestamp is not None and timestamp.tzinfo is not None:
+        # Freshly created objects can still carry an aware timestamp; stored values are naive UTC
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return {
+        'type': 'share' if share_id else 'post',
+        'item': post,
+        'timestamp': timestamp,
+        'sharer': sharer,
+        'share_id': share_id
+    }
+
+
+def _read_entries(viewer, after, limit):
+    # Visibility is re-checked because moderation, publishing and list membership can change after fan-out
+    query = TimelineEntry.query.join(Post, TimelineEntry.post_id == Post.id).options(
+        contains_eager(TimelineEntry.post).joinedload(Post.author),
+        joinedload(TimelineEntry.sharer)
+    ).filter(TimelineEntry.user_id == viewer.user_id, post_visibility_filter(viewer))
+    if after:
+        query = query.filter(_keyset(TimelineEntry.timestamp, TimelineEntry.post_id, TimelineEntry.share_id, after))
+    entries = query.order_by(
+        TimelineEntry.timestamp.desc(), TimelineEntry.post_id.desc(), TimelineEntry.share_id.desc()
+    ).limit(limit).all()
+    return [_wrap(e.post, e.timestamp, e.share_id, e.sharer) for e in entries]
+
+
+def _read_posts(after, limit, *criteria):
+    query = Post.query.options(joinedload(Post.author)).filter(*criteria)
+    if after:
+        query = query.filter(_keyset(Post.timestamp, Post.id, literal(0), after))
+    posts = query.order_by(Post.timestamp.desc(), Post.id.desc()).limit(limit).all()
+    return [_wrap(post, post.timestamp) for post in posts]
+
+
+def _read_pulled_items(viewer, after, limit):
+    """Posts and public shares from followed high-follower authors, which are not fanned out."""
+    pull_author_ids = get_pull_author_ids()
+    if not pull_author_ids:
+        return []
+    followed_pull_ids = db.session.execute(
+        select(followers.c.followed_id).where(
+            followers.c.follower_id == viewer.user_id,
+            followers.c.followed_id.in_(pull_author_ids)
+        )
+    ).scalars().all()
+    if not followed_pull_ids:
+        return []
+
+    items = _read_posts(after, limit, Post.user_id.in_(followed_pull_ids), post_visibility_filter(viewer))
+    share_query = Share.query.join(Post, Share.post_id == Post.id).options(
+        contains_eager(Share.original_post).joinedload(Post.author),
+        joinedload(Share.user)
+    ).filter(
+        Share.user_id.in_(followed_pull_ids),
+        post_visibility_filter(ANONYMOUS) # Shares only ever carry public posts
+    )
+    if after:
+        share_query = share_query.filter(_keyset(Share.timestamp, Share.post_id, Share.id, after))
+    shares = share_query.order_by(Share.timestamp.desc(), Share.post_id.desc(), Share.id.desc()).limit(limit).all()
+    items.extend(_wrap(share.original_post, share.timestamp, share.id, share.user) for share in shares)
+    return items
+
+
+def _merge_page(sources, per_page, cursor):
+    """Merges already-sorted candidate lists into one page, de-duplicating feed items."""
+    candidates = {}
+    for items in sources:
+        for item in items:
+            candidates.setdefault((item['item'].id, item['share_id']), item)
+    ordered = sorted(candidates.values(), key=_sort_key, reverse=True)
+    page_items = ordered[:per_page]
+    next_cursor = encode_cursor(*_sort_key(page_items[-1])) if len(ordered) > per_page else None
+    return CursorPage(page_items, per_page, next_cursor=next_cursor, cursor=cursor)
+
+
+def get_home_timeline(user, cursor=None, per_page=10):
+    """
+    Returns a CursorPage of feed item dicts ({'type', 'item', 'timestamp', 'sharer'}) for
+    `user`: their materialized timeline, posts pulled from followed high-follower authors,
+    and public posts from everyone (the existing discovery behaviour of the home page).
+    Each source reads at most per_page + 1 rows past the cursor.
+    """
+    after = decode_cursor(cursor, id_count=2)
+    limit = per_page + 1
+    viewer = get_viewer(user)
+    return _merge_page([
+        _read_entries(viewer, after, limit),
+        _read_pulled_items(viewer, after, limit),
+        _read_posts(after, limit, post_visibility_filter(ANONYMOUS))
+    ], per_page, cursor)
+
+
+def get_public_timeline(cursor=None, per_page=10):
+    """Public, published posts from all users, newest first (the guest home page)."""
+    after = decode_cursor(cursor, id_count=2)
+    return _merge_page([_read_posts(after, per_page + 1, post_visibility_filter(ANONYMOUS))], per_page, cursor)
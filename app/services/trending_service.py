@@ -1,42 +1,56 @@
-from app import db
-from app.core.models import Hashtag, HashtagUsage
-from sqlalchemy import func
+"""
+Trending hashtags.
+
+The /trending_hashtags page and the API read the streaming top-K summary in
+trending_stream (bounded memory, exponentially decayed counts), so their cost does not
+grow with the HashtagUsage table.
+
+calculate_trending_scores() is the exact windowed computation: a hashtag's score weighs
+its uses in the last hour, day and week, all three counts coming from one grouped query
+(conditional aggregation over the last week of hourly usage rollups plus the raw rows
+not rolled up yet). It is kept for reporting and for checking the streaming ranking
+against.
+"""
 from datetime import datetime, timedelta
 
-def calculate_trending_scores():
+from flask import current_app
+from sqlalchemy import select, func, case
+
+from app import db
+from app.core.models import Hashtag
+from app.services.hashtag_usage_service import usage_rows
+from app.services.trending_stream import top_trending_hashtags, TrendingHashtag # noqa: F401 - re-exported
+
+DEFAULT_TRENDING_LIMIT = 100
+# Weights of the uses in the last hour, day and week
+HOUR_WEIGHT, DAY_WEIGHT, WEEK_WEIGHT = 0.6, 0.3, 0.1
+
+
+def calculate_trending_scores(now=None, limit=None):
     """
-    Calculates a trending score for each hashtag based on its usage
-    over different time periods.
+    Calculates a trending score for each hashtag based on its usage over the last
+    hour, day and week. Returns [(tag_text, score)], highest score first.
     """
-    now = datetime.utcnow()
+    now = now or datetime.utcnow()
     one_hour_ago = now - timedelta(hours=1)
     one_day_ago = now - timedelta(days=1)
     one_week_ago = now - timedelta(weeks=1)
 
-    hashtags = Hashtag.query.all()
-    trending_scores = {}
-
-    for hashtag in hashtags:
-        # Get usage counts for different time periods
-        recent_usage = HashtagUsage.query.filter(
-            HashtagUsage.hashtag_id == hashtag.id,
-            HashtagUsage.timestamp >= one_hour_ago
-        ).count()
-
-        daily_usage = HashtagUsage.query.filter(
-            HashtagUsage.hashtag_id == hashtag.id,
-            HashtagUsage.timestamp >= one_day_ago
-        ).count()
-
-        weekly_usage = HashtagUsage.query.filter(
-            HashtagUsage.hashtag_id == hashtag.id,
-            HashtagUsage.timestamp >= one_week_ago
-        ).count()
-
-        # Calculate score with different weights
-        score = (recent_usage * 0.6) + (daily_usage * 0.3) + (weekly_usage * 0.1)
-        trending_scores[hashtag.tag_text] = score
-
-    # Sort hashtags by score in descending order
-    sorted_hashtags = sorted(trending_scores.items(), key=lambda item: item[1], reverse=True)
-    return sorted_hashtags
+    # Hourly rollup buckets plus the raw rows after them; hashtags without recent usage
+    # still appear (with a score of 0)
+    usage = usage_rows(one_week_ago)
+    hourly = func.coalesce(func.sum(case((usage.c.ts >= one_hour_ago, usage.c.uses), else_=0)), 0)
+    daily = func.coalesce(func.sum(case((usage.c.ts >= one_day_ago, usage.c.uses), else_=0)), 0)
+    weekly = func.coalesce(func.sum(usage.c.uses), 0)
+    score = (hourly * HOUR_WEIGHT + daily * DAY_WEIGHT + weekly * WEEK_WEIGHT).label('score')
+
+    stmt = select(Hashtag.tag_text, score).outerjoin(usage, usage.c.hashtag_id == Hashtag.id)\
+        .group_by(Hashtag.id, Hashtag.tag_text).order_by(score.desc(), Hashtag.id)
+    if limit:
+        stmt = stmt.limit(limit)
+    return [(tag_text, float(tag_score)) for tag_text, tag_score in db.session.execute(stmt)]
+
+
+def get_trending_hashtags(limit=None):
+    """The hottest hashtags right now as [TrendingHashtag(tag_text, score)], best first."""
+    return top_trending_hashtags(limit or current_app.config.get('TRENDING_HASHTAGS_LIMIT', DEFAULT_TRENDING_LIMIT))
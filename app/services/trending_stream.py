@@ -0,0 +1,310 @@
+"""
+Streaming trending hashtags in bounded memory.
+
+Every committed HashtagUsage (process_hashtags creates one per tag per post) is fed
+into a DecayedSpaceSaving summary: a Space-Saving top-K structure over exponentially
+decayed counts, so a use loses half its weight every TRENDING_STREAM_HALF_LIFE seconds
+and the summary never holds more than TRENDING_STREAM_CAPACITY hashtags. Reading the
+top K costs O(capacity), however large the HashtagUsage table grows.
+
+Workers share one view through the snapshot file at TRENDING_STREAM_SNAPSHOT_PATH.
+Each worker collects its own uses in a local summary and, at most every
+TRENDING_STREAM_SYNC_SECONDS, merges them into the snapshot under a file lock and
+reads back everyone's merged counts. When no snapshot exists yet, the first sync seeds
+it from the last week of hashtag usage. Without a snapshot path each worker only
+sees its own uses (seeded the same way).
+"""
+import heapq
+import json
+import math
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, select, func, case
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.util import identity_key
+
+try:
+    import fcntl
+except ImportError: # Windows: snapshot merges then go unlocked and concurrent syncs may drop a delta
+    fcntl = None
+
+from app import db
+from app.core.models import Hashtag, HashtagUsage
+from app.services.hashtag_usage_service import usage_rows
+
+SNAPSHOT_VERSION = 1
+DEFAULT_CAPACITY = 1000
+DEFAULT_HALF_LIFE = 6 * 3600
+# Scaled counts are rebased before exp() of the landmark distance can overflow
+_MAX_EXPONENT = 60.0
+# Seeding buckets: (newest age, oldest age) in hours; each bucket's count is added at its midpoint
+SEED_BUCKETS = [(0, 1), (1, 24)] + [(24 * day, 24 * (day + 1)) for day in range(1, 7)]
+
+TrendingHashtag = namedtuple('TrendingHashtag', ['tag_text', 'score'])
+
+
+class DecayedSpaceSaving:
+    """
+    Space-Saving summary (Metwally et al.) over exponentially decayed counts.
+
+    At most `capacity` items are tracked. Each tracked count over-estimates the true
+    decayed count by at most its error, and any item whose count exceeds
+    total / capacity is guaranteed to be tracked.
+
+    Decay is applied forward from a landmark time: a use at time t adds
+    2 ** ((t - landmark) / half_life), and a count is read as stored * 2 ** (-(now - landmark) / half_life).
+    Time passing therefore touches no counters; they are rescaled only when the
+    landmark moves.
+    """
+    def __init__(self, capacity=DEFAULT_CAPACITY, half_life=DEFAULT_HALF_LIFE, landmark=None):
+        self.capacity = capacity
+        self.half_life = half_life
+        self._rate = math.log(2) / half_life
+        self.landmark = time.time() if landmark is None else landmark
+        self._counts = {} # item -> [count, error], both scaled to the landmark
+
+    def __len__(self):
+        return len(self._counts)
+
+    def _rebase(self, landmark):
+        factor = math.exp(-self._rate * (landmark - self.landmark))
+        for counter in self._counts.values():
+            counter[0] *= factor
+            counter[1] *= factor
+        self.landmark = landmark
+
+    def _scaled(self, when):
+        exponent = self._rate * (when - self.landmark)
+        if exponent > _MAX_EXPONENT:
+            self._rebase(when)
+            exponent = 0.0
+        return math.exp(exponent)
+
+    def _floor(self):
+        """The smallest tracked count once full: an upper bound for every untracked item."""
+        if len(self._counts) < self.capacity:
+            return 0.0
+        return min(counter[0] for counter in self._counts.values())
+
+    def add(self, item, count=1, when=None):
+        weight = count * self._scaled(time.time() if when is None else when)
+        counter = self._counts.get(item)
+        if counter is not None:
+            counter[0] += weight
+        elif len(self._counts) < self.capacity:
+            self._counts[item] = [weight, 0.0]
+        else:
+            # Replace the smallest item; the newcomer inherits its count as error
+            victim = min(self._counts, key=lambda key: self._counts[key][0])
+            floor = self._counts.pop(victim)[0]
+            self._counts[item] = [floor + weight, floor]
+
+    def top(self, k, now=None):
+        """[(item, decayed count, error)] for the `k` largest counts, largest first."""
+        scale = math.exp(-self._rate * ((time.time() if now is None else now) - self.landmark))
+        best = heapq.nlargest(k, self._counts.items(), key=lambda item: item[1][0])
+        return [(item, counter[0] * scale, counter[1] * scale) for item, counter in best]
+
+    def merge(self, other):
+        """
+        Folds `other` into this summary (the mergeable Space-Saving construction):
+        counts are added, an item missing from a full summary is credited with that
+        summary's smallest count, and the `capacity` largest results are kept.
+        """
+        if other.half_life != self.half_life:
+            raise ValueError('Cannot merge trending summaries with different half-lives')
+        landmark = max(self.landmark, other.landmark)
+        self._rebase(landmark)
+        factor = math.exp(-self._rate * (landmark - other.landmark))
+        theirs = {item: (count * factor, error * factor) for item, (count, error) in other._counts.items()}
+        our_floor, their_floor = self._floor(), other._floor() * factor
+
+        combined = {}
+        for item in self._counts.keys() | theirs.keys():
+            count, error = self._counts.get(item, (our_floor, our_floor))
+            their_count, their_error = theirs.get(item, (their_floor, their_floor))
+            combined[item] = [count + their_count, error + their_error]
+        if len(combined) > self.capacity:
+            combined = dict(heapq.nlargest(self.capacity, combined.items(), key=lambda item: item[1][0]))
+        self._counts = combined
+
+    def to_snapshot(self):
+        return {
+            'version': SNAPSHOT_VERSION,
+            'capacity': self.capacity,
+            'half_life': self.half_life,
+            'landmark': self.landmark,
+            'items': [[item, count, error] for item, (count, error) in self._counts.items()],
+        }
+
+    @classmethod
+    def from_snapshot(cls, data):
+        if data.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported trending snapshot version: {data.get('version')}")
+        summary = cls(data['capacity'], data['half_life'], data['landmark'])
+        summary._counts = {item: [count, error] for item, count, error in data['items']}
+        return summary
+
+
+def seed_summary(summary, now=None):
+    """Adds the last week of hashtag usage to `summary` in one grouped query, bucketed by age."""
+    now = time.time() if now is None else now
+    now_dt = datetime.utcfromtimestamp(now)
+    usage = usage_rows(now_dt - timedelta(hours=SEED_BUCKETS[-1][1]))
+    bucket = case(*[
+        (usage.c.ts >= now_dt - timedelta(hours=oldest), index)
+        for index, (_, oldest) in enumerate(SEED_BUCKETS)
+    ])
+    rows = db.session.execute(
+        select(Hashtag.tag_text, bucket, func.sum(usage.c.uses))
+        .join(Hashtag, Hashtag.id == usage.c.hashtag_id)
+        .group_by(Hashtag.tag_text, bucket)
+    ).all()
+    for tag_text, index, count in rows:
+        newest, oldest = SEED_BUCKETS[index]
+        summary.add(tag_text, count, when=now - (newest + oldest) / 2 * 3600)
+    return summary
+
+
+class TrendingStream:
+    """One worker's trending state: its unpublished local uses plus the last merged snapshot it read."""
+    def __init__(self, capacity=DEFAULT_CAPACITY, half_life=DEFAULT_HALF_LIFE):
+        self._lock = threading.Lock()
+        self.capacity = capacity
+        self.half_life = half_life
+        self.local = DecayedSpaceSaving(capacity, half_life)
+        self.shared = None
+        self.synced_at = None # time.monotonic() of the last sync, None before the first one
+        self._top = None
+
+    def _new_summary(self):
+        return DecayedSpaceSaving(self.capacity, self.half_life)
+
+    def record(self, tag_texts, when=None):
+        with self._lock:
+            for tag_text in tag_texts:
+                self.local.add(tag_text, when=when)
+            self._top = None
+
+    def sync(self, path=None):
+        """
+        Publishes the local uses and refreshes the shared view. With a snapshot `path`
+        the local summary is merged into the file under a lock; without one this
+        worker's summary is the whole view. Seeds from the database on first use.
+        """
+        with self._lock:
+            if path is None:
+                if self.synced_at is None:
+                    self.local = seed_summary(self._new_summary()) # The database already has every committed use
+                self.shared = None
+            else:
+                self.shared = self._merge_into_snapshot(path)
+                self.local = self._new_summary()
+            self.synced_at = time.monotonic()
+            self._top = None
+
+    def _merge_into_snapshot(self, path):
+        with open(f'{path}.lock', 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        merged = DecayedSpaceSaving.from_snapshot(json.load(f))
+                except FileNotFoundError:
+                    # First worker ever: start from the database, which includes our local uses
+                    merged, self.local = seed_summary(self._new_summary()), self._new_summary()
+                except (OSError, ValueError, KeyError, TypeError) as e:
+                    current_app.logger.warning('Discarding unreadable trending snapshot %s: %s', path, e)
+                    merged = self._new_summary()
+                merged.merge(self.local)
+                tmp_path = f'{path}.{os.getpid()}.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(merged.to_snapshot(), f, separators=(',', ':'))
+                os.replace(tmp_path, path)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return merged
+
+    def top(self, k):
+        """The `k` hottest hashtags as [TrendingHashtag], from the merged view plus unpublished local uses."""
+        with self._lock:
+            if self._top is None:
+                view = self._new_summary()
+                if self.shared is not None:
+                    view.merge(self.shared)
+                view.merge(self.local)
+                self._top = [TrendingHashtag(item, count) for item, count, _ in view.top(self.capacity)]
+            return self._top[:k]
+
+
+def get_trending_stream():
+    stream = current_app.extensions.get('trending_stream')
+    if stream is None:
+        stream = current_app.extensions.setdefault('trending_stream', TrendingStream(
+            current_app.config.get('TRENDING_STREAM_CAPACITY', DEFAULT_CAPACITY),
+            current_app.config.get('TRENDING_STREAM_HALF_LIFE', DEFAULT_HALF_LIFE)
+        ))
+    return stream
+
+
+def sync_trending_stream(force=False):
+    """Syncs this worker's stream with the shared snapshot if the last sync is older than TRENDING_STREAM_SYNC_SECONDS."""
+    stream = get_trending_stream()
+    interval = current_app.config.get('TRENDING_STREAM_SYNC_SECONDS', 30)
+    if force or stream.synced_at is None or time.monotonic() - stream.synced_at >= interval:
+        stream.sync(current_app.config.get('TRENDING_STREAM_SNAPSHOT_PATH'))
+    return stream
+
+
+def top_trending_hashtags(k):
+    return sync_trending_stream().top(k)
+
+
+# -------------------- Feeding the stream --------------------
+
+def record_hashtag_uses(session, tag_texts):
+    """Feeds uses of `tag_texts` to the stream when `session` commits (for usage rows inserted with Core)."""
+    session.info.setdefault('trending_uses', []).extend(tag_texts)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_hashtag_uses(session, flush_context):
+    uses = [obj for obj in session.new if isinstance(obj, HashtagUsage)]
+    if not uses:
+        return
+    # Usage rows are usually created by id next to their Hashtag, which is then already in the session
+    tag_texts = {}
+    for usage in uses:
+        hashtag = session.identity_map.get(identity_key(Hashtag, usage.hashtag_id))
+        if hashtag is not None:
+            tag_texts[usage.hashtag_id] = hashtag.tag_text
+    missing = {usage.hashtag_id for usage in uses} - tag_texts.keys()
+    if missing:
+        tag_texts.update(session.execute(select(Hashtag.id, Hashtag.tag_text).where(Hashtag.id.in_(missing))).all())
+    record_hashtag_uses(session, [
+        tag_texts[usage.hashtag_id] for usage in uses if usage.hashtag_id in tag_texts
+        for _ in range(usage.usage_count or 1)
+    ])
+
+
+@event.listens_for(Session, 'after_commit')
+def _record_hashtag_uses(session):
+    tags = session.info.pop('trending_uses', None)
+    if not tags or not has_app_context():
+        return
+    stream = current_app.extensions.get('trending_stream')
+    # A worker that has not synced yet will seed from the database, which already has these uses
+    if stream is not None and stream.synced_at is not None:
+        stream.record(tags)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_hashtag_uses(session):
+    session.info.pop('trending_uses', None)
@@ -0,0 +1,168 @@
+"""
+Who can see which posts, stories and profiles.
+
+The privacy rules (PRIVACY_PUBLIC / FOLLOWERS / CUSTOM_LIST / PRIVATE, publishing and
+moderation flags) live here once and are compiled into a single SQL predicate per query,
+so feeds, search and the API filter in the database and paginate the filtered result.
+
+A Viewer carries the requesting user's follow and friend-list memberships, loaded once
+per request and memoized on flask.g. The memberships are read from the database, not
+through the per-process followed-ids cache, so a follow or unfollow committed by another
+worker applies to the next request's privacy decisions. The predicates test those as plain id lists instead of correlated EXISTS
+subqueries per row; very large follow sets fall back to a subquery so the statement
+stays within the database's bound-parameter limits.
+"""
+from flask import g, has_request_context
+from sqlalchemy import select, or_, and_, false
+
+from app import db
+from app.core.models import (
+    Post, Story, User, followers, friend_list_members,
+    PRIVACY_PUBLIC, PRIVACY_FOLLOWERS, PRIVACY_CUSTOM_LIST
+)
+
+# Above this many ids a membership test is compiled as a subquery instead of an IN list
+INLINE_ID_LIMIT = 500
+
+
+class Viewer:
+    """The requesting user and the memberships their visibility depends on (anonymous if user_id is None)."""
+    def __init__(self, user_id=None, followed_ids=(), friend_list_ids=()):
+        self.user_id = user_id
+        self.followed_ids = frozenset(followed_ids)
+        self.friend_list_ids = frozenset(friend_list_ids)
+
+    @property
+    def is_anonymous(self):
+        return self.user_id is None
+
+    def __repr__(self):
+        return f'<Viewer {self.user_id}>'
+
+
+ANONYMOUS = Viewer()
+
+
+def get_viewer(user):
+    """
+    Returns the Viewer for `user`, which may be a User, Flask-Login's current_user
+    (anonymous or not), a Viewer, or None. Within a request it is loaded once per user
+    and reused; outside one (jobs, the scheduler) it is loaded on every call.
+    """
+    if isinstance(user, Viewer):
+        return user
+    if user is None or not getattr(user, 'is_authenticated', False):
+        return ANONYMOUS
+    user_id = user.id
+    if not has_request_context():
+        return _load_viewer(user_id)
+    viewers = g.setdefault('_viewers', {})
+    if user_id not in viewers:
+        viewers[user_id] = _load_viewer(user_id)
+    return viewers[user_id]
+
+
+def forget_viewers(exc=None):
+    """Drops the request's memoized Viewers; registered as a teardown_request handler."""
+    g.pop('_viewers', None)
+
+
+def forget_viewer(user_id):
+    """Drops the request's memoized Viewer for `user_id`, whose memberships changed."""
+    g.get('_viewers', {}).pop(user_id, None)
+
+
+def _load_viewer(user_id):
+    followed_ids = db.session.execute(
+        select(followers.c.followed_id).where(followers.c.follower_id == user_id)
+    ).scalars().all()
+    friend_list_ids = db.session.execute(
+        select(friend_list_members.c.friend_list_id).where(friend_list_members.c.user_id == user_id)
+    ).scalars().all()
+    return Viewer(user_id, followed_ids, friend_list_ids)
+
+
+def _followed_by(viewer, author_column):
+    if not viewer.followed_ids:
+        return false()
+    if len(viewer.followed_ids) > INLINE_ID_LIMIT:
+        return author_column.in_(select(followers.c.followed_id).where(followers.c.follower_id == viewer.user_id))
+    return author_column.in_(sorted(viewer.followed_ids))
+
+
+def _on_friend_list(viewer, list_column):
+    if not viewer.friend_list_ids:
+        return false()
+    if len(viewer.friend_list_ids) > INLINE_ID_LIMIT:
+        return list_column.in_(select(friend_list_members.c.friend_list_id).where(friend_list_members.c.user_id == viewer.user_id))
+    return list_column.in_(sorted(viewer.friend_list_ids))
+
+
+def _audience_filter(model, viewer):
+    """Privacy-level rules shared by posts and stories (publishing and ownership are handled by callers)."""
+    if viewer.is_anonymous:
+        return model.privacy_level == PRIVACY_PUBLIC
+    return or_(
+        model.privacy_level == PRIVACY_PUBLIC,
+        and_(model.privacy_level == PRIVACY_FOLLOWERS, _followed_by(viewer, model.user_id)),
+        and_(model.privacy_level == PRIVACY_CUSTOM_LIST, _on_friend_list(viewer, model.custom_friend_list_id))
+    )
+
+
+def post_visibility_filter(viewer):
+    """
+    SQL predicate for the posts `viewer` may see: all of their own posts (drafts, scheduled
+    and moderated ones included), plus published, unmoderated posts whose privacy level
+    admits them.
+    """
+    viewer = get_viewer(viewer)
+    published = and_(
+        Post.is_published == True,
+        Post.is_hidden_by_moderation == False,
+        _audience_filter(Post, viewer)
+    )
+    if viewer.is_anonymous:
+        return published
+    return or_(Post.user_id == viewer.user_id, published)
+
+
+def story_visibility_filter(viewer, now):
+    """
+    SQL predicate for the unexpired stories `viewer` may see: their own (including
+    scheduled ones) and published stories whose privacy level admits them.
+    """
+    viewer = get_viewer(viewer)
+    published = and_(Story.is_published == True, _audience_filter(Story, viewer))
+    if viewer.is_anonymous:
+        return and_(Story.expires_at > now, published)
+    return and_(Story.expires_at > now, or_(Story.user_id == viewer.user_id, published))
+
+
+def profile_visibility_filter(viewer):
+    """SQL predicate for the user profiles `viewer` may see (custom-list and private profiles are owner-only)."""
+    viewer = get_viewer(viewer)
+    if viewer.is_anonymous:
+        return User.profile_visibility == PRIVACY_PUBLIC
+    return or_(
+        User.id == viewer.user_id,
+        User.profile_visibility == PRIVACY_PUBLIC,
+        and_(User.profile_visibility == PRIVACY_FOLLOWERS, _followed_by(viewer, User.id))
+    )
+
+
+def can_view_post(viewer, post):
+    """In-memory equivalent of post_visibility_filter for a single, already loaded post."""
+    viewer = get_viewer(viewer)
+    if not viewer.is_anonymous and post.user_id == viewer.user_id:
+        return True
+    if not post.is_published or post.is_hidden_by_moderation:
+        return False
+    if post.privacy_level == PRIVACY_PUBLIC:
+        return True
+    if viewer.is_anonymous:
+        return False
+    if post.privacy_level == PRIVACY_FOLLOWERS:
+        return post.user_id in viewer.followed_ids
+    if post.privacy_level == PRIVACY_CUSTOM_LIST:
+        return post.custom_friend_list_id in viewer.friend_list_ids
+    return False
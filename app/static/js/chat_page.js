@@ -83,9 +83,9 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     }
 
-    function appendMessage(data) { // data is the new message object from server
-        if (noMessagesYetP) noMessagesYetP.style.display = 'none';
-
+    // Builds the element for a message object from the server (a new_chat_message event or a
+    // backfilled window), grouped under the sender of previousElement when it is the same sender.
+    function buildMessageElement(data, previousElement) {
         const messageDiv = document.createElement('div');
         messageDiv.classList.add('chat-message', 'mb-2');
         messageDiv.dataset.messageId = data.message_id;
@@ -94,14 +94,13 @@ document.addEventListener('DOMContentLoaded', function () {
         if (data.read_at) { // General read_at (first read by anyone/recipient in 1-1)
             messageDiv.dataset.readAt = data.read_at;
         }
-        // Note: is_read_by_current_user and read_at_by_current_user are not typically sent for brand new messages via socket.
-        // They are more relevant for initially loaded messages.
+        // is_read_by_current_user is only sent with backfilled windows; brand new messages are unread.
+        messageDiv.dataset.isReadByCurrentUser = data.is_read_by_current_user ? 'true' : 'false';
 
-        const lastMessageElement = messagesContainer.lastElementChild;
         let showSender = true;
-        if (lastMessageElement && lastMessageElement.classList.contains('chat-message')) {
-            const lastSenderId = parseInt(lastMessageElement.dataset.senderId);
-            const lastTimestampStr = lastMessageElement.dataset.timestamp;
+        if (previousElement && previousElement.classList.contains('chat-message')) {
+            const lastSenderId = parseInt(previousElement.dataset.senderId);
+            const lastTimestampStr = previousElement.dataset.timestamp;
             if (lastSenderId === data.sender_id) {
                 showSender = false;
                 if (lastTimestampStr) {
@@ -141,13 +140,18 @@ document.addEventListener('DOMContentLoaded', function () {
             const receiptSpan = document.createElement('span');
             receiptSpan.classList.add('read-receipt-status', 'ml-1');
             receiptSpan.dataset.messageId = data.message_id;
-            // For new messages via socket: data.read_at is the general read_at from ChatMessage model.
-            // It will be null if no one has read it yet.
+            // data.read_at is the general read_at from ChatMessage model; null if no one has read it yet.
             let initialStatus = data.read_at ? "✓✓ Read" : "✓ Sent";
             receiptSpan.innerHTML = `<small class="text-muted">${initialStatus}</small>`;
             messageDiv.appendChild(receiptSpan);
         }
+        return messageDiv;
+    }
+
+    function appendMessage(data) { // data is the new message object from server
+        if (noMessagesYetP) noMessagesYetP.style.display = 'none';
 
+        const messageDiv = buildMessageElement(data, messagesContainer.lastElementChild);
         messagesContainer.appendChild(messageDiv);
         messagesContainer.scrollTop = messagesContainer.scrollHeight;
 
@@ -156,6 +160,63 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     }
 
+    // Backfill: older windows are fetched by keyset cursor and prepended above the oldest message shown.
+    let earlierMessagesLink = document.getElementById('load-earlier-messages');
+    let loadingEarlierMessages = false;
+
+    function prependMessages(messages) {
+        const firstMessage = messagesContainer.querySelector('.chat-message');
+        const fragment = document.createDocumentFragment();
+        let previous = null;
+        messages.forEach(data => {
+            const messageDiv = buildMessageElement(data, previous);
+            fragment.appendChild(messageDiv);
+            previous = messageDiv;
+        });
+        const heightBefore = messagesContainer.scrollHeight;
+        if (firstMessage) messagesContainer.insertBefore(fragment, firstMessage);
+        else messagesContainer.appendChild(fragment);
+        messagesContainer.scrollTop += messagesContainer.scrollHeight - heightBefore; // Keep the current view in place
+
+        messages.forEach(data => {
+            if (data.sender_id !== currentUserId && !data.is_read_by_current_user) {
+                observeMessageForRead(messagesContainer.querySelector(`.chat-message[data-message-id="${data.message_id}"]`));
+            }
+        });
+    }
+
+    function loadEarlierMessages() {
+        if (!earlierMessagesLink || loadingEarlierMessages) return;
+        loadingEarlierMessages = true;
+        const url = `${messagesContainer.dataset.messagesUrl}?cursor=${encodeURIComponent(earlierMessagesLink.dataset.cursor)}`;
+        fetch(url, { headers: { 'Accept': 'application/json' }, credentials: 'same-origin' })
+            .then(response => {
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                return response.json();
+            })
+            .then(data => {
+                prependMessages(data.messages);
+                if (data.next_cursor) {
+                    earlierMessagesLink.dataset.cursor = data.next_cursor;
+                } else {
+                    earlierMessagesLink.parentElement.remove();
+                    earlierMessagesLink = null;
+                }
+            })
+            .catch(err => console.error('Could not load earlier messages:', err))
+            .finally(() => { loadingEarlierMessages = false; });
+    }
+
+    if (earlierMessagesLink) {
+        earlierMessagesLink.addEventListener('click', (e) => {
+            e.preventDefault();
+            loadEarlierMessages();
+        });
+        messagesContainer.addEventListener('scroll', () => {
+            if (messagesContainer.scrollTop < 40) loadEarlierMessages();
+        });
+    }
+
     function updateMessageReadStatusUI(messageId, readerUserId, conversationIdFromServer) {
         if (conversationIdFromServer !== conversationId) return;
 
@@ -173,6 +234,18 @@ document.addEventListener('DOMContentLoaded', function () {
         // No specific UI update for incoming messages when current user reads them (handled by observer sending event)
     }
 
+    // The reader's watermark covers every message up to it, including ones not in message_ids
+    function markOutgoingReadUpTo(watermarkTime, watermarkId, readerUserId) {
+        document.querySelectorAll('.chat-message').forEach(msgElement => {
+            if (parseInt(msgElement.dataset.senderId) !== currentUserId) return;
+            const messageId = parseInt(msgElement.dataset.messageId);
+            const messageTime = Date.parse(msgElement.dataset.timestamp);
+            if (messageTime < watermarkTime || (messageTime === watermarkTime && messageId <= watermarkId)) {
+                updateMessageReadStatusUI(messageId, readerUserId, conversationId);
+            }
+        });
+    }
+
     function initializeMessageStatuses() {
         document.querySelectorAll('.chat-message').forEach(msgElement => {
             const senderId = parseInt(msgElement.dataset.senderId);
@@ -232,6 +305,9 @@ document.addEventListener('DOMContentLoaded', function () {
     socket.on('messages_read_update', (data) => {
         if (data.conversation_id && data.conversation_id.toString() === conversationId) {
             data.message_ids.forEach(msgId => updateMessageReadStatusUI(msgId, data.reader_user_id, data.conversation_id));
+            if (data.last_read_timestamp && data.reader_user_id !== currentUserId) {
+                markOutgoingReadUpTo(Date.parse(data.last_read_timestamp), data.last_read_message_id, data.reader_user_id);
+            }
         }
     });
 
@@ -313,7 +389,7 @@ document.addEventListener('DOMContentLoaded', function () {
     }
 
     if (emojiToggleButton && emojiPanel) {
-        emojiToggleButton.addEventListener('click', ()_ => {
+        emojiToggleButton.addEventListener('click', () => {
             emojiPanel.style.display = emojiPanel.style.display === 'none' ? 'block' : 'none';
         });
     }
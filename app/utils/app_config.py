@@ -0,0 +1,9 @@
+"""Reading the app's configuration from code that also runs outside an application context."""
+from flask import current_app, has_app_context
+
+
+def config_value(key, default):
+    """current_app.config[key] (or `default` if unset), or `default` outside an application context."""
+    if has_app_context():
+        return current_app.config.get(key, default)
+    return default
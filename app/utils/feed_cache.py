@@ -0,0 +1,55 @@
+import hashlib
+import time
+
+from app import cache
+
+# Per-user memoization for feed reads (User.followed_posts).
+#
+# Every user has a "feed generation" token that changes whenever something that can
+# appear in other people's feeds changes: their posts, their shares, or (for their own
+# feed) who they follow. A memoized feed page is keyed on the reader's token plus the
+# tokens of everyone they follow, so a write invalidates exactly the affected feeds with
+# one cache write instead of one per follower.
+
+FEED_CACHE_TIMEOUT = 300 # 5 minutes
+_GENERATION_KEY = 'feed_gen:{}'
+_FOLLOWED_IDS_KEY = 'feed_followed_ids:{}:{}'
+
+
+def get_feed_generation(user_id):
+    return cache.get(_GENERATION_KEY.format(user_id)) or 0
+
+
+def get_feed_generations(user_ids):
+    """Feed generation tokens of `user_ids`, in order, in one cache round trip (0 where unset)."""
+    if not user_ids:
+        return []
+    return [generation or 0 for generation in cache.get_many(*[_GENERATION_KEY.format(u) for u in user_ids])]
+
+
+def bump_feed_generation(*user_ids):
+    """Invalidates memoized feeds that include content from (or the follow graph of) `user_ids`."""
+    # A fresh token rather than an increment, so an evicted counter can never reuse an old value
+    token = time.time_ns()
+    for user_id in set(user_ids):
+        if user_id is not None:
+            cache.set(_GENERATION_KEY.format(user_id), token, timeout=0)
+
+
+def get_cached_followed_ids(user_id, loader):
+    """Returns the ids `user_id` follows, memoized until their follow graph changes."""
+    key = _FOLLOWED_IDS_KEY.format(user_id, get_feed_generation(user_id))
+    followed_ids = cache.get(key)
+    if followed_ids is None:
+        followed_ids = list(loader())
+        cache.set(key, followed_ids, timeout=FEED_CACHE_TIMEOUT)
+    return followed_ids
+
+
+def feed_cache_key(prefix, user_id, author_ids, *args):
+    """Builds a memo key that changes whenever the reader's or any author's generation does."""
+    generations = cache.get_many(*[_GENERATION_KEY.format(a) for a in author_ids]) if author_ids else []
+    digest = hashlib.sha1(
+        repr((get_feed_generation(user_id), sorted(zip(author_ids, generations), key=lambda g: g[0]))).encode('utf-8')
+    ).hexdigest()
+    return f'{prefix}:{user_id}:{digest}:' + ':'.join(str(a) for a in args)
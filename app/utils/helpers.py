@@ -3,6 +3,7 @@ import secrets
 from functools import wraps
 from flask import current_app, redirect, url_for, flash, abort
 from PIL import Image
+from werkzeug.local import LocalProxy
 from werkzeug.utils import secure_filename
 import re
 import magic
@@ -20,11 +21,17 @@ try:
 except ImportError:
     MUTAGEN_AVAILABLE = False
 
-from sqlalchemy import func, desc, not_, and_, or_, distinct
+from sqlalchemy import func, desc, not_, and_, or_, distinct, select, insert, literal, exists
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
 from app import db
-from app.core.models import User, Post, Reaction, Comment, Hashtag, Group, GroupMembership, followers, Mention, HistoricalAnalytics, post_hashtags, Article, Event as AppEvent, UserSubscription, SubscriptionPlan, UserPoints, ActivityLog
+from app.core.models import User, Post, Reaction, Comment, Hashtag, HashtagUsage, Group, GroupMembership, followers, Mention, HistoricalAnalytics, post_hashtags, Article, Event as AppEvent, UserSubscription, SubscriptionPlan, UserPoints, ActivityLog
 from datetime import datetime, timedelta, timezone
 from app.utils.gamification_utils import check_and_award_badges, update_user_level
+from app.services.search_service import index_search_rows
+from app.services.trending_stream import record_hashtag_uses
+from app.services.mention_links import render_mentions
+from app.services.recommendation_service import get_recommendations as read_recommendations
 from icalendar import Calendar, Event as IcsEvent
 
 ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
@@ -318,232 +325,104 @@ from app.core.models import Notification
 from app.core.forms import SearchForm
 
 def inject_unread_notification_count():
-    if current_user.is_authenticated:
-        count = Notification.query.filter_by(recipient_id=current_user.id, is_read=False).count()
-    else:
-        count = 0
-    return {'unread_notification_count': count}
+    # Read the (cached) count only if the template actually renders it, and at most once per render
+    count = []
+
+    def _count():
+        if not count:
+            from app.services.notification_service import get_unread_count
+            count.append(get_unread_count(current_user.id) if current_user.is_authenticated else 0)
+        return count[0]
+    return {'unread_notification_count': LocalProxy(_count)}
 
 def inject_search_form():
     form = SearchForm()
     return {'search_form': form}
 
-def process_hashtags(post_body, post_object):
-    post_object.hashtags = []
-    hashtag_regex = r"#([a-zA-Z0-9_]+)"
-    found_tags_texts = re.findall(hashtag_regex, post_body)
+HASHTAG_RE = re.compile(r"#([a-zA-Z0-9_]+)")
+MENTION_RE = re.compile(r"@(\w+)")
 
-    for tag_text in set(found_tags_texts):
-        normalized_tag = tag_text.lower()
-        hashtag = Hashtag.query.filter_by(tag_text=normalized_tag).first()
-        if not hashtag:
-            hashtag = Hashtag(tag_text=normalized_tag)
-            db.session.add(hashtag)
-            db.session.flush()
 
-        if hashtag not in post_object.hashtags:
-             post_object.hashtags.append(hashtag)
-
-        usage = HashtagUsage(hashtag_id=hashtag.id)
-        db.session.add(usage)
-
-def process_mentions(text_content: str, owner_object, actor_user: User) -> list[User]:
-    mentioned_users_objects = []
-    if not text_content:
-        return mentioned_users_objects
-
-    potential_usernames = set(re.findall(r"@(\w+)", text_content))
-
-    for username in potential_usernames:
-        tagged_user = User.query.filter(func.lower(User.username) == username.lower()).first()
-
-        if tagged_user:
-            mention = Mention(
-                user_id=tagged_user.id,
-                actor_id=actor_user.id
-            )
+def _insert_missing_hashtags(tag_texts):
+    """
+    Inserts the hashtags in `tag_texts` in one statement, skipping any that a concurrent
+    transaction created first. Core inserts bypass the session hooks, so the new rows
+    are added to the search index here.
+    """
+    connection = db.session.connection()
+    table = Hashtag.__table__
+    rows = [{'tag_text': tag_text, 'last_used': datetime.utcnow()} for tag_text in sorted(tag_texts)]
+    dialect_insert = {'sqlite': sqlite_insert, 'postgresql': postgresql_insert}.get(connection.dialect.name)
+    if dialect_insert is not None:
+        connection.execute(dialect_insert(table).on_conflict_do_nothing(index_elements=[table.c.tag_text]), rows)
+    else:
+        for row in rows:
+            connection.execute(insert(table).from_select(
+                ['tag_text', 'last_used'],
+                select(literal(row['tag_text']), literal(row['last_used'])).where(
+                    ~exists().where(table.c.tag_text == row['tag_text'])
+                )
+            ))
+    inserted = connection.execute(select(table.c.id, table.c.tag_text).where(table.c.tag_text.in_(tag_texts))).all()
+    index_search_rows(connection, 'hashtags', [(tag_id, {'tag_text': tag_text}) for tag_id, tag_text in inserted])
 
-            if isinstance(owner_object, Post):
-                mention.post_id = owner_object.id
-            elif isinstance(owner_object, Comment):
-                mention.comment_id = owner_object.id
-            else:
-                current_app.logger.warning(f"process_mentions called with invalid owner_object type: {type(owner_object)}")
-                continue
 
-            db.session.add(mention)
-            mentioned_users_objects.append(tagged_user)
+def process_hashtags(post_body, post_object):
+    """
+    Links `post_object` to the hashtags in `post_body` and records one HashtagUsage per
+    tag. One IN lookup finds the existing tags and one insert creates the missing ones,
+    however many tags the post has.
+    """
+    post_object.hashtags = []
+    tag_texts = {tag_text.lower() for tag_text in HASHTAG_RE.findall(post_body or '')}
+    if not tag_texts:
+        return
 
-    return mentioned_users_objects
+    hashtags = {hashtag.tag_text: hashtag for hashtag in Hashtag.query.filter(Hashtag.tag_text.in_(tag_texts))}
+    missing = tag_texts - hashtags.keys()
+    if missing:
+        _insert_missing_hashtags(missing)
+        hashtags.update({hashtag.tag_text: hashtag for hashtag in Hashtag.query.filter(Hashtag.tag_text.in_(missing))})
 
-from markupsafe import Markup, escape
+    ordered = [hashtags[tag_text] for tag_text in sorted(tag_texts)]
+    post_object.hashtags = ordered # Flushed as one executemany into post_hashtags
+    # One executemany; ORM-added rows would each need their own INSERT ... RETURNING id
+    db.session.execute(insert(HashtagUsage), [{'hashtag_id': hashtag.id} for hashtag in ordered])
+    record_hashtag_uses(db.session, [hashtag.tag_text for hashtag in ordered])
 
-def linkify_mentions(text_content):
+def process_mentions(text_content: str, owner_object, actor_user: User) -> list[User]:
+    """
+    Creates a Mention for each existing user @mentioned in `text_content` and returns
+    those users in order of first mention. All names are resolved with one
+    case-insensitive IN lookup (backed by ix_user_username_lower).
+    """
     if not text_content:
-        return Markup('')
-
-    segments = []
-    last_end = 0
-    for match in re.finditer(r"@(\w+)", text_content):
-        segments.append(escape(text_content[last_end:match.start()]))
-
-        username_match = match.group(1)
-        user = User.query.filter(func.lower(User.username) == username_match.lower()).first()
-
-        if user:
-            profile_url = url_for('main.profile', username=user.username)
-            segments.append(f'<a href="{escape(profile_url)}">@{escape(user.username)}</a>')
-        else:
-            segments.append(escape(match.group(0)))
-
-        last_end = match.end()
-
-    segments.append(escape(text_content[last_end:]))
-
-    return Markup("".join(segments))
-
-def get_recommendations(user_id):
-    user = User.query.get(user_id)
-    if not user:
-        return {'posts': [], 'users': [], 'groups': []}
-
-    recommended_posts = recommend_posts(user)
-    recommended_users = recommend_users(user)
-    recommended_groups = recommend_groups(user)
-
-    return {
-        'posts': recommended_posts,
-        'users': recommended_users,
-        'groups': recommended_groups
-    }
-
-def recommend_posts(user, limit=5):
-    if not user:
         return []
-
-    liked_hashtags_q = db.session.query(distinct(Hashtag.id)).select_from(Reaction)\
-        .join(Post, Reaction.post_id == Post.id)\
-        .join(Post.hashtags)\
-        .filter(Reaction.user_id == user.id, Reaction.reaction_type == 'like')
-
-    commented_hashtags_q = db.session.query(distinct(Hashtag.id)).select_from(Comment)\
-        .join(Post, Comment.post_id == Post.id) \
-        .join(Post.hashtags)\
-        .filter(Comment.user_id == user.id)
-
-    user_interest_hashtag_ids = set([h_id for (h_id,) in liked_hashtags_q.all()] + \
-                                    [h_id for (h_id,) in commented_hashtags_q.all()])
-
-    if not user_interest_hashtag_ids:
+    if isinstance(owner_object, Post):
+        owner = {'post': owner_object}
+    elif isinstance(owner_object, Comment):
+        owner = {'comment': owner_object}
+    else:
+        current_app.logger.warning(f"process_mentions called with invalid owner_object type: {type(owner_object)}")
         return []
 
-    liked_post_ids = {reaction.post_id for reaction in user.reactions.filter_by(reaction_type='like') if reaction.post_id is not None}
-    commented_post_ids = {comment.post_id for comment in user.comments if hasattr(comment, 'post_id') and comment.post_id is not None}
-    authored_post_ids = {post.id for post in user.posts if post.id is not None}
-
-    excluded_post_ids = liked_post_ids.union(commented_post_ids).union(authored_post_ids)
-
-    matching_hashtags_subquery = db.session.query(
-        Post.id.label('post_id'),
-        func.count(distinct(Hashtag.id)).label('score')
-    ).join(Post.hashtags).filter(Hashtag.id.in_(user_interest_hashtag_ids)).group_by(Post.id).subquery()
-
-    recommended_posts_query = db.session.query(Post, matching_hashtags_subquery.c.score).\
-        join(matching_hashtags_subquery, Post.id == matching_hashtags_subquery.c.post_id).\
-        filter(not_(Post.id.in_(excluded_post_ids))).\
-        filter(Post.user_id != user.id).\
-        order_by(desc(matching_hashtags_subquery.c.score), desc(Post.timestamp))
-
-    final_recommendations = recommended_posts_query.limit(limit).all()
-
-    return [post for post, score in final_recommendations]
-
-def recommend_users(user, limit=5):
-    if not user:
+    names = list(dict.fromkeys(username.lower() for username in MENTION_RE.findall(text_content)))
+    if not names:
         return []
+    users = {user.username.lower(): user for user in User.query.filter(func.lower(User.username).in_(names))}
+    mentioned_users_objects = [users[name] for name in names if name in users]
+    db.session.add_all([
+        Mention(user_id=user.id, actor_id=actor_user.id, **owner) for user in mentioned_users_objects
+    ])
+    return mentioned_users_objects
 
-    suggested_users_scores = {}
-    already_followed_ids = {followed.id for followed in user.followed}
-
-    if user.followed:
-        mutual_connections_query = db.session.query(
-            User, func.count(followers.c.follower_id).label('mutual_score')
-        ).select_from(User).join(followers, User.id == followers.c.followed_id)\
-         .filter(followers.c.follower_id.in_([f.id for f in user.followed])) \
-         .filter(User.id != user.id) \
-         .filter(not_(User.id.in_(already_followed_ids))) \
-         .group_by(User.id)
-
-        for u, score in mutual_connections_query.all():
-            suggested_users_scores[u.id] = suggested_users_scores.get(u.id, {'user': u, 'score': 0})
-            suggested_users_scores[u.id]['score'] += score
-
-    user_group_ids = {membership.group_id for membership in user.group_memberships}
-    if user_group_ids:
-        shared_groups_query = db.session.query(
-            User, func.count(distinct(GroupMembership.group_id)).label('shared_group_score')
-        ).select_from(User).join(GroupMembership, User.id == GroupMembership.user_id)\
-         .filter(GroupMembership.group_id.in_(user_group_ids))\
-         .filter(User.id != user.id)\
-         .filter(not_(User.id.in_(already_followed_ids))) \
-         .group_by(User.id)
-
-        for u, score in shared_groups_query.all():
-            suggested_users_scores[u.id] = suggested_users_scores.get(u.id, {'user': u, 'score': 0})
-            suggested_users_scores[u.id]['score'] += score
-
-    valid_suggestions = [s for s in suggested_users_scores.values() if s['score'] > 0]
-
-    sorted_suggestions = sorted(valid_suggestions, key=lambda x: x['user'].username)
-    sorted_suggestions = sorted(sorted_suggestions, key=lambda x: x['score'], reverse=True)
-
-    return [item['user'] for item in sorted_suggestions[:limit]]
-
-def recommend_groups(user, limit=5):
-    if not user:
-        return []
+def linkify_mentions(text_content):
+    """Jinja filter: escapes `text_content` and links each @mention of an existing user to their profile."""
+    return render_mentions(text_content)
 
-    suggested_groups_scores = {}
-    user_member_of_group_ids = {membership.group_id for membership in user.group_memberships}
-
-    liked_post_hashtags_ids_q = db.session.query(distinct(Hashtag.id)).select_from(Reaction)\
-        .join(Post, Reaction.post_id == Post.id)\
-        .join(Post.hashtags)\
-        .filter(Reaction.user_id == user.id, Reaction.reaction_type == 'like')
-    liked_post_hashtags_ids = {h_id for (h_id,) in liked_post_hashtags_ids_q.all()}
-
-    if liked_post_hashtags_ids:
-        interest_based_groups_query = db.session.query(
-            Group, func.count(distinct(Hashtag.id)).label('interest_score')
-        ).select_from(Group).join(Post, Post.group_id == Group.id)\
-         .join(Post.hashtags)\
-         .filter(Hashtag.id.in_(liked_post_hashtags_ids))\
-         .filter(not_(Group.id.in_(user_member_of_group_ids)))\
-         .group_by(Group.id)
-
-        for group, score in interest_based_groups_query.all():
-            suggested_groups_scores[group.id] = suggested_groups_scores.get(group.id, {'group': group, 'score': 0})
-            suggested_groups_scores[group.id]['score'] += score
-
-    followed_user_ids = {followed.id for followed in user.followed}
-    if followed_user_ids:
-        social_based_groups_query = db.session.query(
-            Group, func.count(distinct(GroupMembership.user_id)).label('social_score')
-        ).select_from(Group).join(GroupMembership, Group.id == GroupMembership.group_id)\
-         .filter(GroupMembership.user_id.in_(followed_user_ids))\
-         .filter(not_(Group.id.in_(user_member_of_group_ids)))\
-         .group_by(Group.id)
-
-        for group, score in social_based_groups_query.all():
-            suggested_groups_scores[group.id] = suggested_groups_scores.get(group.id, {'group': group, 'score': 0})
-            suggested_groups_scores[group.id]['score'] += score
-
-    valid_suggestions = [s for s in suggested_groups_scores.values() if s['score'] > 0]
-
-    sorted_suggestions = sorted(valid_suggestions, key=lambda x: x['group'].name)
-    sorted_suggestions = sorted(sorted_suggestions, key=lambda x: x['score'], reverse=True)
-
-    return [item['group'] for item in sorted_suggestions[:limit]]
+def get_recommendations(user_id, limit_posts=5, limit_users=5, limit_groups=5):
+    """Posts, users and groups to recommend to `user_id`, read from the precomputed candidates."""
+    return read_recommendations(user_id, limit_posts=limit_posts, limit_users=limit_users, limit_groups=limit_groups)
 
 def award_points(user, action_name, points, related_item=None):
     if not user or not user.is_authenticated:
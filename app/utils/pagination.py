@@ -0,0 +1,84 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+
+def encode_cursor(timestamp, *ids):
+    """
+    Encodes a (timestamp, id, ...) sort key into an opaque, URL-safe cursor string.
+    """
+    payload = [timestamp.isoformat() if timestamp is not None else None] + [int(i) for i in ids]
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, id_count=1):
+    """
+    Decodes a cursor produced by encode_cursor back into (timestamp, id, ...).
+    Returns None for a missing or malformed cursor so callers fall back to the first page.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw.decode('utf-8'))
+        if not isinstance(payload, list) or len(payload) != id_count + 1:
+            return None
+        timestamp = datetime.fromisoformat(payload[0])
+        ids = tuple(int(i) for i in payload[1:])
+    except (binascii.Error, ValueError, TypeError, UnicodeDecodeError):
+        return None
+    if timestamp.tzinfo is not None:
+        # Stored timestamps are naive UTC (SQLite drops the offset)
+        timestamp = timestamp.replace(tzinfo=None)
+    return (timestamp,) + ids
+
+
+class CursorPage:
+    """
+    A page of keyset-paginated results. Mirrors the parts of Flask-SQLAlchemy's
+    Pagination that templates use (items, has_next) plus the cursor for the next page.
+    """
+    def __init__(self, items, per_page, next_cursor=None, cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.cursor = cursor # The cursor this page was requested with (None for the first page)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def is_first_page(self):
+        return self.cursor is None
+
+
+def keyset_paginate(query, timestamp_column, id_column, cursor=None, per_page=20, ascending=False):
+    """
+    Paginates `query` on the (timestamp_column, id_column) keyset instead of OFFSET.
+
+    The id column breaks timestamp ties, so the order is total and stable: rows inserted
+    while a client is paging only ever appear in front of the first page, never shift
+    later pages. The key columns may belong to a joined table (e.g. Bookmark.timestamp for
+    a Post query). Only per_page + 1 rows past the cursor are read, however deep the page.
+    """
+    after = decode_cursor(cursor)
+    key = tuple_(timestamp_column, id_column)
+    if after:
+        query = query.filter(key > tuple_(*after) if ascending else key < tuple_(*after))
+    if ascending:
+        query = query.order_by(None).order_by(timestamp_column.asc(), id_column.asc())
+    else:
+        query = query.order_by(None).order_by(timestamp_column.desc(), id_column.desc())
+
+    rows = query.add_columns(timestamp_column, id_column).limit(per_page + 1).all()
+    items = [row[0] for row in rows[:per_page]]
+    next_cursor = None
+    if len(rows) > per_page:
+        last = rows[per_page - 1]
+        next_cursor = encode_cursor(last[-2], last[-1])
+    return CursorPage(items, per_page, next_cursor=next_cursor, cursor=cursor if after else None)
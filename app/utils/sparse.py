@@ -0,0 +1,166 @@
+"""
+Compressed sparse row (CSR) matrices backed by the standard library's array module.
+
+Interaction data (users x hashtags, users x groups, the follow graph) has a handful of
+non-zeros per row out of millions of columns, so it is stored as three flat arrays:
+row i's column positions are indices[indptr[i]:indptr[i + 1]] (ascending), with their
+values at the same positions of data. Products work a whole batch of rows at a time
+(Gustavson's row-by-row algorithm), touching only non-zeros.
+
+Rows and columns are dense positions; IdIndex maps database ids to them and back.
+"""
+import heapq
+import math
+from array import array
+
+
+class IdIndex:
+    """Database ids <-> dense positions 0..n-1, in first-seen order."""
+    def __init__(self, ids=()):
+        self.ids = array('q')
+        self._positions = {}
+        for entity_id in ids:
+            self.add(entity_id)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, entity_id):
+        return entity_id in self._positions
+
+    def add(self, entity_id):
+        position = self._positions.get(entity_id)
+        if position is None:
+            position = self._positions[entity_id] = len(self.ids)
+            self.ids.append(entity_id)
+        return position
+
+    def position(self, entity_id):
+        return self._positions.get(entity_id)
+
+
+class CSRMatrix:
+    """An immutable n_rows x n_cols sparse matrix of floats."""
+    __slots__ = ('n_rows', 'n_cols', 'indptr', 'indices', 'data')
+
+    def __init__(self, n_rows, n_cols, indptr, indices, data):
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+    @classmethod
+    def from_triples(cls, n_rows, n_cols, triples):
+        """Builds a matrix from (row, col, value) triples in any order; duplicates are summed."""
+        rows = {}
+        for row, col, value in triples:
+            cols = rows.setdefault(row, {})
+            cols[col] = cols.get(col, 0.0) + value
+        indptr, indices, data = array('q', [0]), array('q'), array('d')
+        for row in range(n_rows):
+            cols = rows.get(row)
+            if cols:
+                for col in sorted(cols):
+                    indices.append(col)
+                    data.append(cols[col])
+            indptr.append(len(indices))
+        return cls(n_rows, n_cols, indptr, indices, data)
+
+    @classmethod
+    def from_rows(cls, n_cols, rows):
+        """Builds a matrix from one {col: value} dict per row."""
+        indptr, indices, data = array('q', [0]), array('q'), array('d')
+        for cols in rows:
+            for col in sorted(cols):
+                indices.append(col)
+                data.append(cols[col])
+            indptr.append(len(indices))
+        return cls(len(indptr) - 1, n_cols, indptr, indices, data)
+
+    @property
+    def nnz(self):
+        return len(self.indices)
+
+    def row(self, i):
+        """(column positions, values) of row `i`."""
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return self.indices[start:end], self.data[start:end]
+
+    def row_dict(self, i):
+        return dict(zip(*self.row(i)))
+
+    def transpose(self):
+        counts = array('q', [0]) * (self.n_cols + 1)
+        for col in self.indices:
+            counts[col + 1] += 1
+        for col in range(self.n_cols):
+            counts[col + 1] += counts[col]
+        indptr = array('q', counts)
+        indices = array('q', [0]) * self.nnz
+        data = array('d', [0.0]) * self.nnz
+        next_free = counts
+        for row in range(self.n_rows):
+            for k in range(self.indptr[row], self.indptr[row + 1]):
+                col = self.indices[k]
+                slot = next_free[col]
+                indices[slot] = row
+                data[slot] = self.data[k]
+                next_free[col] = slot + 1
+        return CSRMatrix(self.n_cols, self.n_rows, indptr, indices, data)
+
+    def row_counts(self):
+        """Number of non-zeros in each row."""
+        return array('q', (self.indptr[row + 1] - self.indptr[row] for row in range(self.n_rows)))
+
+    def column_counts(self):
+        """Number of non-zeros in each column."""
+        counts = array('q', [0]) * self.n_cols
+        for col in self.indices:
+            counts[col] += 1
+        return counts
+
+    def scale_columns(self, factors):
+        data = array('d', (value * factors[col] for col, value in zip(self.indices, self.data)))
+        return CSRMatrix(self.n_rows, self.n_cols, self.indptr, self.indices, data)
+
+    def scale_rows(self, factors):
+        data = array('d', self.data)
+        for row in range(self.n_rows):
+            factor = factors[row]
+            for k in range(self.indptr[row], self.indptr[row + 1]):
+                data[k] *= factor
+        return CSRMatrix(self.n_rows, self.n_cols, self.indptr, self.indices, data)
+
+    def normalize_rows(self):
+        """Rows scaled to unit L2 norm (empty rows stay empty), so row dot products are cosines."""
+        factors = array('d')
+        for row in range(self.n_rows):
+            norm = math.sqrt(sum(value * value for value in self.data[self.indptr[row]:self.indptr[row + 1]]))
+            factors.append(1.0 / norm if norm else 0.0)
+        return self.scale_rows(factors)
+
+    def dot_rows(self, rows, other):
+        """Yields (row, {col: value}) for each of `rows` of self . other, non-zeros only."""
+        for row in rows:
+            accumulator = {}
+            for k in range(self.indptr[row], self.indptr[row + 1]):
+                col, value = self.indices[k], self.data[k]
+                for j in range(other.indptr[col], other.indptr[col + 1]):
+                    target = other.indices[j]
+                    accumulator[target] = accumulator.get(target, 0.0) + value * other.data[j]
+            yield row, accumulator
+
+    def dot(self, other):
+        """The matrix product self . other."""
+        if self.n_cols != other.n_rows:
+            raise ValueError(f'Cannot multiply {self.n_rows}x{self.n_cols} by {other.n_rows}x{other.n_cols}')
+        return CSRMatrix.from_rows(other.n_cols, (cols for _, cols in self.dot_rows(range(self.n_rows), other)))
+
+
+def top_n(scores, n, exclude=()):
+    """The `n` (position, score) pairs with the highest positive scores, skipping positions in `exclude`."""
+    return heapq.nlargest(
+        n, ((position, score) for position, score in scores.items() if score > 0 and position not in exclude),
+        key=lambda item: (item[1], item[0])
+    )
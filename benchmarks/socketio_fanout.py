@@ -0,0 +1,103 @@
+"""
+Socket.IO fan-out throughput across worker processes sharing a message queue.
+
+Starts N worker processes, each a Socket.IO server on the queue with its share of
+--users connected clients (user u on worker u % N, each in its own room, as the app's
+notification rooms are). The publisher then emits --events notifications addressed to
+every user's room, in batches of --batch rooms per emit as the group fan-out does, and
+the clock stops when every worker has delivered all of its packets.
+
+    python benchmarks/socketio_fanout.py --workers 1 2 4
+    python benchmarks/socketio_fanout.py --queue redis://localhost:6379/0 --workers 4
+
+Without --queue the in-repo stand-in broker (app.services.socket_broker) is started on
+a free port.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import socketio # noqa: E402
+
+from app.services.socket_broker import LocalBroker # noqa: E402
+
+
+def _worker(url, channel, index, workers, users, events, ready, results):
+    server = socketio.Server(async_mode='threading', client_manager=socketio.RedisManager(url, channel=channel))
+    user_ids = range(index, users, workers)
+    expected = len(user_ids) * events
+    delivered = [0]
+
+    def send(eio_sid, eio_packet):
+        # Stands in for the websocket write: count instead of sending
+        delivered[0] += 1
+        if delivered[0] == expected:
+            results.put(time.monotonic())
+    server._send_eio_packet = send
+
+    for user_id in user_ids:
+        sid = server.manager.connect(f'eio-{user_id}', '/')
+        server.manager.basic_enter_room(sid, '/', str(user_id))
+    server.manager_initialized = True
+    server.manager.initialize()
+    ready.put(index)
+    while True:
+        time.sleep(3600)
+
+
+def run(url, workers, users, events, batch):
+    channel = f'bench-{uuid.uuid4().hex}'
+    context = multiprocessing.get_context('spawn')
+    ready, results = context.Queue(), context.Queue()
+    processes = [context.Process(target=_worker, args=(url, channel, index, workers, users, events, ready, results),
+                                 daemon=True) for index in range(workers)]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        ready.get(timeout=120)
+    time.sleep(0.5) # Let the queue listeners subscribe
+
+    publisher = socketio.RedisManager(url, channel=channel, write_only=True)
+    rooms = [str(user_id) for user_id in range(users)]
+    start = time.monotonic()
+    for event in range(events):
+        for offset in range(0, users, batch):
+            publisher.emit('new_notification', {'type': 'new_group_post', 'post_id': event}, namespace='/',
+                           room=rooms[offset:offset + batch])
+    published = time.monotonic()
+    finished = max(results.get(timeout=600) for _ in processes)
+    for process in processes:
+        process.terminate()
+    return published - start, finished - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--queue', help='Message queue URL (default: a local stand-in broker)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--users', type=int, default=20000, help='Connected clients, across all workers')
+    parser.add_argument('--events', type=int, default=20, help='Notifications sent to every user')
+    parser.add_argument('--batch', type=int, default=500, help='Rooms per emit (NOTIFICATION_FANOUT_EMIT_BATCH)')
+    args = parser.parse_args(argv)
+
+    broker = None
+    url = args.queue
+    if url is None:
+        broker = LocalBroker(port=0).start()
+        url = broker.url
+    print(f'queue {url}: {args.users} users, {args.events} events, {args.batch} rooms per emit')
+    print(f'{"workers":>8} {"publish s":>10} {"total s":>9} {"deliveries/s":>14}')
+    for workers in args.workers:
+        publish_seconds, total_seconds = run(url, workers, args.users, args.events, args.batch)
+        print(f'{workers:>8} {publish_seconds:>10.2f} {total_seconds:>9.2f} {args.users * args.events / total_seconds:>14,.0f}')
+    if broker is not None:
+        broker.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -27,6 +27,11 @@ class Config:
     CLAMAV_PORT = int(os.environ.get('CLAMAV_PORT', 3310))
     CLAMAV_TIMEOUT = int(os.environ.get('CLAMAV_TIMEOUT', 30))
 
+    # Flask-Caching. SimpleCache is per process: with several worker processes use a shared backend
+    # (CACHE_TYPE=RedisCache and CACHE_REDIS_URL) so a commit's cache invalidations reach every process
+    CACHE_TYPE = os.environ.get('CACHE_TYPE', 'SimpleCache')
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+
     # Flask-Mail configuration
     MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.googlemail.com')
     MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
@@ -58,10 +63,85 @@ class Config:
     MODERATION_CATEGORIES_AUTO_BLOCK = [category.strip() for category in _auto_block_categories_str.split(',')]
     MODERATION_ENABLED = os.environ.get('MODERATION_ENABLED', 'True').lower() == 'true'
 
+    # Home timeline (fan-out-on-write). Authors above the follower threshold are read at request time instead.
+    TIMELINE_FANOUT_MAX_FOLLOWERS = int(os.environ.get('TIMELINE_FANOUT_MAX_FOLLOWERS', 5000))
+    TIMELINE_BACKFILL_LIMIT = int(os.environ.get('TIMELINE_BACKFILL_LIMIT', 200)) # Posts copied in on a new follow
+
+    # Search backend: 'auto' (FTS5 on SQLite, substring matching elsewhere), 'fts5', 'like' or a registered backend
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'auto')
+    SEARCH_RESULTS_PER_PAGE = int(os.environ.get('SEARCH_RESULTS_PER_PAGE', 20))
+    # Typo-tolerant (?fuzzy=1) name search: RapidFuzz scores at most FUZZY_SEARCH_MAX_CANDIDATES trigram-pruned names
+    FUZZY_SEARCH_MIN_SCORE = int(os.environ.get('FUZZY_SEARCH_MIN_SCORE', 70)) # 0-100 WRatio cutoff
+    FUZZY_SEARCH_MAX_CANDIDATES = int(os.environ.get('FUZZY_SEARCH_MAX_CANDIDATES', 5000))
+    FUZZY_SEARCH_MAX_RESULTS = int(os.environ.get('FUZZY_SEARCH_MAX_RESULTS', 200))
+    FUZZY_SEARCH_INDEX_TTL = int(os.environ.get('FUZZY_SEARCH_INDEX_TTL', 300)) # Seconds before a worker rebuilds its name arrays
+
+    # Trending hashtags: a streaming top-K summary of decayed hashtag use counts, merged across workers
+    TRENDING_HASHTAGS_LIMIT = int(os.environ.get('TRENDING_HASHTAGS_LIMIT', 100))
+    TRENDING_STREAM_CAPACITY = int(os.environ.get('TRENDING_STREAM_CAPACITY', 1000)) # Hashtags tracked per summary
+    TRENDING_STREAM_HALF_LIFE = int(os.environ.get('TRENDING_STREAM_HALF_LIFE', 6 * 3600)) # Seconds for a use to lose half its weight
+    # Shared by a deployment's workers: a writable path outside the source tree (unset: each worker sees only its own uses)
+    TRENDING_STREAM_SNAPSHOT_PATH = os.environ.get('TRENDING_STREAM_SNAPSHOT_PATH')
+    TRENDING_STREAM_SYNC_SECONDS = int(os.environ.get('TRENDING_STREAM_SYNC_SECONDS', 30)) # How often workers merge into the snapshot
+    # HashtagUsage rollups: raw rows and hourly buckets are deleted after these windows (daily buckets are kept)
+    HASHTAG_USAGE_RAW_RETENTION_HOURS = int(os.environ.get('HASHTAG_USAGE_RAW_RETENTION_HOURS', 48))
+    HASHTAG_USAGE_HOURLY_RETENTION_DAYS = int(os.environ.get('HASHTAG_USAGE_HOURLY_RETENTION_DAYS', 35))
+    # Related posts kept per post in the precomputed index (cards show the first few the viewer may see)
+    RELATED_POSTS_INDEX_SIZE = int(os.environ.get('RELATED_POSTS_INDEX_SIZE', 20))
+    # Recommendations are scored offline; reads only filter the precomputed candidates
+    RECOMMENDATION_CANDIDATES = int(os.environ.get('RECOMMENDATION_CANDIDATES', 50)) # Per kind (posts, users, groups) and user
+    RECOMMENDATION_REFRESH_BATCH = int(os.environ.get('RECOMMENDATION_REFRESH_BATCH', 500)) # Users rescored per job run
+    RECOMMENDATION_MAX_AGE_MINUTES = int(os.environ.get('RECOMMENDATION_MAX_AGE_MINUTES', 6 * 60))
+    RECOMMENDATION_POST_WINDOW_DAYS = int(os.environ.get('RECOMMENDATION_POST_WINDOW_DAYS', 90)) # Posts (and group activity) the engine scores
+
+    # @mention autocomplete prefix index. Workers share it through this snapshot file, on a path outside the
+    # source tree that all of a deployment's processes can write (unset: each builds its own).
+    MENTION_INDEX_SNAPSHOT_PATH = os.environ.get('MENTION_INDEX_SNAPSHOT_PATH')
+    MENTION_INDEX_RELOAD_SECONDS = int(os.environ.get('MENTION_INDEX_RELOAD_SECONDS', 60)) # How often workers check for a newer snapshot
+    # @mention links in rendered bodies: per-worker username LRU plus rendered HTML in the app cache
+    MENTION_LINK_CACHE_SIZE = int(os.environ.get('MENTION_LINK_CACHE_SIZE', 10000)) # Usernames per worker
+    MENTION_LINK_CACHE_TTL = int(os.environ.get('MENTION_LINK_CACHE_TTL', 300)) # Seconds a worker trusts a resolved username
+    MENTION_LINK_HTML_TTL = int(os.environ.get('MENTION_LINK_HTML_TTL', 3600))
+    # Group notifications: one INSERT ... SELECT per group plus batched socket emits, on a background task
+    NOTIFICATION_FANOUT_ASYNC = os.environ.get('NOTIFICATION_FANOUT_ASYNC', 'true').lower() in ['true', 'on', '1']
+    NOTIFICATION_FANOUT_EMIT_BATCH = int(os.environ.get('NOTIFICATION_FANOUT_EMIT_BATCH', 500)) # Member rooms per socket emit
+    # Seconds; commits that change the count delete it sooner, but a per-process cache only in the committing process
+    NOTIFICATION_UNREAD_CACHE_TTL = int(os.environ.get('NOTIFICATION_UNREAD_CACHE_TTL', 5 if CACHE_TYPE == 'SimpleCache' else 3600))
+    # Unread notifications for the same kind and target absorb new actors while their latest activity is this recent (0: off)
+    NOTIFICATION_COALESCE_WINDOW_SECONDS = int(os.environ.get('NOTIFICATION_COALESCE_WINDOW_SECONDS', 6 * 3600))
+    NOTIFICATION_PUSH_DEBOUNCE_SECONDS = float(os.environ.get('NOTIFICATION_PUSH_DEBOUNCE_SECONDS', 2)) # At most a leading and a trailing push per key (0: no debounce)
+    # Transactional outbox: side effects of posts, comments, reactions and chat messages, applied by background workers
+    OUTBOX_WORKERS = int(os.environ.get('OUTBOX_WORKERS', 2)) # Per process (0: apply events right after the commit that enqueued them)
+    OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 100)) # Events claimed per UPDATE
+    OUTBOX_LEASE_SECONDS = int(os.environ.get('OUTBOX_LEASE_SECONDS', 300)) # Claimed events are claimable again after this
+    OUTBOX_POLL_SECONDS = float(os.environ.get('OUTBOX_POLL_SECONDS', 5)) # Idle workers poll for events other processes enqueued
+    OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 8))
+    OUTBOX_RETRY_BASE_SECONDS = int(os.environ.get('OUTBOX_RETRY_BASE_SECONDS', 5)) # Doubled after each failed attempt
+    OUTBOX_RETRY_MAX_SECONDS = int(os.environ.get('OUTBOX_RETRY_MAX_SECONDS', 3600))
+    # Follow graph (follower counts, friend-of-friend suggestions). Workers mmap this snapshot, written by the scheduler
+    # to a path outside the source tree (unset: each worker builds its own and rebuilds it every SOCIAL_GRAPH_RELOAD_SECONDS).
+    SOCIAL_GRAPH_SNAPSHOT_PATH = os.environ.get('SOCIAL_GRAPH_SNAPSHOT_PATH')
+    SOCIAL_GRAPH_RELOAD_SECONDS = int(os.environ.get('SOCIAL_GRAPH_RELOAD_SECONDS', 60)) # How often workers check for a newer snapshot
+    # Socket.IO across processes: emits from any worker, outbox worker or the scheduler reach clients on every worker.
+    # A Redis URL (redis://host:6379/0), or the local stand-in broker's (python -m app.services.socket_broker). Unset: one process.
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+    SOCKETIO_CHANNEL = os.environ.get('SOCKETIO_CHANNEL', 'flask-socketio') # Processes of one deployment share a channel
+    # Run the background jobs in this process. With several worker processes enable it in exactly one.
+    SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', 'true').lower() in ['true', 'on', '1']
+
 
 class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:' # Use in-memory SQLite for tests
+    MENTION_INDEX_SNAPSHOT_PATH = None
+    TRENDING_STREAM_SNAPSHOT_PATH = None
+    SOCIAL_GRAPH_SNAPSHOT_PATH = None
+    NOTIFICATION_FANOUT_ASYNC = False # Fan out inline so tests see the notifications
+    NOTIFICATION_PUSH_DEBOUNCE_SECONDS = 0 # Push every notification inline
+    OUTBOX_WORKERS = 0 # Apply outbox events inline so tests see their side effects
+    CACHE_TYPE = 'SimpleCache'
+    NOTIFICATION_UNREAD_CACHE_TTL = 3600 # One process: commits invalidate every cached count
+    SOCKETIO_MESSAGE_QUEUE = None # Test clients and emits stay in this process
     WTF_CSRF_ENABLED = False # Disable CSRF forms protection in testing
     SERVER_NAME = 'localhost.test' # Added for url_for to work in tests
     APPLICATION_ROOT = '/'
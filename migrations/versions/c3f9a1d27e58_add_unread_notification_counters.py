@@ -0,0 +1,35 @@
+"""Add recipient/is_read index and backfill unread notification counters
+
+Revision ID: c3f9a1d27e58
+Revises: b8e3d5a07c14
+Create Date: 2026-10-17 22:14:31.508263
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f9a1d27e58'
+down_revision = 'b8e3d5a07c14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.create_index('ix_notifications_recipient_is_read', ['recipient_id', 'is_read'], unique=False)
+
+    # The unread badge now reads the user's counter row: seed it from the existing notifications
+    op.execute(sa.text(
+        "INSERT INTO engagement_counter (entity_type, entity_id, name, value) "
+        "SELECT 'user', recipient_id, 'unread_notifications', count(*) FROM notifications "
+        "WHERE is_read = false GROUP BY recipient_id"
+    ))
+
+
+def downgrade():
+    op.execute(sa.text("DELETE FROM engagement_counter WHERE name = 'unread_notifications'"))
+
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.drop_index('ix_notifications_recipient_is_read')
@@ -0,0 +1,42 @@
+"""Add FTS5 search indexes for posts, users, groups and hashtags
+
+Revision ID: d3a8f6c2e571
+Revises: c5e92a7f1b38
+Create Date: 2026-10-17 16:40:27.915402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3a8f6c2e571'
+down_revision = 'c5e92a7f1b38'
+branch_labels = None
+depends_on = None
+
+
+# (index table, source table, indexed columns); mirrors app.services.search_service.SEARCH_INDEXES
+SEARCH_INDEXES = (
+    ('post_search', 'post', ('body',)),
+    ('user_search', 'user', ('username', 'email')),
+    ('group_search', 'group', ('name', 'description')),
+    ('hashtag_search', 'hashtag', ('tag_text',)),
+)
+
+
+def upgrade():
+    # FTS5 only exists on SQLite; other databases use the substring search backend
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for index_table, source_table, columns in SEARCH_INDEXES:
+        op.execute(f"CREATE VIRTUAL TABLE {index_table} USING fts5({', '.join(columns)}, tokenize='unicode61')")
+        values = ', '.join("COALESCE(%s, '')" % c for c in columns)
+        op.execute(f'INSERT INTO {index_table} (rowid, {", ".join(columns)}) SELECT id, {values} FROM "{source_table}"')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for index_table, _, _ in SEARCH_INDEXES:
+        op.execute(f'DROP TABLE IF EXISTS {index_table}')
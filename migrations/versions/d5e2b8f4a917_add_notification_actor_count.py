@@ -0,0 +1,27 @@
+"""Add actor_count to notifications for coalesced notifications
+
+Revision ID: d5e2b8f4a917
+Revises: c3f9a1d27e58
+Create Date: 2026-10-17 23:02:47.631904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5e2b8f4a917'
+down_revision = 'c3f9a1d27e58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows each stand for a single actor
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('actor_count', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.drop_column('actor_count')
@@ -0,0 +1,25 @@
+"""Add case-insensitive username index
+
+Revision ID: f1d6a2b9c384
+Revises: e9b4c1d7a203
+Create Date: 2026-10-17 19:05:12.640218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1d6a2b9c384'
+down_revision = 'e9b4c1d7a203'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Expression index: backs the lower(username) IN (...) lookup of @mentions
+    op.create_index('ix_user_username_lower', 'user', [sa.text('lower(username)')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_user_username_lower', table_name='user')
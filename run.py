@@ -8,4 +8,6 @@ def make_shell_context():
     return {'db': db} # 'User': User, 'Post': Post}
 
 if __name__ == '__main__':
+    from app.services.outbox import start_outbox_workers
+    start_outbox_workers(app) # Only the server process drains the outbox in the background
     socketio.run(app, debug=True)
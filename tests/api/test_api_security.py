@@ -4,7 +4,7 @@ import time
 from datetime import datetime, timedelta, timezone
 
 from app import create_app, db
-from app.core.models import User, Application, AccessToken, Post, FriendList, PRIVACY_PUBLIC, PRIVACY_CUSTOM_LIST
+from app.core.models import User, Application, AccessToken, Post, FriendList, PRIVACY_PUBLIC, PRIVACY_CUSTOM_LIST, PRIVACY_PRIVATE
 from app.oauth2 import generate_access_token, ACCESS_TOKEN_EXPIRES_IN_SECONDS
 from config import TestingConfig
 
@@ -80,6 +80,49 @@ class APISecurityTestCase(unittest.TestCase):
         data = json.loads(response.data.decode('utf-8'))
         self.assertEqual(data.get('username'), self.test_user.username)
 
+    def test_get_user_posts_cursor_walk(self):
+        now = datetime.utcnow()
+        for i in range(5):
+            db.session.add(Post(body=f"API post {i}", author=self.test_user, privacy_level=PRIVACY_PUBLIC,
+                                is_published=True, timestamp=now - timedelta(minutes=i)))
+        db.session.commit()
+
+        response = self.app.get(f'/api/v1/users/{self.test_user.id}/posts?per_page=2', headers=self.auth_headers)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(data['total_items'], 5)
+        bodies = [p['body'] for p in data['posts']]
+        cursor = data['next_cursor']
+        while cursor:
+            response = self.app.get(f'/api/v1/users/{self.test_user.id}/posts?per_page=2&cursor={cursor}',
+                                    headers=self.auth_headers)
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data.decode('utf-8'))
+            self.assertNotIn('total_items', data)
+            bodies.extend(p['body'] for p in data['posts'])
+            cursor = data['next_cursor']
+        self.assertEqual(bodies, [f"API post {i}" for i in range(5)])
+
+    def test_get_user_posts_filters_privacy_before_paginating(self):
+        other = User(username='otherapiuser', email='other@example.com')
+        other.set_password('otherpassword')
+        db.session.add(other)
+        db.session.commit()
+        now = datetime.utcnow()
+        # Private posts interleaved with public ones used to leave holes in the paginated pages
+        for i in range(6):
+            db.session.add(Post(body=f"Other post {i}", author=other, is_published=True,
+                                privacy_level=PRIVACY_PUBLIC if i % 2 == 0 else PRIVACY_PRIVATE,
+                                timestamp=now - timedelta(minutes=i)))
+        db.session.commit()
+
+        response = self.app.get(f'/api/v1/users/{other.id}/posts?per_page=2', headers=self.auth_headers)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertEqual([p['body'] for p in data['posts']], ["Other post 0", "Other post 2"])
+        self.assertEqual(data['total_items'], 3)
+        self.assertEqual(data['total_pages'], 2)
+
     # --- API Input Validation Tests (for POST /api/v1/posts) ---
     def test_create_post_missing_body(self):
         response = self.app.post('/api/v1/posts', headers=self.auth_headers,
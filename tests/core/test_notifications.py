@@ -254,8 +254,8 @@ class TestLikeMilestoneNotifications(unittest.TestCase):
     def setUp(self):
         self.app = create_app(TestingConfig) # Use TestingConfig like other tests in this file
 
-        # Patch LIKE_MILESTONES in app.routes for the duration of the tests
-        self.milestones_patch = patch('app.routes.LIKE_MILESTONES', TEST_LIKE_MILESTONES)
+        # Patch LIKE_MILESTONES in the outbox handlers for the duration of the tests
+        self.milestones_patch = patch('app.services.side_effects.LIKE_MILESTONES', TEST_LIKE_MILESTONES)
         self.mock_milestones = self.milestones_patch.start()
 
         self.app_context = self.app.app_context()
@@ -0,0 +1,183 @@
+import unittest
+from datetime import datetime, timedelta
+
+from app import create_app, db, cache
+from app.core.models import User, Post, Share, TimelineEntry, PRIVACY_PUBLIC, PRIVACY_FOLLOWERS, PRIVACY_PRIVATE
+from app.services import timeline_service
+from app.services.timeline_service import get_home_timeline, get_public_timeline
+from config import TestingConfig
+
+
+class TimelineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        cache.clear()
+
+        self.author = User(username='author', email='author@example.com')
+        self.follower = User(username='follower', email='follower@example.com')
+        self.stranger = User(username='stranger', email='stranger@example.com')
+        for user in (self.author, self.follower, self.stranger):
+            user.set_password('password')
+        db.session.add_all([self.author, self.follower, self.stranger])
+        db.session.commit()
+
+        self.follower.follow(self.author)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        cache.clear()
+        self.app_context.pop()
+
+    def _post(self, body, privacy=PRIVACY_FOLLOWERS, published=True, minutes_ago=0, author=None):
+        post = Post(body=body, author=author or self.author, privacy_level=privacy, is_published=published,
+                    timestamp=datetime.utcnow() - timedelta(minutes=minutes_ago))
+        db.session.add(post)
+        db.session.commit()
+        return post
+
+    def _entry_owner_ids(self, post):
+        return {e.user_id for e in TimelineEntry.query.filter_by(post_id=post.id, share_id=0)}
+
+    def _timeline_bodies(self, user, **kwargs):
+        return [item['item'].body for item in get_home_timeline(user, **kwargs).items]
+
+    def test_post_fans_out_to_author_and_followers(self):
+        post = self._post("Followers only")
+        self.assertEqual(self._entry_owner_ids(post), {self.author.id, self.follower.id})
+        self.assertIn("Followers only", self._timeline_bodies(self.follower))
+        self.assertNotIn("Followers only", self._timeline_bodies(self.stranger))
+
+    def test_private_and_unpublished_posts_stay_with_author(self):
+        private_post = self._post("Private", privacy=PRIVACY_PRIVATE)
+        scheduled_post = self._post("Scheduled", published=False)
+        self.assertEqual(self._entry_owner_ids(private_post), {self.author.id})
+        self.assertEqual(self._entry_owner_ids(scheduled_post), {self.author.id})
+        self.assertIn("Scheduled", self._timeline_bodies(self.author))
+
+        # Publishing (as publish_scheduled_content does) fans the post out
+        scheduled_post.is_published = True
+        db.session.commit()
+        self.assertEqual(self._entry_owner_ids(scheduled_post), {self.author.id, self.follower.id})
+
+    def test_follow_backfills_and_unfollow_removes(self):
+        post = self._post("Before follow")
+        self.stranger.follow(self.author)
+        db.session.commit()
+        self.assertIn(self.stranger.id, self._entry_owner_ids(post))
+
+        self.stranger.unfollow(self.author)
+        db.session.commit()
+        self.assertNotIn(self.stranger.id, self._entry_owner_ids(post))
+
+    def test_privacy_change_retracts_post(self):
+        post = self._post("Soon private")
+        post.privacy_level = PRIVACY_PRIVATE
+        db.session.commit()
+        self.assertEqual(self._entry_owner_ids(post), {self.author.id})
+
+    def test_share_fans_out_to_sharer_followers(self):
+        post = self._post("Shared public post", privacy=PRIVACY_PUBLIC, author=self.stranger, minutes_ago=10)
+        db.session.add(Share(user=self.author, original_post=post))
+        db.session.commit()
+
+        items = get_home_timeline(self.follower).items
+        shares = [item for item in items if item['type'] == 'share']
+        self.assertEqual(len(shares), 1)
+        self.assertEqual(shares[0]['sharer'].id, self.author.id)
+        self.assertEqual(shares[0]['item'].id, post.id)
+
+    def test_cursor_pages_are_disjoint_and_ordered(self):
+        for i in range(7):
+            self._post(f"Post {i}", minutes_ago=i)
+
+        first_page = get_home_timeline(self.follower, per_page=3)
+        self.assertTrue(first_page.has_next)
+        seen = [item['item'].body for item in first_page.items]
+        cursor = first_page.next_cursor
+        while cursor:
+            page = get_home_timeline(self.follower, cursor=cursor, per_page=3)
+            seen.extend(item['item'].body for item in page.items)
+            cursor = page.next_cursor
+        self.assertEqual(seen, [f"Post {i}" for i in range(7)])
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        self._post("Only post")
+        self.assertEqual(self._timeline_bodies(self.follower, cursor='not-a-cursor'), ["Only post"])
+
+    def test_high_follower_author_is_pulled_at_read_time(self):
+        self.app.config['TIMELINE_FANOUT_MAX_FOLLOWERS'] = 0
+        cache.delete(timeline_service.PULL_AUTHORS_CACHE_KEY)
+
+        post = self._post("Celebrity post")
+        self.assertEqual(self._entry_owner_ids(post), {self.author.id})
+        self.assertIn("Celebrity post", self._timeline_bodies(self.follower))
+        self.assertNotIn("Celebrity post", self._timeline_bodies(self.stranger))
+
+    def test_public_timeline_hides_unpublished_and_hidden_posts(self):
+        self._post("Public", privacy=PRIVACY_PUBLIC)
+        self._post("Draft", privacy=PRIVACY_PUBLIC, published=False)
+        hidden = self._post("Hidden", privacy=PRIVACY_PUBLIC)
+        hidden.is_hidden_by_moderation = True
+        db.session.commit()
+
+        bodies = [item['item'].body for item in get_public_timeline().items]
+        self.assertEqual(bodies, ["Public"])
+
+
+class FollowedPostsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        cache.clear()
+
+        self.user1 = User(username='userone', email='one@example.com')
+        self.user2 = User(username='usertwo', email='two@example.com')
+        for user in (self.user1, self.user2):
+            user.set_password('password')
+        db.session.add_all([self.user1, self.user2])
+        db.session.commit()
+        self.user1.follow(self.user2)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        cache.clear()
+        self.app_context.pop()
+
+    def test_cursor_walk_merges_posts_and_shares(self):
+        now = datetime.utcnow()
+        own = Post(body="Own post", author=self.user1, timestamp=now - timedelta(minutes=30))
+        db.session.add(own)
+        for i in range(4):
+            db.session.add(Post(body=f"Followed post {i}", author=self.user2, timestamp=now - timedelta(minutes=i)))
+        db.session.commit()
+        db.session.add(Share(user=self.user2, original_post=own, timestamp=now + timedelta(minutes=1)))
+        db.session.commit()
+
+        first_page = self.user1.followed_posts(page=1, per_page=2)
+        self.assertEqual(first_page.total, 6)
+        seen = [(item['type'], item['item'].body) for item in first_page.items]
+        cursor = first_page.next_cursor
+        while cursor:
+            page = self.user1.followed_posts(per_page=2, cursor=cursor)
+            seen.extend((item['type'], item['item'].body) for item in page.items)
+            cursor = page.next_cursor
+
+        self.assertEqual(seen, [
+            ('share', "Own post"),
+            ('post', "Followed post 0"), ('post', "Followed post 1"),
+            ('post', "Followed post 2"), ('post', "Followed post 3"),
+            ('post', "Own post"),
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
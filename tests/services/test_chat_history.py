@@ -0,0 +1,127 @@
+import unittest
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from unittest.mock import patch
+
+from flask import request
+from flask_login import login_user
+from sqlalchemy import event
+
+from app import create_app, db, cache
+from app.core.models import User, Conversation, ChatMessage, ConversationReadState
+from app.services.chat_history import load_message_window
+from config import TestingConfig
+
+
+class ChatHistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app.config['CHAT_MESSAGES_PER_PAGE'] = 4
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        cache.clear()
+
+        self.ann = User(username='ann', email='ann@example.com')
+        self.bob = User(username='bob', email='bob@example.com')
+        self.eve = User(username='eve', email='eve@example.com')
+        for user in (self.ann, self.bob, self.eve):
+            user.set_password('password')
+        self.conversation = Conversation()
+        self.conversation.participants.extend([self.ann, self.bob])
+        db.session.add_all([self.ann, self.bob, self.eve, self.conversation])
+        db.session.commit()
+
+        start = datetime(2026, 1, 1, 12, 0)
+        self.messages = [ChatMessage(conversation_id=self.conversation.id, body=f'message {i}',
+                                     sender_id=(self.ann, self.bob)[i % 2].id, timestamp=start + timedelta(minutes=i))
+                         for i in range(10)]
+        db.session.add_all(self.messages)
+        db.session.commit()
+        # bob has read up to ann's last message
+        db.session.add(ConversationReadState(user_id=self.bob.id, conversation_id=self.conversation.id,
+                                             last_read_message_id=self.messages[8].id,
+                                             last_read_timestamp=self.messages[8].timestamp, read_at=start))
+        db.session.commit()
+        self.message_ids = [message.id for message in self.messages]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        cache.clear()
+        self.app_context.pop()
+
+    @contextmanager
+    def _count_queries(self):
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+    def test_latest_window_with_senders_and_read_watermark_in_two_queries(self):
+        conversation_id, bob_id = self.conversation.id, self.bob.id
+        db.session.expire_all()
+        with self._count_queries() as statements:
+            page, messages = load_message_window(conversation_id, bob_id)
+            senders = [message['sender_username'] for message in messages]
+        self.assertEqual(len(statements), 2)
+        self.assertEqual([message['id'] for message in messages], self.message_ids[6:]) # Oldest first
+        self.assertEqual(senders, ['ann', 'bob', 'ann', 'bob'])
+        self.assertEqual([message['is_read_by_current_user'] for message in messages], [True, True, True, False])
+        self.assertIn('FROM conversation_read_state', statements[1])
+        self.assertTrue(page.has_next)
+
+    def test_cursor_backfills_older_windows(self):
+        page, messages = load_message_window(self.conversation.id, self.bob.id)
+        seen = [message['id'] for message in messages]
+        while page.has_next:
+            page, messages = load_message_window(self.conversation.id, self.bob.id, cursor=page.next_cursor)
+            seen = [message['id'] for message in messages] + seen
+        self.assertEqual(seen, self.message_ids)
+        self.assertTrue(messages[0]['is_read_by_current_user'])
+
+    def _get(self, user, url, **kwargs):
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+        with self.app.app_context(): # A fresh g: Flask-Login caches the user there
+            return client.get(url, **kwargs)
+
+    def test_backfill_endpoint_pages_as_json(self):
+        url = f'/chat/{self.conversation.id}/messages'
+        self.assertEqual(self._get(self.eve, url).status_code, 403)
+
+        first = self._get(self.bob, url).get_json()
+        older = self._get(self.bob, url, query_string={'cursor': first['next_cursor']}).get_json()
+        self.assertEqual([message['message_id'] for message in older['messages']], self.message_ids[2:6])
+        self.assertEqual(older['messages'][0]['timestamp'], '2026-01-01T12:02:00Z')
+        self.assertEqual(older['messages'][0]['sender_username'], 'ann')
+        last = self._get(self.bob, url, query_string={'cursor': older['next_cursor']}).get_json()
+        self.assertEqual([message['message_id'] for message in last['messages']], self.message_ids[:2])
+        self.assertIsNone(last['next_cursor'])
+        self.assertTrue(last['messages'][0]['is_read_by_current_user'])
+
+    def test_page_renders_latest_window_with_backfill_link(self):
+        page = self._get(self.bob, f'/chat/{self.conversation.id}').get_data(as_text=True)
+        self.assertIn('message 9', page)
+        self.assertNotIn('message 5', page)
+        self.assertIn('id="load-earlier-messages"', page)
+
+    def test_socket_backfill(self):
+        # Called directly: the Socket.IO test client only sees handlers of the first app created in a process
+        from app.core.events import handle_load_older_messages
+        sent = []
+        with self.app.test_request_context('/'), \
+                patch('app.core.events.emit', lambda event, data, **kwargs: sent.append((event, data))):
+            request.sid = 'sid'
+            login_user(self.bob)
+            handle_load_older_messages({'conversation_id': self.conversation.id})
+            handle_load_older_messages({'conversation_id': self.conversation.id, 'cursor': sent[0][1]['next_cursor']})
+            login_user(self.eve)
+            handle_load_older_messages({'conversation_id': self.conversation.id})
+        self.assertEqual([event for event, data in sent], ['older_messages', 'older_messages', 'chat_error'])
+        self.assertEqual([message['message_id'] for message in sent[1][1]['messages']], self.message_ids[2:6])
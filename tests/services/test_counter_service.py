@@ -0,0 +1,156 @@
+import unittest
+
+from app import create_app, db, cache
+from app.core.models import User, Post, Reaction, Comment, Share, Bookmark, Group, GroupMembership, EngagementCounter
+from app.services.counter_service import (
+    get_counters, get_counter, get_reaction_counts, reconcile_counters, top_posts_by_engagement,
+    POST, USER, GROUP, COMMENTS, SHARES, BOOKMARKS, FOLLOWERS, FOLLOWING, POSTS, COMMENTS_RECEIVED, MEMBERS
+)
+from config import TestingConfig
+
+
+class CounterServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        cache.clear()
+
+        self.author = User(username='author', email='author@example.com')
+        self.fan = User(username='fan', email='fan@example.com')
+        for user in (self.author, self.fan):
+            user.set_password('password')
+        db.session.add_all([self.author, self.fan])
+        db.session.commit()
+        self.post = Post(body="Counted post", author=self.author, is_published=True)
+        db.session.add(self.post)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        cache.clear()
+        self.app_context.pop()
+
+    def _user_counters(self, user):
+        return get_counters(USER, [user.id])[user.id]
+
+    def test_reactions_are_counted_per_type_for_post_and_author(self):
+        reaction = Reaction(user_id=self.fan.id, post_id=self.post.id, reaction_type='like')
+        db.session.add_all([reaction, Reaction(user_id=self.author.id, post_id=self.post.id, reaction_type='love')])
+        db.session.commit()
+        self.assertEqual(get_reaction_counts([self.post.id])[self.post.id], {'like': 1, 'love': 1})
+        self.assertEqual(self.post.reaction_count('like'), 1)
+        self.assertEqual(self.post.reaction_count(), 2)
+        self.assertEqual(get_counter(USER, self.author.id, 'reactions_received:like'), 1)
+
+        # Switching the reaction type in place, as react_to_post does
+        reaction.reaction_type = 'love'
+        db.session.commit()
+        self.assertEqual(get_reaction_counts([self.post.id])[self.post.id], {'love': 2})
+        self.assertEqual(get_counter(USER, self.author.id, 'reactions_received:love'), 2)
+
+        db.session.delete(reaction)
+        db.session.commit()
+        self.assertEqual(self.post.reaction_count(), 1)
+        self.assertEqual(get_counter(USER, self.author.id, 'reactions_received:love'), 1)
+
+    def test_comments_shares_and_bookmarks(self):
+        comment = Comment(body="Hi", user_id=self.fan.id, post_id=self.post.id)
+        db.session.add_all([
+            comment,
+            Share(user_id=self.fan.id, post_id=self.post.id),
+            Bookmark(user_id=self.fan.id, post_id=self.post.id)
+        ])
+        db.session.commit()
+        self.assertEqual(get_counters(POST, [self.post.id])[self.post.id],
+                         {COMMENTS: 1, SHARES: 1, BOOKMARKS: 1})
+        self.assertEqual(get_counter(USER, self.author.id, COMMENTS_RECEIVED), 1)
+
+        db.session.delete(comment)
+        db.session.commit()
+        self.assertEqual(get_counter(POST, self.post.id, COMMENTS), 0)
+        self.assertEqual(get_counter(USER, self.author.id, COMMENTS_RECEIVED), 0)
+
+    def test_follow_and_unfollow(self):
+        self.fan.follow(self.author)
+        db.session.commit()
+        self.assertEqual(get_counter(USER, self.author.id, FOLLOWERS), 1)
+        self.assertEqual(get_counter(USER, self.fan.id, FOLLOWING), 1)
+        self.fan.unfollow(self.author)
+        db.session.commit()
+        self.assertEqual(get_counter(USER, self.author.id, FOLLOWERS), 0)
+        self.assertEqual(get_counter(USER, self.fan.id, FOLLOWING), 0)
+
+    def test_group_membership(self):
+        group = Group(name='Counters', creator_id=self.author.id)
+        db.session.add(group)
+        db.session.commit()
+        membership = GroupMembership(user_id=self.fan.id, group_id=group.id)
+        db.session.add_all([membership, GroupMembership(user_id=self.author.id, group_id=group.id, role='admin')])
+        db.session.commit()
+        self.assertEqual(group.member_count(), 2)
+        db.session.delete(membership)
+        db.session.commit()
+        self.assertEqual(group.member_count(), 1)
+
+        group_id = group.id
+        db.session.delete(group)
+        db.session.commit()
+        self.assertEqual(get_counters(GROUP, [group_id])[group_id], {})
+
+    def test_deleting_a_post_drops_its_counters_and_author_totals(self):
+        db.session.add_all([
+            Reaction(user_id=self.fan.id, post_id=self.post.id, reaction_type='like'),
+            Comment(body="Hi", user_id=self.fan.id, post_id=self.post.id)
+        ])
+        db.session.commit()
+        self.assertEqual(get_counter(USER, self.author.id, POSTS), 1)
+
+        post_id = self.post.id
+        db.session.delete(self.post)
+        db.session.commit()
+        self.assertEqual(get_counters(POST, [post_id])[post_id], {})
+        author_counters = self._user_counters(self.author)
+        self.assertEqual(author_counters[POSTS], 0)
+        self.assertEqual(author_counters['reactions_received:like'], 0)
+        self.assertEqual(author_counters[COMMENTS_RECEIVED], 0)
+
+    def test_top_posts_by_engagement(self):
+        quiet = Post(body="Quiet", author=self.author, is_published=True)
+        db.session.add(quiet)
+        db.session.commit()
+        db.session.add_all([
+            Reaction(user_id=self.fan.id, post_id=quiet.id, reaction_type='like'),
+            Comment(body="Hi", user_id=self.fan.id, post_id=quiet.id)
+        ])
+        db.session.commit()
+        self.assertEqual(top_posts_by_engagement(self.author.id, limit=1), [quiet])
+        self.assertEqual(top_posts_by_engagement(self.author.id), [quiet, self.post])
+
+    def test_reconcile_repairs_drift_from_bulk_writes(self):
+        self.fan.follow(self.author)
+        db.session.add(Reaction(user_id=self.fan.id, post_id=self.post.id, reaction_type='like'))
+        db.session.commit()
+        self.assertEqual(reconcile_counters(), [])
+
+        # Writes that bypass the ORM are invisible to the session hooks
+        Reaction.query.filter_by(post_id=self.post.id).delete(synchronize_session=False)
+        db.session.execute(EngagementCounter.__table__.delete().where(EngagementCounter.name == FOLLOWERS))
+        db.session.commit()
+
+        drift = reconcile_counters(repair=False)
+        self.assertEqual(drift, [
+            (POST, self.post.id, 'reactions:like', 1, 0),
+            (USER, self.author.id, FOLLOWERS, 0, 1),
+            (USER, self.author.id, 'reactions_received:like', 1, 0),
+        ])
+        self.assertEqual(reconcile_counters(), drift)
+        self.assertEqual(reconcile_counters(repair=False), [])
+        self.assertEqual(self.post.reaction_count(), 0)
+        self.assertEqual(get_counter(USER, self.author.id, FOLLOWERS), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
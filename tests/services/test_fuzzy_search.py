@@ -0,0 +1,80 @@
+import unittest
+
+from app import create_app, db, cache
+from app.core.models import User, Group, Hashtag
+from app.services.fuzzy_search import FuzzyNameIndex, fuzzy_search_query, get_fuzzy_index, ngrams
+from config import TestingConfig
+
+
+class FuzzyNameIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.index = FuzzyNameIndex([
+            (1, 'jonathan'), (2, 'Johnny'), (3, 'joanna'), (4, 'margaret'), (5, None), (6, 'marguerite')
+        ])
+
+    def test_ngrams_are_padded(self):
+        self.assertEqual(ngrams('Ab'), {'  a', ' ab', 'ab '})
+
+    def test_typos_still_match(self):
+        self.assertEqual(self.index.search('jonathn', limit=1)[0][0], 1)
+        self.assertEqual(self.index.search('margeret', limit=1)[0][0], 4)
+        self.assertEqual(self.index.search('zzzz'), [])
+        self.assertEqual(self.index.search('  '), [])
+
+    def test_candidates_are_pruned_by_shared_ngrams(self):
+        self.assertEqual(len(self.index), 5) # Empty names are skipped
+        candidates = self.index.candidates('margaret', max_candidates=10)
+        self.assertEqual({self.index.ids[position] for position in candidates}, {4, 6})
+        self.assertEqual(len(self.index.candidates('margaret', max_candidates=1)), 1)
+        self.assertEqual(self.index.ids[self.index.candidates('margaret', max_candidates=1)[0]], 4)
+
+
+class FuzzySearchQueryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        cache.clear()
+
+        self.alice = User(username='alice_wonder', email='alice@example.com')
+        self.alan = User(username='alan', email='alan@example.com')
+        for user in (self.alice, self.alan):
+            user.set_password('password')
+        db.session.add_all([self.alice, self.alan])
+        db.session.commit()
+        db.session.add_all([
+            Group(name='Photography Lovers', creator_id=self.alice.id),
+            Hashtag(tag_text='photography')
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        cache.clear()
+        self.app_context.pop()
+
+    def test_query_is_ranked_by_match_quality(self):
+        query, rank = fuzzy_search_query('users', 'alcie_wondr')
+        self.assertEqual([user.id for user in query.order_by(rank).all()], [self.alice.id])
+        query, rank = fuzzy_search_query('groups', 'fotography lovers')
+        self.assertEqual([group.name for group in query.order_by(rank)], ['Photography Lovers'])
+        query, rank = fuzzy_search_query('hashtags', 'photgraphy')
+        self.assertEqual([tag.tag_text for tag in query.order_by(rank)], ['photography'])
+        self.assertEqual(fuzzy_search_query('users', 'qqqqqq'), (None, None))
+
+    def test_index_is_rebuilt_after_ttl(self):
+        index = get_fuzzy_index('users')
+        self.assertIs(get_fuzzy_index('users'), index)
+        self.app.config['FUZZY_SEARCH_INDEX_TTL'] = 0
+        self.assertIsNot(get_fuzzy_index('users'), index)
+
+    def test_search_route_fuzzy_mode(self):
+        client = self.app.test_client()
+        self.assertNotIn(b'alice_wonder', client.get('/search?q=alcie_wondr&category=users').data)
+        self.assertIn(b'alice_wonder', client.get('/search?q=alcie_wondr&category=users&fuzzy=1').data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+from datetime import datetime, timedelta
+
+from app import create_app, db, cache
+from app.core.models import Hashtag, HashtagUsage, HashtagUsageHourly, HashtagUsageDaily
+from app.services.hashtag_usage_service import rollup_hashtag_usage, hourly_watermark, usage_rows
+from app.services.trending_service import calculate_trending_scores
+from config import TestingConfig
+
+
+class HashtagUsageRollupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        cache.clear()
+
+        self.now = datetime(2026, 3, 10, 12, 30)
+        self.python, self.flask = Hashtag(tag_text='python'), Hashtag(tag_text='flask')
+        db.session.add_all([self.python, self.flask])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        cache.clear()
+        self.app_context.pop()
+
+    def _use(self, hashtag, age, times=1):
+        db.session.add_all([HashtagUsage(hashtag_id=hashtag.id, timestamp=self.now - age) for _ in range(times)])
+        db.session.commit()
+
+    def _hourly(self):
+        return {(row.hashtag_id, row.bucket_start): row.count for row in HashtagUsageHourly.query.all()}
+
+    def test_complete_hours_and_days_are_rolled_up(self):
+        self._use(self.python, timedelta(minutes=10))             # current hour: left raw
+        self._use(self.python, timedelta(hours=1), times=2)       # 11:30
+        self._use(self.flask, timedelta(hours=1, minutes=20))     # 11:10
+        self._use(self.flask, timedelta(days=1, hours=3))         # yesterday 09:30
+
+        result = rollup_hashtag_usage(now=self.now)
+        self.assertEqual(self._hourly(), {
+            (self.python.id, datetime(2026, 3, 10, 11)): 2,
+            (self.flask.id, datetime(2026, 3, 10, 11)): 1,
+            (self.flask.id, datetime(2026, 3, 9, 9)): 1,
+        })
+        self.assertEqual([(row.bucket_start, row.count) for row in HashtagUsageDaily.query.all()],
+                         [(datetime(2026, 3, 9), 1)]) # Today is not complete yet
+        self.assertEqual(hourly_watermark(), datetime(2026, 3, 10, 12))
+        self.assertEqual(result['raw_deleted'], 0)
+
+        # Re-running changes nothing
+        rollup_hashtag_usage(now=self.now)
+        self.assertEqual(len(self._hourly()), 3)
+        self.assertEqual(HashtagUsageDaily.query.count(), 1)
+
+    def test_expired_rows_are_compacted_after_rollup(self):
+        self._use(self.python, timedelta(days=3), times=4)
+        self._use(self.python, timedelta(days=40))
+        self._use(self.python, timedelta(hours=2))
+        result = rollup_hashtag_usage(now=self.now)
+        self.assertEqual(result['raw_deleted'], 5)
+        self.assertEqual(HashtagUsage.query.count(), 1)
+        self.assertEqual(result['hourly_deleted'], 1) # The 40 day old bucket lives on in the daily table
+        self.assertEqual([(row.bucket_start, row.count) for row in HashtagUsageDaily.query.order_by('bucket_start')],
+                         [(datetime(2026, 1, 29), 1), (datetime(2026, 3, 7), 4)])
+        self.assertEqual(sorted(self._hourly().items()), [
+            ((self.python.id, datetime(2026, 3, 7, 12)), 4), ((self.python.id, datetime(2026, 3, 10, 10)), 1)
+        ])
+
+    def test_usage_count_is_summed_like_the_trending_stream(self):
+        db.session.add(HashtagUsage(hashtag_id=self.python.id, timestamp=self.now - timedelta(hours=2), usage_count=3))
+        db.session.add(HashtagUsage(hashtag_id=self.python.id, timestamp=self.now - timedelta(minutes=5), usage_count=2))
+        db.session.commit()
+        rollup_hashtag_usage(now=self.now)
+        self.assertEqual(self._hourly(), {(self.python.id, datetime(2026, 3, 10, 10)): 3})
+        usage = usage_rows(self.now - timedelta(days=1))
+        self.assertEqual(db.session.execute(db.select(db.func.sum(usage.c.uses))).scalar(), 5)
+
+    def test_trending_scores_read_buckets_and_raw_tail(self):
+        self._use(self.python, timedelta(minutes=10))
+        self._use(self.flask, timedelta(hours=5), times=2)
+        self._use(self.flask, timedelta(days=3))
+        before = dict(calculate_trending_scores(now=self.now))
+        rollup_hashtag_usage(now=self.now)
+        HashtagUsage.query.filter(HashtagUsage.timestamp < self.now - timedelta(hours=1)).delete()
+        db.session.commit()
+        after = dict(calculate_trending_scores(now=self.now))
+        self.assertEqual(before.keys(), after.keys())
+        for tag, score in before.items():
+            self.assertAlmostEqual(after[tag], score)
+
+
+if __name__ == '__main__':
+    unittest.main()
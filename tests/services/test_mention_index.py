@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import event
+
+from app import create_app, db, cache
+from app.core.models import User
+from app.services.mention_index import (
+    MentionIndex, MentionEntry, get_mention_index, refresh_mention_index, search_mentions
+)
+from config import TestingConfig
+
+
+class MentionIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        cache.clear()
+
+        self.users = {}
+        for name in ('viewer', 'Sam', 'samantha', 'sammy', 'samuel', 'zoe'):
+            user = User(username=name, email=f'{name}@example.com')
+            user.set_password('password')
+            self.users[name] = user
+        db.session.add_all(self.users.values())
+        db.session.commit()
+        self.viewer = self.users['viewer']
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        cache.clear()
+        self.app_context.pop()
+
+    def _usernames(self, prefix, user=None, limit=10):
+        return [entry.username for entry in search_mentions(prefix, user, limit=limit)]
+
+    def test_prefix_match_is_case_insensitive(self):
+        self.assertEqual(set(self._usernames('SAM')), {'Sam', 'samantha', 'sammy', 'samuel'})
+        self.assertEqual(self._usernames('samu'), ['samuel'])
+        self.assertEqual(self._usernames('x'), [])
+        self.assertEqual(self._usernames(''), [])
+
+    def test_followed_users_then_popularity(self):
+        for name in ('zoe', 'Sam', 'samuel'):
+            self.users[name].follow(self.users['samantha'])
+        for name in ('zoe', 'Sam'):
+            self.users[name].follow(self.users['samuel'])
+        self.viewer.follow(self.users['sammy'])
+        db.session.commit()
+        refresh_mention_index() # Pick up the new follower counts
+
+        # sammy is followed by the viewer; then samantha (3 followers), samuel (2), Sam (0)
+        self.assertEqual(self._usernames('sam', self.viewer), ['sammy', 'samantha', 'samuel', 'Sam'])
+        self.assertEqual(self._usernames('sam', self.viewer, limit=2), ['sammy', 'samantha'])
+        self.assertEqual(self._usernames('sam'), ['samantha', 'samuel', 'sammy', 'Sam'])
+
+    def test_commits_update_the_index_incrementally(self):
+        get_mention_index()
+        newcomer = User(username='samwise', email='samwise@example.com')
+        newcomer.set_password('password')
+        db.session.add(newcomer)
+        db.session.commit()
+        self.assertIn('samwise', self._usernames('samw'))
+
+        newcomer.username = 'gamgee'
+        db.session.commit()
+        self.assertEqual(self._usernames('samw'), [])
+        self.assertEqual(self._usernames('gam'), ['gamgee'])
+
+        self.users['zoe'].username = 'zelda'
+        db.session.rollback()
+        self.assertEqual(self._usernames('zel'), [])
+
+        db.session.delete(newcomer)
+        db.session.commit()
+        self.assertEqual(self._usernames('gam'), [])
+
+    def test_warm_index_answers_without_queries(self):
+        self._usernames('s', self.viewer) # Builds the index and caches the viewer's follow list
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            self.assertEqual(len(self._usernames('sa', self.viewer)), 4)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual(statements, [])
+
+    def test_snapshot_is_shared_between_workers(self):
+        snapshot_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, snapshot_dir)
+        path = os.path.join(snapshot_dir, 'mention_index.json')
+        self.app.config['MENTION_INDEX_SNAPSHOT_PATH'] = path
+        self.app.config['MENTION_INDEX_RELOAD_SECONDS'] = 0
+        refresh_mention_index()
+        self.assertTrue(os.path.exists(path))
+
+        # A second worker loads the snapshot instead of querying
+        other = MentionIndex.read_snapshot(path)
+        self.assertEqual(len(other), len(self.users))
+        self.assertEqual({e.username for e in other.search('sam')}, {'Sam', 'samantha', 'sammy', 'samuel'})
+
+        # A change committed here after the snapshot survives reloading an older snapshot
+        get_mention_index()
+        newcomer = User(username='samwise', email='samwise@example.com')
+        newcomer.set_password('password')
+        db.session.add(newcomer)
+        db.session.commit()
+        older = MentionIndex.read_snapshot(path)
+        older.write_snapshot(path)
+        os.utime(path, (os.path.getmtime(path) + 5,) * 2)
+        self.assertIn('samwise', self._usernames('samw'))
+
+    def test_snapshot_round_trip(self):
+        index = MentionIndex([MentionEntry(1, 'Alpha', 'a.jpg', 3), MentionEntry(2, 'alps', None, 0)])
+        restored = MentionIndex.from_snapshot(index.to_snapshot())
+        self.assertEqual([(e.user_id, e.username, e.profile_picture_url) for e in restored.search('AL')],
+                         [(1, 'Alpha', 'a.jpg'), (2, 'alps', None)])
+        with self.assertRaises(ValueError):
+            MentionIndex.from_snapshot({'version': 0, 'entries': []})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import unittest
+from unittest import mock
+
+from flask import g
+from sqlalchemy import event
+
+from app import create_app, db, cache
+from app.core.models import User, Post, Comment
+from app.services.mention_links import UsernameCache, prime_mentions, render_mentions
+from app.services.post_view_service import load_post_views
+from config import TestingConfig
+
+
+class UsernameCacheTestCase(unittest.TestCase):
+    def test_least_recently_used_names_are_evicted(self):
+        usernames = UsernameCache(size=2, ttl=60)
+        usernames.put_many({'alice': (1, 'Alice'), 'bob': (2, 'bob')}, generation=0)
+        usernames.get_many(['alice'], generation=0)
+        usernames.put_many({'carol': None}, generation=0)
+        self.assertEqual(usernames.get_many(['alice', 'bob', 'carol'], generation=0), {'alice': (1, 'Alice'), 'carol': None})
+
+    def test_entries_expire_and_belong_to_a_generation(self):
+        usernames = UsernameCache(size=10, ttl=60)
+        with mock.patch('app.services.mention_links.time.monotonic', return_value=1000):
+            usernames.put_many({'alice': (1, 'Alice')}, generation=1)
+            self.assertEqual(usernames.get_many(['alice'], generation=2), {})
+            usernames.put_many({'alice': (1, 'Alice')}, generation=1)
+        with mock.patch('app.services.mention_links.time.monotonic', return_value=1061):
+            self.assertEqual(usernames.get_many(['alice'], generation=1), {})
+        self.assertEqual(len(usernames), 0)
+
+
+class MentionLinksTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        cache.clear()
+
+        self.users = [User(username=f'User{i}', email=f'user{i}@example.com') for i in range(6)]
+        for user in self.users:
+            user.set_password('password')
+        db.session.add_all(self.users)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        cache.clear()
+        self.app_context.pop()
+
+    def _count_user_queries(self, func):
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            result = func()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        return result, len([s for s in statements if 'lower(user.username)' in s])
+
+    def _render_page(self, bodies):
+        with self.app.test_request_context('/'):
+            prime_mentions(bodies)
+            return [str(render_mentions(body)) for body in bodies]
+
+    def test_a_page_resolves_its_mentions_in_one_query(self):
+        bodies = [f'hi @user{i} and @USER{i + 1}, not @ghost' for i in range(5)]
+        html, queries = self._count_user_queries(lambda: self._render_page(bodies))
+        self.assertEqual(queries, 1)
+        self.assertEqual(html[0], 'hi <a href="/user/User0">@User0</a> and <a href="/user/User1">@User1</a>, not @ghost')
+
+        # A new body with known names is served by the worker's username cache
+        _, queries = self._count_user_queries(lambda: self._render_page(['@user2 <b>@ghost</b>']))
+        self.assertEqual(queries, 0)
+        self.assertEqual(self._render_page(['@user2 <b>@ghost</b>'])[0],
+                         '<a href="/user/User2">@User2</a> &lt;b&gt;@ghost&lt;/b&gt;')
+
+    def test_rendered_bodies_are_cached(self):
+        self._render_page(['@user1'])
+        self.app.extensions['mention_links'] = UsernameCache() # Rendering again needs neither cache layer's names
+        html, queries = self._count_user_queries(lambda: self._render_page(['@user1']))
+        self.assertEqual((html, queries), (['<a href="/user/User1">@User1</a>'], 0))
+
+    def test_username_changes_invalidate_links(self):
+        self.assertEqual(self._render_page(['@ghost @user3']),
+                         ['@ghost <a href="/user/User3">@User3</a>'])
+        ghost = User(username='Ghost', email='ghost@example.com')
+        ghost.set_password('password')
+        db.session.add(ghost)
+        self.users[3].username = 'renamed'
+        db.session.commit()
+        self.assertEqual(self._render_page(['@ghost @user3']),
+                         ['<a href="/user/Ghost">@Ghost</a> @user3'])
+
+    def test_post_views_prime_bodies_and_comments(self):
+        author = self.users[0]
+        posts = [Post(body=f'post for @user{i}', author=author) for i in range(1, 4)]
+        db.session.add_all(posts)
+        db.session.flush()
+        db.session.add_all([Comment(body=f'@user{i + 3} agrees', user_id=author.id, post_id=post.id)
+                            for i, post in enumerate(posts)])
+        db.session.commit()
+
+        with self.app.test_request_context('/'):
+            views = load_post_views(posts, None)
+            self.assertEqual(g.mention_resolver._pending, {f'user{i}' for i in range(1, 6)})
+
+            def render():
+                return [str(render_mentions(post.body)) for post in posts] + \
+                       [str(render_mentions(c.body)) for view in views.values() for c in view.comments]
+            html, queries = self._count_user_queries(render)
+        self.assertEqual(queries, 1)
+        self.assertIn('<a href="/user/User5">@User5</a> agrees', html)
+
+
+if __name__ == '__main__':
+    unittest.main()
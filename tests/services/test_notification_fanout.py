@@ -0,0 +1,114 @@
+import unittest
+from contextlib import contextmanager
+from unittest.mock import patch
+
+from sqlalchemy import event
+
+from app import create_app, db, cache
+from app.core.models import User, Group, GroupMembership, Notification
+from app.services.notification_fanout import fan_out_group_notification, notify_group_members
+from config import TestingConfig
+
+
+class NotificationFanoutTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app.config['NOTIFICATION_FANOUT_EMIT_BATCH'] = 2
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        cache.clear()
+
+        self.members = []
+        for index in range(5):
+            user = User(username=f'member{index}', email=f'member{index}@example.com')
+            user.set_password('password')
+            self.members.append(user)
+        self.outsider = User(username='outsider', email='outsider@example.com')
+        self.outsider.set_password('password')
+        db.session.add_all(self.members + [self.outsider])
+        db.session.commit()
+        self.actor = self.members[0]
+        self.group = Group(name='Climbers', creator_id=self.actor.id)
+        db.session.add(self.group)
+        db.session.flush()
+        db.session.add_all([GroupMembership(user_id=user.id, group_id=self.group.id) for user in self.members])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        cache.clear()
+        self.app_context.pop()
+
+    @contextmanager
+    def _count_queries(self):
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+    def test_one_insert_for_all_members_and_batched_emits(self):
+        group_id, actor_id = self.group.id, self.actor.id
+        payload = {'type': 'new_group_post', 'group_id': group_id}
+        with patch('app.services.notification_fanout.socketio.emit') as emit, self._count_queries() as statements:
+            notified = fan_out_group_notification(group_id, actor_id, 'new_group_post', payload=payload)
+
+        self.assertEqual(notified, 4)
+        self.assertEqual(len([s for s in statements if s.lstrip().upper().startswith('INSERT INTO NOTIFICATIONS')]), 1)
+        self.assertLessEqual(len(statements), 4) # Member ids, open aggregates, the INSERT ... SELECT, the unread counter upsert
+        rows = Notification.query.filter_by(type='new_group_post').all()
+        self.assertEqual(sorted(n.recipient_id for n in rows), sorted(u.id for u in self.members[1:]))
+        self.assertTrue(all(n.actor_id == self.actor.id and n.related_group_id == self.group.id and not n.is_read
+                            for n in rows))
+        # Four member rooms, two per emit
+        self.assertEqual(emit.call_count, 2)
+        rooms = [room for call in emit.call_args_list for room in call.kwargs['to']]
+        self.assertEqual(sorted(rooms), sorted(str(u.id) for u in self.members[1:]))
+        self.assertTrue(all(call.args == ('new_notification', payload) for call in emit.call_args_list))
+
+    def test_later_posts_coalesce_into_unread_notifications(self):
+        group_id = self.group.id
+        second_actor, reader = self.members[1].id, self.members[2].id
+        fan_out_group_notification(group_id, self.actor.id, 'new_group_post')
+        Notification.query.filter_by(recipient_id=reader).update({'is_read': True})
+        db.session.commit()
+        fan_out_group_notification(group_id, second_actor, 'new_group_post')
+        fan_out_group_notification(group_id, second_actor, 'new_group_post')
+
+        rows = {n.recipient_id: n for n in Notification.query.filter_by(is_read=False)}
+        self.assertEqual(len(rows), 5)
+        self.assertEqual((rows[second_actor].actor_id, rows[second_actor].actor_count), (self.actor.id, 1))
+        self.assertEqual(rows[self.actor.id].actor_count, 1) # Only the second poster's posts
+        self.assertEqual(rows[reader].actor_count, 1) # Read the first: a new row
+        for user in self.members[3:]:
+            self.assertEqual((rows[user.id].actor_id, rows[user.id].actor_count), (second_actor, 2))
+        self.assertEqual(Notification.query.count(), 6)
+
+    def test_alternating_posters_count_once_each(self):
+        group_id, first, second = self.group.id, self.actor.id, self.members[1].id
+        for actor_id in (first, second, first, second, first):
+            fan_out_group_notification(group_id, actor_id, 'new_group_post')
+        for user in self.members[2:]:
+            notification = Notification.query.filter_by(recipient_id=user.id).one()
+            self.assertEqual((notification.actor_id, notification.actor_count), (first, 2))
+
+    def test_async_fan_out_runs_on_a_background_task(self):
+        self.app.config['NOTIFICATION_FANOUT_ASYNC'] = True
+        with patch('app.services.notification_fanout.socketio.start_background_task') as start:
+            self.assertIsNone(notify_group_members(self.group.id, self.actor.id, 'group_share', related_post_id=None))
+        self.assertEqual(Notification.query.count(), 0)
+        task, app, kwargs = start.call_args.args
+        self.assertIs(app, self.app)
+
+        with patch('app.services.notification_fanout.socketio.emit') as emit:
+            task(app, kwargs)
+        self.assertEqual(Notification.query.filter_by(type='group_share').count(), 4)
+        emit.assert_not_called() # No payload, no socket event
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,235 @@
+import os
+import runpy
+import unittest
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from flask_login import login_user, logout_user
+from sqlalchemy import event
+
+from app import create_app, db, cache
+from app.core.models import User, Post, Group, GroupMembership, Notification
+from app.services.counter_service import USER, UNREAD_NOTIFICATIONS, get_counter, reconcile_counters
+from app.services.notification_fanout import fan_out_group_notification
+from app.services.notification_service import get_unread_count, mark_all_read, notify, PushDebouncer
+from app.utils.helpers import inject_unread_notification_count
+import config
+from config import TestingConfig
+
+
+class NotificationServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        cache.clear()
+
+        self.users = []
+        for name in ('ann', 'bob', 'cat'):
+            user = User(username=name, email=f'{name}@example.com')
+            user.set_password('password')
+            self.users.append(user)
+        db.session.add_all(self.users)
+        db.session.commit()
+        self.ann, self.bob, self.cat = self.users
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        cache.clear()
+        self.app_context.pop()
+
+    @contextmanager
+    def _count_queries(self):
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+    def _notify(self, recipient, count=1):
+        notifications = [Notification(recipient_id=recipient.id, actor_id=self.cat.id, type='follow')
+                         for _ in range(count)]
+        db.session.add_all(notifications)
+        db.session.commit()
+        return notifications
+
+    def test_counter_follows_orm_changes(self):
+        first, second, third = self._notify(self.ann, 3)
+        self.assertEqual(get_counter(USER, self.ann.id, UNREAD_NOTIFICATIONS), 3)
+
+        first.is_read = True
+        db.session.commit()
+        self.assertEqual(get_counter(USER, self.ann.id, UNREAD_NOTIFICATIONS), 2)
+        db.session.delete(first) # Already read: no change
+        db.session.delete(second)
+        db.session.commit()
+        self.assertEqual(get_counter(USER, self.ann.id, UNREAD_NOTIFICATIONS), 1)
+        third.is_read = True
+        db.session.rollback()
+        self.assertEqual(get_counter(USER, self.ann.id, UNREAD_NOTIFICATIONS), 1)
+        self.assertEqual(reconcile_counters(repair=False), [])
+
+    def test_cached_count_invalidated_on_commit(self):
+        ann_id = self.ann.id
+        self._notify(self.ann, 2)
+        self.assertEqual(get_unread_count(ann_id), 2)
+        with self._count_queries() as statements:
+            self.assertEqual(get_unread_count(ann_id), 2)
+        self.assertEqual(statements, [])
+
+        self._notify(self.ann)
+        self.assertEqual(get_unread_count(ann_id), 3)
+        mark_all_read(ann_id)
+        self.assertEqual(get_unread_count(ann_id), 3) # Not committed yet
+        db.session.commit()
+        self.assertEqual(get_unread_count(ann_id), 0)
+        self.assertEqual(Notification.query.filter_by(recipient_id=ann_id, is_read=False).count(), 0)
+        self.assertEqual(reconcile_counters(repair=False), [])
+
+    def test_cache_backend_and_unread_ttl_follow_the_config(self):
+        # A per-process cache only sees its own process's deletes, so it keeps counts briefly
+        for cache_type, ttl in (('SimpleCache', 5), ('RedisCache', 3600)):
+            with patch.dict(os.environ, {'CACHE_TYPE': cache_type}):
+                os.environ.pop('NOTIFICATION_UNREAD_CACHE_TTL', None)
+                settings = runpy.run_path(config.__file__)['Config']
+            self.assertEqual(settings.NOTIFICATION_UNREAD_CACHE_TTL, ttl)
+
+        class NullCacheConfig(TestingConfig):
+            CACHE_TYPE = 'NullCache'
+        app = create_app(NullCacheConfig)
+        self.assertEqual(type(app.extensions['cache'][cache]).__name__, 'NullCache')
+
+    def test_group_fan_out_counts_every_recipient(self):
+        group = Group(name='Climbers', creator_id=self.ann.id)
+        db.session.add(group)
+        db.session.flush()
+        db.session.add_all([GroupMembership(user_id=user.id, group_id=group.id) for user in self.users])
+        db.session.commit()
+        self._notify(self.bob)
+        self.assertEqual(get_unread_count(self.bob.id), 1)
+
+        fan_out_group_notification(group.id, self.ann.id, 'new_group_post')
+        self.assertEqual((get_unread_count(self.ann.id), get_unread_count(self.bob.id), get_unread_count(self.cat.id)),
+                         (0, 2, 1))
+        self.assertEqual(reconcile_counters(repair=False), [])
+
+    def test_context_processor_reads_count_only_when_rendered(self):
+        self._notify(self.ann, 2)
+        ann = db.session.get(User, self.ann.id)
+        with self.app.test_request_context('/'):
+            login_user(ann)
+            with self._count_queries() as statements:
+                context = inject_unread_notification_count()
+            self.assertEqual(statements, [])
+            self.assertEqual(context['unread_notification_count'], 2)
+            self.assertFalse(context['unread_notification_count'] == 0)
+            self.assertEqual(f"{context['unread_notification_count']}", '2')
+            logout_user()
+            self.assertEqual(inject_unread_notification_count()['unread_notification_count'], 0)
+
+
+    def test_notifications_for_the_same_target_coalesce(self):
+        post = Post(body='Hello', author=self.ann)
+        db.session.add(post)
+        db.session.commit()
+        start = datetime.now(timezone.utc)
+        with patch('app.services.notification_fanout.socketio.emit') as emit:
+            for minutes, actor, reaction_type in ((0, self.bob, 'like'), (1, self.cat, 'love'), (2, self.cat, 'like')):
+                notify(self.ann.id, actor.id, f'reaction_{reaction_type}', related_post_id=post.id,
+                       now=start + timedelta(minutes=minutes),
+                       payload={'message': 'single', 'actor_username': actor.username})
+                db.session.commit()
+
+        notification = Notification.query.filter_by(recipient_id=self.ann.id).one()
+        self.assertEqual((notification.actor_id, notification.actor_count, notification.type),
+                         (self.cat.id, 2, 'reaction_like')) # cat reacting twice counts once
+        self.assertEqual(get_unread_count(self.ann.id), 1)
+        self.assertEqual([call.args[1]['message'] for call in emit.call_args_list],
+                         ['single', 'cat and 1 other reacted to your post.', 'cat and 1 other reacted to your post.'])
+
+        # Read notifications and stale ones start a new row
+        mark_all_read(self.ann.id)
+        db.session.commit()
+        notify(self.ann.id, self.bob.id, 'reaction_like', related_post_id=post.id, now=start + timedelta(minutes=3))
+        db.session.commit()
+        notify(self.ann.id, self.cat.id, 'reaction_like', related_post_id=post.id, now=start + timedelta(days=1))
+        notify(self.ann.id, self.cat.id, 'follow')
+        db.session.commit()
+        self.assertEqual(Notification.query.filter_by(recipient_id=self.ann.id).count(), 4)
+        self.assertEqual(get_unread_count(self.ann.id), 3)
+        self.assertEqual(reconcile_counters(repair=False), [])
+
+    def test_coalesced_count_is_of_distinct_actors(self):
+        post = Post(body='Hello', author=self.ann)
+        db.session.add(post)
+        db.session.commit()
+        start = datetime.now(timezone.utc)
+        with patch('app.services.notification_fanout.socketio.emit') as emit:
+            for minutes, actor in enumerate((self.bob, self.cat, self.bob, self.cat, self.bob)):
+                notify(self.ann.id, actor.id, 'comment', related_post_id=post.id, now=start + timedelta(minutes=minutes),
+                       payload={'message': 'single', 'actor_username': actor.username})
+                db.session.commit()
+
+        notification = Notification.query.filter_by(recipient_id=self.ann.id).one()
+        self.assertEqual((notification.actor_id, notification.actor_count), (self.bob.id, 2))
+        self.assertEqual(emit.call_args.args[1]['message'], 'bob and 1 other commented on your post.')
+        self.assertEqual(sorted(link.actor_id for link in notification.actor_links), sorted([self.bob.id, self.cat.id]))
+
+    def test_coalesced_group_notifications_render(self):
+        group = Group(name='Climbers', creator_id=self.ann.id)
+        post = Post(body='Hello', author=self.bob)
+        db.session.add_all([group, post])
+        db.session.commit()
+        start = datetime.now(timezone.utc)
+        for minutes, actor in enumerate((self.bob, self.cat)):
+            notify(self.ann.id, actor.id, 'new_group_poll', related_group_id=group.id, now=start + timedelta(minutes=minutes))
+            notify(self.ann.id, actor.id, 'group_share', related_group_id=group.id, related_post_id=post.id,
+                   now=start + timedelta(minutes=minutes))
+        db.session.commit()
+
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(self.ann.id)
+        with self.app.app_context(): # A fresh g: Flask-Login caches the user there
+            page = ' '.join(client.get('/notifications').get_data(as_text=True).split())
+        self.assertIn('cat</a> and 1 other created polls in group', page)
+        self.assertIn('cat</a> and 1 other shared posts to group', page)
+        self.assertNotIn('A new notification.', page)
+
+    def test_pushes_wait_for_commit(self):
+        with patch('app.services.notification_fanout.socketio.emit') as emit:
+            notify(self.ann.id, self.bob.id, 'follow', payload={'message': 'bob followed you'})
+            db.session.rollback()
+            notify(self.ann.id, self.cat.id, 'follow', payload={'message': 'cat followed you'})
+            db.session.commit()
+        self.assertEqual(emit.call_count, 1)
+        self.assertEqual(emit.call_args.args[1], {'message': 'cat followed you', 'actor_count': 1})
+        self.assertEqual(emit.call_args.kwargs['to'], [str(self.ann.id)])
+
+    def test_debouncer_sends_leading_and_trailing_push(self):
+        debouncer = PushDebouncer(interval=2)
+        with patch('app.services.notification_fanout.socketio.emit') as emit, \
+                patch('app.services.notification_service.socketio.start_background_task') as start, \
+                patch('app.services.notification_service.socketio.sleep'):
+            self.assertTrue(debouncer.push('post:1', {'n': 1}, [self.ann.id]))
+            self.assertFalse(debouncer.push('post:1', {'n': 2}, [self.ann.id]))
+            self.assertFalse(debouncer.push('post:1', {'n': 3}, [self.ann.id]))
+            self.assertTrue(debouncer.push('post:2', {'n': 1}, [self.bob.id]))
+            self.assertEqual([call.args[1] for call in emit.call_args_list], [{'n': 1}, {'n': 1}])
+
+            flush, app, key = start.call_args_list[0].args
+            flush(app, key)
+            self.assertEqual(emit.call_args.args[1], {'n': 3})
+            self.assertTrue(debouncer.push('post:1', {'n': 4}, [self.ann.id])) # A new burst
+            flush, app, key = start.call_args_list[1].args
+            flush(app, key) # Nothing new for post:2
+        self.assertEqual(emit.call_count, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
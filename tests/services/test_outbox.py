@@ -0,0 +1,178 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import Mock, patch
+
+from app import create_app, db, cache
+from app.core.models import User, Post, Reaction, Notification, UserPoints, OutboxEvent
+from app.services.outbox import outbox_handler, enqueue, claim_batch, apply_event, drain_outbox
+from app.services.side_effects import REACTION_ADDED, LIKE_MILESTONE_REACHED
+from config import TestingConfig
+
+
+@outbox_handler('test_failing')
+def _failing(payload):
+    raise ValueError('handler failed')
+
+
+@outbox_handler('test_commits_then_fails')
+def _commits_then_fails(payload):
+    db.session.add(Notification(recipient_id=payload['user_id'], actor_id=payload['user_id'], type='follow'))
+    db.session.commit() # Must only flush: the whole event rolls back below
+    raise ValueError('handler failed after committing')
+
+
+@outbox_handler('test_notifies')
+def _notifies(payload):
+    db.session.add(Notification(recipient_id=payload['user_id'], actor_id=payload['user_id'], type='follow'))
+
+
+class OutboxTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app.config['OUTBOX_MAX_ATTEMPTS'] = 2
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        cache.clear()
+
+        self.ann = User(username='ann', email='ann@example.com')
+        self.bob = User(username='bob', email='bob@example.com')
+        for user in (self.ann, self.bob):
+            user.set_password('password')
+        db.session.add_all([self.ann, self.bob])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        cache.clear()
+        self.app_context.pop()
+
+    def _event(self, key):
+        return db.session.execute(db.select(OutboxEvent).filter_by(idempotency_key=key)).scalar_one()
+
+    def test_reaction_side_effects_applied_after_commit(self):
+        post = Post(body='hello', author=self.ann)
+        db.session.add_all([post, UserPoints(user_id=self.ann.id, points=10, level=1)])
+        db.session.commit()
+        reaction = Reaction(user_id=self.bob.id, post_id=post.id, reaction_type='love')
+        db.session.add(reaction)
+        db.session.flush()
+        enqueue(REACTION_ADDED, {'reaction_id': reaction.id, 'reaction_type': 'love'}, f'{REACTION_ADDED}:{reaction.id}')
+        db.session.commit()
+
+        self.assertEqual(UserPoints.query.filter_by(user_id=self.ann.id).one().points, 13)
+        notification = Notification.query.filter_by(recipient_id=self.ann.id, type='reaction_love').one()
+        self.assertEqual(notification.actor_id, self.bob.id)
+        event = self._event(f'{REACTION_ADDED}:{reaction.id}')
+        self.assertIsNotNone(event.processed_at)
+        self.assertIsNone(event.claim_token)
+
+    def _react(self, user, post_id):
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+        with self.app.app_context(): # A fresh g: Flask-Login caches the user there
+            client.post(f'/react/{post_id}/like')
+
+    @patch('app.services.side_effects.LIKE_MILESTONES', [2])
+    def test_like_milestone_decided_by_the_like_that_reached_it(self):
+        post = Post(body='hello', author=self.ann)
+        cat, dan = User(username='cat', email='cat@example.com'), User(username='dan', email='dan@example.com')
+        for user in (cat, dan):
+            user.set_password('password')
+        db.session.add_all([post, cat, dan, UserPoints(user_id=self.ann.id, points=10, level=1)])
+        db.session.commit()
+        post_id = post.id
+
+        # Three likes commit before any event is applied, then one is taken back and redone
+        self.app.extensions['outbox_workers'] = Mock()
+        for user in (self.bob, cat, dan, dan, dan):
+            self._react(user, post_id)
+        self.assertEqual(OutboxEvent.query.filter_by(kind=LIKE_MILESTONE_REACHED).count(), 1)
+
+        del self.app.extensions['outbox_workers']
+        drain_outbox()
+        milestones = Notification.query.filter_by(recipient_id=self.ann.id, type='like_milestone_2').all()
+        self.assertEqual([notification.actor_id for notification in milestones], [cat.id])
+
+    def test_same_idempotency_key_enqueued_once(self):
+        self.app.extensions['outbox_workers'] = Mock() # Leave the events pending
+        enqueue('test_failing', {}, 'dedupe:1')
+        enqueue('test_failing', {}, 'dedupe:1')
+        db.session.commit()
+        enqueue('test_failing', {'again': True}, 'dedupe:1')
+        db.session.commit()
+        self.assertEqual(OutboxEvent.query.count(), 1)
+        self.assertEqual(self._event('dedupe:1').payload, {})
+        self.assertEqual(self.app.extensions['outbox_workers'].wake.call_count, 2)
+
+    def test_failed_event_retried_with_backoff_then_given_up(self):
+        enqueue('test_failing', {}, 'failing:1')
+        db.session.commit()
+        event = self._event('failing:1')
+        self.assertEqual(event.attempts, 1)
+        self.assertIsNone(event.failed_at)
+        self.assertGreater(event.available_at, datetime.utcnow() + timedelta(seconds=3))
+        self.assertIn('handler failed', event.last_error)
+        self.assertEqual(drain_outbox(), 0) # Not due yet
+
+        event.available_at = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        self.assertEqual(drain_outbox(), 1)
+        db.session.expire_all()
+        event = self._event('failing:1')
+        self.assertEqual(event.attempts, 2)
+        self.assertIsNotNone(event.failed_at)
+        self.assertIsNone(event.processed_at)
+
+    def test_handler_commits_only_flush(self):
+        enqueue('test_commits_then_fails', {'user_id': self.ann.id}, 'partial:1')
+        db.session.commit()
+        self.assertEqual(Notification.query.count(), 0)
+        self.assertEqual(self._event('partial:1').attempts, 1)
+
+    def test_claimed_events_are_leased(self):
+        self.app.extensions['outbox_workers'] = Mock()
+        enqueue('test_failing', {}, 'lease:1')
+        enqueue('test_failing', {}, 'lease:2')
+        db.session.commit()
+
+        token, events = claim_batch(batch_size=1)
+        self.assertEqual([event.kind for event in events], ['test_failing'])
+        other_token, other_events = claim_batch()
+        self.assertEqual(len(other_events), 1)
+        self.assertNotEqual(events[0].id, other_events[0].id)
+        self.assertEqual(claim_batch()[1], []) # Both are leased
+
+        # Once the lease runs out the event is claimed again, and the first claim is lost
+        db.session.execute(db.update(OutboxEvent).where(OutboxEvent.id == events[0].id)
+                           .values(available_at=datetime.utcnow() - timedelta(seconds=1)))
+        db.session.commit()
+        new_token, reclaimed = claim_batch()
+        self.assertEqual([event.id for event in reclaimed], [events[0].id])
+        self.assertFalse(apply_event(self.app, token, *events[0]))
+        db.session.expire_all()
+        self.assertEqual(self._event('lease:1').claim_token, new_token)
+
+    def test_inline_commit_applies_only_its_own_events(self):
+        self.app.extensions['outbox_workers'] = Mock() # Another user's event, left for the workers
+        enqueue('test_notifies', {'user_id': self.ann.id}, 'elsewhere:1')
+        db.session.commit()
+        del self.app.extensions['outbox_workers']
+
+        enqueue('test_notifies', {'user_id': self.bob.id}, 'mine:1')
+        db.session.commit()
+        db.session.expire_all()
+        self.assertIsNotNone(self._event('mine:1').processed_at)
+        self.assertIsNone(self._event('elsewhere:1').processed_at)
+        self.assertEqual([n.recipient_id for n in Notification.query.filter_by(type='follow')], [self.bob.id])
+
+    def test_create_app_starts_no_workers(self):
+        class ServerConfig(TestingConfig):
+            TESTING = False
+            SCHEDULER_ENABLED = False
+            OUTBOX_WORKERS = 2
+        # CLI commands and migrations create the app too; only the server entry point starts workers
+        app = create_app(ServerConfig)
+        self.assertNotIn('outbox_workers', app.extensions)
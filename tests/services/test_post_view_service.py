@@ -0,0 +1,134 @@
+import unittest
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from app import create_app, db, cache
+from app.core.models import (
+    User, Post, Reaction, Comment, MediaItem, Hashtag, Poll, PollOption, PollVote, Bookmark,
+    PRIVACY_PUBLIC, PRIVACY_PRIVATE
+)
+from app.services.post_view_service import load_post_views
+from config import TestingConfig
+
+
+class PostViewServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        cache.clear()
+
+        self.author = User(username='author', email='author@example.com')
+        self.viewer = User(username='viewer', email='viewer@example.com')
+        for user in (self.author, self.viewer):
+            user.set_password('password')
+        db.session.add_all([self.author, self.viewer])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        cache.clear()
+        self.app_context.pop()
+
+    def _post(self, body, tags=(), privacy=PRIVACY_PUBLIC):
+        post = Post(body=body, author=self.author, is_published=True, privacy_level=privacy)
+        for tag in tags:
+            hashtag = Hashtag.query.filter_by(tag_text=tag).first() or Hashtag(tag_text=tag)
+            post.hashtags.append(hashtag)
+        db.session.add(post)
+        db.session.commit()
+        return post
+
+    def _engage(self, post):
+        db.session.add_all([
+            Reaction(user_id=self.viewer.id, post_id=post.id, reaction_type='love'),
+            Reaction(user_id=self.author.id, post_id=post.id, reaction_type='like'),
+            Comment(body="Nice", user_id=self.viewer.id, post_id=post.id),
+            MediaItem(post_id=post.id, filename='a.jpg', media_type='image'),
+            Bookmark(user_id=self.viewer.id, post_id=post.id)
+        ])
+        poll = Poll(question="Yes?", user_id=self.author.id, post_id=post.id)
+        db.session.add(poll)
+        db.session.commit()
+        yes, no = PollOption(option_text="Yes", poll_id=poll.id), PollOption(option_text="No", poll_id=poll.id)
+        db.session.add_all([yes, no])
+        db.session.commit()
+        db.session.add(PollVote(user_id=self.viewer.id, option_id=yes.id, poll_id=poll.id))
+        db.session.commit()
+
+    @contextmanager
+    def _count_queries(self):
+        statements = []
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    def test_view_matches_per_post_accessors(self):
+        post = self._post("Engaged post", tags=['alpha'])
+        self._engage(post)
+
+        view = load_post_views([post], self.viewer)[post.id]
+        self.assertEqual(view.reaction_count('love'), post.reaction_count(reaction_type='love'))
+        self.assertEqual(view.reaction_count('like'), 1)
+        self.assertEqual(view.reaction_count(), post.reaction_count())
+        self.assertEqual(view.viewer_reaction, post.get_reaction_by_user(self.viewer).reaction_type)
+        self.assertEqual([m.filename for m in view.media_items], ['a.jpg'])
+        self.assertEqual([h.tag_text for h in view.hashtags], ['alpha'])
+        self.assertEqual([c.body for c in view.comments], ["Nice"])
+        self.assertTrue(view.is_bookmarked)
+        self.assertFalse(view.is_purchased)
+
+        poll_view = view.polls[0]
+        self.assertTrue(poll_view.viewer_has_voted)
+        self.assertEqual(poll_view.total_votes, poll_view.poll.total_votes())
+        self.assertEqual([(o.option.option_text, o.vote_count) for o in poll_view.options], [("Yes", 1), ("No", 0)])
+
+        anonymous_view = load_post_views([post], None)[post.id]
+        self.assertIsNone(anonymous_view.viewer_reaction)
+        self.assertFalse(anonymous_view.is_bookmarked)
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        posts = [self._post(f"Post {i}", tags=['shared', f'tag{i}']) for i in range(10)]
+        for post in posts:
+            self._engage(post)
+        post_ids = [post.id for post in posts]
+        viewer_id = self.viewer.id
+
+        def fresh_posts(ids):
+            # Start each measurement from a clean session, as a new request would
+            db.session.expunge_all()
+            cache.clear()
+            return Post.query.filter(Post.id.in_(ids)).all()
+
+        page = fresh_posts(post_ids[:2])
+        viewer = db.session.get(User, viewer_id)
+        with self._count_queries() as small_page:
+            load_post_views(page, viewer)
+        page = fresh_posts(post_ids)
+        viewer = db.session.get(User, viewer_id)
+        with self._count_queries() as full_page:
+            load_post_views(page, viewer)
+        self.assertEqual(len(full_page), len(small_page))
+        self.assertLess(len(full_page), 20)
+
+    def test_related_posts_ranked_and_visibility_filtered(self):
+        post = self._post("Source", tags=['a', 'b'])
+        best = self._post("Shares two tags", tags=['a', 'b'])
+        good = self._post("Shares one tag", tags=['b'])
+        self._post("Private match", tags=['a', 'b'], privacy=PRIVACY_PRIVATE)
+        self._post("Unrelated", tags=['c'])
+
+        view = load_post_views([post], self.viewer)[post.id]
+        self.assertEqual([r.post.id for r in view.related_posts], [best.id, good.id])
+        self.assertEqual([t.tag_text for t in view.related_posts[0].hashtags], ['a', 'b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import unittest
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from flask import request
+from flask_login import login_user
+from sqlalchemy import event
+
+from app import create_app, db, cache, socketio
+from app.core.models import User, Conversation, ChatMessage, ConversationReadState
+from app.services.read_state import mark_read, unread_counts, get_watermarks
+from config import TestingConfig
+
+
+class ReadStateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        cache.clear()
+
+        self.ann = User(username='ann', email='ann@example.com')
+        self.bob = User(username='bob', email='bob@example.com')
+        self.cat = User(username='cat', email='cat@example.com')
+        for user in (self.ann, self.bob, self.cat):
+            user.set_password('password')
+        self.conversation = Conversation()
+        self.conversation.participants.extend([self.ann, self.bob, self.cat])
+        self.other_conversation = Conversation()
+        self.other_conversation.participants.extend([self.ann, self.bob])
+        db.session.add_all([self.ann, self.bob, self.cat, self.conversation, self.other_conversation])
+        db.session.commit()
+
+        self.start = datetime(2026, 1, 1, 12, 0)
+        senders = [self.ann, self.cat, self.bob, self.ann, self.ann, self.cat]
+        self.messages = [ChatMessage(conversation_id=self.conversation.id, body=f'message {i}', sender_id=sender.id,
+                                     timestamp=self.start + timedelta(minutes=i))
+                         for i, sender in enumerate(senders)]
+        self.elsewhere = ChatMessage(conversation_id=self.other_conversation.id, body='elsewhere',
+                                     sender_id=self.ann.id, timestamp=self.start + timedelta(hours=1))
+        db.session.add_all(self.messages + [self.elsewhere])
+        db.session.commit()
+        self.ids = [message.id for message in self.messages]
+        self.conversation_id, self.bob_id = self.conversation.id, self.bob.id
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        cache.clear()
+        self.app_context.pop()
+
+    @contextmanager
+    def _count_queries(self):
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+    def _read_at(self):
+        return {message_id: read_at for message_id, read_at in
+                db.session.query(ChatMessage.id, ChatMessage.read_at).filter(ChatMessage.id.in_(self.ids))}
+
+    def test_mark_read_moves_the_watermark_with_a_fixed_number_of_statements(self):
+        elsewhere_id = self.elsewhere.id
+        with self._count_queries() as statements:
+            result = mark_read(self.bob_id, self.conversation_id, [self.ids[1], self.ids[3], elsewhere_id])
+            db.session.commit()
+        # The given messages, the previous watermark, the UPSERT and the read_at UPDATE
+        self.assertEqual(len(statements), 4)
+        self.assertEqual(result['last_read_message_id'], self.ids[3])
+        self.assertEqual(result['message_ids'], [self.ids[1], self.ids[3]])
+        self.assertEqual(result['sender_ids'], sorted([self.ann.id, self.cat.id]))
+
+        watermark = db.session.get(ConversationReadState, (self.bob.id, self.conversation.id))
+        self.assertEqual((watermark.last_read_message_id, watermark.last_read_timestamp),
+                         (self.ids[3], self.messages[3].timestamp))
+        read_at = self._read_at()
+        # Others' messages up to the watermark are materialized as read, bob's own is not
+        self.assertTrue(all(read_at[self.ids[i]] for i in (0, 1, 3)))
+        self.assertIsNone(read_at[self.ids[2]])
+        self.assertIsNone(read_at[self.ids[4]])
+        self.assertIsNone(db.session.get(ChatMessage, self.elsewhere.id).read_at)
+
+    def test_watermark_never_moves_back(self):
+        mark_read(self.bob.id, self.conversation.id, [self.ids[4]])
+        db.session.commit()
+        self.assertIsNone(mark_read(self.bob.id, self.conversation.id, [self.ids[0], self.ids[4]]))
+        self.assertIsNone(mark_read(self.bob.id, self.conversation.id, [self.elsewhere.id]))
+
+        result = mark_read(self.bob.id, self.conversation.id, [self.ids[5]])
+        db.session.commit()
+        self.assertEqual(result['message_ids'], [self.ids[5]])
+        self.assertEqual(get_watermarks(self.conversation.id)[self.bob.id][1], self.ids[5])
+
+    def test_unread_counts_compare_against_the_watermark(self):
+        mark_read(self.bob.id, self.conversation.id, [self.ids[3]])
+        db.session.commit()
+        conversation_ids = [self.conversation.id, self.other_conversation.id]
+        with self._count_queries() as statements:
+            counts = unread_counts(self.bob_id, conversation_ids)
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(counts, {self.conversation.id: 2, self.other_conversation.id: 1})
+        # ann's own messages are never unread to her
+        self.assertEqual(unread_counts(self.ann.id, conversation_ids), {self.conversation.id: 3, self.other_conversation.id: 0})
+
+    def test_mark_messages_as_read_event_emits_one_update(self):
+        # Called directly: the Socket.IO test client only sees handlers of the first app created in a process
+        from app.core.events import handle_mark_messages_as_read
+        emitted = []
+        with self.app.test_request_context('/'), \
+                patch.object(socketio, 'emit', lambda event, data, **kwargs: emitted.append((event, data, kwargs))):
+            request.sid = 'sid'
+            login_user(self.bob)
+            handle_mark_messages_as_read({'conversation_id': self.conversation.id, 'message_ids': [self.ids[0], self.ids[1]]})
+            handle_mark_messages_as_read({'conversation_id': self.conversation.id, 'message_ids': [self.ids[0]]})
+        self.assertEqual(len(emitted), 1)
+        name, payload, kwargs = emitted[0]
+        self.assertEqual(name, 'messages_read_update')
+        self.assertEqual(payload['message_ids'], self.ids[:2])
+        self.assertEqual(payload['last_read_message_id'], self.ids[1])
+        self.assertEqual(payload['last_read_timestamp'], '2026-01-01T12:01:00Z')
+        self.assertEqual(sorted(kwargs['to']), sorted([f'conv_{self.conversation.id}', str(self.ann.id), str(self.cat.id)]))
+        self.assertEqual(unread_counts(self.bob.id, [self.conversation.id]), {self.conversation.id: 3})
+
+    def test_mark_read_requires_a_participant(self):
+        from app.core.events import handle_mark_messages_as_read
+        outsider = User(username='dan', email='dan@example.com')
+        outsider.set_password('password')
+        db.session.add(outsider)
+        db.session.commit()
+        emitted, errors = [], []
+        with self.app.test_request_context('/'), \
+                patch.object(socketio, 'emit', lambda event, data, **kwargs: emitted.append(event)), \
+                patch('app.core.events.emit', lambda event, data, **kwargs: errors.append(event)):
+            request.sid = 'sid'
+            login_user(outsider)
+            handle_mark_messages_as_read({'conversation_id': self.conversation.id, 'message_ids': [self.ids[5]]})
+        self.assertEqual((emitted, errors), ([], ['mark_read_error']))
+        self.assertEqual(get_watermarks(self.conversation.id), {})
+        self.assertFalse(any(self._read_at().values()))
+
+    def test_conversation_list_shows_unread_counts(self):
+        mark_read(self.bob.id, self.conversation.id, [self.ids[3]])
+        db.session.commit()
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(self.bob.id)
+        with self.app.app_context(): # A fresh g: Flask-Login caches the user there
+            page = client.get('/chat').get_data(as_text=True)
+        self.assertIn('badge-pill mr-1">2</span>', page)
+        self.assertIn('badge-pill mr-1">1</span>', page)
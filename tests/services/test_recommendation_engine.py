@@ -0,0 +1,130 @@
+import unittest
+from datetime import datetime, timedelta
+
+from app import create_app, db, cache
+from app.core.models import User, Post, Group, GroupMembership, Hashtag, Reaction, Comment, RecommendationCandidate
+from app.services.recommendation_engine import RecommendationEngine
+from app.services.recommendation_service import refresh_recommendations
+from config import TestingConfig
+
+
+class RecommendationEngineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        cache.clear()
+
+        self.users = {}
+        for name in ('reader', 'author', 'friend', 'member', 'other'):
+            user = User(username=name, email=f'{name}@example.com')
+            user.set_password('password')
+            self.users[name] = user
+        db.session.add_all(self.users.values())
+        db.session.commit()
+        self.reader = self.users['reader']
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        cache.clear()
+        self.app_context.pop()
+
+    def _post(self, author, tags, group=None, **kwargs):
+        post = Post(body='Post', author=author, group=group, is_published=True, **kwargs)
+        post.hashtags = [Hashtag.query.filter_by(tag_text=tag).first() or Hashtag(tag_text=tag) for tag in tags]
+        db.session.add(post)
+        db.session.commit()
+        return post
+
+    def _group(self, name, *members):
+        group = Group(name=name, creator_id=self.users['author'].id)
+        db.session.add(group)
+        db.session.flush()
+        db.session.add_all([GroupMembership(user_id=member.id, group_id=group.id) for member in members])
+        db.session.commit()
+        return group
+
+    def _engine(self, *users):
+        return RecommendationEngine([user.id for user in users or [self.reader]])
+
+    def test_posts_ranked_by_weighted_interest_cosine(self):
+        author = self.users['author']
+        # #common is on every post, so it counts for less than the rarer hashtags
+        liked = self._post(author, ['climbing', 'common'])
+        commented = self._post(author, ['photo', 'common'])
+        db.session.add_all([Reaction(user_id=self.reader.id, post_id=liked.id, reaction_type='like'),
+                            Comment(body='Nice', user_id=self.reader.id, post_id=commented.id)])
+        db.session.commit()
+        photo = self._post(author, ['photo', 'common'])
+        climbing = self._post(author, ['climbing', 'common'])
+        common = self._post(author, ['common', 'cooking'])
+        self._post(author, ['cooking'])
+        self._post(self.reader, ['photo'])
+        self._post(author, ['photo'], timestamp=datetime.utcnow() - timedelta(days=365))
+
+        ranked = self._engine().score_posts(10)[self.reader.id]
+        # Comments weigh more than reactions; posts the reader wrote, saw or that are too old never appear
+        self.assertEqual([post_id for post_id, _ in ranked], [photo.id, climbing.id, common.id])
+        self.assertTrue(all(0 < score <= 1 for _, score in ranked))
+        self.assertEqual(self._engine().score_posts(1)[self.reader.id], ranked[:1])
+
+    def test_groups_combine_co_membership_follows_and_hashtags(self):
+        friend, member, other = self.users['friend'], self.users['member'], self.users['other']
+        joined = self._group('Joined', self.reader, member)
+        co_members = self._group('Co-members', member)
+        followed = self._group('Followed', friend)
+        tagged = self._group('Tagged', other)
+        self._group('Unrelated', other)
+        self.reader.follow(friend)
+        liked = self._post(self.users['author'], ['climbing'])
+        self._post(other, ['climbing'], group=tagged)
+        db.session.add(Reaction(user_id=self.reader.id, post_id=liked.id, reaction_type='like'))
+        db.session.commit()
+
+        ranked = dict(self._engine().score_groups(10)[self.reader.id])
+        self.assertEqual(set(ranked), {co_members.id, followed.id, tagged.id})
+        self.assertNotIn(joined.id, ranked)
+        self.assertAlmostEqual(ranked[followed.id], 1.0) # The only person the reader follows is a member
+        self.assertAlmostEqual(ranked[co_members.id], 1 / (2 ** 0.5)) # Shares one of Joined's two members
+
+    def test_users_from_mutual_follows_and_shared_groups(self):
+        author, friend, member, other = (self.users[name] for name in ('author', 'friend', 'member', 'other'))
+        self.reader.follow(friend)
+        friend.follow(author)
+        friend.follow(other)
+        db.session.commit()
+        self._group('Shared', self.reader, author, member)
+
+        ranked = self._engine().score_users(10)[self.reader.id]
+        self.assertEqual(ranked, [(author.id, 2.0), (other.id, 1.0), (member.id, 1.0)])
+
+    def test_whole_batch_scored_together(self):
+        author, friend = self.users['author'], self.users['friend']
+        post = self._post(author, ['climbing'])
+        candidate = self._post(author, ['climbing'])
+        db.session.add_all([Reaction(user_id=user.id, post_id=post.id, reaction_type='like')
+                            for user in (self.reader, friend)])
+        db.session.commit()
+
+        scores = self._engine(self.reader, friend, author).score_posts(10)
+        self.assertEqual(scores[self.reader.id], scores[friend.id])
+        self.assertEqual([post_id for post_id, _ in scores[self.reader.id]], [candidate.id])
+        self.assertEqual(scores[author.id], [])
+
+    def test_refresh_writes_engine_candidates(self):
+        author = self.users['author']
+        liked = self._post(author, ['climbing'])
+        candidate = self._post(author, ['climbing'])
+        db.session.add(Reaction(user_id=self.reader.id, post_id=liked.id, reaction_type='like'))
+        db.session.commit()
+
+        self.assertEqual(refresh_recommendations(), len(self.users))
+        rows = RecommendationCandidate.query.filter_by(user_id=self.reader.id, kind='post').all()
+        self.assertEqual([row.item_id for row in rows], [candidate.id])
+        self.assertAlmostEqual(rows[0].score, 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
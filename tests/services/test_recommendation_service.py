@@ -0,0 +1,129 @@
+import unittest
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from app import create_app, db, cache
+from app.core.models import (
+    User, Post, Group, GroupMembership, Hashtag, Reaction, Comment, RecommendationCandidate, RecommendationState,
+    PRIVACY_PRIVATE
+)
+from app.services.recommendation_service import get_recommendations, refresh_recommendations, users_due_for_refresh
+from config import TestingConfig
+
+
+class RecommendationServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        cache.clear()
+
+        self.users = {}
+        for name in ('reader', 'author', 'friend', 'stranger'):
+            user = User(username=name, email=f'{name}@example.com')
+            user.set_password('password')
+            self.users[name] = user
+        db.session.add_all(self.users.values())
+        db.session.commit()
+        self.reader = self.users['reader']
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        cache.clear()
+        self.app_context.pop()
+
+    def _post(self, author, tags, group=None, **kwargs):
+        post = Post(body='Post', author=author, group=group, is_published=True, **kwargs)
+        post.hashtags = [Hashtag.query.filter_by(tag_text=tag).first() or Hashtag(tag_text=tag) for tag in tags]
+        db.session.add(post)
+        db.session.commit()
+        return post
+
+    def _group(self, name, *members):
+        group = Group(name=name, creator_id=self.users['author'].id)
+        db.session.add(group)
+        db.session.flush()
+        db.session.add_all([GroupMembership(user_id=member.id, group_id=group.id) for member in members])
+        db.session.commit()
+        return group
+
+    def _ids(self, kind):
+        return [item.id for item in get_recommendations(self.reader.id)[kind]]
+
+    @contextmanager
+    def _count_queries(self):
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+    def test_posts_ranked_by_shared_interests_and_filtered_on_read(self):
+        author = self.users['author']
+        liked = self._post(author, ['python', 'flask'])
+        commented = self._post(author, ['python'])
+        db.session.add_all([Reaction(user_id=self.reader.id, post_id=liked.id, reaction_type='like'),
+                            Comment(body='Nice', user_id=self.reader.id, post_id=commented.id)])
+        db.session.commit()
+        best = self._post(author, ['python', 'flask'])
+        good = self._post(author, ['flask'])
+        self._post(author, ['python'], privacy_level=PRIVACY_PRIVATE)
+        self._post(author, ['rust'])
+        self._post(self.reader, ['python'])
+
+        self.assertEqual(self._ids('posts'), [best.id, good.id])
+        # Liking a candidate hides it straight away, before the candidates are rescored
+        db.session.add(Reaction(user_id=self.reader.id, post_id=best.id, reaction_type='like'))
+        db.session.commit()
+        self.assertEqual(self._ids('posts'), [good.id])
+
+    def test_users_and_groups_from_follows_and_memberships(self):
+        friend, stranger, author = self.users['friend'], self.users['stranger'], self.users['author']
+        self.reader.follow(friend)
+        friend.follow(stranger)
+        db.session.commit()
+        shared = self._group('Shared', self.reader, author)
+        friends_group = self._group('Friends', friend)
+        self._group('Unrelated', stranger)
+
+        recommendations = get_recommendations(self.reader.id)
+        self.assertEqual({user.id for user in recommendations['users']}, {stranger.id, author.id})
+        self.assertEqual([group.id for group in recommendations['groups']], [friends_group.id])
+        self.assertNotIn(shared.id, self._ids('groups'))
+
+        self.reader.follow(stranger)
+        db.session.commit()
+        self.assertEqual(self._ids('users'), [author.id])
+
+    def test_reads_only_query_the_candidates(self):
+        get_recommendations(self.reader.id)
+        db.session.expunge_all()
+        with self._count_queries() as statements:
+            get_recommendations(self.reader.id)
+        self.assertFalse([s for s in statements if s.lstrip().upper().startswith(('INSERT', 'DELETE'))])
+        self.assertLessEqual(len(statements), 7) # User, state, viewer's follows and friend lists and one query per kind
+
+    def test_refresh_rescores_stale_then_missing_then_old_users(self):
+        now = datetime.utcnow()
+        reader, author, friend, stranger = (self.users[name] for name in ('reader', 'author', 'friend', 'stranger'))
+        self.assertEqual(refresh_recommendations(now=now - timedelta(days=1), limit=2), 2)
+        self.assertEqual({state.user_id for state in RecommendationState.query}, {reader.id, author.id})
+
+        post = self._post(author, ['python'])
+        db.session.add(Reaction(user_id=reader.id, post_id=post.id, reaction_type='like'))
+        db.session.commit()
+        self.assertTrue(db.session.get(RecommendationState, reader.id).is_stale)
+        self.assertEqual(users_due_for_refresh(now, limit=10), [reader.id, friend.id, stranger.id, author.id])
+
+        self.assertEqual(refresh_recommendations(now=now), 4)
+        self.assertEqual(users_due_for_refresh(now, limit=10), [])
+        self.assertEqual(RecommendationCandidate.query.filter_by(user_id=reader.id, kind='post').count(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+
+from sqlalchemy import select
+
+from app import create_app, db, cache
+from app.core.models import User, Post, Hashtag, RelatedPost
+from app.services.related_posts_service import get_related_post_ids, rebuild_related_posts
+from config import TestingConfig
+
+
+class RelatedPostsServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        cache.clear()
+        self.app.config['RELATED_POSTS_INDEX_SIZE'] = 2
+
+        self.author = User(username='author', email='author@example.com')
+        self.author.set_password('password')
+        db.session.add(self.author)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        cache.clear()
+        self.app_context.pop()
+
+    def _tag(self, post, tags):
+        post.hashtags = [Hashtag.query.filter_by(tag_text=tag).first() or Hashtag(tag_text=tag) for tag in tags]
+        db.session.commit()
+
+    def _post(self, tags, is_published=True):
+        post = Post(body='Post', author=self.author, is_published=is_published)
+        db.session.add(post)
+        self._tag(post, tags)
+        return post
+
+    def _index(self):
+        rows = db.session.execute(
+            select(RelatedPost.post_id, RelatedPost.related_post_id, RelatedPost.score)
+            .order_by(RelatedPost.post_id, RelatedPost.score.desc(), RelatedPost.related_post_id.desc())
+        ).all()
+        index = {}
+        for post_id, related_id, score in rows:
+            index.setdefault(post_id, []).append((related_id, score))
+        return index
+
+    def test_tagging_updates_both_sides(self):
+        first = self._post(['a', 'b'])
+        second = self._post(['b'])
+        third = self._post(['a', 'b', 'c'])
+        self.assertEqual(self._index(), {
+            first.id: [(third.id, 2), (second.id, 1)],
+            second.id: [(third.id, 1), (first.id, 1)],
+            third.id: [(first.id, 2), (second.id, 1)],
+        })
+
+        # A better match pushes the weakest entry out of full lists
+        fourth = self._post(['a', 'b', 'c'])
+        self.assertEqual(self._index()[first.id], [(fourth.id, 2), (third.id, 2)])
+        self.assertEqual(self._index()[third.id], [(fourth.id, 3), (first.id, 2)])
+
+        # Retagging drops the post from the lists it no longer belongs in
+        self._tag(fourth, ['z'])
+        self.assertNotIn(fourth.id, self._index())
+        self.assertEqual(self._index()[third.id], [(first.id, 2)])
+        self.assertFalse(any(fourth.id in dict(related) for related in self._index().values()))
+
+    def test_unpublished_and_deleted_posts_are_left_out(self):
+        published = self._post(['a'])
+        draft = self._post(['a'], is_published=False)
+        self.assertEqual(self._index(), {draft.id: [(published.id, 1)]})
+
+        draft.is_published = True
+        db.session.commit()
+        self.assertEqual(self._index(), {draft.id: [(published.id, 1)], published.id: [(draft.id, 1)]})
+
+        db.session.delete(draft)
+        db.session.commit()
+        self.assertEqual(self._index(), {})
+
+    def test_rebuild_matches_incremental_index(self):
+        posts = [self._post(tags) for tags in (['a'], ['a', 'b'], ['b', 'c'], ['a', 'b', 'c'], ['c'])]
+        self._tag(posts[0], ['a', 'c'])
+        incremental = self._index()
+        rebuilt_rows = rebuild_related_posts(batch_size=2)
+        rebuilt = self._index()
+        self.assertEqual(rebuilt_rows, sum(len(related) for related in rebuilt.values()))
+        # The list of the post that changed last is exact without a rebuild
+        self.assertEqual(incremental[posts[0].id], rebuilt[posts[0].id])
+        self.assertTrue(all(len(related) == 2 for related in rebuilt.values()))
+        self.assertEqual(get_related_post_ids([posts[3].id], limit=1), {posts[3].id: [posts[2].id]})
+
+
+if __name__ == '__main__':
+    unittest.main()
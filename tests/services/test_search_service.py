@@ -0,0 +1,125 @@
+import unittest
+
+from app import create_app, db, cache
+from app.core.models import User, Post, Group, Hashtag
+from app.services.search_service import (
+    search_query, page_of, rebuild_search_index, get_search_backend, tokenize, SEARCH_BACKENDS,
+    SearchBackend, LikeSearchBackend, register_search_backend
+)
+from config import TestingConfig
+
+SEARCH_MODEL_IDS = {'posts': Post.id, 'users': User.id, 'groups': Group.id, 'hashtags': Hashtag.id}
+
+
+class SearchServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        cache.clear()
+
+        self.alice = User(username='alice_wonder', email='alice@example.com')
+        self.bob = User(username='bob', email='bob@example.org')
+        for user in (self.alice, self.bob):
+            user.set_password('password')
+        db.session.add_all([self.alice, self.bob])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        cache.clear()
+        self.app_context.pop()
+
+    def _ids(self, kind, term):
+        query, rank = search_query(kind, term)
+        if query is None:
+            return []
+        return [obj.id for obj in query.order_by(rank, SEARCH_MODEL_IDS[kind]).all()]
+
+    def test_sqlite_uses_fts5_backend(self):
+        self.assertIs(get_search_backend(), SEARCH_BACKENDS['fts5'])
+
+    def test_index_follows_create_edit_and_delete(self):
+        post = Post(body="Learning python generators", author=self.alice, is_published=True)
+        db.session.add(post)
+        db.session.commit()
+        self.assertEqual(self._ids('posts', 'generators'), [post.id])
+
+        post.body = "Learning rust lifetimes"
+        db.session.commit()
+        self.assertEqual(self._ids('posts', 'generators'), [])
+        self.assertEqual(self._ids('posts', 'lifetimes'), [post.id])
+
+        db.session.delete(post)
+        db.session.commit()
+        self.assertEqual(self._ids('posts', 'lifetimes'), [])
+
+    def test_prefix_and_multi_field_matching(self):
+        group = Group(name='Gardening Club', description='Tomatoes and herbs', creator_id=self.alice.id)
+        db.session.add_all([group, Hashtag(tag_text='gardening')])
+        db.session.commit()
+        self.assertEqual(self._ids('users', 'ali'), [self.alice.id])
+        self.assertEqual(self._ids('users', 'bob@example.org'), [self.bob.id])
+        self.assertEqual(self._ids('groups', 'garden'), [group.id])
+        self.assertEqual(self._ids('groups', 'herb'), [group.id])
+        self.assertEqual(len(self._ids('hashtags', 'gard')), 1)
+
+    def test_results_are_ranked_and_paginated(self):
+        weak = Post(body="cats and a long list of other unrelated words about the weather today", author=self.bob)
+        strong = Post(body="cats cats cats", author=self.bob)
+        db.session.add_all([weak, strong])
+        db.session.commit()
+        self.assertEqual(self._ids('posts', 'cats'), [strong.id, weak.id])
+
+        query, rank = search_query('posts', 'cats')
+        first, has_next = page_of(query.order_by(rank), 1, 1)
+        second, has_more = page_of(query.order_by(rank), 2, 1)
+        self.assertEqual(([p.id for p in first], has_next), ([strong.id], True))
+        self.assertEqual(([p.id for p in second], has_more), ([weak.id], False))
+
+    def test_query_syntax_in_user_input_is_inert(self):
+        db.session.add(Post(body='quoted "NEAR" OR stars*', author=self.bob))
+        db.session.commit()
+        self.assertEqual(tokenize('"NEAR(a b)" OR *'), ['near', 'a', 'b', 'or'])
+        self.assertEqual(search_query('posts', '*"()'), (None, None))
+        self.assertEqual(len(self._ids('posts', 'NEAR OR')), 1)
+
+    def test_rebuild_repopulates_from_source_tables(self):
+        post = Post(body="Indexed after the fact", author=self.alice)
+        db.session.add(post)
+        db.session.commit()
+        db.session.execute(db.text('DELETE FROM post_search'))
+        db.session.commit()
+        self.assertEqual(self._ids('posts', 'indexed'), [])
+        rebuild_search_index()
+        self.assertEqual(self._ids('posts', 'indexed'), [post.id])
+
+    def test_like_backend_matches_substrings(self):
+        self.app.config['SEARCH_BACKEND'] = 'like'
+        self.assertEqual(self._ids('users', 'ice_won'), [self.alice.id])
+        self.assertEqual(search_query('users', '  '), (None, None))
+
+    def test_incomplete_backends_are_rejected_up_front(self):
+        class NoMatchBackend(SearchBackend):
+            def index(self, connection, kind, rows):
+                pass
+
+            def remove(self, connection, kind, entity_ids):
+                pass
+
+            def rebuild(self, connection, kind=None):
+                pass
+
+        with self.assertRaises(TypeError):
+            NoMatchBackend()
+        with self.assertRaises(TypeError):
+            register_search_backend('incomplete', NoMatchBackend)
+        self.assertNotIn('incomplete', SEARCH_BACKENDS)
+        register_search_backend('substring', LikeSearchBackend())
+        self.assertIsInstance(SEARCH_BACKENDS.pop('substring'), LikeSearchBackend)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import os
+import tempfile
+import unittest
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from app import create_app, db, cache
+from app.core.models import User, followers
+from app.services.social_graph import (
+    SocialGraph, get_social_graph, refresh_social_graph, friends_of_friends, follower_count, following_count
+)
+from config import TestingConfig
+
+
+class SocialGraphSnapshotTestCase(unittest.TestCase):
+
+    def test_csr_rows_and_mmap_round_trip(self):
+        graph = SocialGraph.build([(1, 2), (1, 3), (2, 3), (3, 1), (1, 2), (40, 3)], built_at=123.5)
+        self.assertEqual(list(graph.ids), [1, 2, 3, 40])
+        self.assertEqual(list(graph.following(1)), [2, 3])
+        self.assertEqual(list(graph.followers(3)), [1, 2, 40])
+        self.assertEqual(list(graph.following(99)), [])
+        self.assertTrue(graph.is_following(40, 3))
+        self.assertFalse(graph.is_following(3, 40))
+        self.assertEqual((graph.follower_count(3), graph.following_count(1), graph.edge_count), (3, 2, 5))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'social_graph.bin')
+            graph.write_snapshot(path)
+            mapped = SocialGraph.open_snapshot(path)
+            self.assertEqual(mapped.built_at, 123.5)
+            self.assertEqual([list(mapped.following(user_id)) for user_id in graph.ids],
+                             [list(graph.following(user_id)) for user_id in graph.ids])
+            self.assertEqual(list(mapped.followers(1)), [3])
+            with open(path, 'r+b') as f:
+                f.write(b'NOTGRAPH')
+            with self.assertRaises(ValueError):
+                SocialGraph.open_snapshot(path)
+
+    def test_empty_graph(self):
+        graph = SocialGraph.build([])
+        self.assertEqual(len(graph), 0)
+        self.assertFalse(graph.is_following(1, 2))
+        self.assertEqual(graph.follower_count(1), 0)
+
+
+class SocialGraphServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        cache.clear()
+
+        self.users = {}
+        for name in ('ann', 'bob', 'cat', 'dan', 'eve'):
+            user = User(username=name, email=f'{name}@example.com')
+            user.set_password('password')
+            self.users[name] = user
+        db.session.add_all(self.users.values())
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        cache.clear()
+        self.app_context.pop()
+
+    def _follow(self, *pairs):
+        for follower, followed in pairs:
+            self.users[follower].follow(self.users[followed])
+        db.session.commit()
+
+    @contextmanager
+    def _count_queries(self):
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+    def test_is_following_reads_the_database_once_per_request(self):
+        ann, bob, cat = self.users['ann'], self.users['bob'], self.users['cat']
+        self._follow(('ann', 'bob'))
+        refresh_social_graph()
+        [user.username for user in (ann, bob, cat)] # Reload the users expired by the commit
+        with self.app.test_request_context('/'), self._count_queries() as statements:
+            self.assertTrue(ann.is_following(bob))
+            self.assertFalse(ann.is_following(cat))
+            self.assertFalse(bob.is_following(ann))
+        # Each follower's Viewer: their followed ids and friend lists
+        self.assertEqual(len(statements), 4)
+
+    def test_other_workers_changes_are_seen_before_the_next_snapshot(self):
+        ann, bob, cat = self.users['ann'], self.users['bob'], self.users['cat']
+        self._follow(('ann', 'bob'))
+        refresh_social_graph()
+        # Written by another worker: no session hooks, no cache bump in this process
+        db.session.execute(followers.delete().where(followers.c.follower_id == ann.id))
+        db.session.execute(followers.insert().values(follower_id=ann.id, followed_id=cat.id))
+        db.session.commit()
+        with self.app.test_request_context('/'):
+            self.assertFalse(ann.is_following(bob))
+            self.assertTrue(ann.is_following(cat))
+            ann.follow(cat) # Already following: no duplicate row
+            db.session.commit()
+        self.assertFalse(ann.is_following(bob))
+        self.assertTrue(ann.is_following(cat))
+
+        # Without a shared snapshot the worker rebuilds its own graph for the counts
+        self.assertEqual(follower_count(bob.id), 1)
+        self.app.config['SOCIAL_GRAPH_RELOAD_SECONDS'] = 0
+        self.assertEqual((follower_count(bob.id), follower_count(cat.id)), (0, 1))
+
+    def test_commit_in_a_request_refreshes_its_viewer(self):
+        ann, bob = self.users['ann'], self.users['bob']
+        with self.app.test_request_context('/'):
+            self.assertFalse(ann.is_following(bob))
+            ann.follow(bob)
+            db.session.commit()
+            self.assertTrue(ann.is_following(bob))
+            ann.unfollow(bob)
+            db.session.commit()
+            self.assertFalse(ann.is_following(bob))
+
+    def test_changes_after_the_snapshot(self):
+        ann, bob, cat = self.users['ann'], self.users['bob'], self.users['cat']
+        self._follow(('ann', 'bob'), ('cat', 'bob'))
+        graph = refresh_social_graph()
+
+        # Pending in the session, then committed: both seen before the next snapshot
+        ann.follow(cat)
+        ann.unfollow(bob)
+        self.assertTrue(ann.is_following(cat))
+        self.assertFalse(ann.is_following(bob))
+        ann.follow(cat) # Already following (uncommitted): no duplicate row
+        db.session.flush()
+        self.assertTrue(ann.is_following(cat))
+        db.session.commit()
+        self.assertIs(get_social_graph(), graph)
+        self.assertTrue(ann.is_following(cat))
+        self.assertFalse(ann.is_following(bob))
+        self.assertEqual((follower_count(bob.id), follower_count(cat.id), following_count(ann.id)), (1, 1, 1))
+
+        # Rolled back changes never count
+        cat.unfollow(bob)
+        db.session.rollback()
+        self.assertTrue(cat.is_following(bob))
+        self.assertEqual(follower_count(bob.id), 1)
+
+        # The next snapshot includes them and drops the patches
+        refresh_social_graph()
+        self.assertEqual(list(get_social_graph().following(ann.id)), [cat.id])
+        self.assertEqual((follower_count(bob.id), follower_count(cat.id)), (1, 1))
+
+    def test_friends_of_friends(self):
+        ann, bob, cat, dan, eve = (self.users[name] for name in ('ann', 'bob', 'cat', 'dan', 'eve'))
+        self._follow(('ann', 'bob'), ('ann', 'cat'), ('bob', 'dan'), ('cat', 'dan'), ('cat', 'eve'),
+                     ('bob', 'ann'), ('cat', 'bob'))
+        refresh_social_graph()
+        self.assertEqual(friends_of_friends(ann.id), [(dan.id, 2), (eve.id, 1)])
+        self.assertEqual(friends_of_friends(ann.id, limit=1), [(dan.id, 2)])
+
+        self._follow(('ann', 'dan'))
+        self.assertEqual(friends_of_friends(ann.id), [(eve.id, 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
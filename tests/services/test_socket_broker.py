@@ -0,0 +1,94 @@
+import time
+import unittest
+import uuid
+
+import redis
+import socketio
+from flask import Flask
+from flask_socketio import SocketIO
+
+from app.services.socket_broker import LocalBroker, message_queue_options
+from config import Config, TestingConfig
+
+
+def _wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = predicate()
+        if result:
+            return result
+        time.sleep(0.02)
+    return predicate()
+
+
+class LocalBrokerTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.broker = LocalBroker(port=0).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.broker.stop()
+
+    def test_redis_clients_publish_and_subscribe(self):
+        for protocol in (2, 3):
+            with self.subTest(protocol=protocol):
+                client = redis.Redis.from_url(self.broker.url, protocol=protocol)
+                self.assertTrue(client.ping())
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe('events')
+                _wait_for(lambda: self.broker.subscriber_count(b'events'))
+                self.assertEqual(client.publish('events', b'\x00payload'), 1)
+                self.assertEqual(client.publish('elsewhere', b'lost'), 0)
+                message = _wait_for(lambda: pubsub.get_message(timeout=0.05))
+                self.assertEqual((message['channel'], message['data']), (b'events', b'\x00payload'))
+
+                pubsub.unsubscribe('events')
+                self.assertTrue(_wait_for(lambda: self.broker.subscriber_count(b'events') == 0))
+                pubsub.close()
+                client.close()
+
+    def _server(self, channel, room):
+        """
+        Another worker process: a Socket.IO server on the same queue with one client in `room`.
+        (Flask-SocketIO's test client refuses to run with a message queue.)
+        """
+        server = socketio.Server(async_mode='threading',
+                                 client_manager=socketio.RedisManager(self.broker.url, channel=channel))
+        received = []
+        server._send_eio_packet = lambda eio_sid, eio_packet: received.append(
+            socketio.packet.Packet(encoded_packet=eio_packet.data).data)
+        sid = server.manager.connect('eio-client', '/')
+        server.manager.basic_enter_room(sid, '/', room)
+        # Servers start listening to the queue with their first connection
+        server.manager_initialized = True
+        server.manager.initialize()
+        _wait_for(lambda: self.broker.subscriber_count(channel.encode()))
+        return received
+
+    def test_emits_reach_clients_of_other_processes(self):
+        channel = f'test-{uuid.uuid4().hex}'
+        received = self._server(channel, '42')
+        web = SocketIO(Flask(__name__), async_mode='threading', message_queue=self.broker.url, channel=channel)
+        scheduler = SocketIO(message_queue=self.broker.url, channel=channel) # Write-only, as in a process serving no sockets
+
+        web.emit('new_notification', {'message': 'from a request'}, to='42')
+        scheduler.emit('new_notification', {'message': 'from a job'}, to=['7', '42'])
+        web.emit('new_notification', {'message': 'not yours'}, to='7')
+        self.assertTrue(_wait_for(lambda: len(received) >= 2))
+        time.sleep(0.1)
+        self.assertEqual(received, [['new_notification', {'message': 'from a request'}],
+                                    ['new_notification', {'message': 'from a job'}]])
+
+    def test_channels_separate_deployments(self):
+        received = self._server(f'test-{uuid.uuid4().hex}', '42')
+        web = SocketIO(Flask(__name__), async_mode='threading', message_queue=self.broker.url,
+                       channel=f'test-{uuid.uuid4().hex}')
+        web.emit('new_notification', {'message': 'hi'}, to='42')
+        time.sleep(0.2)
+        self.assertEqual(received, [])
+
+    def test_message_queue_options(self):
+        self.assertEqual(message_queue_options(TestingConfig.__dict__), {})
+        config = {'SOCKETIO_MESSAGE_QUEUE': self.broker.url, 'SOCKETIO_CHANNEL': Config.SOCKETIO_CHANNEL}
+        self.assertEqual(message_queue_options(config), {'message_queue': self.broker.url, 'channel': 'flask-socketio'})
@@ -0,0 +1,61 @@
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from app import create_app, db, cache
+from app.core.models import Hashtag, HashtagUsage
+from app.services.trending_service import calculate_trending_scores
+from config import TestingConfig
+
+
+class TrendingServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        cache.clear()
+
+        self.now = datetime.utcnow()
+        self.python, self.flask, self.quiet = Hashtag(tag_text='python'), Hashtag(tag_text='flask'), Hashtag(tag_text='quiet')
+        db.session.add_all([self.python, self.flask, self.quiet])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        cache.clear()
+        self.app_context.pop()
+
+    def _use(self, hashtag, age, times=1):
+        db.session.add_all([HashtagUsage(hashtag_id=hashtag.id, timestamp=self.now - age) for _ in range(times)])
+
+    def test_window_counts_are_weighted(self):
+        self._use(self.python, timedelta(minutes=10))        # hour, day and week
+        self._use(self.flask, timedelta(hours=5), times=2)   # day and week
+        self._use(self.flask, timedelta(days=3))             # week only
+        self._use(self.quiet, timedelta(days=30), times=5)   # outside every window
+        db.session.commit()
+
+        scores = dict(calculate_trending_scores(now=self.now))
+        self.assertAlmostEqual(scores['python'], 0.6 + 0.3 + 0.1)
+        self.assertAlmostEqual(scores['flask'], 2 * 0.3 + 3 * 0.1)
+        self.assertEqual(scores['quiet'], 0)
+        self.assertEqual([tag for tag, _ in calculate_trending_scores(now=self.now)], ['python', 'flask', 'quiet'])
+        self.assertEqual(len(calculate_trending_scores(now=self.now, limit=1)), 1)
+
+    def test_scores_take_one_aggregate_query(self):
+        self._use(self.flask, timedelta(minutes=1))
+        db.session.commit()
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            self.assertEqual(calculate_trending_scores(now=self.now)[0][0], 'flask')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual(len(statements), 2) # The rollup watermark, then the scores
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from app import create_app, db, cache
+from app.core.models import User, Post, Hashtag, HashtagUsage
+from app.services.trending_service import get_trending_hashtags
+from app.services.trending_stream import DecayedSpaceSaving, TrendingStream, sync_trending_stream
+from app.utils.helpers import process_hashtags
+from config import TestingConfig
+
+HOUR = 3600
+
+
+class DecayedSpaceSavingTestCase(unittest.TestCase):
+    def test_counts_halve_every_half_life(self):
+        summary = DecayedSpaceSaving(capacity=10, half_life=HOUR, landmark=0)
+        summary.add('python', 4, when=0)
+        summary.add('flask', 1, when=HOUR)
+        top = summary.top(2, now=2 * HOUR)
+        self.assertEqual([item for item, _, _ in top], ['python', 'flask'])
+        self.assertAlmostEqual(top[0][1], 1.0)
+        self.assertAlmostEqual(top[1][1], 0.5)
+
+    def test_memory_is_bounded_and_heavy_hitters_survive(self):
+        summary = DecayedSpaceSaving(capacity=5, half_life=HOUR, landmark=0)
+        for i in range(200):
+            summary.add('hot', when=i)
+            summary.add(f'rare{i}', when=i)
+        self.assertEqual(len(summary), 5)
+        item, count, error = summary.top(1, now=200)[0]
+        self.assertEqual(item, 'hot')
+        self.assertLessEqual(count - error, 200)
+
+    def test_landmark_is_rebased_far_in_the_future(self):
+        summary = DecayedSpaceSaving(capacity=5, half_life=1, landmark=0)
+        summary.add('a', when=0)
+        summary.add('b', when=1000) # 2 ** 1000 would overflow without a rebase
+        self.assertEqual(summary.landmark, 1000)
+        self.assertAlmostEqual(summary.top(1, now=1000)[0][1], 1.0)
+
+    def test_merge_and_snapshot_round_trip(self):
+        first = DecayedSpaceSaving(capacity=3, half_life=HOUR, landmark=0)
+        second = DecayedSpaceSaving(capacity=3, half_life=HOUR, landmark=HOUR)
+        first.add('python', 2, when=0)
+        second.add('python', 1, when=HOUR)
+        second.add('flask', 1, when=HOUR)
+        first.merge(DecayedSpaceSaving.from_snapshot(second.to_snapshot()))
+        self.assertEqual({item: round(count, 6) for item, count, _ in first.top(3, now=HOUR)}, {'python': 2.0, 'flask': 1.0})
+        with self.assertRaises(ValueError):
+            first.merge(DecayedSpaceSaving(half_life=2 * HOUR))
+        with self.assertRaises(ValueError):
+            DecayedSpaceSaving.from_snapshot({'version': 0})
+
+
+class TrendingStreamTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        cache.clear()
+
+        self.author = User(username='author', email='author@example.com')
+        self.author.set_password('password')
+        db.session.add(self.author)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        cache.clear()
+        self.app_context.pop()
+
+    def _post(self, body):
+        post = Post(body=body, author=self.author)
+        db.session.add(post)
+        process_hashtags(body, post)
+        return post
+
+    def _tags(self, limit=10):
+        return [tag.tag_text for tag in get_trending_hashtags(limit)]
+
+    def test_seeds_from_recent_usage_then_follows_commits(self):
+        old = Hashtag(tag_text='old')
+        db.session.add(old)
+        db.session.flush()
+        db.session.add_all([HashtagUsage(hashtag_id=old.id, timestamp=datetime.utcnow() - timedelta(days=3))
+                            for _ in range(3)])
+        self._post('#recent')
+        db.session.commit()
+        self.assertEqual(self._tags(), ['recent', 'old']) # One use now outweighs three from 3 days ago
+
+        self._post('#old #old #flask')
+        self._post('#flask')
+        db.session.commit()
+        self.assertEqual(self._tags(), ['flask', 'old', 'recent'])
+        self.assertEqual(self._tags(limit=1), ['flask'])
+
+        self._post('#ignored')
+        db.session.rollback()
+        self.assertNotIn('ignored', self._tags())
+
+    def test_reads_do_not_touch_the_database(self):
+        self._post('#python')
+        db.session.commit()
+        self._tags()
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            self.assertEqual(self._tags(), ['python'])
+            response = self.app.test_client().get('/trending_hashtags')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(statements, [])
+
+    def test_workers_merge_through_the_snapshot(self):
+        snapshot_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, snapshot_dir)
+        path = os.path.join(snapshot_dir, 'trending_stream.json')
+        self.app.config['TRENDING_STREAM_SNAPSHOT_PATH'] = path
+        self._post('#seeded')
+        db.session.commit()
+
+        sync_trending_stream(force=True) # Seeds the snapshot from the database
+        self._post('#here')
+        db.session.commit()
+        other = TrendingStream()
+        other.sync(path)
+        other.record(['there', 'there'])
+        other.sync(path)
+        stream = sync_trending_stream(force=True)
+        self.assertEqual([tag.tag_text for tag in stream.top(10)], ['there', 'here', 'seeded'])
+        self.assertEqual(len(other.top(10)), 2) # `here` was published after `other` last synced
+
+
+if __name__ == '__main__':
+    unittest.main()
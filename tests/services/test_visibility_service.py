@@ -0,0 +1,177 @@
+import itertools
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from app import create_app, db, cache
+from app.core.models import (
+    User, Post, Story, FriendList, followers,
+    PRIVACY_PUBLIC, PRIVACY_FOLLOWERS, PRIVACY_CUSTOM_LIST, PRIVACY_PRIVATE
+)
+from app.services import visibility_service
+from app.services.visibility_service import (
+    ANONYMOUS, get_viewer, post_visibility_filter, story_visibility_filter, profile_visibility_filter, can_view_post
+)
+from config import TestingConfig
+
+PRIVACY_LEVELS = (PRIVACY_PUBLIC, PRIVACY_FOLLOWERS, PRIVACY_CUSTOM_LIST, PRIVACY_PRIVATE)
+
+
+def legacy_can_view_post(viewer_user, post):
+    """The rules the routes and API handlers implemented by hand before the visibility module."""
+    if viewer_user is not None and post.user_id == viewer_user.id:
+        return True
+    if not post.is_published or post.is_hidden_by_moderation:
+        return False
+    if post.privacy_level == PRIVACY_PUBLIC:
+        return True
+    if viewer_user is None:
+        return False
+    if post.privacy_level == PRIVACY_FOLLOWERS:
+        return viewer_user.is_following(post.author)
+    if post.privacy_level == PRIVACY_CUSTOM_LIST:
+        return post.custom_friend_list is not None and viewer_user in post.custom_friend_list.members.all()
+    return False
+
+
+class VisibilityServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        cache.clear()
+
+        self.author = User(username='author', email='author@example.com', profile_visibility=PRIVACY_PUBLIC)
+        self.follower = User(username='follower', email='follower@example.com', profile_visibility=PRIVACY_FOLLOWERS)
+        self.list_member = User(username='member', email='member@example.com', profile_visibility=PRIVACY_PRIVATE)
+        self.stranger = User(username='stranger', email='stranger@example.com', profile_visibility=PRIVACY_FOLLOWERS)
+        self.users = [self.author, self.follower, self.list_member, self.stranger]
+        for user in self.users:
+            user.set_password('password')
+        db.session.add_all(self.users)
+        db.session.commit()
+
+        self.follower.follow(self.author)
+        self.close_friends = FriendList(name='Close friends', owner=self.author)
+        db.session.add(self.close_friends)
+        db.session.commit()
+        self.close_friends.members.append(self.list_member)
+        db.session.commit()
+
+        # Every combination of privacy level, publishing and moderation state
+        self.posts = []
+        for privacy, published, hidden in itertools.product(PRIVACY_LEVELS, (True, False), (False, True)):
+            self.posts.append(Post(
+                body=f"{privacy} published={published} hidden={hidden}", author=self.author,
+                privacy_level=privacy, is_published=published, is_hidden_by_moderation=hidden,
+                custom_friend_list_id=self.close_friends.id if privacy == PRIVACY_CUSTOM_LIST else None
+            ))
+        db.session.add_all(self.posts)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        cache.clear()
+        self.app_context.pop()
+
+    def _visible_post_ids(self, viewer):
+        return {p.id for p in Post.query.filter(post_visibility_filter(viewer))}
+
+    def test_sql_predicate_matches_legacy_rules(self):
+        for viewer_user in self.users + [None]:
+            expected = {p.id for p in self.posts if legacy_can_view_post(viewer_user, p)}
+            with self.subTest(viewer=viewer_user):
+                self.assertEqual(self._visible_post_ids(viewer_user), expected)
+
+    def test_in_memory_check_matches_sql_predicate(self):
+        for viewer_user in self.users + [None]:
+            viewer = get_viewer(viewer_user)
+            visible = self._visible_post_ids(viewer)
+            for post in self.posts:
+                with self.subTest(viewer=viewer_user, post=post.body):
+                    self.assertEqual(can_view_post(viewer, post), post.id in visible)
+
+    def test_large_membership_sets_compile_to_subqueries(self):
+        original_limit = visibility_service.INLINE_ID_LIMIT
+        visibility_service.INLINE_ID_LIMIT = 0
+        try:
+            for viewer_user in self.users:
+                expected = {p.id for p in self.posts if legacy_can_view_post(viewer_user, p)}
+                self.assertEqual(self._visible_post_ids(viewer_user), expected)
+        finally:
+            visibility_service.INLINE_ID_LIMIT = original_limit
+
+    def test_follow_changes_are_picked_up(self):
+        followers_post = next(p for p in self.posts
+                              if p.privacy_level == PRIVACY_FOLLOWERS and p.is_published and not p.is_hidden_by_moderation)
+        self.assertNotIn(followers_post.id, self._visible_post_ids(self.stranger))
+        self.stranger.follow(self.author)
+        db.session.commit()
+        self.assertIn(followers_post.id, self._visible_post_ids(self.stranger))
+
+    def test_viewer_is_loaded_once_per_request(self):
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        db.session.refresh(self.stranger)
+        with self.app.test_request_context('/'):
+            event.listen(db.engine, 'before_cursor_execute', listener)
+            try:
+                first = get_viewer(self.stranger)
+                self.assertIs(get_viewer(self.stranger), first)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', listener)
+        # The followed ids and the friend lists
+        self.assertEqual(len(statements), 2)
+        self.assertNotIn(self.author.id, first.followed_ids)
+
+        # A follow written elsewhere (another worker) is seen by the next request
+        db.session.execute(followers.insert().values(follower_id=self.stranger.id, followed_id=self.author.id))
+        db.session.commit()
+        with self.app.test_request_context('/'):
+            self.assertIn(self.author.id, get_viewer(self.stranger).followed_ids)
+
+    def test_anonymous_viewer(self):
+        self.assertIs(get_viewer(None), ANONYMOUS)
+        visible = Post.query.filter(post_visibility_filter(None)).all()
+        self.assertEqual([(p.privacy_level, p.is_published, p.is_hidden_by_moderation) for p in visible],
+                         [(PRIVACY_PUBLIC, True, False)])
+
+    def test_story_visibility(self):
+        now = datetime.utcnow()
+        stories = {}
+        for privacy in PRIVACY_LEVELS:
+            story = Story(author=self.author, caption=privacy, image_filename='s.jpg', privacy_level=privacy, is_published=True,
+                          custom_friend_list_id=self.close_friends.id if privacy == PRIVACY_CUSTOM_LIST else None)
+            stories[privacy] = story
+        expired = Story(author=self.author, caption='expired', image_filename='e.jpg', privacy_level=PRIVACY_PUBLIC, is_published=True)
+        db.session.add_all(list(stories.values()) + [expired])
+        db.session.commit()
+        expired.expires_at = now - timedelta(hours=1)
+        db.session.commit()
+
+        def captions(viewer):
+            return {s.caption for s in Story.query.filter(story_visibility_filter(viewer, now))}
+
+        self.assertEqual(captions(self.author), set(PRIVACY_LEVELS))
+        self.assertEqual(captions(self.follower), {PRIVACY_PUBLIC, PRIVACY_FOLLOWERS})
+        self.assertEqual(captions(self.list_member), {PRIVACY_PUBLIC, PRIVACY_CUSTOM_LIST})
+        self.assertEqual(captions(self.stranger), {PRIVACY_PUBLIC})
+        self.assertEqual(captions(None), {PRIVACY_PUBLIC})
+
+    def test_profile_visibility(self):
+        def usernames(viewer):
+            return {u.username for u in User.query.filter(profile_visibility_filter(viewer))}
+
+        self.assertEqual(usernames(None), {'author'})
+        self.assertEqual(usernames(self.author), {'author'})
+        self.assertEqual(usernames(self.stranger), {'author', 'stranger'})
+        self.author.follow(self.follower)
+        db.session.commit()
+        self.assertEqual(usernames(self.author), {'author', 'follower'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -142,5 +142,83 @@ class TestGeneralHelpers(unittest.TestCase): # Create a new class for more gener
         self.assertAlmostEqual(current_time, now_utc, delta=timedelta(seconds=1))
 
 
+from sqlalchemy import event
+
+from app import create_app, db, cache
+from app.core.models import User, Post, Hashtag, HashtagUsage, Mention
+from app.services.search_service import search_query
+from app.utils.helpers import process_hashtags, process_mentions
+from config import TestingConfig
+
+
+class TestHashtagAndMentionProcessing(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        cache.clear()
+
+        self.author = User(username='author', email='author@example.com')
+        self.alice = User(username='Alice', email='alice@example.com')
+        self.bob = User(username='bob', email='bob@example.com')
+        for user in (self.author, self.alice, self.bob):
+            user.set_password('password')
+        db.session.add_all([self.author, self.alice, self.bob, Hashtag(tag_text='python')])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        cache.clear()
+        self.app_context.pop()
+
+    def _post(self, body):
+        post = Post(body=body, author=self.author)
+        db.session.add(post)
+        db.session.flush()
+        return post
+
+    def _count_statements(self, func, *args):
+        statements = []
+        listener = lambda conn, cursor, statement, *rest: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            func(*args)
+            db.session.flush()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        return len(statements)
+
+    def test_process_hashtags_reuses_and_creates_tags(self):
+        post = self._post('#Python #flask #python #new_tag')
+        process_hashtags(post.body, post)
+        db.session.commit()
+        self.assertEqual(sorted(tag.tag_text for tag in post.hashtags), ['flask', 'new_tag', 'python'])
+        self.assertEqual(Hashtag.query.count(), 3)
+        self.assertEqual(HashtagUsage.query.count(), 3)
+        # Tags created by the bulk insert are searchable straight away
+        query, _ = search_query('hashtags', 'flask')
+        self.assertEqual([tag.tag_text for tag in query], ['flask'])
+
+    def test_process_hashtags_query_count_does_not_grow_with_tags(self):
+        few = self._count_statements(process_hashtags, '#a1 #a2', self._post('#a1 #a2'))
+        body = ' '.join(f'#b{i}' for i in range(30))
+        many = self._count_statements(process_hashtags, body, self._post(body))
+        self.assertEqual(few, many)
+
+    def test_process_mentions_is_case_insensitive_and_deduplicated(self):
+        post = self._post('@alice @BOB @Alice @nobody')
+        mentioned = process_mentions(post.body, post, self.author)
+        db.session.commit()
+        self.assertEqual(mentioned, [self.alice, self.bob])
+        self.assertEqual(sorted((m.user_id, m.post_id, m.actor_id) for m in Mention.query.all()),
+                         sorted([(self.alice.id, post.id, self.author.id), (self.bob.id, post.id, self.author.id)]))
+
+    def test_process_mentions_rejects_unknown_owner(self):
+        self.assertEqual(process_mentions('@alice', object(), self.author), [])
+        self.assertEqual(Mention.query.count(), 0)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+from datetime import datetime, timedelta
+
+from app import create_app, db
+from app.core.models import User, Notification
+from app.utils.pagination import encode_cursor, decode_cursor, keyset_paginate
+from config import TestingConfig
+
+
+class TestCursorEncoding(unittest.TestCase):
+
+    def test_round_trip(self):
+        ts = datetime(2024, 5, 1, 12, 30, 15, 123456)
+        self.assertEqual(decode_cursor(encode_cursor(ts, 42)), (ts, 42))
+        self.assertEqual(decode_cursor(encode_cursor(ts, 1, 2), id_count=2), (ts, 1, 2))
+
+    def test_malformed_cursor_is_ignored(self):
+        self.assertIsNone(decode_cursor(None))
+        self.assertIsNone(decode_cursor('not-a-cursor'))
+        self.assertIsNone(decode_cursor(encode_cursor(datetime.utcnow(), 1, 2))) # Wrong arity
+
+
+class TestKeysetPaginate(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.user = User(username='pager', email='pager@example.com')
+        self.user.set_password('password')
+        db.session.add(self.user)
+        db.session.commit()
+
+        # Two notifications share a timestamp so the id tie-breaker is exercised
+        now = datetime.utcnow()
+        for minutes in (0, 1, 1, 2, 3):
+            db.session.add(Notification(recipient_id=self.user.id, actor_id=self.user.id, type='test',
+                                        timestamp=now - timedelta(minutes=minutes)))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _walk(self, ascending=False):
+        query = Notification.query.filter_by(recipient_id=self.user.id)
+        seen, cursor = [], None
+        while True:
+            page = keyset_paginate(query, Notification.timestamp, Notification.id,
+                                   cursor=cursor, per_page=2, ascending=ascending)
+            self.assertEqual(page.is_first_page, cursor is None)
+            seen.extend(page.items)
+            if not page.has_next:
+                return seen
+            cursor = page.next_cursor
+
+    def test_walk_covers_every_row_once_in_order(self):
+        seen = self._walk()
+        expected = sorted(seen, key=lambda n: (n.timestamp, n.id), reverse=True)
+        self.assertEqual(len(seen), 5)
+        self.assertEqual([n.id for n in seen], [n.id for n in expected])
+
+    def test_ascending_walk(self):
+        seen = self._walk(ascending=True)
+        self.assertEqual([n.id for n in seen],
+                         [n.id for n in sorted(seen, key=lambda n: (n.timestamp, n.id))])
+
+    def test_rows_added_while_paging_do_not_shift_later_pages(self):
+        query = Notification.query.filter_by(recipient_id=self.user.id)
+        first = keyset_paginate(query, Notification.timestamp, Notification.id, per_page=2)
+        db.session.add(Notification(recipient_id=self.user.id, actor_id=self.user.id, type='test', timestamp=datetime.utcnow()))
+        db.session.commit()
+        second = keyset_paginate(query, Notification.timestamp, Notification.id,
+                                 cursor=first.next_cursor, per_page=2)
+        self.assertFalse({n.id for n in first.items} & {n.id for n in second.items})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+from app.utils.sparse import CSRMatrix, IdIndex, top_n
+
+
+def dense(matrix):
+    rows = [[0.0] * matrix.n_cols for _ in range(matrix.n_rows)]
+    for row in range(matrix.n_rows):
+        for col, value in matrix.row_dict(row).items():
+            rows[row][col] = value
+    return rows
+
+
+class TestCSRMatrix(unittest.TestCase):
+
+    def setUp(self):
+        # [[1, 0, 2],
+        #  [0, 0, 0],
+        #  [0, 3, 4]]
+        self.matrix = CSRMatrix.from_triples(3, 3, [(2, 2, 4.0), (0, 2, 1.5), (0, 0, 1.0), (2, 1, 3.0), (0, 2, 0.5)])
+
+    def test_from_triples_sorts_and_sums_duplicates(self):
+        self.assertEqual(dense(self.matrix), [[1.0, 0.0, 2.0], [0.0, 0.0, 0.0], [0.0, 3.0, 4.0]])
+        self.assertEqual(list(self.matrix.indptr), [0, 2, 2, 4])
+        self.assertEqual(self.matrix.nnz, 4)
+        self.assertEqual(list(self.matrix.row_counts()), [2, 0, 2])
+        self.assertEqual(list(self.matrix.column_counts()), [1, 1, 2])
+
+    def test_transpose_and_product(self):
+        self.assertEqual(dense(self.matrix.transpose()), [[1.0, 0.0, 0.0], [0.0, 0.0, 3.0], [2.0, 0.0, 4.0]])
+        self.assertEqual(dense(self.matrix.dot(self.matrix.transpose())), [[5.0, 0.0, 8.0], [0.0, 0.0, 0.0], [8.0, 0.0, 25.0]])
+        with self.assertRaises(ValueError):
+            self.matrix.dot(CSRMatrix.from_triples(2, 2, []))
+
+    def test_normalized_rows_give_cosines(self):
+        normalized = self.matrix.normalize_rows()
+        cosines = normalized.dot(normalized.transpose())
+        self.assertAlmostEqual(cosines.row_dict(0)[0], 1.0)
+        self.assertAlmostEqual(cosines.row_dict(0)[2], 8.0 / (5 ** 0.5 * 5))
+        self.assertEqual(cosines.row_dict(1), {})
+
+    def test_top_n_skips_excluded_and_non_positive_scores(self):
+        scores = {0: 0.5, 1: 0.9, 2: 0.0, 3: 0.5, 4: 0.7}
+        self.assertEqual(top_n(scores, 3, exclude={4}), [(1, 0.9), (3, 0.5), (0, 0.5)])
+
+    def test_id_index(self):
+        index = IdIndex([40, 10, 40])
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.add(30), 2)
+        self.assertEqual(index.position(10), 1)
+        self.assertIsNone(index.position(99))
+        self.assertEqual(list(index.ids), [40, 10, 30])
+
+
+if __name__ == '__main__':
+    unittest.main()